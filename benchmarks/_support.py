@@ -0,0 +1,81 @@
+"""
+Helpers shared by the benchmark scripts.
+
+Every Lambda ships as its own `handler.py`, so the handlers are imported by
+path under unique module names rather than as a package.
+"""
+import importlib.util
+import os
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+FUNCTIONS_DIR = REPO_ROOT / "src" / "functions"
+# Contents of the `common` Lambda layer, mounted at /opt/python in Lambda
+LAYER_DIR = REPO_ROOT / "src" / "layers" / "common" / "python"
+
+MB = 1024 * 1024
+
+
+def load_handler(function_name: str):
+    """
+    Import src/functions/<function_name>/handler.py as `<function_name>_handler`.
+    The function directory and the shared layer are put on sys.path so sibling
+    modules and `healthtech_common` resolve the same way they do in Lambda.
+    """
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault("AWS_REGION", os.environ["AWS_DEFAULT_REGION"])
+    if str(LAYER_DIR) not in sys.path:
+        sys.path.append(str(LAYER_DIR))
+
+    module_name = f"{function_name}_handler"
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    func_dir = FUNCTIONS_DIR / function_name
+    if str(func_dir) not in sys.path:
+        sys.path.insert(0, str(func_dir))
+
+    spec = importlib.util.spec_from_file_location(module_name, func_dir / "handler.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_function_module(function_name: str, module: str):
+    """Import a sibling module (e.g. bedrock_guardrail/preclassifier.py) without its handler."""
+    func_dir = FUNCTIONS_DIR / function_name
+    if str(func_dir) not in sys.path:
+        sys.path.insert(0, str(func_dir))
+    return importlib.import_module(module)
+
+
+class FakeContext:
+    """Minimal stand-in for the Lambda context object."""
+
+    def __init__(self, request_id: str = "bench-request", remaining_ms: int = 300_000):
+        self.aws_request_id = request_id
+        self._remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self) -> int:
+        return self._remaining_ms
+
+
+def map_items(s3, result: dict) -> list[dict]:
+    """The Map items content_splitter wrote for the ParallelAnalysis ItemReader (needs an S3 that keeps bodies)."""
+    import json
+
+    manifest = result["chunk_manifest"]
+    return json.loads(s3.get_object(Bucket=manifest["bucket"], Key=manifest["key"])["Body"].read())
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB (Linux reports KB)."""
+    import resource
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def parse_sizes_mb(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
@@ -0,0 +1,312 @@
+"""
+A small in-process interpreter for src/statemachine/pipeline.asl.json.
+
+It covers the parts of the Amazon States Language the pipeline uses: Task
+(Lambda ARNs and lambda:invoke.waitForTaskToken), Choice (And/Or/Not,
+String/Numeric/Boolean comparisons, IsPresent), Map (ItemsPath, or an S3
+JSON ItemReader for a Distributed Map; Iterator or ItemProcessor,
+MaxConcurrency on a thread pool), Parameters with `.$` paths, ResultPath,
+OutputPath null, Retry (IntervalSeconds, BackoffRate, MaxDelaySeconds), Catch, Fail
+with Error/Cause or ErrorPath/CausePath, and the `$$.Execution.Id` and
+`$$.Task.Token` context paths.
+Resource placeholders such as `${RouterArn}` resolve to handler functions.
+
+State input and output go through a JSON round trip between states, as they
+do in Step Functions, and every state entered is recorded with its duration
+and payload size so benchmarks can report per-stage numbers.
+"""
+import json
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from _support import REPO_ROOT, FakeContext
+
+DEFINITION = REPO_ROOT / "src" / "statemachine" / "pipeline.asl.json"
+
+WAIT_FOR_TASK_TOKEN = "arn:aws:states:::lambda:invoke.waitForTaskToken"
+LAMBDA_INVOKE = "arn:aws:states:::lambda:invoke"
+S3_GET_OBJECT = "arn:aws:states:::s3:getObject"
+
+# Largest payload Step Functions passes between states
+STATE_PAYLOAD_LIMIT = 256 * 1024
+
+
+class StatesError(Exception):
+    """A failed state, carrying the error name Retry and Catch match on."""
+
+    def __init__(self, error: str, cause: str = ""):
+        super().__init__(f"{error}: {cause}" if cause else error)
+        self.error = error
+        self.cause = cause
+
+
+def _error_name(exc: Exception) -> str:
+    # Lambda reports the exception's class name as errorType
+    return exc.error if isinstance(exc, StatesError) else type(exc).__name__
+
+
+def _matches(patterns: list[str], error: str) -> bool:
+    if "States.ALL" in patterns or error in patterns:
+        return True
+    return "States.TaskFailed" in patterns and error != "States.Timeout"
+
+
+def get_path(data, path: str, context: dict | None = None):
+    """Resolve a simple reference path: `$`, `$.a.b`, `$.items[0]`, `$$.Task.Token` or `$$.Execution.Id`."""
+    if path.startswith("$$"):
+        data, path = context or {}, path[1:]
+    if path == "$":
+        return data
+    for name, index in re.findall(r"\.([^.\[]+)|\[(\d+)\]", path[1:]):
+        try:
+            data = data[int(index)] if index else data[name]
+        except (KeyError, IndexError, TypeError):
+            raise StatesError("States.Runtime", f"path {path} not found in input") from None
+    return data
+
+
+def _has_path(data, path: str) -> bool:
+    try:
+        get_path(data, path)
+        return True
+    except StatesError:
+        return False
+
+
+def apply_parameters(template, data, context: dict | None = None):
+    if isinstance(template, dict):
+        out = {}
+        for key, value in template.items():
+            if key.endswith(".$"):
+                out[key[:-2]] = get_path(data, value, context)
+            else:
+                out[key] = apply_parameters(value, data, context)
+        return out
+    if isinstance(template, list):
+        return [apply_parameters(value, data, context) for value in template]
+    return template
+
+
+def apply_result_path(data, result, path: str | None):
+    if path is None:
+        return data
+    if path == "$":
+        return result
+    data = dict(data) if isinstance(data, dict) else {}
+    target = data
+    names = path[2:].split(".")
+    for name in names[:-1]:
+        target[name] = dict(target.get(name) or {})
+        target = target[name]
+    target[names[-1]] = result
+    return data
+
+
+_COMPARISONS = {
+    "StringEquals": lambda a, b: isinstance(a, str) and a == b,
+    "NumericEquals": lambda a, b: isinstance(a, (int, float)) and a == b,
+    "NumericGreaterThan": lambda a, b: isinstance(a, (int, float)) and a > b,
+    "NumericGreaterThanEquals": lambda a, b: isinstance(a, (int, float)) and a >= b,
+    "NumericLessThan": lambda a, b: isinstance(a, (int, float)) and a < b,
+    "NumericLessThanEquals": lambda a, b: isinstance(a, (int, float)) and a <= b,
+    "BooleanEquals": lambda a, b: isinstance(a, bool) and a == b,
+}
+
+
+def evaluate_rule(rule: dict, data) -> bool:
+    if "And" in rule:
+        return all(evaluate_rule(r, data) for r in rule["And"])
+    if "Or" in rule:
+        return any(evaluate_rule(r, data) for r in rule["Or"])
+    if "Not" in rule:
+        return not evaluate_rule(rule["Not"], data)
+    variable = rule["Variable"]
+    if "IsPresent" in rule:
+        return _has_path(data, variable) == rule["IsPresent"]
+    if not _has_path(data, variable):
+        return False
+    value = get_path(data, variable)
+    for op, compare in _COMPARISONS.items():
+        if op in rule:
+            return compare(value, rule[op])
+    raise StatesError("States.Runtime", f"unsupported Choice rule {rule}")
+
+
+class StateMachine:
+    """
+    Runs executions of an ASL definition against in-process handlers.
+
+    resources maps each Resource / FunctionName placeholder to a handler
+    (`lambda_handler(event, context)`). For waitForTaskToken states, sfn is the
+    FakeStepFunctions the handlers resume the execution through, and
+    on_task_token(state_name, payload) is called after the registering
+    invocation returns, to deliver whatever would complete the task (the
+    Textract SNS notification, say). A token still unresolved after that
+    fails the state with States.Timeout.
+
+    time_scale multiplies Retry intervals (0 skips the waits), and
+    map_concurrency, when set, overrides every Map state's MaxConcurrency.
+    s3 is the client a Map's ItemReader reads its items through.
+    """
+
+    def __init__(self, resources: dict, definition: dict | None = None, sfn=None, on_task_token=None,
+                 time_scale: float = 0.0, map_concurrency: int | None = None, s3=None):
+        self.definition = definition or json.loads(Path(DEFINITION).read_text())
+        self.resources = resources
+        self.sfn = sfn
+        self.s3 = s3
+        self.on_task_token = on_task_token
+        self.time_scale = time_scale
+        self.map_concurrency = map_concurrency
+        self.trace: list[dict] = []
+        self._lock = threading.Lock()
+
+    def _record(self, **entry):
+        with self._lock:
+            self.trace.append(entry)
+
+    def execute(self, data) -> dict:
+        """Run one execution; returns its output. Failures raise StatesError."""
+        execution = {"Id": f"arn:aws:states:us-east-1:000000000000:execution:pipeline:{uuid.uuid4()}"}
+        return self._run(self.definition, json.loads(json.dumps(data)), execution)
+
+    def _run(self, machine: dict, data, execution: dict):
+        states = machine["States"]
+        name = machine["StartAt"]
+        while True:
+            state = states[name]
+            started = time.perf_counter()
+            attempts, error = 1, None
+            try:
+                data, next_name, attempts = self._enter(name, state, data, execution)
+            except StatesError as exc:
+                error = exc.error
+                raise
+            finally:
+                payload = len(json.dumps(data))
+                self._record(state=name, type=state["Type"], seconds=time.perf_counter() - started,
+                             attempts=attempts, payload_bytes=payload, error=error)
+            if payload > STATE_PAYLOAD_LIMIT:
+                raise StatesError("States.DataLimitExceeded", f"{name} output is {payload} bytes")
+            if next_name is None:
+                return data
+            name = next_name
+
+    def _enter(self, name: str, state: dict, data, execution: dict):
+        kind = state["Type"]
+        if kind == "Choice":
+            for rule in state["Choices"]:
+                if evaluate_rule(rule, data):
+                    return data, rule["Next"], 1
+            if "Default" in state:
+                return data, state["Default"], 1
+            raise StatesError("States.NoChoiceMatched", name)
+        if kind == "Pass":
+            result = state.get("Result", data)
+            return apply_result_path(data, result, state.get("ResultPath", "$")), state.get("Next"), 1
+        if kind in ("Succeed", "Fail"):
+            if kind == "Fail":
+                error = get_path(data, state["ErrorPath"]) if "ErrorPath" in state else state.get("Error", "States.Fail")
+                cause = get_path(data, state["CausePath"]) if "CausePath" in state else state.get("Cause", "")
+                raise StatesError(error, cause)
+            return data, None, 1
+
+        result, exc, attempts = self._with_retry(state, lambda: self._execute_state(name, state, data, execution))
+        if exc is not None:
+            error = _error_name(exc)
+            for catcher in state.get("Catch", []):
+                if _matches(catcher["ErrorEquals"], error):
+                    caught = {"Error": error, "Cause": getattr(exc, "cause", "") or str(exc)}
+                    return apply_result_path(data, caught, catcher.get("ResultPath", "$")), catcher["Next"], attempts
+            if isinstance(exc, StatesError):
+                raise exc
+            raise StatesError(error, str(exc)) from exc
+
+        result = json.loads(json.dumps(result))
+        data = apply_result_path(data, result, state.get("ResultPath", "$"))
+        if "OutputPath" in state and state["OutputPath"] is None:
+            data = {}
+        return data, None if state.get("End") else state["Next"], attempts
+
+    def _with_retry(self, state: dict, call) -> tuple[object, Exception | None, int]:
+        """(result, final error, attempts). The first Retry entry matching the error applies."""
+        retried = {}
+        attempts = 0
+        while True:
+            attempts += 1
+            try:
+                return call(), None, attempts
+            except Exception as exc:
+                error = _error_name(exc)
+                match = next((n for n, r in enumerate(state.get("Retry", [])) if _matches(r["ErrorEquals"], error)), None)
+                if match is None:
+                    return None, exc, attempts
+                retrier = state["Retry"][match]
+                count = retried.get(match, 0)
+                if count >= retrier.get("MaxAttempts", 3):
+                    return None, exc, attempts
+                retried[match] = count + 1
+                delay = retrier.get("IntervalSeconds", 1) * retrier.get("BackoffRate", 2.0) ** count
+                delay = min(delay, retrier.get("MaxDelaySeconds", delay))
+                if self.time_scale:
+                    time.sleep(delay * self.time_scale)
+
+    def _execute_state(self, name: str, state: dict, data, execution: dict):
+        if state["Type"] == "Map":
+            return self._map(state, data, execution)
+        if state["Type"] != "Task":
+            raise StatesError("States.Runtime", f"unsupported state type {state['Type']}")
+
+        token = uuid.uuid4().hex
+        context = {"Execution": execution, "Task": {"Token": token}}
+        event = apply_parameters(state["Parameters"], data, context) if "Parameters" in state else data
+        resource = state["Resource"]
+
+        if resource in (WAIT_FOR_TASK_TOKEN, LAMBDA_INVOKE):
+            handler = self.resources[event["FunctionName"]]
+            output = self._invoke(handler, event.get("Payload", {}))
+            if resource == LAMBDA_INVOKE:
+                return {"Payload": output, "StatusCode": 200}
+            return self._await_token(name, token, event.get("Payload", {}))
+
+        return self._invoke(self.resources[resource], event)
+
+    @staticmethod
+    def _invoke(handler, event):
+        # Events cross the Lambda boundary as JSON; each invocation gets its own request id
+        return handler(json.loads(json.dumps(event)), FakeContext(request_id=str(uuid.uuid4())))
+
+    def _await_token(self, name: str, token: str, payload: dict):
+        if self.on_task_token:
+            self.on_task_token(name, payload)
+        outcome = self.sfn.outcomes.pop(token, None) if self.sfn else None
+        if outcome is None:
+            raise StatesError("States.Timeout", f"{name} task token was not returned")
+        status, detail = outcome
+        if status != "success":
+            raise StatesError(status, detail)
+        return json.loads(detail)
+
+    def _map_items(self, state: dict, data) -> list:
+        reader = state.get("ItemReader")
+        if reader is None:
+            return get_path(data, state.get("ItemsPath", "$"))
+        if reader["Resource"] != S3_GET_OBJECT or reader.get("ReaderConfig", {}).get("InputType") != "JSON":
+            raise StatesError("States.Runtime", f"unsupported ItemReader {reader['Resource']}")
+        params = apply_parameters(reader["Parameters"], data)
+        try:
+            body = self.s3.get_object(Bucket=params["Bucket"], Key=params["Key"])["Body"].read()
+        except Exception as exc:
+            raise StatesError("States.ItemReaderFailed", str(exc)) from exc
+        return json.loads(body)
+
+    def _map(self, state: dict, data, execution: dict):
+        items = self._map_items(state, data)
+        machine = state.get("ItemProcessor") or state["Iterator"]
+        concurrency = self.map_concurrency or state.get("MaxConcurrency") or len(items) or 1
+        with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(items) or 1))) as pool:
+            return list(pool.map(lambda item: self._run(machine, item, execution), items))
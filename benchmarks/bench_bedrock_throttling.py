@@ -0,0 +1,143 @@
+"""
+bedrock_guardrail behaviour against a Bedrock stand-in that injects failures.
+
+Scenarios (each run against a fresh client layer):
+- throttle:    a fraction of calls raise ThrottlingException; every chunk should
+               still be classified, via backoff on the same path, with no
+               invoke_model fallback calls
+- no_converse: Converse rejects tool use; only the first chunk should try it
+- bad_request: Converse rejects the first chunk alone (input too long); that
+               chunk falls back to invoke_model and the rest keep using Converse
+- outage:      every call fails; the circuit breaker should open and later
+               chunks fail fast without reaching the service
+- half_open:   once the cool-down passes, concurrent callers get one probe
+               through the breaker, not a burst
+
+    python benchmarks/bench_bedrock_throttling.py --chunks 200 --throttle-rate 0.3
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+
+from _support import FakeContext, load_function_module, load_handler
+from fakes import FakeBedrock, FakeS3
+
+CLINICAL = "Patient reviewed in clinic. BP 130/85. Continue Metformin 500mg BD. Review in 4 weeks. "
+
+
+class OversizedFirstChunk(FakeBedrock):
+    """Converse rejects the first request as too long, as Bedrock does for one oversized chunk."""
+
+    def converse(self, modelId, messages, **kwargs):
+        if not self.calls.get("converse"):
+            self._enter("converse")
+            raise self._error("ValidationException", "converse", "Input is too long for requested model.")
+        return super().converse(modelId, messages, **kwargs)
+
+
+def half_open_probes(callers: int = 16) -> tuple[int, int]:
+    """Callers let through by a half-open breaker at once, and after a probe failed with a non-transient error."""
+    client_mod = load_function_module("bedrock_guardrail", "bedrock_client")
+    clock = [0.0]
+    breaker = client_mod.CircuitBreaker(failure_threshold=1, reset_timeout_s=30, clock=lambda: clock[0])
+    breaker.record_failure()
+    clock[0] += 30
+
+    allowed = []
+    barrier = threading.Barrier(callers)
+
+    def caller():
+        barrier.wait()
+        allowed.append(breaker.allow())
+
+    threads = [threading.Thread(target=caller) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # The probe ends in a bad request: Bedrock's health is still unknown, so the next caller probes
+    breaker.release()
+    return sum(allowed), sum(breaker.allow() for _ in range(callers))
+
+
+def run(guardrail, bedrock: FakeBedrock, chunks: int, breaker_threshold: int = 8) -> dict:
+    client_mod = load_function_module("bedrock_guardrail", "bedrock_client")
+    fake_s3 = FakeS3()
+    guardrail.s3 = fake_s3
+    guardrail.result_cache = None
+    guardrail.PRECLASSIFIER_MODE = "off"
+    guardrail.bedrock_client = client_mod.GuardrailBedrockClient(
+        bedrock,
+        max_attempts=6,
+        base_delay_s=0.002,
+        max_delay_s=0.05,
+        breaker=client_mod.CircuitBreaker(failure_threshold=breaker_threshold, reset_timeout_s=60),
+    )
+
+    ok = failed = 0
+    started = time.perf_counter()
+    for n in range(chunks):
+        fake_s3.objects[("bench", f"c/{n}.txt")] = f"{CLINICAL} chunk {n}".encode("utf-8")
+        try:
+            result = guardrail.lambda_handler({"s3_bucket": "bench", "s3_key": f"c/{n}.txt"}, FakeContext())
+            ok += result["classification"] == "VALID"
+        except (client_mod.BedrockThrottledError, client_mod.CircuitOpenError):
+            failed += 1
+    elapsed = time.perf_counter() - started
+
+    return {
+        "ok": ok,
+        "failed": failed,
+        "seconds": elapsed,
+        "service_calls": dict(bedrock.calls),
+        "client": dict(guardrail.bedrock_client.stats),
+        "circuit": guardrail.bedrock_client.breaker.state,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=200)
+    parser.add_argument("--throttle-rate", type=float, default=0.3)
+    args = parser.parse_args()
+
+    # No per-invocation EMF records in the output (bench_instrumentation measures them)
+    os.environ.setdefault("INSTRUMENTATION", "off")
+    guardrail = load_handler("bedrock_guardrail")
+    logging.getLogger().setLevel(logging.ERROR)
+
+    r = run(guardrail, FakeBedrock(throttle_rate=args.throttle_rate, seed=1), args.chunks)
+    print(f"throttle    {r}")
+    assert r["ok"] == args.chunks, "throttled chunks were not all classified"
+    assert "invoke_model" not in r["service_calls"], "throttling fell through to invoke_model"
+
+    r = run(guardrail, FakeBedrock(converse_supported=False), args.chunks)
+    print(f"no_converse {r}")
+    assert r["service_calls"].get("converse") == 1, "Converse retried after it was known to fail"
+    assert r["ok"] == args.chunks
+
+    r = run(guardrail, OversizedFirstChunk(), args.chunks)
+    print(f"bad_request {r}")
+    assert r["service_calls"].get("converse") == args.chunks, "one rejected request turned Converse off"
+    assert r["service_calls"].get("invoke_model") == 1, "the rejected chunk did not fall back to invoke_model"
+    assert r["ok"] == args.chunks
+
+    r = run(guardrail, FakeBedrock(outage=True), args.chunks, breaker_threshold=8)
+    print(f"outage      {r}")
+    assert r["circuit"] == "open"
+    assert sum(r["service_calls"].values()) <= 8, "circuit breaker did not stop calls to a failing service"
+    assert r["failed"] == args.chunks
+
+    probes, after_release = half_open_probes()
+    print(f"half_open   probes={probes} after_release={after_release}")
+    assert probes == 1, f"a half-open breaker let {probes} concurrent callers through"
+    assert after_release == 1, f"{after_release} callers got through after the probe was released"
+
+    print("all scenarios behaved as expected")
+
+
+if __name__ == "__main__":
+    main()
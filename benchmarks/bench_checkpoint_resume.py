@@ -0,0 +1,209 @@
+"""
+Re-running failed documents with stage checkpoints: what a resumed execution
+redoes, and a check that it never repeats a model call.
+
+Each scenario runs the state machine through bench_pipeline's Pipeline with
+the guardrail's result cache off, so only checkpoints carry work between runs:
+
+  bedrock     Bedrock is unavailable for a --fail-fraction of the chunks, so
+              their Map iterations exhaust their retries and those documents'
+              executions fail; the failed documents are then run again with
+              Bedrock healthy.
+  healthlake  HealthLake answers 503 to every request, so every execution
+              fails in AggregateAndIngest; all documents are then run again.
+
+Reported per run: executions that failed, chunks in the Map, model calls,
+Textract calls and checkpoint objects kept. After the re-run, one more
+execution of the same documents stands in for a concurrent one (a retried
+event that was still in flight) finishing after they were ingested. The check
+fails (exit 1) if a re-run sends the model any chunk it already answered or
+starts or reads a Textract job, or if that late execution finds its checkpoints
+gone and calls the model or Textract again.
+
+It also fails if a web upload carrying an email attachment's content_sha256
+metadata resumes from that attachment's checkpoints instead of being
+analysed itself.
+
+    python benchmarks/bench_checkpoint_resume.py --documents 24 --batch-size 4
+"""
+import argparse
+import contextlib
+import hashlib
+import logging
+import os
+import sys
+import threading
+import zlib
+
+from asl_runner import StatesError
+from bench_pipeline import BUCKET, SHAPES, Pipeline, _responder
+from fakes import FakeHealthLake
+
+
+class ModelLog:
+    """
+    Responder that records the chunks the model answered, and the fail_when
+    predicate that makes Bedrock unavailable for some chunks while `failing` is set.
+    """
+
+    def __init__(self, fail_fraction: float):
+        self.fail_fraction = fail_fraction
+        self.failing = False
+        self.answered: list[str] = []
+        self._lock = threading.Lock()
+
+    def fails(self, text: str) -> bool:
+        return self.failing and zlib.crc32(text.encode("utf-8")) % 1000 < self.fail_fraction * 1000
+
+    def __call__(self, text: str) -> dict:
+        with self._lock:
+            self.answered.append(text)
+        return _responder(text)
+
+
+def _args(cli) -> argparse.Namespace:
+    # Pipeline settings; latencies stay at zero so the scenarios are about call counts
+    return argparse.Namespace(
+        s3_latency_ms=0.0, textract_latency_ms=0.0, textract_ms_per_page=cli.textract_ms_per_page,
+        bedrock_latency_ms=0.0, bedrock_throttle_rate=0.0, seed=cli.seed, completion="callback",
+        batch_size=cli.batch_size, map_concurrency=None,
+    )
+
+
+def _execute(pipeline: Pipeline, events: list[dict]) -> tuple[list[dict], dict]:
+    """Run each event; returns the events whose execution failed and what the run cost."""
+    for counter in (pipeline.textract.calls, pipeline.bedrock.calls):
+        counter.clear()
+    trace_start = len(pipeline.machine.trace)
+    failed = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for event in events:
+            try:
+                pipeline.machine.execute(event)
+            except StatesError:
+                failed.append(event)
+
+    trace = pipeline.machine.trace[trace_start:]
+    return failed, {
+        "executions": len(events),
+        "failed": len(failed),
+        "map_items": sum(1 for entry in trace if entry["state"] == "GuardrailAndExtract"),
+        "model_calls": sum(pipeline.bedrock.calls.values()),
+        "textract_calls": sum(pipeline.textract.calls.values()),
+    }
+
+
+def _checkpoint_objects(pipeline: Pipeline) -> int:
+    return sum(1 for bucket, key in pipeline.s3.metadata if bucket == BUCKET and key.startswith("checkpoints/"))
+
+
+def scenario(name: str, cli) -> list[str]:
+    problems = []
+    model = ModelLog(cli.fail_fraction)
+    with FakeHealthLake() as healthlake:
+        pipeline = Pipeline(_args(cli), healthlake)
+        pipeline.bedrock.responder = model
+        pipeline.bedrock.fail_when = model.fails
+        guardrail = pipeline.handlers["bedrock_guardrail"]
+        guardrail.result_cache = None
+        # Only the failing chunks fail: the breaker would otherwise open and fail every chunk after them
+        guardrail.bedrock_client.breaker.failure_threshold = 10**6
+        # Handlers set the level when loaded
+        logging.getLogger().setLevel(logging.CRITICAL)
+        shapes = list(SHAPES)
+        events = [pipeline.upload(n, shapes[n % len(shapes)], cli.pages, cli.seed + n) for n in range(cli.documents)]
+
+        if name == "bedrock":
+            model.failing = True
+        else:
+            healthlake.outage_status = 503
+        failed, first = _execute(pipeline, events)
+        model.failing = False
+        healthlake.outage_status = None
+        answered_first = set(model.answered)
+        kept = _checkpoint_objects(pipeline)
+
+        model.answered.clear()
+        _, second = _execute(pipeline, failed)
+        # Nothing fails in the re-run, so every chunk it sent the model was answered
+        repeated = [text for text in model.answered if text in answered_first]
+        left = _checkpoint_objects(pipeline)
+        # Ingest must not have cleared the checkpoints under an execution that is still running
+        _, late = _execute(pipeline, failed)
+
+    for label, run in (("first", first), ("re-run", second), ("late", late)):
+        print(f"{name:>10} {label:>7} {run['executions']:>10} {run['failed']:>7} {run['map_items']:>9} "
+              f"{run['model_calls']:>11} {run['textract_calls']:>14}")
+    print(f"{'':>10} checkpoint objects after the first run: {kept}, after the re-run: {left}")
+
+    if not failed:
+        problems.append(f"{name}: no execution failed, nothing to resume")
+    if second["failed"]:
+        problems.append(f"{name}: {second['failed']} re-run executions failed")
+    if repeated:
+        problems.append(f"{name}: re-run repeated {len(repeated)} model calls for chunks answered in the first run")
+    if second["textract_calls"]:
+        problems.append(f"{name}: re-run made {second['textract_calls']} Textract calls")
+    if late["failed"] or late["model_calls"] or late["textract_calls"]:
+        problems.append(f"{name}: a late execution after ingest lost its checkpoints: {late['failed']} failed, "
+                        f"{late['model_calls']} model and {late['textract_calls']} Textract calls")
+    return problems
+
+
+def spoofed_hash_problems(cli) -> list[str]:
+    """An attachment is ingested, then a different web upload arrives claiming the attachment's content hash."""
+    build, ext = SHAPES["text_pdf"]
+    with FakeHealthLake() as healthlake:
+        pipeline = Pipeline(_args(cli), healthlake)
+        logging.getLogger().setLevel(logging.CRITICAL)
+        events = []
+        for n, key in enumerate((f"incoming/message1/referral{ext}", f"incoming/web_upload/upload{ext}")):
+            body = build(cli.pages, cli.seed + n)
+            if not events:
+                digest = hashlib.sha256(body).hexdigest()
+            pipeline.s3.put_object(Bucket=BUCKET, Key=key, Body=body,
+                                   Metadata={"source_channel": "email", "content_sha256": digest})
+            events.append({"detail": {"bucket": {"name": BUCKET}, "object": {"key": key}}})
+        _, attachment = _execute(pipeline, events[:1])
+        _, upload = _execute(pipeline, events[1:])
+
+    if attachment["failed"] or upload["failed"]:
+        return [f"spoofed hash: {attachment['failed'] + upload['failed']} executions failed"]
+    if not upload["model_calls"]:
+        return ["spoofed hash: a web upload claiming an attachment's content_sha256 reused its checkpoints"]
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=6, help="pages per document")
+    parser.add_argument("--batch-size", type=int, default=1, help="GUARDRAIL_BATCH_SIZE (chunks per Map item)")
+    parser.add_argument("--fail-fraction", type=float, default=0.08,
+                        help="share of chunks Bedrock fails in the first run of the bedrock scenario")
+    parser.add_argument("--textract-ms-per-page", type=float, default=1.0, help="fake job duration per page")
+    parser.add_argument("--scenarios", default="bedrock,healthlake")
+    parser.add_argument("--seed", type=int, default=0)
+    cli = parser.parse_args()
+
+    # HealthLake retries 503s with backoff; keep its delays at the fakes' scale
+    os.environ.setdefault("HEALTHLAKE_BACKOFF_BASE_S", "0.001")
+    os.environ.setdefault("INSTRUMENTATION", "off")
+
+    print(f"{'scenario':>10} {'run':>7} {'executions':>10} {'failed':>7} {'map_items':>9} {'model_calls':>11} "
+          f"{'textract_calls':>14}")
+    problems = []
+    for name in cli.scenarios.split(","):
+        problems += scenario(name, cli)
+    problems += spoofed_hash_problems(cli)
+
+    print()
+    for problem in problems:
+        print(f"FAIL {problem}")
+    if problems:
+        sys.exit(1)
+    print("re-runs resumed from their checkpoints with no repeated model or Textract calls")
+
+
+if __name__ == "__main__":
+    main()
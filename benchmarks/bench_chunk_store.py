@@ -0,0 +1,130 @@
+"""
+Split wall time of content_splitter across the three chunk store modes.
+
+The S3 stand-in adds a fixed per-call latency so the number of round trips
+(serial: one PUT per chunk, parallel: the same PUTs overlapped, packed: one
+multipart upload) dominates, as it does against real S3. The packed result is
+also read back with ranged GETs to check every chunk round-trips intact, and a
+failed part upload or source read must not leave the multipart upload open.
+
+    python benchmarks/bench_chunk_store.py --size-mb 50 --latency-ms 10
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+from _support import MB, FakeContext, load_handler, map_items
+from fakes import FakeS3, SyntheticBody
+
+PATTERN = "Referral letter: patient seen for follow-up, vitals stable, meds unchanged.\n".encode("utf-8")
+
+
+def run_mode(splitter, mode: str, size_mb: int, latency_s: float) -> dict:
+    fake_s3 = FakeS3(latency_s=latency_s)
+    fake_s3.add_synthetic_object("bench", "incoming/synthetic.csv", size_mb * MB, PATTERN)
+    splitter.s3 = fake_s3
+
+    # Fixed 5000-char chunks keep every mode's chunk set identical (and checkable below)
+    event = {"bucket": "bench", "key": "incoming/synthetic.csv", "mode": "NATIVE_PARSE", "chunk_store": mode,
+             "format": "text", "chunking": {"strategy": "fixed"}}
+    started = time.perf_counter()
+    result = splitter.lambda_handler(event, FakeContext(request_id=f"bench-{mode}"))
+    elapsed = time.perf_counter() - started
+
+    # Verify the Map items resolve back to the original chunk text
+    fake_s3.latency_s = 0
+    items = map_items(fake_s3, result)
+    for item in items[:: max(1, len(items) // 50)]:
+        kwargs = {"Bucket": item["s3_bucket"], "Key": item["s3_key"]}
+        if "byte_range" in item:
+            start, end = item["byte_range"]
+            kwargs["Range"] = f"bytes={start}-{end - 1}"
+        text = fake_s3.get_object(**kwargs)["Body"].read().decode("utf-8")
+        assert len(text) == 5000 or item["chunk_id"] == len(items) - 1, item
+
+    return {
+        "mode": mode,
+        "chunks": len(items),
+        "seconds": elapsed,
+        "s3_calls": sum(v for k, v in fake_s3.calls.items() if k != "get_object"),
+    }
+
+
+class _FailingPartS3(FakeS3):
+    """upload_part fails from the second part on."""
+
+    def upload_part(self, **kwargs):
+        if kwargs["PartNumber"] > 1:
+            raise ConnectionError("connection reset during upload_part")
+        return super().upload_part(**kwargs)
+
+
+class _TruncatedBody(SyntheticBody):
+    """A source stream that drops after `fail_at` bytes."""
+
+    def __init__(self, size: int, pattern: bytes, fail_at: int):
+        super().__init__(size, pattern)
+        self._fail_at = fail_at
+
+    def _produce(self, n: int) -> bytes:
+        if self._pos >= self._fail_at:
+            raise ConnectionError("connection reset while reading the source")
+        return super()._produce(n)
+
+
+def abort_problems(splitter) -> list[str]:
+    """A packed split that fails after its first part must abort the multipart upload."""
+    size = 40 * MB
+    failing_part = _FailingPartS3()
+    failing_part.add_synthetic_object("bench", "incoming/synthetic.csv", size, PATTERN)
+    failing_read = FakeS3()
+    failing_read.add_generated_object("bench", "incoming/synthetic.csv",
+                                      lambda: _TruncatedBody(size, PATTERN, fail_at=20 * MB))
+
+    problems = []
+    for name, fake_s3 in (("upload_part failure", failing_part), ("source read failure", failing_read)):
+        splitter.s3 = fake_s3
+        event = {"bucket": "bench", "key": "incoming/synthetic.csv", "mode": "NATIVE_PARSE",
+                 "chunk_store": "packed", "format": "text", "chunking": {"strategy": "fixed"}}
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                splitter.lambda_handler(event, FakeContext(request_id="bench-abort"))
+        except ConnectionError:
+            pass
+        else:
+            problems.append(f"{name}: split did not fail")
+        if not fake_s3.calls.get("upload_part"):
+            problems.append(f"{name}: failed before any part was uploaded, nothing to abort")
+        if fake_s3.uploads:
+            problems.append(f"{name}: {len(fake_s3.uploads)} multipart upload(s) left open")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=10.0, help="simulated S3 round-trip latency")
+    parser.add_argument("--modes", default="serial,parallel,packed")
+    args = parser.parse_args()
+
+    # No per-invocation EMF records in the output (bench_instrumentation measures them)
+    os.environ.setdefault("INSTRUMENTATION", "off")
+    splitter = load_handler("content_splitter")
+    print(f"input={args.size_mb}MB latency={args.latency_ms}ms")
+    print(f"{'mode':>10} {'chunks':>8} {'write_calls':>12} {'seconds':>9}")
+    for mode in args.modes.split(","):
+        r = run_mode(splitter, mode, args.size_mb, args.latency_ms / 1000)
+        print(f"{r['mode']:>10} {r['chunks']:>8} {r['s3_calls']:>12} {r['seconds']:>9.2f}")
+
+    problems = abort_problems(splitter)
+    for problem in problems:
+        print(f"FAIL {problem}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
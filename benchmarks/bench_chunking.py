@@ -0,0 +1,108 @@
+"""
+Chunk count, token fill and split throughput of the content_splitter strategies.
+
+Synthetic documents mimic the shapes the pipeline receives:
+- referral:  letter prose in paragraphs
+- labs:      tab-separated lab tables, many short lines
+- ocr_scan:  Textract-style short lines with form-feed page breaks
+- dense:     one long run of text with no line breaks (worst case for boundaries)
+
+    python benchmarks/bench_chunking.py --size-mb 20 --target-tokens 1250,3000
+"""
+import argparse
+import os
+import random
+import time
+
+from _support import MB, load_function_module
+
+WORDS = (
+    "patient reviewed clinic history hypertension diabetes medication metformin amlodipine blood pressure "
+    "stable follow up referral cognitive assessment memory decline family reports examination normal plan "
+    "continue review weeks consultant letter dear doctor thank you for seeing"
+).split()
+
+
+def _sentence(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 18))).capitalize() + ". "
+
+
+def make_document(shape: str, size: int, seed: int = 7) -> str:
+    rng = random.Random(seed)
+    parts = []
+    total = 0
+    while total < size:
+        if shape == "referral":
+            piece = "".join(_sentence(rng) for _ in range(rng.randint(2, 6))) + "\n\n"
+        elif shape == "labs":
+            piece = "\t".join([rng.choice(["HbA1c", "Glucose", "Na", "K", "Creatinine", "Hb"]),
+                               f"{rng.uniform(1, 150):.1f}", rng.choice(["mmol/L", "%", "g/dL"]), "N"]) + "\n"
+        elif shape == "ocr_scan":
+            lines = [_sentence(rng)[: rng.randint(20, 80)] for _ in range(rng.randint(30, 50))]
+            piece = "\n".join(lines) + "\n\f"
+        elif shape == "dense":
+            piece = _sentence(rng)
+        else:
+            raise ValueError(shape)
+        parts.append(piece)
+        total += len(piece)
+    return "".join(parts)[:size]
+
+
+def blocks(text: str, block_chars: int = 256 * 1024):
+    for i in range(0, len(text), block_chars):
+        yield text[i:i + block_chars]
+
+
+BOUNDARY_ENDINGS = ("\f", "\n", ". ", "? ", "! ", "; ")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=20)
+    parser.add_argument("--shapes", default="referral,labs,ocr_scan,dense")
+    parser.add_argument("--strategies", default="fixed,boundary")
+    parser.add_argument("--target-tokens", default="1250,3000")
+    parser.add_argument("--overlap-tokens", type=int, default=0)
+    args = parser.parse_args()
+
+    chunking = load_function_module("content_splitter", "chunking")
+    size = int(args.size_mb * MB)
+
+    # An explicit 0 in the event is a setting, not a missing one
+    saved = {name: os.environ.get(name) for name in ("CHUNK_OVERLAP_TOKENS", "CHUNK_MIN_FILL")}
+    os.environ.update(CHUNK_OVERLAP_TOKENS="50", CHUNK_MIN_FILL="0.7")
+    config = chunking.ChunkingConfig.from_event({"chunking": {"overlap_tokens": 0, "min_fill": 0}})
+    for name, value in saved.items():
+        if value is None:
+            os.environ.pop(name)
+        else:
+            os.environ[name] = value
+    assert (config.overlap_tokens, config.min_fill) == (0, 0.0), f"event overrides of 0 were ignored: {config}"
+
+    print(f"{'shape':>9} {'strategy':>9} {'target':>7} {'chunks':>7} {'mean_tok':>9} {'fill':>6} "
+          f"{'clean_cut':>10} {'MB/s':>7}")
+    for shape in args.shapes.split(","):
+        doc = make_document(shape, size)
+        for strategy in args.strategies.split(","):
+            for target in [int(t) for t in args.target_tokens.split(",")]:
+                config = chunking.ChunkingConfig(strategy=strategy, target_tokens=target,
+                                                 overlap_tokens=args.overlap_tokens)
+                splitter = chunking.make_splitter(config)
+
+                started = time.perf_counter()
+                chunks = list(splitter.split(blocks(doc)))
+                elapsed = time.perf_counter() - started
+
+                if not args.overlap_tokens:
+                    assert "".join(chunks).strip() == doc.strip(), f"{shape}/{strategy} lost text"
+
+                tokens = [chunking.estimate_tokens(c) for c in chunks]
+                mean_tokens = sum(tokens) / len(tokens)
+                clean = sum(1 for c in chunks[:-1] if c.endswith(BOUNDARY_ENDINGS)) / max(1, len(chunks) - 1)
+                print(f"{shape:>9} {strategy:>9} {target:>7} {len(chunks):>7} {mean_tokens:>9.0f} "
+                      f"{mean_tokens / target:>6.0%} {clean:>10.0%} {len(doc) / MB / elapsed:>7.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+document_router decisions on a mixed intake: extension-only vs content sniffing
+with PDF text-layer detection.
+
+The corpus mixes born-digital PDFs, scanned PDFs, PDFs with CID fonts, images,
+DOCX and CSV, a few of them under the wrong extension, and a few plain text
+and JSON files that must be rejected. For each router
+configuration it reports Textract jobs started, estimated Textract pages and
+cost avoided (from the router's EMF records), sniffing cost, and how many
+files got the route their content calls for. The check fails (exit 1) if a
+sniffing router accepts a file that is not a supported input type. It then times content_splitter's
+native PDF text extraction, the work that replaces Textract for the text PDFs.
+
+    python benchmarks/bench_document_routing.py --documents 200 --pages 8
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import documents
+from _support import MB, FakeContext, load_handler
+from fakes import FakeS3, FakeTextract
+
+# (name, builder(pages, seed) -> bytes, extension, expected route); weights approximate a referral inbox
+SHAPES = [
+    ("text_pdf", lambda pages, seed: documents.text_pdf(pages, seed=seed), ".pdf", "NATIVE_PARSE", 45),
+    ("scanned_pdf", lambda pages, seed: documents.scanned_pdf(pages, image_bytes=50_000, seed=seed), ".pdf", "ASYNC_OCR", 25),
+    ("cid_font_pdf", lambda pages, seed: documents.cid_pdf(pages, seed=seed), ".pdf", "ASYNC_OCR", 5),
+    ("jpeg", lambda pages, seed: b"\xff\xd8\xff\xe0" + random.Random(seed).randbytes(80_000), ".jpg", "ASYNC_OCR", 10),
+    ("docx", lambda pages, seed: documents.docx(documents.clinical_lines(40 * pages, seed=seed)), ".docx", "NATIVE_PARSE", 8),
+    ("csv", lambda pages, seed: documents.csv_rows(200 * pages, seed=seed), ".csv", "NATIVE_PARSE", 5),
+    # Misnamed: a phone photo saved as .pdf, a text PDF saved without an extension
+    ("jpeg_as_pdf", lambda pages, seed: b"\xff\xd8\xff\xe0" + random.Random(seed).randbytes(80_000), ".pdf", "ASYNC_OCR", 1),
+    ("pdf_no_ext", lambda pages, seed: documents.text_pdf(pages, seed=seed), "", "NATIVE_PARSE", 1),
+    # Text that is not CSV is not an input type: rejected by extension and by content alike
+    ("notes_txt", lambda pages, seed: "\n".join(documents.clinical_lines(40 * pages, seed=seed)).encode(), ".txt", None, 1),
+    ("json", lambda pages, seed: json.dumps({"lines": documents.clinical_lines(10 * pages, seed=seed)}).encode(),
+     ".json", None, 1),
+]
+
+CONFIGS = [
+    # (label, sniffing, PDF_TEXT_DETECTION)
+    ("extension", False, "off"),
+    ("sniff", True, "off"),
+    ("sniff+text", True, "on"),
+]
+
+
+def _corpus(n: int, pages: int, seed: int) -> list[tuple[str, str, bytes, str]]:
+    rng = random.Random(seed)
+    weights = [shape[4] for shape in SHAPES]
+    corpus = []
+    for i in range(n):
+        name, build, ext, expected, _ = rng.choices(SHAPES, weights=weights)[0]
+        corpus.append((name, f"incoming/bench-{i}/doc{i}{ext}", build(pages, i), expected))
+    return corpus
+
+
+def _extension_route(key: str) -> str | None:
+    """The original router's decision."""
+    ext = os.path.splitext(key)[1].lower()
+    if ext in (".pdf", ".jpg", ".png", ".jpeg"):
+        return "ASYNC_OCR"
+    if ext in (".csv", ".xlsx", ".docx"):
+        return "NATIVE_PARSE"
+    return None
+
+
+def run_config(router, corpus, sniffing: bool, text_detection: str) -> dict:
+    fake_s3 = FakeS3()
+    for _, key, data, _ in corpus:
+        fake_s3.objects[("bench", key)] = data
+    textract = FakeTextract()
+    router.s3 = fake_s3
+    router.textract = textract
+    router.PDF_TEXT_DETECTION = text_detection
+
+    correct = 0
+    accepted = []
+    latencies = []
+    metrics = {"TextractPagesAvoided": 0, "TextractCostAvoidedUSD": 0.0, "SniffBytes": 0}
+    for name, key, data, expected in corpus:
+        if not sniffing:
+            route = _extension_route(key)
+            if route == "ASYNC_OCR":
+                textract.start_document_text_detection(DocumentLocation={"S3Object": {"Bucket": "bench", "Name": key}})
+            correct += route == expected
+            continue
+
+        event = {"detail": {"bucket": {"name": "bench"}, "object": {"key": key}}}
+        log = io.StringIO()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(log):
+            try:
+                route = router.lambda_handler(event, FakeContext())["mode"]
+            except ValueError:
+                route = None
+        latencies.append((time.perf_counter() - started) * 1000)
+        correct += route == expected
+        if expected is None and route is not None:
+            accepted.append(name)
+
+        for line in log.getvalue().splitlines():
+            if line.startswith("{") and '"_aws"' in line:
+                record = json.loads(line)
+                for metric in metrics:
+                    metrics[metric] += record.get(metric, 0)
+
+    return {
+        "textract_jobs": textract.calls.get("start_document_text_detection", 0),
+        "correct": correct,
+        "pages_avoided": metrics["TextractPagesAvoided"],
+        "cost_avoided": metrics["TextractCostAvoidedUSD"],
+        "sniff_kb_per_doc": metrics["SniffBytes"] / len(corpus) / 1024,
+        "route_ms_p50": statistics.median(latencies) if latencies else 0.0,
+        "s3_get": fake_s3.calls.get("get_object", 0),
+        "accepted_unsupported": accepted,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=8, help="pages per PDF")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--extract-pages", type=int, default=500, help="page count for the native extraction timing")
+    args = parser.parse_args()
+
+    os.environ.setdefault("BUCKET_NAME", "bench")
+    router = load_handler("document_router")
+    # Every document is routed from scratch; no earlier run's OCR text to find
+    router.checkpoints = None
+    corpus = _corpus(args.documents, args.pages, args.seed)
+    counts = {}
+    for name, *_ in corpus:
+        counts[name] = counts.get(name, 0) + 1
+    print(f"documents={len(corpus)} pages/pdf={args.pages} mix={json.dumps(counts)}")
+    print(f"{'router':>12} {'textract':>9} {'correct':>8} {'pages_saved':>12} {'usd_saved':>10} "
+          f"{'sniff_KB':>9} {'route_ms':>9} {'s3_gets':>8}")
+
+    problems = []
+    for label, sniffing, text_detection in CONFIGS:
+        r = run_config(router, corpus, sniffing, text_detection)
+        print(f"{label:>12} {r['textract_jobs']:>9} {r['correct']:>8} {r['pages_avoided']:>12} "
+              f"{r['cost_avoided']:>10.4f} {r['sniff_kb_per_doc']:>9.1f} {r['route_ms_p50']:>9.2f} {r['s3_get']:>8}")
+        if r["accepted_unsupported"]:
+            problems.append(f"{label}: routed {len(r['accepted_unsupported'])} unsupported files "
+                            f"({', '.join(sorted(set(r['accepted_unsupported'])))})")
+
+    # What replaces Textract for the text PDFs: content_splitter's text-layer read
+    from healthtech_common import pdf_text
+
+    data = documents.text_pdf(args.extract_pages, seed=args.seed)
+    started = time.perf_counter()
+    chars = sum(len(t) for t in pdf_text.iter_pdf_text(data[i:i + MB] for i in range(0, len(data), MB)))
+    elapsed = time.perf_counter() - started
+    print(f"\nnative PDF extraction: {args.extract_pages} pages, {len(data) / MB:.1f}MB -> {chars} chars "
+          f"in {elapsed:.2f}s ({args.extract_pages / elapsed:.0f} pages/s)")
+
+    print()
+    for problem in problems:
+        print(f"FAIL {problem}")
+    if problems:
+        sys.exit(1)
+    print("only supported input types were routed")
+
+
+if __name__ == "__main__":
+    main()
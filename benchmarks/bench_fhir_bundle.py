@@ -0,0 +1,84 @@
+"""
+FHIR write throughput of fhir_ingest: one POST per resource vs Bundles.
+
+Runs against the local HealthLake stand-in (fakes.FakeHealthLake) with an
+optional per-request latency. Each synthetic patient is a Patient plus the
+Provenance that targets it, so two resources per patient.
+
+    python benchmarks/bench_fhir_bundle.py --patients 500 --latency-ms 20
+"""
+import argparse
+import os
+import time
+
+from _support import load_handler
+from fakes import FakeHealthLake
+
+
+def _patient(ingest, n: int) -> dict:
+    return ingest._map_entities_to_patient_fhir({
+        "PatientName": f"Test Patient{n}",
+        "PatientIdentifier": f"S{n:07d}A",
+        "Gender": "female",
+        "Vitals": "BP 120/80",
+        "Medications": "Metformin 500mg",
+    })
+
+
+def run_single(ingest, patients: int) -> int:
+    for n in range(patients):
+        ingest.FHIR_WRITE_MODE = "single"
+        ingest._write_resources("bench", _patient(ingest, n), {"original_name": f"doc{n}.pdf"}, "bench")
+    return patients * 2
+
+
+def run_bundles(ingest, patients: int, bundle_type: str, max_entries: int) -> int:
+    ingest.FHIR_BUNDLE_TYPE = bundle_type
+    ingest.FHIR_BUNDLE_MAX_ENTRIES = max_entries
+    writer = ingest._new_bundle_writer("bench")
+    for n in range(patients):
+        entry = writer.entry_for(_patient(ingest, n))
+        provenance = ingest._build_provenance(writer.reference_for(entry), {"original_name": f"doc{n}.pdf"}, "bench")
+        writer.add_group([entry, writer.entry_for(provenance)])
+    writer.flush()
+    assert not writer.failures(), writer.failures()[:3]
+    return len(writer.responses)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="simulated HealthLake request latency")
+    parser.add_argument("--max-entries", default="20,100")
+    args = parser.parse_args()
+
+    # SigV4 signing needs credentials; the stand-in does not verify them
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+
+    with FakeHealthLake(latency_s=args.latency_ms / 1000) as healthlake:
+        os.environ["HEALTHLAKE_ENDPOINT"] = healthlake.endpoint
+        ingest = load_handler("fhir_ingest")
+
+        print(f"patients={args.patients} latency={args.latency_ms}ms")
+        print(f"{'mode':>22} {'resources':>10} {'requests':>9} {'seconds':>8} {'res/s':>8}")
+
+        cases = [("single", None, None)]
+        for max_entries in [int(m) for m in args.max_entries.split(",")]:
+            cases += [("transaction", "transaction", max_entries), ("batch", "batch", max_entries)]
+
+        for label, bundle_type, max_entries in cases:
+            healthlake.requests.clear()
+            started = time.perf_counter()
+            if bundle_type is None:
+                written = run_single(ingest, args.patients)
+            else:
+                written = run_bundles(ingest, args.patients, bundle_type, max_entries)
+                label = f"{label}(max={max_entries})"
+            elapsed = time.perf_counter() - started
+            requests = sum(healthlake.requests.values())
+            print(f"{label:>22} {written:>10} {requests:>9} {elapsed:>8.2f} {written / elapsed:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Repeat ingestion through fhir_ingest: duplicate Patients and HealthLake calls.
+
+Each synthetic referral is ingested --repeats times (Step Functions retries,
+the same letter arriving by email and web), its chunk results read through a
+results manifest as the pipeline passes them. `create` is the original
+behaviour; `conditional` upserts on the identifier behind the patient index.
+
+A quarter of the referrals have no extracted identifier, and each of those
+has a lookalike: another document for another patient with the same name,
+vitals and medications. The check fails (exit 1) unless `conditional` ends
+with exactly one Patient per document, so repeats dedupe and lookalikes
+do not collapse into one.
+
+    python benchmarks/bench_ingest_idempotency.py --referrals 100 --repeats 3
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from _support import FakeContext, load_handler
+from fakes import FakeHealthLake, FakeS3
+
+BUCKET = "bench"
+
+
+def _guardrail_results(n: int, with_identifier: bool) -> list[dict]:
+    entities = {
+        # Lookalikes share n's entities
+        "PatientName": f"Test Patient{n}",
+        "PatientIdentifier": f"S{n:07d}A" if with_identifier else "UNKNOWN",
+        "Gender": "male" if n % 2 else "female",
+        "Vitals": "BP 130/85",
+        "Medications": "Amlodipine 5mg",
+    }
+    return [{
+        "classification": "VALID",
+        "reason": "Clinical referral letter",
+        "entities": entities,
+        "metadata": {"original_name": f"referral{n}.pdf", "sender": "gp@example.com"},
+    }]
+
+
+def _event(s3: FakeS3, name: str, results: list[dict]) -> dict:
+    """Results behind a manifest, as content_splitter and bedrock_guardrail leave them."""
+    result_key = f"temp/results/{name}/000000.json"
+    manifest_key = f"temp/results/{name}/manifest.json"
+    s3.put_object(Bucket=BUCKET, Key=result_key, Body=json.dumps(results).encode())
+    s3.put_object(Bucket=BUCKET, Key=manifest_key,
+                  Body=json.dumps({"bucket": BUCKET, "total_chunks": 1, "result_keys": [result_key]}).encode())
+    return {"results_manifest": {"bucket": BUCKET, "key": manifest_key, "source": f"s3://{BUCKET}/incoming/{name}.pdf",
+                                 "document_hash": f"sha256-{name}"}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--referrals", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="simulated HealthLake request latency")
+    args = parser.parse_args()
+
+    # SigV4 signing needs credentials; the stand-in does not verify them
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    os.environ.setdefault("HEALTHLAKE_ID", "bench")
+    # No per-invocation EMF records in the output (bench_instrumentation measures them)
+    os.environ.setdefault("INSTRUMENTATION", "off")
+
+    print(f"referrals={args.referrals} repeats={args.repeats} latency={args.latency_ms}ms")
+    print(f"{'mode':>12} {'patients':>9} {'provenance':>11} {'requests':>9} {'deduped':>8} {'ms/run':>7}")
+
+    documents = []
+    for n in range(args.referrals):
+        with_identifier = n % 4 != 0
+        documents.append((f"referral{n}", _guardrail_results(n, with_identifier)))
+        if not with_identifier:
+            documents.append((f"lookalike{n}", _guardrail_results(n, with_identifier)))
+
+    problems = []
+    for mode in ("create", "conditional"):
+        with FakeHealthLake(latency_s=args.latency_ms / 1000) as healthlake:
+            os.environ["HEALTHLAKE_ENDPOINT"] = healthlake.endpoint
+            ingest = load_handler("fhir_ingest")
+            ingest.FHIR_UPSERT_MODE = mode
+            ingest.patient_index = ingest.build_patient_index("memory")
+            ingest.s3 = s3 = FakeS3()
+            events = [_event(s3, name, results) for name, results in documents]
+            # Clients are cached per datastore with their endpoint; point them at this stand-in
+            from healthtech_common import healthlake as healthlake_client
+            healthlake_client._clients.clear()
+
+            deduped = 0
+            runs = 0
+            started = time.perf_counter()
+            for _ in range(args.repeats):
+                for event in events:
+                    out = ingest.lambda_handler(event, FakeContext())
+                    assert out["status"] == "SUCCESS", out
+                    deduped += bool(out.get("deduplicated"))
+                    runs += 1
+            elapsed = time.perf_counter() - started
+
+            patients = len(healthlake.resources.get("Patient", {}))
+            provenance = len(healthlake.resources.get("Provenance", {}))
+            requests = sum(healthlake.requests.values())
+            print(f"{mode:>12} {patients:>9} {provenance:>11} {requests:>9} {deduped:>8} "
+                  f"{elapsed / runs * 1000:>7.1f}")
+            if mode == "conditional" and patients != len(documents):
+                problems.append(f"{patients} Patients for {len(documents)} documents "
+                                f"({len(documents) - args.referrals} lookalikes without an identifier)")
+
+    print()
+    for problem in problems:
+        print(f"FAIL {problem}")
+    if problems:
+        sys.exit(1)
+    print("one Patient per document: repeats dedupe, lookalike documents stay apart")
+
+
+if __name__ == "__main__":
+    main()
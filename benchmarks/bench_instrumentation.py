@@ -0,0 +1,119 @@
+"""
+Cost of healthtech_common.instrumentation.
+
+Micro: nanoseconds per phase() / record_count() with an invocation in flight
+and without one (the path library code takes outside a handler), and
+microseconds per EMF record emitted.
+
+Handlers: content_splitter on a text document and bedrock_guardrail on single
+chunks (Bedrock stand-in with no latency, pre-classifier and cache off, so
+the handler's own work is all that is measured), each timed through the
+instrumented handler and through the undecorated function
+(`lambda_handler.__wrapped__`, whose phase() calls then take the no-op path).
+
+    python benchmarks/bench_instrumentation.py --invocations 2000
+"""
+import argparse
+import contextlib
+import os
+import statistics
+import time
+
+from _support import FakeContext, load_function_module, load_handler
+from fakes import FakeBedrock, FakeS3
+
+CLINICAL = "Patient reviewed in clinic. BP 130/85. Continue Metformin 500mg BD. Review in 4 weeks.\n"
+
+
+def _ns_per_call(fn, n: int) -> float:
+    started = time.perf_counter_ns()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter_ns() - started) / n
+
+
+def micro(n: int):
+    from healthtech_common import instrumentation as inst
+
+    def one_phase():
+        with inst.phase("S3Read"):
+            pass
+
+    idle_phase = _ns_per_call(one_phase, n)
+    idle_count = _ns_per_call(lambda: inst.record_count("Chunks"), n)
+
+    inst._current = inst.Invocation("bench", False)
+    live_phase = _ns_per_call(one_phase, n)
+    live_count = _ns_per_call(lambda: inst.record_count("Chunks"), n)
+    for name in ("S3Read", "PromptBuild", "ModelCall", "Parse", "S3Write"):
+        inst._current.add_phase(name, 0.001)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        emit_us = _ns_per_call(lambda: inst._current.emit("bench-request"), n // 100) / 1000
+    inst._current = None
+
+    print(f"{'':>14} {'no invocation':>14} {'in invocation':>14}")
+    print(f"{'phase()':>14} {idle_phase:>11.0f} ns {live_phase:>11.0f} ns")
+    print(f"{'record_count':>14} {idle_count:>11.0f} ns {live_count:>11.0f} ns")
+    print(f"emit (6 phases): {emit_us:.1f} us per record\n")
+
+
+def _time_handler(fn, make_event, invocations: int) -> list[float]:
+    samples = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for n in range(invocations):
+            event = make_event(n)
+            started = time.perf_counter()
+            fn(event, FakeContext(request_id=f"bench-{n}"))
+            samples.append(time.perf_counter() - started)
+    return samples
+
+
+def handlers(invocations: int):
+    fake_s3 = FakeS3()
+    splitter = load_handler("content_splitter")
+    splitter.s3 = fake_s3
+    fake_s3.objects[("bench", "incoming/letter.txt")] = (CLINICAL * 2000).encode("utf-8")
+
+    guardrail = load_handler("bedrock_guardrail")
+    client_mod = load_function_module("bedrock_guardrail", "bedrock_client")
+    guardrail.s3 = fake_s3
+    guardrail.result_cache = None
+    guardrail.PRECLASSIFIER_MODE = "off"
+    guardrail.bedrock_client = client_mod.GuardrailBedrockClient(FakeBedrock())
+    for n in range(invocations):
+        fake_s3.objects[("bench", f"chunks/{n}.txt")] = f"{CLINICAL * 40} chunk {n}".encode("utf-8")
+
+    cases = [
+        ("content_splitter", splitter.lambda_handler,
+         lambda n: {"bucket": "bench", "key": "incoming/letter.txt", "mode": "NATIVE_PARSE", "format": "text"},
+         max(1, invocations // 20)),
+        ("bedrock_guardrail", guardrail.lambda_handler,
+         lambda n: {"s3_bucket": "bench", "s3_key": f"chunks/{n}.txt"}, invocations),
+    ]
+    print(f"{'handler':>18} {'invocations':>12} {'plain_us':>10} {'instrumented_us':>16} {'overhead_us':>12} {'overhead':>9}")
+    for name, handler, make_event, count in cases:
+        # Interleaved rounds so drift hits both variants alike
+        plain, instrumented = [], []
+        for _ in range(3):
+            plain += _time_handler(handler.__wrapped__, make_event, count)
+            instrumented += _time_handler(handler, make_event, count)
+        base = statistics.median(plain) * 1e6
+        inst = statistics.median(instrumented) * 1e6
+        print(f"{name:>18} {count:>12} {base:>10.1f} {inst:>16.1f} {inst - base:>12.1f} {(inst - base) / base:>9.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=1_000_000, help="iterations for the micro benchmarks")
+    parser.add_argument("--invocations", type=int, default=2000, help="guardrail invocations per round")
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    load_handler("document_router")  # puts the layer on sys.path
+    micro(args.calls)
+    handlers(args.invocations)
+
+
+if __name__ == "__main__":
+    main()
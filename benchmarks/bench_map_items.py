@@ -0,0 +1,78 @@
+"""
+State size of one long document through the state machine.
+
+Step Functions caps the state passed between states at 256KB. Passed inline
+(`ItemsPath: $.chunks`), the Map items alone outgrow that at a few hundred
+chunks, so a long document failed in SplitContent with
+States.DataLimitExceeded. The splitter now writes the items to S3 and the
+Distributed Map reads them through its ItemReader.
+
+One text PDF of --pages pages runs through bench_pipeline's Pipeline (which
+enforces the limit on every state's output). Reported: chunks, the size the
+items would have had inline, and the largest state payload. The check fails
+(exit 1) if the execution fails or any state outgrows --max-state-kb.
+
+    python benchmarks/bench_map_items.py --pages 1000
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sys
+
+from _support import map_items
+from asl_runner import STATE_PAYLOAD_LIMIT, StatesError
+from bench_pipeline import Pipeline
+from fakes import FakeHealthLake
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=1000, help="pages of the text PDF")
+    parser.add_argument("--max-state-kb", type=float, default=32.0,
+                        help="largest state payload allowed, well inside the 256KB limit")
+    parser.add_argument("--seed", type=int, default=0)
+    cli = parser.parse_args()
+    os.environ.setdefault("INSTRUMENTATION", "off")
+
+    args = argparse.Namespace(
+        s3_latency_ms=0.0, textract_latency_ms=0.0, textract_ms_per_page=0.0, bedrock_latency_ms=0.0,
+        bedrock_throttle_rate=0.0, seed=cli.seed, completion="callback", batch_size=1, map_concurrency=None,
+    )
+    problems = []
+    with FakeHealthLake() as healthlake:
+        pipeline = Pipeline(args, healthlake)
+        # Handlers set the level when loaded
+        logging.getLogger().setLevel(logging.ERROR)
+        event = pipeline.upload(0, "text_pdf", cli.pages, cli.seed)
+        try:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                out = pipeline.machine.execute(event)
+            if out.get("status") != "SUCCESS":
+                problems.append(f"execution ended {out.get('status')}: {out.get('reason')}")
+        except StatesError as e:
+            problems.append(f"execution failed: {e.error}: {e.cause}")
+
+        split = next((entry for entry in pipeline.machine.trace if entry["state"] == "SplitContent"), None)
+        manifests = [key for _, key in pipeline.s3.objects if key.endswith("/items.json")]
+        items = map_items(pipeline.s3, {"chunk_manifest": {"bucket": "bench", "key": manifests[0]}}) if manifests else []
+        largest = max(entry["payload_bytes"] for entry in pipeline.machine.trace)
+
+    inline_kb = len(json.dumps({"chunks": items})) / 1024
+    print(f"pages={cli.pages} chunks={len(items)} inline items={inline_kb:.1f}KB "
+          f"(limit {STATE_PAYLOAD_LIMIT / 1024:.0f}KB) SplitContent output="
+          f"{split['payload_bytes'] / 1024 if split else 0:.1f}KB largest state={largest / 1024:.1f}KB")
+
+    if largest > cli.max_state_kb * 1024:
+        problems.append(f"largest state payload is {largest / 1024:.1f}KB, over {cli.max_state_kb}KB")
+    print()
+    for problem in problems:
+        print(f"FAIL {problem}")
+    if problems:
+        sys.exit(1)
+    print("the Map items stay in S3 and every state stays small")
+
+
+if __name__ == "__main__":
+    main()
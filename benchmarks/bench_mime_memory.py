@@ -0,0 +1,182 @@
+"""
+Peak memory of mime_extractor on synthetic emails with large attachments.
+
+Each (size, mode) case runs in a fresh subprocess so ru_maxrss is not
+inherited from an earlier, larger case. The raw email is generated on the fly
+(headers, then base64 attachment bodies as repeated 76-char lines) and the
+uploaded attachments are counted rather than stored, so the numbers reflect
+the parser and upload path alone. Spooled attachments land in the system temp
+directory, as they would on Lambda's /tmp. A last check makes sure a failed
+attachment upload never hides the read error that stopped a streaming parse.
+
+    python benchmarks/bench_mime_memory.py --sizes 50,100,250,500
+    python benchmarks/bench_mime_memory.py --sizes 50,100 --modes streaming,buffered
+"""
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from _support import MB, FakeContext, load_handler, parse_sizes_mb, peak_rss_mb
+from fakes import FakeS3, SyntheticBody
+
+BOUNDARY = "bench-boundary-7f3a"
+
+# 57 raw bytes encode to exactly one 76-char base64 line
+RAW_LINE = bytes(range(57))
+B64_LINE = base64.b64encode(RAW_LINE) + b"\r\n"
+
+
+class SyntheticEmailBody:
+    """A StreamingBody concatenating literal header sections and SyntheticBody attachment bodies."""
+
+    def __init__(self, size: int, attachments: int):
+        lines_per_attachment = max(1, size // attachments // len(B64_LINE))
+        self._sections = [(
+            "From: referrals@clinic.example\r\n"
+            "To: intake@healthtech.example\r\n"
+            "Subject: Referral packet\r\n"
+            "MIME-Version: 1.0\r\n"
+            f'Content-Type: multipart/mixed; boundary="{BOUNDARY}"\r\n'
+            "\r\n"
+            f"--{BOUNDARY}\r\n"
+            "Content-Type: text/plain; charset=utf-8\r\n"
+            "\r\n"
+            "Please find the referral documents attached.\r\n"
+        ).encode("ascii")]
+        for i in range(attachments):
+            self._sections.append((
+                f"--{BOUNDARY}\r\n"
+                "Content-Type: application/pdf\r\n"
+                "Content-Transfer-Encoding: base64\r\n"
+                f'Content-Disposition: attachment; filename="referral-{i}.pdf"\r\n'
+                "\r\n"
+            ).encode("ascii"))
+            self._sections.append(SyntheticBody(lines_per_attachment * len(B64_LINE), B64_LINE))
+        self._sections.append(f"--{BOUNDARY}--\r\n".encode("ascii"))
+        self.decoded_bytes = lines_per_attachment * len(RAW_LINE) * attachments
+
+    def iter_chunks(self, chunk_size: int = 1024):
+        for section in self._sections:
+            if isinstance(section, bytes):
+                yield section
+            else:
+                yield from section.iter_chunks(chunk_size)
+
+    def read(self, amt: int | None = None) -> bytes:
+        # The buffered mode's whole-object read
+        return b"".join(self.iter_chunks(MB))
+
+
+class _DroppedEmailBody(SyntheticEmailBody):
+    """The raw email stream drops inside the second attachment, once the first is complete."""
+
+    def iter_chunks(self, chunk_size: int = 1024):
+        # Sections: email headers, then a header and a body per attachment
+        for i, section in enumerate(self._sections):
+            if i == 4:
+                raise ConnectionResetError("raw email stream reset")
+            yield from [section] if isinstance(section, bytes) else section.iter_chunks(chunk_size)
+
+
+class _FailingUploadS3(FakeS3):
+    def upload_fileobj(self, Fileobj, Bucket, Key, **kwargs):
+        raise TimeoutError(f"upload of {Key} timed out")
+
+
+def error_precedence_problems() -> list[str]:
+    """The parse error wins over upload failures; an upload failure still fails a clean parse."""
+    os.environ["BUCKET_NAME"] = "bench"
+    os.environ["MIME_PARSE_MODE"] = "streaming"
+    extractor = load_handler("mime_extractor")
+    extractor.ledger = None
+    event = {"Records": [{"Sns": {"Message": json.dumps({"mail": {"messageId": "bench-msg"}})}}]}
+
+    problems = []
+    for name, body, expected in (("dropped stream", _DroppedEmailBody, ConnectionResetError),
+                                 ("clean stream", SyntheticEmailBody, TimeoutError)):
+        fake_s3 = _FailingUploadS3(keep_bodies=False)
+        fake_s3.add_generated_object("bench", "raw_email/bench-msg", lambda body=body: body(4 * MB, 3))
+        extractor.s3 = fake_s3
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                extractor.lambda_handler(event, FakeContext())
+        except Exception as e:
+            if not isinstance(e, expected):
+                problems.append(f"{name}: raised {type(e).__name__}: {e}, expected {expected.__name__}")
+        else:
+            problems.append(f"{name}: succeeded despite failed uploads")
+    return problems
+
+
+def run_case(size_mb: int, mode: str, attachments: int) -> dict:
+    os.environ["BUCKET_NAME"] = "bench"
+    os.environ["MIME_PARSE_MODE"] = mode
+    extractor = load_handler("mime_extractor")
+    fake_s3 = FakeS3(keep_bodies=False)
+    fake_s3.add_generated_object("bench", "raw_email/bench-msg", lambda: SyntheticEmailBody(size_mb * MB, attachments))
+    extractor.s3 = fake_s3
+
+    event = {"Records": [{"Sns": {"Message": json.dumps({"mail": {"messageId": "bench-msg"}})}}]}
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = extractor.lambda_handler(event, FakeContext())
+    elapsed = time.perf_counter() - started
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "size_mb": size_mb,
+        "mode": mode,
+        "attachments": result["attachments"],
+        "written_mb": round(fake_s3.bytes_written / MB, 1),
+        "seconds": round(elapsed, 2),
+        "mb_per_s": round(size_mb / elapsed, 1) if elapsed else None,
+        "traced_peak_mb": round(traced_peak / MB, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="50,100,250,500", help="raw email sizes in MB, comma separated")
+    parser.add_argument("--modes", default="streaming,buffered", help="parse modes to compare (streaming,buffered)")
+    parser.add_argument("--attachments", type=int, default=3, help="attachments per email, sharing the size evenly")
+    parser.add_argument("--case", nargs=3, metavar=("SIZE_MB", "MODE", "ATTACHMENTS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(int(args.case[0]), args.case[1], int(args.case[2]))))
+        return
+
+    print(f"{'size_mb':>8} {'mode':>10} {'atts':>5} {'written_MB':>11} {'sec':>8} {'MB/s':>8} {'traced_MB':>10} {'rss_MB':>8}")
+    for mode in args.modes.split(","):
+        for size_mb in parse_sizes_mb(args.sizes):
+            out = subprocess.run(
+                [sys.executable, __file__, "--case", str(size_mb), mode, str(args.attachments)],
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            r = json.loads(out.stdout.strip().splitlines()[-1])
+            print(
+                f"{r['size_mb']:>8} {r['mode']:>10} {r['attachments']:>5} {r['written_mb']:>11} {r['seconds']:>8} "
+                f"{r['mb_per_s']:>8} {r['traced_peak_mb']:>10} {r['peak_rss_mb']:>8}"
+            )
+
+    problems = error_precedence_problems()
+    for problem in problems:
+        print(f"FAIL {problem}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+content_splitter throughput and memory on large native documents: XLSX
+workbooks, CSV exports and long DOCX letters, run through the format-specific
+extractors and the chunker.
+
+Each (format, rows, mode) case runs in a fresh subprocess. The handler is
+timed once untraced, then run again under tracemalloc for the peak (tracing
+slows Python several times over, so the two are kept apart). "legacy" is the
+old NATIVE_PARSE path, the whole object read and decoded as UTF-8: a fair
+baseline for CSV, and for the zip containers a measure of what they used to
+cost (their output is compressed bytes, not text).
+
+    python benchmarks/bench_native_extractors.py --rows 100000,500000
+    python benchmarks/bench_native_extractors.py --formats xlsx --rows 1000000 --modes native
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import documents
+from _support import MB, FakeContext, load_handler, peak_rss_mb
+from fakes import FakeS3
+
+BUILDERS = {
+    "xlsx": lambda rows: documents.xlsx(rows),
+    "csv": lambda rows: documents.csv_rows(rows),
+    "docx": lambda rows: documents.docx(documents.clinical_lines(rows)),
+}
+
+
+def _run(splitter, data: bytes, fmt: str, mode: str) -> tuple[dict, FakeS3]:
+    fake_s3 = FakeS3(keep_bodies=False)
+    fake_s3.objects[("bench", f"incoming/large.{fmt}")] = data
+    splitter.s3 = fake_s3
+    event = {"bucket": "bench", "key": f"incoming/large.{fmt}", "mode": "NATIVE_PARSE"}
+    if mode == "native":
+        event["format"] = fmt
+    else:
+        event.update({"format": "text", "split_mode": "buffered"})
+    return splitter.lambda_handler(event, FakeContext()), fake_s3
+
+
+def run_case(fmt: str, rows: int, mode: str) -> dict:
+    splitter = load_handler("content_splitter")
+    data = BUILDERS[fmt](rows)
+
+    started = time.perf_counter()
+    result, fake_s3 = _run(splitter, data, fmt, mode)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    _run(splitter, data, fmt, mode)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "format": fmt,
+        "rows": rows,
+        "mode": mode,
+        "input_mb": round(len(data) / MB, 1),
+        "chunks": result["chunk_manifest"]["items"],
+        "seconds": round(elapsed, 2),
+        "rows_per_s": round(rows / elapsed) if elapsed else None,
+        "mb_per_s": round(len(data) / MB / elapsed, 1) if elapsed else None,
+        "traced_peak_mb": round(traced_peak / MB, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "s3_gets": fake_s3.calls.get("get_object", 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--formats", default="xlsx,csv,docx")
+    parser.add_argument("--rows", default="100000,500000", help="rows (paragraphs for DOCX), comma separated")
+    parser.add_argument("--modes", default="native,legacy")
+    parser.add_argument("--case", nargs=3, metavar=("FORMAT", "ROWS", "MODE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(args.case[0], int(args.case[1]), args.case[2])))
+        return
+
+    print(f"{'format':>6} {'rows':>9} {'mode':>7} {'in_MB':>7} {'chunks':>7} {'sec':>7} {'rows/s':>8} "
+          f"{'MB/s':>6} {'traced_MB':>10} {'rss_MB':>7} {'gets':>5}")
+    for fmt in args.formats.split(","):
+        for rows in (int(r) for r in args.rows.split(",")):
+            for mode in args.modes.split(","):
+                out = subprocess.run([sys.executable, __file__, "--case", fmt, str(rows), mode],
+                                     capture_output=True, text=True, check=True)
+                r = json.loads(out.stdout.strip().splitlines()[-1])
+                print(f"{r['format']:>6} {r['rows']:>9} {r['mode']:>7} {r['input_mb']:>7} {r['chunks']:>7} "
+                      f"{r['seconds']:>7} {r['rows_per_s']:>8} {r['mb_per_s']:>6} {r['traced_peak_mb']:>10} "
+                      f"{r['peak_rss_mb']:>7} {r['s3_gets']:>5}")
+
+
+if __name__ == "__main__":
+    main()
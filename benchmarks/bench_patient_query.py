@@ -0,0 +1,153 @@
+"""
+patient_query latency with the response cache on and off.
+
+Dashboard-like traffic against the local HealthLake stand-in: a skewed mix
+of list/search queries and Patient reads, where about half the clients
+revalidate with the ETag they already hold. fhir_ingest writes are simulated
+by bumping the cache generation every --write-every requests.
+
+Before timing, the check walks the `next` links of projected searches
+(`_summary=true`, `_elements=name`) and fails (exit 1) if any page after the
+first comes back with elements the projection drops.
+
+    python benchmarks/bench_patient_query.py --requests 2000 --latency-ms 80
+"""
+import argparse
+import base64
+import gzip
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import urllib.parse
+
+from _support import FakeContext, load_handler
+from fakes import FakeHealthLake, FakeS3
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def _event(path: str, qs: dict | None, etag: str | None) -> dict:
+    headers = {"accept-encoding": "gzip, deflate, br"}
+    if etag:
+        headers["if-none-match"] = etag
+    return {
+        "requestContext": {"http": {"method": "GET"}},
+        "rawPath": path,
+        "queryStringParameters": qs,
+        "headers": headers,
+    }
+
+
+def _workload(rng: random.Random, patient_ids: list[str], n: int) -> list[tuple[str, dict | None]]:
+    queries = [("/patients", None)]
+    queries += [("/patients", {"family": f"Family{i}"}) for i in range(20)]
+    queries += [(f"/patients/{pid}", None) for pid in patient_ids[:50]]
+    # Zipf-like skew: the default list and a few popular patients dominate, as on a dashboard
+    weights = [1 / (rank + 1) for rank in range(len(queries))]
+    return rng.choices(queries, weights=weights, k=n)
+
+
+def projection_problems(query) -> list[str]:
+    """Follow next links of projected searches; every page must keep the first page's projection."""
+    problems = []
+    for qs, dropped in (({"_summary": "true"}, "extension"), ({"_elements": "name"}, "identifier")):
+        event_qs, pages = dict(qs), 0
+        while event_qs and pages < 3:
+            resp = query.lambda_handler(_event("/patients", event_qs, None), FakeContext())
+            bundle = json.loads(gzip.decompress(base64.b64decode(resp["body"])) if resp.get("isBase64Encoded")
+                                else resp["body"])
+            pages += 1
+            if any(dropped in entry["resource"] for entry in bundle.get("entry") or []):
+                problems.append(f"{qs}: page {pages} carries {dropped!r}")
+            next_url = next((link["url"] for link in bundle.get("link") or [] if link["relation"] == "next"), None)
+            event_qs = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(next_url).query)) if next_url else None
+        if pages < 2:
+            problems.append(f"{qs}: no second page to check")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--patients", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=80.0, help="simulated HealthLake search latency")
+    parser.add_argument("--write-every", type=int, default=200, help="bump the cache generation every N requests")
+    parser.add_argument("--revalidate", type=float, default=0.5, help="share of requests that send If-None-Match")
+    args = parser.parse_args()
+
+    # SigV4 signing needs credentials; the stand-in does not verify them
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    os.environ.setdefault("HEALTHLAKE_ID", "bench")
+    # No per-invocation EMF records in the output (bench_instrumentation measures them)
+    os.environ.setdefault("INSTRUMENTATION", "off")
+    os.environ.setdefault("BUCKET_NAME", "bench")
+
+    with FakeHealthLake(latency_s=args.latency_ms / 1000) as healthlake:
+        os.environ["HEALTHLAKE_ENDPOINT"] = healthlake.endpoint
+        query = load_handler("patient_query")
+        from healthtech_common.cache_generation import bump_generation
+
+        patient_ids = []
+        for i in range(args.patients):
+            patient = healthlake._create({
+                "resourceType": "Patient",
+                "identifier": [{"system": "urn:bench", "value": f"P{i:05d}"}],
+                "name": [{"family": f"Family{i % 20}", "given": [f"Given{i}"]}],
+                "extension": [{"url": "ai-extracted-entities", "valueString": "x" * 2000}],
+            })
+            patient_ids.append(patient["id"])
+
+        fake_s3 = FakeS3()
+        query.s3 = fake_s3
+        query.generation_marker.s3 = fake_s3
+        # Re-read the marker on every request so invalidation in the run is exact
+        query.generation_marker.check_interval_s = 0
+
+        problems = projection_problems(query)
+        for problem in problems:
+            print(f"FAIL {problem}")
+        if problems:
+            sys.exit(1)
+
+        print(f"requests={args.requests} latency={args.latency_ms}ms write_every={args.write_every}")
+        print(f"{'cache':>6} {'p50_ms':>7} {'p99_ms':>7} {'mean_ms':>8} {'hits':>6} {'304s':>6} "
+              f"{'healthlake':>11} {'body_KB':>8}")
+
+        for mode in ("off", "on"):
+            query.response_cache = query.ResponseCache(ttl_seconds=30) if mode == "on" else None
+            rng = random.Random(11)
+            etags: dict[str, str] = {}
+            latencies, hits, not_modified, body_bytes = [], 0, 0, 0
+            healthlake.requests.clear()
+
+            for n, (path, qs) in enumerate(_workload(rng, patient_ids, args.requests)):
+                if n and n % args.write_every == 0:
+                    bump_generation(fake_s3, "bench")
+
+                cache_key = path + repr(sorted((qs or {}).items()))
+                etag = etags.get(cache_key) if rng.random() < args.revalidate else None
+
+                started = time.perf_counter()
+                resp = query.lambda_handler(_event(path, qs, etag), FakeContext())
+                latencies.append((time.perf_counter() - started) * 1000)
+
+                assert resp["statusCode"] in (200, 304), resp
+                etags[cache_key] = resp["headers"]["ETag"]
+                hits += resp["headers"]["X-Cache"] == "HIT"
+                not_modified += resp["statusCode"] == 304
+                body_bytes += len(resp["body"])
+
+            print(f"{mode:>6} {statistics.median(latencies):>7.1f} {_percentile(latencies, 0.99):>7.1f} "
+                  f"{statistics.fmean(latencies):>8.1f} {hits:>6} {not_modified:>6} "
+                  f"{sum(healthlake.requests.values()):>11} {body_bytes / 1024:>8.0f}")
+
+
+if __name__ == "__main__":
+    main()
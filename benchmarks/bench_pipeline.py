@@ -0,0 +1,376 @@
+"""
+End-to-end pipeline benchmark: document_router, content_splitter,
+bedrock_guardrail and fhir_ingest run in process, in the order
+src/statemachine/pipeline.asl.json gives them, with the Map fan-out on a
+thread pool (asl_runner.py).
+
+S3, Textract, Bedrock and HealthLake are the stand-ins from fakes.py, each
+with configurable latency; Bedrock can also throttle. Scanned PDFs go
+through Textract and either the callback path (AwaitTextract, with the SNS
+notification delivered to textract_callback when the fake job finishes) or
+the splitter's polling fallback.
+
+Before timing, it checks AwaitTextract's failure routes (exit 1 on a
+problem): a Textract job that ends FAILED fails the execution as
+TextractJobFailed on both completion paths without analysing anything, and
+any other failure to park on the task token falls back to polling.
+
+It reports per-state latency (Map items are counted individually), end-to-end
+latency, documents and pages per second, peak RSS and service call counts.
+--save-baseline writes the results as JSON; --baseline compares a run with a
+saved one and exits non-zero on regressions beyond --tolerance.
+
+    python benchmarks/bench_pipeline.py --documents 40 --pages 8 --save-baseline
+    python benchmarks/bench_pipeline.py --documents 40 --pages 8 --baseline
+    python benchmarks/bench_pipeline.py --shapes scanned_pdf --completion poll --bedrock-throttle-rate 0.2
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import documents
+from _support import FakeContext, load_function_module, load_handler, peak_rss_mb
+from asl_runner import StateMachine, StatesError
+from fakes import FakeBedrock, FakeHealthLake, FakeS3, FakeStepFunctions, FakeTextract, default_guardrail_responder
+
+BUCKET = "bench"
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baselines" / "pipeline.json"
+
+# name -> (builder(pages, seed) -> bytes, extension); sized so one "page" is roughly a page of text
+SHAPES = {
+    "text_pdf": (lambda pages, seed: documents.text_pdf(pages, seed=seed), ".pdf"),
+    "scanned_pdf": (lambda pages, seed: documents.scanned_pdf(pages, image_bytes=50_000, seed=seed), ".pdf"),
+    "docx": (lambda pages, seed: documents.docx(documents.clinical_lines(45 * pages, seed=seed)), ".docx"),
+    "xlsx": (lambda pages, seed: documents.xlsx(60 * pages, seed=seed), ".xlsx"),
+    "csv": (lambda pages, seed: documents.csv_rows(60 * pages, seed=seed), ".csv"),
+}
+
+# Resource placeholders in pipeline.asl.json (filled in by Terraform's templatefile)
+RESOURCES = {
+    "${RouterArn}": "document_router",
+    "${SplitterArn}": "content_splitter",
+    "${BedrockArn}": "bedrock_guardrail",
+    "${IngestArn}": "fhir_ingest",
+}
+
+
+def _responder(text: str) -> dict:
+    """default_guardrail_responder with an identifier taken from the text, so documents are different patients."""
+    result = default_guardrail_responder(text)
+    if result["classification"] == "VALID":
+        result["entities"] = {**result["entities"], "PatientIdentifier": f"S{zlib.crc32(text.encode()) % 10**7:07d}A"}
+    return result
+
+
+class Pipeline:
+    """The four handlers and textract_callback, wired to one set of fakes."""
+
+    def __init__(self, args, healthlake: FakeHealthLake):
+        os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+        os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+        os.environ["BUCKET_NAME"] = BUCKET
+        os.environ["HEALTHLAKE_ID"] = "bench"
+        os.environ["HEALTHLAKE_ENDPOINT"] = healthlake.endpoint
+
+        self.healthlake = healthlake
+        self.s3 = FakeS3(latency_s=args.s3_latency_ms / 1000)
+        self.textract = FakeTextract(self.s3, latency_s=args.textract_latency_ms / 1000,
+                                     seconds_per_page=args.textract_ms_per_page / 1000)
+        self.bedrock = FakeBedrock(latency_s=args.bedrock_latency_ms / 1000, throttle_rate=args.bedrock_throttle_rate,
+                                   responder=_responder, seed=args.seed)
+        self.sfn = FakeStepFunctions()
+
+        self.handlers = {name: load_handler(name) for name in (*RESOURCES.values(), "textract_callback")}
+        router = self.handlers["document_router"]
+        router.s3, router.textract, router.sfn = self.s3, self.textract, self.sfn
+        router.TEXTRACT_COMPLETION_MODE = args.completion.upper()
+        router.TEXTRACT_SNS_TOPIC_ARN = "arn:aws:sns:us-east-1:000000000000:bench-textract"
+        router.TEXTRACT_ROLE_ARN = "arn:aws:iam::000000000000:role/bench-textract"
+
+        callback = self.handlers["textract_callback"]
+        callback.s3, callback.sfn = self.s3, self.sfn
+
+        splitter = self.handlers["content_splitter"]
+        splitter.s3, splitter.textract = self.s3, self.textract
+        splitter.GUARDRAIL_BATCH_SIZE = args.batch_size
+        # Poll on the fake job's timescale, not Textract's
+        splitter.TEXTRACT_POLL_INITIAL_S = max(args.textract_ms_per_page / 4000, 0.001)
+        splitter.TEXTRACT_POLL_MAX_S = splitter.TEXTRACT_POLL_INITIAL_S * 8
+        splitter.TEXTRACT_POLL_BUDGET_S = splitter.TEXTRACT_POLL_MAX_S * 4
+
+        client_mod = load_function_module("bedrock_guardrail", "bedrock_client")
+        guardrail = self.handlers["bedrock_guardrail"]
+        guardrail.s3 = self.s3
+        guardrail.bedrock_client = client_mod.GuardrailBedrockClient(
+            self.bedrock,
+            max_attempts=6,
+            base_delay_s=0.002,
+            max_delay_s=0.05,
+            breaker=client_mod.CircuitBreaker(failure_threshold=8, reset_timeout_s=60),
+        )
+
+        ingest = self.handlers["fhir_ingest"]
+        ingest.s3 = self.s3
+        ingest.patient_index = ingest.build_patient_index("memory")
+        from healthtech_common import healthlake as healthlake_client
+        healthlake_client._clients.clear()
+
+        # Stage checkpoints in the fake bucket, as the deployed functions keep them in the data lake
+        from healthtech_common.checkpoints import build_checkpoint_store
+        for name in ("document_router", "content_splitter", "bedrock_guardrail", "fhir_ingest"):
+            self.handlers[name].checkpoints = build_checkpoint_store(self.s3, BUCKET)
+
+        self.machine = StateMachine(
+            {arn: self.handlers[name].lambda_handler for arn, name in RESOURCES.items()},
+            sfn=self.sfn,
+            on_task_token=self._deliver_textract_notification,
+            # Retry intervals are in seconds; run them at the fakes' millisecond scale
+            time_scale=0.001,
+            map_concurrency=args.map_concurrency,
+            s3=self.s3,
+        )
+
+    def _deliver_textract_notification(self, state: str, payload: dict):
+        """What SNS does when the job finishes: invoke textract_callback with the completion message."""
+        message = self.textract.completion_message(payload["job_id"])
+        event = {"Records": [{"Sns": {"Message": json.dumps(message)}}]}
+        self.handlers["textract_callback"].lambda_handler(event, FakeContext())
+
+    def upload(self, n: int, shape: str, pages: int, seed: int) -> dict:
+        build, ext = SHAPES[shape]
+        key = f"incoming/bench-{n}/document{n}{ext}"
+        self.s3.put_object(Bucket=BUCKET, Key=key, Body=build(pages, seed),
+                           Metadata={"original_name": f"document{n}{ext}", "sender": "gp@example.com"})
+        # EventBridge "Object Created" event
+        return {"detail": {"bucket": {"name": BUCKET}, "object": {"key": key}}}
+
+    def calls(self) -> dict:
+        return {
+            "s3": dict(sorted(self.s3.calls.items())),
+            "textract": dict(sorted(self.textract.calls.items())),
+            "bedrock": dict(sorted(self.bedrock.calls.items())),
+            "bedrock_errors": dict(sorted(self.bedrock.errors.items())),
+            "healthlake": dict(sorted(self.healthlake.requests.items())),
+            "stepfunctions": dict(sorted(self.sfn.calls.items())),
+        }
+
+
+def completion_problems(args) -> list[str]:
+    """One scanned document per case: a failing Textract job on each completion path, and a register_callback error."""
+    problems = []
+    for completion, job_fails, register_fails in (("callback", True, False), ("poll", True, False),
+                                                  ("callback", False, True)):
+        label = f"{completion}, " + ("job FAILED" if job_fails else "register_callback error")
+        case = argparse.Namespace(**{**vars(args), "completion": completion})
+        with FakeHealthLake() as healthlake:
+            pipeline = Pipeline(case, healthlake)
+            logging.getLogger().setLevel(logging.ERROR)
+            event = pipeline.upload(0, "scanned_pdf", 2, args.seed)
+            if job_fails:
+                pipeline.textract.failing.add(event["detail"]["object"]["key"])
+            router = pipeline.handlers["document_router"]
+            register_callback = router.register_callback
+
+            def unavailable(event):
+                raise RuntimeError("S3 unavailable")
+
+            if register_fails:
+                router.register_callback = unavailable
+            try:
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    out, error = pipeline.machine.execute(event), None
+            except StatesError as e:
+                out, error = None, e
+            finally:
+                router.register_callback = register_callback
+            entered = {entry["state"] for entry in pipeline.machine.trace}
+
+        if job_fails:
+            if error is None or error.error != "TextractJobFailed":
+                problems.append(f"{label}: ended {error.error if error else out.get('status')}, "
+                                f"expected TextractJobFailed")
+            elif "ParallelAnalysis" in entered:
+                problems.append(f"{label}: analysed a document Textract could not read")
+        elif error is not None or out.get("status") != "SUCCESS":
+            problems.append(f"{label}: did not fall back to polling ({error or out.get('status')})")
+    return problems
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[int(pct) - 1]
+
+
+def _latency(values: list[float]) -> dict:
+    return {
+        "count": len(values),
+        "p50_ms": round(_percentile(values, 50) * 1000, 2),
+        "p95_ms": round(_percentile(values, 95) * 1000, 2),
+        "total_s": round(sum(values), 3),
+    }
+
+
+def run(args) -> dict:
+    rng = random.Random(args.seed)
+    shapes = args.shapes.split(",")
+    corpus = [(n, rng.choice(shapes)) for n in range(args.documents)]
+
+    with FakeHealthLake(latency_s=args.healthlake_latency_ms / 1000) as healthlake:
+        pipeline = Pipeline(args, healthlake)
+        events = [pipeline.upload(n, shape, args.pages, args.seed + n) for n, shape in corpus]
+        for counter in (pipeline.s3.calls, pipeline.textract.calls, pipeline.bedrock.calls, pipeline.sfn.calls):
+            counter.clear()
+
+        def execute(event) -> tuple[float, dict]:
+            started = time.perf_counter()
+            out = pipeline.machine.execute(event)
+            return time.perf_counter() - started, out
+
+        # Handlers print routing lines and EMF records; keep them out of the report
+        started = time.perf_counter()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            with ThreadPoolExecutor(max_workers=args.executions) as pool:
+                runs = list(pool.map(execute, events))
+        elapsed = time.perf_counter() - started
+
+        failed = [out for _, out in runs if out.get("status") != "SUCCESS"]
+        if failed:
+            raise SystemExit(f"{len(failed)} executions did not succeed, first: {failed[0]}")
+
+        states: dict[str, list[float]] = {}
+        attempts: dict[str, int] = {}
+        for entry in pipeline.machine.trace:
+            states.setdefault(entry["state"], []).append(entry["seconds"])
+            attempts[entry["state"]] = attempts.get(entry["state"], 0) + entry["attempts"]
+        max_payload = max(entry["payload_bytes"] for entry in pipeline.machine.trace)
+
+        pages = args.documents * args.pages
+        return {
+            "config": {key: getattr(args, key) for key in (
+                "documents", "pages", "shapes", "executions", "map_concurrency", "batch_size", "completion",
+                "s3_latency_ms", "textract_latency_ms", "textract_ms_per_page", "bedrock_latency_ms",
+                "bedrock_throttle_rate", "healthlake_latency_ms", "seed")},
+            "states": {name: {**_latency(values), "attempts": attempts[name]} for name, values in states.items()},
+            "end_to_end": _latency([seconds for seconds, _ in runs]),
+            "seconds": round(elapsed, 3),
+            "docs_per_s": round(args.documents / elapsed, 2),
+            "pages_per_s": round(pages / elapsed, 2),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "max_state_payload_kb": round(max_payload / 1024, 1),
+            "calls": pipeline.calls(),
+        }
+
+
+def compare(result: dict, baseline: dict, tolerance: float, floor_ms: float = 1.0) -> list[str]:
+    """Regressions of result against baseline; latencies within floor_ms of each other are noise."""
+    regressions = []
+
+    def slower(label: str, now: float, before: float):
+        if now > before * (1 + tolerance) and now - before > floor_ms:
+            regressions.append(f"{label}: {before} -> {now} ms")
+
+    for name, before in baseline["states"].items():
+        now = result["states"].get(name)
+        if now is None:
+            regressions.append(f"{name}: state no longer entered")
+            continue
+        slower(f"{name} p50", now["p50_ms"], before["p50_ms"])
+        slower(f"{name} p95", now["p95_ms"], before["p95_ms"])
+    slower("end-to-end p50", result["end_to_end"]["p50_ms"], baseline["end_to_end"]["p50_ms"])
+    slower("end-to-end p95", result["end_to_end"]["p95_ms"], baseline["end_to_end"]["p95_ms"])
+
+    for key in ("docs_per_s", "pages_per_s"):
+        if result[key] < baseline[key] * (1 - tolerance):
+            regressions.append(f"{key}: {baseline[key]} -> {result[key]}")
+    if result["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        regressions.append(f"peak_rss_mb: {baseline['peak_rss_mb']} -> {result['peak_rss_mb']}")
+
+    # Call counts are deterministic for a given config and seed, so any increase counts
+    for service, before in baseline["calls"].items():
+        for op, count in before.items():
+            now = result["calls"].get(service, {}).get(op, 0)
+            if now > count:
+                regressions.append(f"{service}.{op} calls: {count} -> {now}")
+    return regressions
+
+
+def report(result: dict):
+    config = result["config"]
+    print(" ".join(f"{key}={value}" for key, value in config.items()))
+    print(f"{'state':>20} {'count':>6} {'p50_ms':>9} {'p95_ms':>9} {'total_s':>8} {'attempts':>9}")
+    for name, r in result["states"].items():
+        print(f"{name:>20} {r['count']:>6} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['total_s']:>8} {r['attempts']:>9}")
+    e2e = result["end_to_end"]
+    print(f"{'end-to-end':>20} {e2e['count']:>6} {e2e['p50_ms']:>9} {e2e['p95_ms']:>9} {e2e['total_s']:>8}")
+    print(f"\n{result['seconds']}s  {result['docs_per_s']} docs/s  {result['pages_per_s']} pages/s  "
+          f"peak RSS {result['peak_rss_mb']} MB  largest state payload {result['max_state_payload_kb']} KB")
+    for service, calls in result["calls"].items():
+        if calls:
+            print(f"  {service}: " + ", ".join(f"{op}={count}" for op, count in calls.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=40)
+    parser.add_argument("--pages", type=int, default=8, help="pages per document (rows/paragraphs scale with it)")
+    parser.add_argument("--shapes", default=",".join(SHAPES), help=f"comma separated, from {','.join(SHAPES)}")
+    parser.add_argument("--executions", type=int, default=4, help="concurrent state machine executions")
+    parser.add_argument("--map-concurrency", type=int, default=None,
+                        help="override the Map state's MaxConcurrency")
+    parser.add_argument("--batch-size", type=int, default=1, help="GUARDRAIL_BATCH_SIZE (chunks per Map item)")
+    parser.add_argument("--completion", choices=("callback", "poll"), default="callback",
+                        help="how scanned documents learn their Textract job finished")
+    parser.add_argument("--s3-latency-ms", type=float, default=1.0)
+    parser.add_argument("--textract-latency-ms", type=float, default=5.0)
+    parser.add_argument("--textract-ms-per-page", type=float, default=20.0, help="fake job duration per page")
+    parser.add_argument("--bedrock-latency-ms", type=float, default=40.0)
+    parser.add_argument("--bedrock-throttle-rate", type=float, default=0.05)
+    parser.add_argument("--healthlake-latency-ms", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE, type=Path, metavar="PATH",
+                        help="write the results as a baseline (default benchmarks/baselines/pipeline.json)")
+    parser.add_argument("--baseline", nargs="?", const=DEFAULT_BASELINE, type=Path, metavar="PATH",
+                        help="compare with a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown before flagging")
+    args = parser.parse_args()
+
+    # Throttling retries are expected here; keep the handlers' warnings out of the report
+    logging.getLogger().setLevel(logging.ERROR)
+    problems = completion_problems(args)
+    for problem in problems:
+        print(f"FAIL {problem}")
+    if problems:
+        sys.exit(1)
+    result = run(args)
+    report(result)
+
+    if args.save_baseline:
+        args.save_baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.save_baseline.write_text(json.dumps(result, indent=2) + "\n")
+        print(f"\nbaseline written to {args.save_baseline}")
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        if baseline["config"] != result["config"]:
+            changed = sorted(k for k in result["config"] if baseline["config"].get(k) != result["config"][k])
+            print(f"\nwarning: config differs from the baseline ({', '.join(changed)})")
+        regressions = compare(result, baseline, args.tolerance)
+        print(f"\n{len(regressions)} regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+        for line in regressions:
+            print(f"  {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
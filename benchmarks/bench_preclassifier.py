@@ -0,0 +1,64 @@
+"""
+Precision and avoided model calls of the bedrock_guardrail pre-classifier.
+
+Runs preclassify() over the labeled chunks in fixtures/guardrail_chunks.jsonl
+(labels: LEGAL_APPENDIX, NOISE, MEDICAL, OTHER). A short-circuit is correct
+when the synthesized category equals the label; any MEDICAL chunk that is
+short-circuited is reported separately because it would drop clinical data.
+
+    python benchmarks/bench_preclassifier.py
+    PRECLASS_LEGAL_MIN_HITS=2 python benchmarks/bench_preclassifier.py
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+from _support import load_function_module
+
+FIXTURES = Path(__file__).parent / "fixtures" / "guardrail_chunks.jsonl"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", default=str(FIXTURES))
+    parser.add_argument("--repeat", type=int, default=200, help="passes over the fixtures for the throughput figure")
+    args = parser.parse_args()
+
+    pre = load_function_module("bedrock_guardrail", "preclassifier")
+    config = pre.PreclassifierConfig.from_env()
+    samples = [json.loads(line) for line in Path(args.fixtures).read_text().splitlines() if line.strip()]
+
+    decided = correct = medical_dropped = 0
+    per_label: dict[str, list[int]] = {}
+    for sample in samples:
+        result = pre.preclassify(sample["text"], config)
+        counts = per_label.setdefault(sample["label"], [0, 0])
+        counts[0] += 1
+        if result is None:
+            continue
+        counts[1] += 1
+        decided += 1
+        if result["category"] == sample["label"]:
+            correct += 1
+        if sample["label"] == "MEDICAL":
+            medical_dropped += 1
+
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        for sample in samples:
+            pre.preclassify(sample["text"], config)
+    elapsed = time.perf_counter() - started
+
+    print(f"config: {config}")
+    print(f"{'label':>15} {'chunks':>7} {'short-circuited':>16}")
+    for label, (total, short) in sorted(per_label.items()):
+        print(f"{label:>15} {total:>7} {short:>16}")
+    print(f"precision:           {correct / decided:.3f}" if decided else "precision:           n/a (nothing decided)")
+    print(f"model calls avoided: {decided}/{len(samples)} ({decided / len(samples):.1%})")
+    print(f"MEDICAL short-circuited (must be 0): {medical_dropped}")
+    print(f"throughput:          {len(samples) * args.repeat / elapsed:,.0f} chunks/s")
+
+
+if __name__ == "__main__":
+    main()
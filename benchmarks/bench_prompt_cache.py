@@ -0,0 +1,116 @@
+"""
+Input tokens per bedrock_guardrail call with the static prompt prefix cached
+and uncached.
+
+The guardrail sends the compliance instructions and JSON schema as a system
+prompt ending in a prompt-cache checkpoint, and only the chunk text as the
+user message. Against a Bedrock stand-in that caches prefixes the way Bedrock
+does (written once, then read; ignored below --cache-min-tokens), this runs
+the same chunks through each API path with BEDROCK_PROMPT_CACHE on and off
+and reports, per call: uncached input tokens, cache reads and writes, and
+input cost relative to the uncached run (cache writes at --write-price and
+reads at --read-price times the input price, Anthropic's rates on Bedrock).
+The guardrail sends a checkpoint only when caching is on and its prefix
+estimate reaches BEDROCK_PROMPT_CACHE_MIN_TOKENS, which follows
+--cache-min-tokens here. The last scenarios check three things. With the
+defaults, no checkpoint is sent. A model rejecting checkpoints is remembered
+and served without them. A ValidationException that is not about the cache
+(no tool use) does not mark the model as lacking cache support.
+
+    python benchmarks/bench_prompt_cache.py --chunks 200 --cache-min-tokens 1024
+    python benchmarks/bench_prompt_cache.py --cache-min-tokens 256
+"""
+import argparse
+import logging
+import os
+
+from _support import FakeContext, load_function_module, load_handler
+from fakes import FakeBedrock, FakeS3
+
+CLINICAL = ("Patient reviewed in clinic. BP 130/85. Continue Metformin 500mg BD. Review in 4 weeks. "
+            "Referred by GP for persistent cough; chest clear on auscultation. ")
+
+
+def run(guardrail, bedrock: FakeBedrock, chunks: int, cache_mode: str, batch: int, min_tokens: int = 0) -> dict:
+    client_mod = load_function_module("bedrock_guardrail", "bedrock_client")
+    fake_s3 = FakeS3()
+    guardrail.s3 = fake_s3
+    guardrail.result_cache = None
+    guardrail.PRECLASSIFIER_MODE = "off"
+    guardrail.PROMPT_CACHE_MODE = cache_mode
+    guardrail.PROMPT_CACHE_MIN_TOKENS = min_tokens
+    guardrail.bedrock_client = client_mod.GuardrailBedrockClient(bedrock)
+
+    items = []
+    for n in range(chunks):
+        fake_s3.objects[("bench", f"c/{n}.txt")] = f"{CLINICAL * 6} chunk {n}".encode("utf-8")
+        items.append({"s3_bucket": "bench", "s3_key": f"c/{n}.txt"})
+    for start in range(0, chunks, batch):
+        group = items[start:start + batch]
+        event = {"batch": group} if batch > 1 else group[0]
+        guardrail.lambda_handler(event, FakeContext())
+
+    return {**bedrock.usage, "cache_support": dict(guardrail.bedrock_client.prompt_cache_support)}
+
+
+def prefix_tokens(guardrail, path: str, batch: int) -> int:
+    """Size of the cached prefix, as the cache write of a first call that is always cached."""
+    bedrock = FakeBedrock(converse_supported=path == "converse", cache_min_tokens=0)
+    return run(guardrail, bedrock, batch, "on", batch)["cache_write"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=4, help="chunks per batched Map item for the batch rows")
+    parser.add_argument("--cache-min-tokens", type=int, default=1024,
+                        help="shortest prefix the model caches (1024 for most Claude models on Bedrock)")
+    parser.add_argument("--write-price", type=float, default=1.25, help="cache write price, x input price")
+    parser.add_argument("--read-price", type=float, default=0.1, help="cache read price, x input price")
+    args = parser.parse_args()
+
+    os.environ.setdefault("INSTRUMENTATION", "off")
+    guardrail = load_handler("bedrock_guardrail")
+    default_mode, default_min_tokens = guardrail.PROMPT_CACHE_MODE, guardrail.PROMPT_CACHE_MIN_TOKENS
+    logging.getLogger().setLevel(logging.ERROR)
+
+    print(f"prefixes under {args.cache_min_tokens} tokens are not cached")
+    print(f"{'path':>12} {'batch':>5} {'prefix':>6} {'cache':>5} {'calls':>6} {'input/call':>11} {'read/call':>10} "
+          f"{'write/call':>11} {'input_cost':>11}")
+    for path in ("converse", "invoke_model"):
+        for batch in (1, args.batch):
+            prefix = prefix_tokens(guardrail, path, batch)
+            baseline = None
+            for mode in ("off", "on"):
+                bedrock = FakeBedrock(converse_supported=path == "converse", cache_min_tokens=args.cache_min_tokens)
+                r = run(guardrail, bedrock, args.chunks, mode, batch, args.cache_min_tokens)
+                # Only the answered calls: invoke_model rows also hold the rejected Converse probe
+                calls = bedrock.calls[path]
+                cost = r["input"] + r["cache_write"] * args.write_price + r["cache_read"] * args.read_price
+                baseline = baseline or cost
+                print(f"{path:>12} {batch:>5} {prefix:>6} {mode:>5} {calls:>6} {r['input'] / calls:>11.0f} "
+                      f"{r['cache_read'] / calls:>10.0f} {r['cache_write'] / calls:>11.0f} {cost / baseline:>11.1%}")
+
+    model_id = os.environ.get("BEDROCK_MODEL_ID", "anthropic.claude-3-5-sonnet-20240620-v1:0")
+    bedrock = FakeBedrock(prompt_cache=False)
+    r = run(guardrail, bedrock, args.chunks, default_mode, 1, default_min_tokens)
+    print(f"\ndefaults ({default_mode}, {default_min_tokens} tokens) on a model without caching calls={bedrock.calls}")
+    assert bedrock.calls.get("converse") == args.chunks, "a checkpoint was sent with the default settings"
+
+    bedrock = FakeBedrock(prompt_cache=False)
+    r = run(guardrail, bedrock, args.chunks, "on", 1)
+    print(f"no_cache_model calls={bedrock.calls} remembered={r['cache_support']}")
+    # One rejected request with the checkpoint, then every call without it
+    assert bedrock.calls.get("converse") == args.chunks + 1, bedrock.calls
+    assert r["cache_support"] == {model_id: False}
+
+    bedrock = FakeBedrock(converse_supported=False, cache_min_tokens=0)
+    r = run(guardrail, bedrock, args.chunks, "on", 1)
+    print(f"no_tool_use_model calls={bedrock.calls} remembered={r['cache_support']}")
+    # The tool-use rejection is not a cache rejection: caching stays on for invoke_model
+    assert bedrock.calls.get("converse") == 1 and r["cache_support"] == {}, (bedrock.calls, r["cache_support"])
+    assert bedrock.usage["cache_read"], "invoke_model calls were sent without their checkpoint"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+AggregateAndIngest scaling with the number of chunk results.
+
+Synthetic guardrail results (mostly VALID, some NOISE and legal-appendix
+chunks, vitals/medications repeating with case and spacing variants) are fed
+to fhir_ingest three ways:
+
+- legacy:   a copy of the original list-based partition and merge
+            (`r not in legal_appendix`, `v not in vitals`), timed alone
+- inline:   the Map output passed as the event, as before
+- manifest: results written to S3 per Map item and read back through the
+            splitter's manifest, the pipeline's path
+
+It reports time per result, traced peak memory, S3 GETs and the size of the
+state that reaches AggregateAndIngest (Step Functions caps it at 256KB).
+
+    python benchmarks/bench_result_aggregation.py --results 1000,10000,100000
+"""
+import argparse
+import json
+import os
+import random
+import time
+import tracemalloc
+
+from _support import MB, FakeContext, load_handler
+from fakes import FakeHealthLake, FakeS3
+
+STATE_PAYLOAD_LIMIT = 256 * 1024
+
+VITALS = ["BP {}/{}", "bp {}/{} ", "BP  {}/{}.", "Pulse {} bpm, BP {}"]
+MEDS = ["Amlodipine {}mg", "amlodipine {}mg", "Metformin {}mg bd", "METFORMIN {}mg BD."]
+
+
+def _results(n: int, seed: int = 0) -> list[dict]:
+    rng = random.Random(seed)
+    records = []
+    for i in range(n):
+        roll = rng.random()
+        if roll < 0.10:
+            records.append({"classification": "INVALID", "category": "NOISE", "reason": "Blank page",
+                            "entities": {}, "metadata": {}})
+        elif roll < 0.15:
+            records.append({"classification": "INVALID", "category": "LEGAL_APPENDIX",
+                            "reason": f"Statute text, Mental Capacity Act section {i % 9}", "entities": {}, "metadata": {}})
+        else:
+            # Enough distinct readings that the old list scans grow with the document
+            reading = rng.randrange(max(1, n // 8))
+            records.append({
+                "classification": "VALID",
+                "reason": "Clinical notes",
+                "entities": {
+                    "PatientName": "Jane Example" if i > 3 else "<UNKNOWN>",
+                    "PatientIdentifier": "S1234567A" if i > 5 else "UNKNOWN",
+                    "Gender": "female",
+                    "Vitals": rng.choice(VITALS).format(100 + reading % 90, 60 + reading // 90 % 50),
+                    "Medications": rng.choice(MEDS).format(5 * (1 + reading % 40)),
+                },
+                "metadata": {"original_name": "long-record.pdf", "sender": "gp@example.com"},
+            })
+    return records
+
+
+def _legacy_aggregate(results: list[dict], is_legal, is_unknown) -> tuple[int, int]:
+    """The original handler's partition and merge, kept for comparison."""
+    valid_results = [r for r in results if r.get("classification") == "VALID"]
+    invalid_results = [r for r in results if r.get("classification") == "INVALID"]
+    noise = [r for r in invalid_results if r.get("category") == "NOISE"]
+    legal_appendix = [r for r in invalid_results if is_legal(r)]
+    hard_invalid = [r for r in invalid_results if r not in legal_appendix and r not in noise]
+    vitals, meds = [], []
+    for res in valid_results:
+        e = res.get("entities", {}) or {}
+        v = e.get("Vitals")
+        if not is_unknown(v) and v not in vitals:
+            vitals.append(v)
+        m = e.get("Medications")
+        if not is_unknown(m) and m not in meds:
+            meds.append(m)
+    return len(hard_invalid), len(vitals) + len(meds)
+
+
+def _store(fake_s3: FakeS3, items: list[list[dict]]) -> dict:
+    keys = []
+    for n, records in enumerate(items):
+        key = f"temp/results/bench/{n:06d}.json"
+        fake_s3.put_object(Bucket="bench", Key=key, Body=json.dumps(records))
+        keys.append(key)
+    manifest = {"bucket": "bench", "total_chunks": sum(map(len, items)), "result_keys": keys}
+    fake_s3.put_object(Bucket="bench", Key="temp/results/bench/manifest.json", Body=json.dumps(manifest))
+    return {"results_manifest": {"bucket": "bench", "key": "temp/results/bench/manifest.json"}}
+
+
+def _timed(fn) -> tuple[object, float, float]:
+    started = time.perf_counter()
+    out = fn()
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return out, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--results", default="1000,10000,50000,100000", help="chunk results per document")
+    parser.add_argument("--batch-size", type=int, default=4, help="chunks per Map item (GUARDRAIL_BATCH_SIZE)")
+    parser.add_argument("--legacy-max", type=int, default=50000, help="skip the legacy copy above this size")
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    os.environ.setdefault("HEALTHLAKE_ID", "bench")
+    # No per-invocation EMF records in the output (bench_instrumentation measures them)
+    os.environ.setdefault("INSTRUMENTATION", "off")
+
+    print(f"batch_size={args.batch_size}")
+    print(f"{'results':>8} {'mode':>9} {'seconds':>8} {'us/result':>10} {'traced_MB':>10} {'state_KB':>9} {'gets':>6}")
+    with FakeHealthLake() as healthlake:
+        os.environ["HEALTHLAKE_ENDPOINT"] = healthlake.endpoint
+        ingest = load_handler("fhir_ingest")
+        from healthtech_common import healthlake as healthlake_client
+        healthlake_client._clients.clear()
+
+        for n in (int(x) for x in args.results.split(",")):
+            records = _results(n)
+            items = [records[i:i + args.batch_size] for i in range(0, n, args.batch_size)]
+
+            if n <= args.legacy_max:
+                _, elapsed, peak = _timed(lambda: _legacy_aggregate(records, ingest._is_legal_appendix_chunk, ingest._is_unknown))
+                print(f"{n:>8} {'legacy':>9} {elapsed:>8.2f} {elapsed / n * 1e6:>10.1f} {peak / MB:>10.1f} "
+                      f"{len(json.dumps(items)) / 1024:>9.1f} {'-':>6}")
+
+            for mode in ("inline", "manifest"):
+                fake_s3 = FakeS3()
+                ingest.s3 = fake_s3
+                ingest.patient_index = ingest.build_patient_index("memory")
+                event = items if mode == "inline" else _store(fake_s3, items)
+                fake_s3.calls.clear()
+                out, elapsed, peak = _timed(lambda: ingest.lambda_handler(event, FakeContext()))
+                assert out["status"] == "SUCCESS", out
+                state_kb = len(json.dumps(event)) / 1024
+                print(f"{n:>8} {mode:>9} {elapsed:>8.2f} {elapsed / n * 1e6:>10.1f} {peak / MB:>10.1f} "
+                      f"{state_kb:>9.1f} {fake_s3.calls.get('get_object', 0) // 2:>6}"
+                      f"{'  > Step Functions limit' if state_kb * 1024 > STATE_PAYLOAD_LIMIT else ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Peak memory of content_splitter on synthetic NATIVE_PARSE inputs.
+
+Each (size, mode) case runs in a fresh subprocess so ru_maxrss is not
+inherited from an earlier, larger case. The input is generated on the fly and
+chunk bodies are counted rather than stored, so the numbers reflect the
+splitter alone.
+
+    python benchmarks/bench_splitter_memory.py --sizes 100,500,1000,2000
+    python benchmarks/bench_splitter_memory.py --sizes 100,500 --modes streaming,buffered
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from _support import MB, FakeContext, load_handler, parse_sizes_mb, peak_rss_mb
+from fakes import FakeS3
+
+# Mixed ASCII and multi-byte UTF-8 so block boundaries regularly land inside a character.
+PATTERN = "Patient reviewed in clinic — BP 120/80, café visit, 患者記録 ✓\n".encode("utf-8")
+
+
+def run_case(size_mb: int, mode: str) -> dict:
+    splitter = load_handler("content_splitter")
+    fake_s3 = FakeS3(keep_bodies=False)
+    fake_s3.add_synthetic_object("bench", "incoming/synthetic.csv", size_mb * MB, PATTERN)
+    splitter.s3 = fake_s3
+
+    event = {"bucket": "bench", "key": "incoming/synthetic.csv", "mode": "NATIVE_PARSE", "split_mode": mode, "format": "text"}
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = splitter.lambda_handler(event, FakeContext())
+    elapsed = time.perf_counter() - started
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "size_mb": size_mb,
+        "mode": mode,
+        "chunks": result["chunk_manifest"]["items"],
+        "seconds": round(elapsed, 2),
+        "mb_per_s": round(size_mb / elapsed, 1) if elapsed else None,
+        "traced_peak_mb": round(traced_peak / MB, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,500,1000,2000", help="input sizes in MB, comma separated")
+    parser.add_argument("--modes", default="streaming", help="split modes to compare (streaming,buffered)")
+    parser.add_argument("--case", nargs=2, metavar=("SIZE_MB", "MODE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(int(args.case[0]), args.case[1])))
+        return
+
+    print(f"{'size_mb':>8} {'mode':>10} {'chunks':>8} {'sec':>8} {'MB/s':>8} {'traced_MB':>10} {'rss_MB':>8}")
+    for mode in args.modes.split(","):
+        for size_mb in parse_sizes_mb(args.sizes):
+            out = subprocess.run(
+                [sys.executable, __file__, "--case", str(size_mb), mode],
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            r = json.loads(out.stdout.strip().splitlines()[-1])
+            print(
+                f"{r['size_mb']:>8} {r['mode']:>10} {r['chunks']:>8} {r['seconds']:>8} "
+                f"{r['mb_per_s']:>8} {r['traced_peak_mb']:>10} {r['peak_rss_mb']:>8}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Import-time (cold start init) cost of every handler, and a startup budget check.
+
+Each handler is imported in a fresh interpreter under `python -X importtime`,
+with its function directory and the common layer on sys.path as in Lambda.
+Reported per handler: median import time over --runs, the packages that
+cost the most (self time summed per top-level package, so `boto3` includes
+`boto3.s3.transfer`), and any boto3 client built during import. Clients
+come from healthtech_common.clients and are built on first use, so that
+list should stay empty.
+
+    python benchmarks/bench_startup.py --top 8          # profile
+    python benchmarks/bench_startup.py --save-budget    # writes baselines/startup_budget.json
+    python benchmarks/bench_startup.py --check          # exits 1 over budget or on clients built at import
+
+Budgets are milliseconds on the machine that saved them (measured median
+times --headroom); re-save them on a new machine rather than loosening
+--check.
+"""
+import argparse
+import json
+import math
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+from _support import FUNCTIONS_DIR, LAYER_DIR
+
+BUDGET_PATH = Path(__file__).resolve().parent / "baselines" / "startup_budget.json"
+
+# Separates interpreter startup from the handler's imports in the -X importtime output
+_MARKER = "-- import handler --"
+# Runs in the child interpreter: argv is the function directory, the layer directory and the marker
+_IMPORT_SCRIPT = """
+import json, sys, time
+sys.path[:0] = [sys.argv[1], sys.argv[2]]
+sys.stderr.write(sys.argv[3] + "\\n")
+sys.stderr.flush()
+started = time.perf_counter()
+import handler
+elapsed = time.perf_counter() - started
+clients = sys.modules.get("healthtech_common.clients")
+print(json.dumps({"import_ms": elapsed * 1000, "clients": clients.created() if clients else []}))
+"""
+
+
+def _handlers() -> list[str]:
+    return sorted(p.parent.name for p in FUNCTIONS_DIR.glob("*/handler.py"))
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    # Lambda sets these; no request is made during import
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    env.setdefault("AWS_REGION", env["AWS_DEFAULT_REGION"])
+    env.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    env.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    env.setdefault("BUCKET_NAME", "bench")
+    env.setdefault("HEALTHLAKE_ID", "bench")
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+def _parse_importtime(stderr: str) -> dict[str, int]:
+    """Self time in microseconds per top-level package imported by the handler, from -X importtime output."""
+    per_package: dict[str, int] = defaultdict(int)
+    for line in stderr.partition(_MARKER)[2].splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|", 2)
+        per_package[name.strip().split(".")[0]] += int(self_us)
+    return per_package
+
+
+def profile(function: str, runs: int) -> dict:
+    timings, packages, clients = [], defaultdict(list), set()
+    for _ in range(runs):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", _IMPORT_SCRIPT, str(FUNCTIONS_DIR / function), str(LAYER_DIR), _MARKER],
+            capture_output=True, text=True, env=_env(), check=False,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(f"importing {function} failed:\n{proc.stderr[-2000:]}")
+        out = json.loads(proc.stdout.strip().splitlines()[-1])
+        timings.append(out["import_ms"])
+        clients.update(out["clients"])
+        for name, us in _parse_importtime(proc.stderr).items():
+            packages[name].append(us)
+    return {
+        "import_ms": statistics.median(timings),
+        "packages": {name: statistics.median(us) / 1000 for name, us in packages.items()},
+        "clients": sorted(clients),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--functions", default=",".join(_handlers()), help="handlers to import")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per handler")
+    parser.add_argument("--top", type=int, default=5, help="most expensive packages listed per handler")
+    parser.add_argument("--check", action="store_true", help="exit 1 when a handler is over its budget")
+    parser.add_argument("--save-budget", action="store_true", help=f"write budgets to {BUDGET_PATH.name}")
+    parser.add_argument("--headroom", type=float, default=1.5, help="budget = measured median x headroom")
+    args = parser.parse_args()
+
+    budgets = json.loads(BUDGET_PATH.read_text()) if BUDGET_PATH.exists() else {}
+    results, failures = {}, []
+    print(f"{'handler':>18} {'import_ms':>10} {'budget_ms':>10}  top packages (ms, self time)")
+    for function in args.functions.split(","):
+        result = results[function] = profile(function, args.runs)
+        budget = budgets.get(function)
+        top = sorted(result["packages"].items(), key=lambda kv: -kv[1])[: args.top]
+        print(f"{function:>18} {result['import_ms']:>10.1f} {budget if budget is not None else '-':>10}  "
+              + ", ".join(f"{name} {ms:.1f}" for name, ms in top))
+        if result["clients"]:
+            print(f"{'':>18} clients built at import: {', '.join(result['clients'])}")
+            failures.append(f"{function}: builds {', '.join(result['clients'])} at import")
+        if budget is not None and result["import_ms"] > budget:
+            failures.append(f"{function}: import {result['import_ms']:.1f}ms over its {budget}ms budget")
+
+    if args.save_budget:
+        BUDGET_PATH.parent.mkdir(exist_ok=True)
+        saved = {name: int(math.ceil(r["import_ms"] * args.headroom / 10) * 10) for name, r in results.items()}
+        BUDGET_PATH.write_text(json.dumps({**budgets, **saved}, indent=2, sort_keys=True) + "\n")
+        print(f"\nbudgets saved to {BUDGET_PATH}")
+
+    if args.check:
+        print()
+        for failure in failures:
+            print(f"OVER BUDGET {failure}")
+        if failures:
+            sys.exit(1)
+        print("all handlers within their startup budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+Bytes and tokens the text compaction stage saves before chunks reach the
+model, and a check that it changes no extraction result.
+
+Every document in fixtures/ocr_documents.jsonl (faxed OCR pages with
+banners, letterheads, page numbers, whitespace runs and hyphenated line
+ends) goes through content_splitter twice, as saved OCR text, with
+COMPACTION off and on. The chunks are read back the way bedrock_guardrail
+reads them, and for each run:
+
+- a rule-based stand-in for the model's entity extraction is merged across
+  the chunks as fhir_ingest merges them
+- the guardrail pre-classifier decides each chunk
+
+This is repeated for each --target-tokens chunk budget. The check fails
+(exit 1) if the merged entities differ between the two runs or from the
+fixture's expected entities, or if the pre-classifier short-circuits a
+compacted chunk that has entities in it. A fixture's `must_keep` lines (table
+cells, vitals at page edges) must survive compaction at least as many times
+as given. Compaction must also leave every
+pre-classifier decision on fixtures/guardrail_chunks.jsonl unchanged. A
+synthetic --pages document with the same furniture gives the savings and
+throughput at scale.
+
+    python benchmarks/bench_text_compaction.py
+    python benchmarks/bench_text_compaction.py --target-tokens 1250 --pages 2000
+"""
+import argparse
+import contextlib
+import io
+import json
+import re
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+from _support import MB, FakeContext, load_function_module, load_handler, map_items
+from documents import clinical_lines
+from fakes import FakeS3
+
+FIXTURES = Path(__file__).parent / "fixtures"
+BUCKET = "bench"
+
+NAME = re.compile(r"\b(?:Patient|Re):\s+(?:(?:Mdm|Mr|Mrs|Ms)\.?\s+)?([A-Z][A-Za-z ]*?)\s+NRIC\b")
+IDENTIFIER = re.compile(r"\b[STFG]\d{7}[A-Z]\b")
+GENDER = re.compile(r"\b(?:Sex:\s*)?(Male|Female|M|F)\b(?=[\s,.]|$)")
+VITALS = re.compile(r"\bBP\s*(\d{2,3})/(\d{2,3})\b")
+MEDICATION = re.compile(r"\b([A-Z][a-z]{3,})\s+(\d+)\s?mg\b")
+
+
+def extract_entities(text: str) -> dict:
+    """Rule-based stand-in for the model's extraction, run per chunk."""
+    name, identifier = NAME.search(text), IDENTIFIER.search(text)
+    gender = GENDER.search(text) if name or identifier else None
+    return {
+        "PatientName": name.group(1).strip() if name else "<UNKNOWN>",
+        "PatientIdentifier": identifier.group(0) if identifier else "<UNKNOWN>",
+        "Gender": {"m": "male", "f": "female"}.get(gender.group(1)[0].lower()) if gender else "unknown",
+        "Vitals": [f"BP {high}/{low}" for high, low in VITALS.findall(text)],
+        "Medications": [f"{drug} {dose}mg" for drug, dose in MEDICATION.findall(text)],
+    }
+
+
+def merge_entities(per_chunk: list[dict]) -> dict:
+    """First known value wins; vitals and medications are distinct, in first-seen order (as fhir_ingest)."""
+    merged = {"PatientName": "<UNKNOWN>", "PatientIdentifier": "<UNKNOWN>", "Gender": "unknown"}
+    vitals, meds = {}, {}
+    for e in per_chunk:
+        for field, unknown in (("PatientName", "<UNKNOWN>"), ("PatientIdentifier", "<UNKNOWN>"), ("Gender", "unknown")):
+            if merged[field] == unknown and e[field] not in (unknown, None):
+                merged[field] = e[field]
+        vitals.update(dict.fromkeys(e["Vitals"]))
+        meds.update(dict.fromkeys(e["Medications"]))
+    merged["Vitals"] = " | ".join(vitals) or "<UNKNOWN>"
+    merged["Medications"] = " | ".join(meds) or "<UNKNOWN>"
+    return merged
+
+
+def textract_text(pages: list[str]) -> str:
+    """Pages as iter_textract_text writes them to the OCR checkpoint."""
+    return "".join(page + "\n\f" for page in pages)
+
+
+def split(splitter, guardrail, s3: FakeS3, name: str, text: str, compaction: str, target_tokens: int) -> list[str]:
+    """Run content_splitter on saved OCR text; returns the chunk texts as bedrock_guardrail reads them."""
+    text_key = f"ocr/{name}.txt"
+    s3.put_object(Bucket=BUCKET, Key=text_key, Body=text.encode("utf-8"))
+    event = {"bucket": BUCKET, "key": f"incoming/{name}.pdf", "mode": "NATIVE_PARSE", "format": "ocr",
+             "text_key": text_key, "compaction": compaction, "chunking": {"target_tokens": target_tokens}}
+    # The handler prints its compaction summary
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = splitter.lambda_handler(event, FakeContext(request_id=f"{name}-{compaction}"))
+    return [guardrail._read_chunk_text(item) for item in map_items(s3, result)]
+
+
+def faxed_pages(pages: int, seed: int = 0) -> list[str]:
+    """Synthetic fax: banner and letterhead on every page, page-number footer, one hyphenated line end."""
+    out = []
+    for n in range(1, pages + 1):
+        lines = clinical_lines(40, seed=seed * 100_003 + n)
+        lines[10] = lines[10].rstrip(".") + " hyper-"
+        lines[11] = "tension " + lines[11].lower()
+        out.append("\n".join([
+            f"FROM: ST  MARY'S MEDICAL CENTRE    FAX: +65 6123 4567    05/10/2026 14:{n % 60:02d}    P.{n:03d}/{pages:03d}",
+            "ST MARY'S MEDICAL CENTRE   Discharge   summary",
+            *lines,
+            f"Page {n} of {pages}",
+        ]))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", default=str(FIXTURES / "ocr_documents.jsonl"))
+    parser.add_argument("--guardrail-fixtures", default=str(FIXTURES / "guardrail_chunks.jsonl"))
+    parser.add_argument("--target-tokens", default="60,100,300,1250",
+                        help="chunk budgets for the fixtures, comma separated; small ones put entities in different chunks")
+    parser.add_argument("--pages", type=int, default=500, help="pages of the synthetic fax")
+    args = parser.parse_args()
+
+    splitter = load_handler("content_splitter")
+    guardrail = load_handler("bedrock_guardrail")
+    compaction = load_function_module("content_splitter", "compaction")
+    pre = load_function_module("bedrock_guardrail", "preclassifier")
+    pre_config = pre.PreclassifierConfig.from_env()
+    s3 = FakeS3()
+    splitter.s3 = guardrail.s3 = s3
+    splitter.checkpoints = None
+
+    def categories(chunks: list[str]) -> list:
+        return [(pre.preclassify(chunk, pre_config) or {}).get("category") for chunk in chunks]
+
+    problems = []
+    documents = [json.loads(line) for line in Path(args.fixtures).read_text().splitlines() if line.strip()]
+    print(f"{'document':>24} {'budget':>6} {'pages':>5} {'chunks':>9} {'bytes':>13} {'saved':>6} {'tokens_saved':>12}")
+    for budget in (int(t) for t in args.target_tokens.split(",") if t.strip()):
+        for doc in documents:
+            label = f"{doc['name']} at {budget} tokens"
+            text = textract_text(doc["pages"])
+            raw = split(splitter, guardrail, s3, doc["name"], text, "off", budget)
+            compacted = split(splitter, guardrail, s3, doc["name"], text, "on", budget)
+            raw_bytes, compacted_bytes = (sum(len(c.encode("utf-8")) for c in chunks) for chunks in (raw, compacted))
+            saved = raw_bytes - compacted_bytes
+            print(f"{doc['name']:>24} {budget:>6} {len(doc['pages']):>5} {len(raw):>4} -> {len(compacted):<2} "
+                  f"{raw_bytes:>6} -> {compacted_bytes:<5} {saved / raw_bytes:>6.1%} "
+                  f"{int(saved / splitter.CHARS_PER_TOKEN):>12}")
+
+            before, after = merge_entities(map(extract_entities, raw)), merge_entities(map(extract_entities, compacted))
+            if before != after:
+                problems.append(f"{label}: entities changed\n    off: {before}\n    on:  {after}")
+            elif after != doc["expected"]:
+                problems.append(f"{label}: entities differ from the fixture\n    got:      {after}\n"
+                                f"    expected: {doc['expected']}")
+            for chunk, category in zip(compacted, categories(compacted)):
+                found = extract_entities(chunk)
+                if category and (found["Vitals"] or found["Medications"] or found["PatientIdentifier"] != "<UNKNOWN>"):
+                    problems.append(f"{label}: pre-classifier short-circuits a compacted chunk with entities as {category}")
+
+    for doc in documents:
+        kept = Counter(re.split(r"[\n\f]", "".join(compaction.TextCompactor().compact([textract_text(doc["pages"])]))))
+        for line, count in doc.get("must_keep", {}).items():
+            if kept[line] < count:
+                problems.append(f"{doc['name']}: {line!r} kept {kept[line]} of {count} times")
+
+    samples = [json.loads(line) for line in Path(args.guardrail_fixtures).read_text().splitlines() if line.strip()]
+    changed = [s["label"] for s in samples
+               if categories([s["text"]]) != categories(["".join(compaction.TextCompactor().compact([s["text"]]))])]
+    print(f"\npre-classifier decisions changed on {len(changed)}/{len(samples)} guardrail fixture chunks")
+    if changed:
+        problems.append(f"pre-classifier decisions changed on guardrail fixtures labeled {changed}")
+
+    text = textract_text(faxed_pages(args.pages))
+    compactor = compaction.TextCompactor()
+    started = time.perf_counter()
+    for _ in compactor.compact([text]):
+        pass
+    elapsed = time.perf_counter() - started
+    print(f"synthetic fax, {args.pages} pages: {compactor.bytes_in / MB:.2f}MB, saved {compactor.bytes_saved:,} bytes "
+          f"({compactor.bytes_saved / compactor.bytes_in:.1%}), ~{compactor.tokens_saved:,} tokens, "
+          f"{compactor.lines_dropped:,} lines dropped, {compactor.bytes_in / MB / elapsed:.1f} MB/s")
+
+    print()
+    for problem in problems:
+        print(f"FAIL {problem}")
+    if problems:
+        sys.exit(1)
+    print("compaction saved input tokens without changing any extraction result")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Memory of reading long Textract jobs: all LINE blocks joined into one string
+(the old get_textract_results) against iter_textract_text, which yields one
+document page at a time as the results pages arrive.
+
+FakeTextract serves a scanned PDF of N pages, 1000 blocks per results page.
+Both paths feed the same splitter and only count the chunks, so the traced
+peak is the text path alone. The streaming path also has to number its
+chunks: the check fails (exit 1) unless every page 1..N is cited by a chunk
+in order, and unless its peak at the largest page count stays within
+--max-growth times the peak at the smallest.
+
+    python benchmarks/bench_textract_pages.py --pages 500,2000,5000
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+
+from _support import MB, FakeContext, load_handler
+from documents import scanned_pdf
+from fakes import FakeS3, FakeTextract
+
+BUCKET = "bench"
+
+
+def joined_text(splitter, job_id: str, context) -> list[str]:
+    """The pre-streaming reader: every LINE of every results page in one list, then one string."""
+    lines = []
+    response = splitter._wait_for_textract(job_id, context)
+    while True:
+        lines.extend(block["Text"] for block in response["Blocks"] if block["BlockType"] == "LINE")
+        if not response.get("NextToken"):
+            break
+        response = splitter.textract.get_document_text_detection(JobId=job_id, NextToken=response["NextToken"])
+    return ["\n".join(lines)]
+
+
+class PageCoverage:
+    """Checks, without keeping them, that chunk page ranges run from page 1 in order with no page skipped."""
+
+    def __init__(self):
+        self.next_page = 1
+        self.problem = None
+
+    def add(self, first: int, last: int) -> None:
+        if self.problem is None and (first > self.next_page or last < first):
+            self.problem = f"chunk cites {first}-{last} after page {self.next_page - 1}"
+        self.next_page = max(self.next_page, last + 1)
+
+    def check(self, pages: int) -> str | None:
+        if self.problem is None and self.next_page != pages + 1:
+            return f"chunks cite pages up to {self.next_page - 1}"
+        return self.problem
+
+
+def run_case(splitter, pages: int, mode: str) -> dict:
+    s3 = FakeS3(keep_bodies=False)
+    key = f"incoming/scan-{pages}.pdf"
+    # Tiny images: FakeTextract only counts the /Page objects
+    s3.objects[(BUCKET, key)] = scanned_pdf(pages, image_bytes=16)
+    textract = FakeTextract(s3)
+    splitter.textract = textract
+    job_id = textract.start_document_text_detection(DocumentLocation={"S3Object": {"Bucket": BUCKET, "Name": key}})["JobId"]
+    chunker = splitter.make_splitter(splitter.ChunkingConfig.from_event({}))
+    context = FakeContext()
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    chunks, coverage = 0, PageCoverage()
+    if mode == "joined":
+        for _ in chunker.split(joined_text(splitter, job_id, context)):
+            chunks += 1
+    else:
+        for _, cited in splitter.split_with_pages(chunker, splitter.iter_textract_text(job_id, context)):
+            chunks += 1
+            coverage.add(*cited)
+    elapsed = time.perf_counter() - started
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "pages": pages,
+        "mode": mode,
+        "chunks": chunks,
+        "results_pages": textract.calls.get("get_document_text_detection", 0),
+        "seconds": round(elapsed, 2),
+        "traced_peak_mb": round(traced_peak / MB, 2),
+        "coverage": coverage,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", default="500,2000,5000", help="document page counts, comma separated")
+    parser.add_argument("--modes", default="joined,streaming")
+    parser.add_argument("--max-growth", type=float, default=1.5,
+                        help="allowed streaming peak at the largest page count, relative to the smallest")
+    args = parser.parse_args()
+
+    splitter = load_handler("content_splitter")
+    page_counts = [int(p) for p in args.pages.split(",") if p.strip()]
+
+    print(f"{'pages':>6} {'mode':>10} {'chunks':>7} {'results_pages':>13} {'sec':>6} {'traced_MB':>10}")
+    streaming, problems = [], []
+    for mode in args.modes.split(","):
+        for pages in page_counts:
+            r = run_case(splitter, pages, mode)
+            print(f"{r['pages']:>6} {r['mode']:>10} {r['chunks']:>7} {r['results_pages']:>13} "
+                  f"{r['seconds']:>6} {r['traced_peak_mb']:>10}")
+            if mode == "streaming":
+                streaming.append(r)
+                problem = r["coverage"].check(pages)
+                if problem:
+                    problems.append(f"{pages} pages: {problem}")
+
+    if len(streaming) > 1:
+        smallest, largest = streaming[0], streaming[-1]
+        if largest["traced_peak_mb"] > smallest["traced_peak_mb"] * args.max_growth:
+            problems.append(f"streaming peak grew from {smallest['traced_peak_mb']}MB at {smallest['pages']} pages "
+                            f"to {largest['traced_peak_mb']}MB at {largest['pages']} pages")
+
+    print()
+    for problem in problems:
+        print(f"FAIL {problem}")
+    if problems:
+        sys.exit(1)
+    print("streamed Textract text stays flat in memory and every page is cited by a chunk")
+
+
+if __name__ == "__main__":
+    main()
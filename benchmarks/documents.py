@@ -0,0 +1,183 @@
+"""
+Synthetic input documents for the benchmarks, generated in memory.
+
+PDFs are minimal but well formed (catalog, page tree, xref) in the three
+shapes the router has to tell apart: born-digital text, scanned images, and
+text drawn with a CID (Identity-H) font whose strings are glyph ids.
+Spreadsheets are written part by part, so large workbooks never exist as one
+XML string.
+"""
+import io
+import itertools
+import random
+import zipfile
+import zlib
+
+WORDS = (
+    "patient referred for review of hypertension and type 2 diabetes blood pressure "
+    "medication metformin amlodipine follow up clinic history examination plan "
+    "cardiology renal function stable symptoms reported dose increased letter"
+).split()
+
+
+def clinical_lines(n: int, seed: int = 0, words_per_line: int = 12) -> list[str]:
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(words_per_line)).capitalize() + "." for _ in range(n)]
+
+
+def _stream(data: bytes, extra: bytes = b"", compress: bool = True) -> bytes:
+    if compress:
+        data = zlib.compress(data)
+        extra += b" /Filter /FlateDecode"
+    return b"<< /Length %d%s >>\nstream\n" % (len(data), extra) + data + b"\nendstream"
+
+
+def _pdf(objects: list[bytes]) -> bytes:
+    """Serialize objects 1..n (1 is the catalog) with a classic xref table."""
+    out = bytearray(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def _pdf_literal(text: str) -> bytes:
+    raw = text.encode("cp1252", errors="replace")
+    return b"(" + raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def _paged_pdf(pages: int, font: bytes, page_parts) -> bytes:
+    """page_parts(i, first_free_object) -> (content bytes, resources bytes, extra objects)."""
+    objects: list[bytes] = [b"<< /Type /Catalog /Pages 2 0 R >>", b"", font]
+    kids = []
+    for i in range(pages):
+        page_number = len(objects) + 1
+        content, resources, extra = page_parts(i, page_number + 2)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+                       b"/Resources << /Font << /F1 3 0 R >> %s >> >>" % (page_number + 1, resources))
+        objects.append(_stream(content))
+        objects.extend(extra)
+        kids.append(b"%d 0 R" % page_number)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), pages)
+    return _pdf(objects)
+
+
+def text_pdf(pages: int, lines_per_page: int = 45, seed: int = 0) -> bytes:
+    """Born-digital: Helvetica text, one Tj per line."""
+    def page_parts(i, _):
+        lines = clinical_lines(lines_per_page, seed=seed * 100_003 + i)
+        ops = [b"BT /F1 10 Tf 14 TL 56 740 Td"] + [_pdf_literal(line) + b" Tj T*" for line in lines] + [b"ET"]
+        return b"\n".join(ops), b"", []
+
+    font = b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"
+    return _paged_pdf(pages, font, page_parts)
+
+
+def scanned_pdf(pages: int, image_bytes: int = 200_000, seed: int = 0) -> bytes:
+    """Scanned: one full-page 1700x2200 JPEG per page, no text."""
+    rng = random.Random(seed)
+
+    def page_parts(i, image_number):
+        image = _stream(b"\xff\xd8\xff\xe0" + rng.randbytes(image_bytes),
+                        b" /Type /XObject /Subtype /Image /Width 1700 /Height 2200 /ColorSpace /DeviceGray"
+                        b" /BitsPerComponent 8 /Filter /DCTDecode", compress=False)
+        return b"q 612 0 0 792 0 0 cm /Im1 Do Q", b"/XObject << /Im1 %d 0 R >>" % image_number, [image]
+
+    font = b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    return _paged_pdf(pages, font, page_parts)
+
+
+def cid_pdf(pages: int, lines_per_page: int = 45, seed: int = 0) -> bytes:
+    """Text drawn with an Identity-H font: strings are 2-byte glyph ids, not characters."""
+    def page_parts(i, _):
+        lines = clinical_lines(lines_per_page, seed=seed * 100_003 + i)
+        ops = [b"BT /F1 10 Tf 14 TL 56 740 Td"]
+        for line in lines:
+            glyphs = b"".join(b"%04X" % (ord(c) - 29 if c != " " else 3) for c in line)
+            ops.append(b"<" + glyphs + b"> Tj T*")
+        ops.append(b"ET")
+        return b"\n".join(ops), b"", []
+
+    font = b"<< /Type /Font /Subtype /Type0 /BaseFont /ABCDEF+NotoSansCJK /Encoding /Identity-H >>"
+    return _paged_pdf(pages, font, page_parts)
+
+
+def docx(paragraphs: list[str]) -> bytes:
+    body = "".join(f"<w:p><w:r><w:t>{p}</w:t></w:r></w:p>" for p in paragraphs)
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml", '<?xml version="1.0"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types"/>')
+        z.writestr("_rels/.rels", '<?xml version="1.0"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"/>')
+        z.writestr("word/document.xml",
+                   '<?xml version="1.0"?><w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                   f"<w:body>{body}</w:body></w:document>")
+    return buf.getvalue()
+
+
+def csv_rows(rows: int, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    lines = ["patient_id,visit_date,systolic,diastolic,medication,notes"]
+    for i in range(rows):
+        lines.append(f"P{i:07d},2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d},"
+                     f"{rng.randint(100, 180)},{rng.randint(60, 110)},{rng.choice(WORDS)},{' '.join(rng.choices(WORDS, k=6))}")
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def _visit(rng: random.Random, i: int) -> list:
+    """One lab/visit row: patient_id, visit_date, systolic, diastolic, medication, notes."""
+    return [f"P{i:07d}", f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            rng.randint(100, 180), rng.randint(60, 110), rng.choice(WORDS), " ".join(rng.choices(WORDS, k=6))]
+
+
+def _column(index: int) -> str:
+    name = ""
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        name = chr(65 + rem) + name
+    return name
+
+
+def xlsx(rows: int, sheets: int = 1, seed: int = 0) -> bytes:
+    """Workbook of visit rows; text cells go through the shared-string table as Excel writes them."""
+    rng = random.Random(seed)
+    header = ["patient_id", "visit_date", "systolic", "diastolic", "medication", "notes"]
+    shared: dict[str, int] = {}
+    ns = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+    rel_ns = 'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"'
+
+    def cell(ref: str, value) -> str:
+        if isinstance(value, int):
+            return f'<c r="{ref}"><v>{value}</v></c>'
+        return f'<c r="{ref}" t="s"><v>{shared.setdefault(value, len(shared))}</v></c>'
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml", '<?xml version="1.0"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types"/>')
+        for s in range(sheets):
+            with z.open(f"xl/worksheets/sheet{s + 1}.xml", "w", force_zip64=True) as part:
+                part.write(f'<?xml version="1.0" encoding="UTF-8"?><worksheet {ns}><sheetData>'.encode())
+                for r, values in enumerate(itertools.chain([header], (_visit(rng, i) for i in range(rows))), 1):
+                    cells = "".join(cell(f"{_column(c)}{r}", v) for c, v in enumerate(values))
+                    part.write(f'<row r="{r}">{cells}</row>'.encode())
+                part.write(b"</sheetData></worksheet>")
+        z.writestr("xl/sharedStrings.xml",
+                   f'<?xml version="1.0" encoding="UTF-8"?><sst {ns} uniqueCount="{len(shared)}">'
+                   + "".join(f"<si><t>{text}</t></si>" for text in shared) + "</sst>")
+        z.writestr("xl/workbook.xml",
+                   f'<?xml version="1.0" encoding="UTF-8"?><workbook {ns} {rel_ns}><sheets>'
+                   + "".join(f'<sheet name="Visits {s + 1}" sheetId="{s + 1}" r:id="rId{s + 1}"/>' for s in range(sheets))
+                   + "</sheets></workbook>")
+        z.writestr("xl/_rels/workbook.xml.rels",
+                   '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                   + "".join(f'<Relationship Id="rId{s + 1}" Target="worksheets/sheet{s + 1}.xml" '
+                             'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+                             for s in range(sheets))
+                   + "</Relationships>")
+    return buf.getvalue()
@@ -0,0 +1,730 @@
+"""
+In-process stand-ins for the AWS services the pipeline talks to.
+
+They implement only the calls and response shapes the handlers use, so a
+benchmark can swap them into a loaded handler module (e.g. `handler.s3 = FakeS3()`)
+and run it without network access.
+"""
+import hashlib
+import io
+import itertools
+import json
+import re
+import threading
+import time
+import uuid
+
+from documents import clinical_lines
+
+
+class FakeStreamingBody:
+    """Mimics botocore's StreamingBody over an in-memory bytes object."""
+
+    def __init__(self, data: bytes):
+        self._stream = io.BytesIO(data)
+
+    def read(self, amt: int | None = None) -> bytes:
+        return self._stream.read() if amt is None else self._stream.read(amt)
+
+    def iter_chunks(self, chunk_size: int = 1024):
+        while True:
+            block = self._stream.read(chunk_size)
+            if not block:
+                return
+            yield block
+
+
+class SyntheticBody:
+    """
+    A StreamingBody that generates `size` bytes on the fly by repeating `pattern`.
+    Nothing larger than one requested block is ever materialised, so multi-GB
+    inputs can be benchmarked without multi-GB of RAM in the harness itself.
+    """
+
+    def __init__(self, size: int, pattern: bytes):
+        self._size = size
+        self._pattern = pattern
+        self._pos = 0
+
+    def _produce(self, n: int) -> bytes:
+        n = min(n, self._size - self._pos)
+        if n <= 0:
+            return b""
+        offset = self._pos % len(self._pattern)
+        reps = (offset + n) // len(self._pattern) + 1
+        data = (self._pattern * reps)[offset:offset + n]
+        self._pos += n
+        return data
+
+    def read(self, amt: int | None = None) -> bytes:
+        return self._produce(self._size if amt is None else amt)
+
+    def iter_chunks(self, chunk_size: int = 1024):
+        while True:
+            block = self._produce(chunk_size)
+            if not block:
+                return
+            yield block
+
+
+def _client_error(code: str, op: str, message: str | None = None):
+    from botocore.exceptions import ClientError
+
+    return ClientError({"Error": {"Code": code, "Message": message or f"fake {code}"}}, op)
+
+
+class _S3Exceptions:
+    class NoSuchKey(Exception):
+        pass
+
+
+class FakeS3:
+    """
+    Dict-backed S3 client.
+
+    latency_s is added to every call to approximate a network round trip.
+    With keep_bodies=False, put_object only counts bytes, which keeps the
+    harness itself out of memory measurements.
+    """
+
+    def __init__(self, latency_s: float = 0.0, keep_bodies: bool = True):
+        self.latency_s = latency_s
+        self.keep_bodies = keep_bodies
+        self.objects: dict[tuple[str, str], bytes] = {}
+        self.synthetic: dict[tuple[str, str], tuple[int, bytes]] = {}
+        self.generated: dict[tuple[str, str], object] = {}
+        self.metadata: dict[tuple[str, str], dict] = {}
+        self.etags: dict[tuple[str, str], str] = {}
+        self.uploads: dict[str, dict[int, bytes]] = {}
+        self.upload_metadata: dict[str, dict] = {}
+        self.exceptions = _S3Exceptions
+        self._upload_ids = itertools.count(1)
+        self.calls: dict[str, int] = {}
+        self.bytes_written = 0
+        self._lock = threading.Lock()
+
+    def _record(self, op: str):
+        with self._lock:
+            self.calls[op] = self.calls.get(op, 0) + 1
+        if self.latency_s:
+            time.sleep(self.latency_s)
+
+    def add_synthetic_object(self, bucket: str, key: str, size: int, pattern: bytes):
+        self.synthetic[(bucket, key)] = (size, pattern)
+
+    def add_generated_object(self, bucket: str, key: str, body_factory):
+        """Serve get_object from body_factory(), a fresh streaming body per call."""
+        self.generated[(bucket, key)] = body_factory
+
+    def put_object(self, Bucket, Key, Body=b"", Metadata=None, IfNoneMatch=None, IfMatch=None, **kwargs):
+        self._record("put_object")
+        data = Body.encode("utf-8") if isinstance(Body, str) else bytes(Body)
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        with self._lock:
+            # Conditional create and replace; metadata and ETags are kept even when bodies are not
+            if IfNoneMatch == "*" and (Bucket, Key) in self.metadata:
+                raise _client_error("PreconditionFailed", "PutObject")
+            if IfMatch is not None and (Bucket, Key) not in self.metadata:
+                raise _client_error("NoSuchKey", "PutObject")
+            if IfMatch is not None and self.etags.get((Bucket, Key)) != IfMatch:
+                raise _client_error("PreconditionFailed", "PutObject")
+            self.bytes_written += len(data)
+            if self.keep_bodies:
+                self.objects[(Bucket, Key)] = data
+            self.metadata[(Bucket, Key)] = Metadata or {}
+            self.etags[(Bucket, Key)] = etag
+        return {"ETag": etag}
+
+    def create_multipart_upload(self, Bucket, Key, Metadata=None, **kwargs):
+        self._record("create_multipart_upload")
+        upload_id = f"upload-{next(self._upload_ids)}"
+        with self._lock:
+            self.uploads[upload_id] = {}
+            self.upload_metadata[upload_id] = Metadata or {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        self._record("upload_part")
+        data = Body if isinstance(Body, bytes) else Body.read()
+        with self._lock:
+            self.bytes_written += len(data)
+            self.uploads[UploadId][PartNumber] = data if self.keep_bodies else b""
+        return {"ETag": f'"{UploadId}-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        self._record("complete_multipart_upload")
+        with self._lock:
+            parts = self.uploads.pop(UploadId)
+            if self.keep_bodies:
+                self.objects[(Bucket, Key)] = b"".join(parts[p["PartNumber"]] for p in MultipartUpload["Parts"])
+            self.metadata[(Bucket, Key)] = self.upload_metadata.pop(UploadId, {})
+        return {"ETag": f'"{UploadId}"'}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Config=None, **kwargs):
+        """Managed upload: multipart above Config.multipart_threshold, reading one part at a time."""
+        extra = ExtraArgs or {}
+        threshold = Config.multipart_threshold if Config else 8 * 1024 * 1024
+        chunk_size = Config.multipart_chunksize if Config else 8 * 1024 * 1024
+
+        data = Fileobj.read(threshold)
+        if len(data) < threshold:
+            self.put_object(Bucket=Bucket, Key=Key, Body=data, **extra)
+            return
+
+        upload_id = self.create_multipart_upload(Bucket=Bucket, Key=Key)["UploadId"]
+        parts = []
+        while data:
+            number = len(parts) + 1
+            resp = self.upload_part(Bucket=Bucket, Key=Key, UploadId=upload_id, PartNumber=number, Body=data)
+            parts.append({"ETag": resp["ETag"], "PartNumber": number})
+            data = Fileobj.read(chunk_size)
+        self.complete_multipart_upload(Bucket=Bucket, Key=Key, UploadId=upload_id, MultipartUpload={"Parts": parts})
+        with self._lock:
+            self.metadata[(Bucket, Key)] = extra.get("Metadata", {})
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self._record("abort_multipart_upload")
+        with self._lock:
+            self.uploads.pop(UploadId, None)
+            self.upload_metadata.pop(UploadId, None)
+        return {}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._record("delete_object")
+        with self._lock:
+            self.objects.pop((Bucket, Key), None)
+            self.metadata.pop((Bucket, Key), None)
+            self.etags.pop((Bucket, Key), None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        self._record("delete_objects")
+        with self._lock:
+            for obj in Delete["Objects"]:
+                self.objects.pop((Bucket, obj["Key"]), None)
+                self.metadata.pop((Bucket, obj["Key"]), None)
+                self.etags.pop((Bucket, obj["Key"]), None)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix="", ContinuationToken=None, MaxKeys=1000, **kwargs):
+        self._record("list_objects_v2")
+        with self._lock:
+            keys = sorted(key for bucket, key in self.metadata if bucket == Bucket and key.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        page = {"Contents": [{"Key": key} for key in keys[start:start + MaxKeys]], "KeyCount": len(keys[start:start + MaxKeys])}
+        if start + MaxKeys < len(keys):
+            page["NextContinuationToken"] = str(start + MaxKeys)
+        return page
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        self._record("get_object")
+        if (Bucket, Key) in self.generated:
+            return {"Body": self.generated[(Bucket, Key)]()}
+        if (Bucket, Key) in self.synthetic:
+            size, pattern = self.synthetic[(Bucket, Key)]
+            return {"Body": SyntheticBody(size, pattern), "ContentLength": size}
+
+        try:
+            data = self.objects[(Bucket, Key)]
+        except KeyError:
+            raise self.exceptions.NoSuchKey(f"s3://{Bucket}/{Key}")
+
+        if Range:
+            start, end = Range.replace("bytes=", "").split("-")
+            data = data[int(start):int(end) + 1 if end else None]
+        return {"Body": FakeStreamingBody(data), "ContentLength": len(data), "ETag": self.etags.get((Bucket, Key))}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._record("head_object")
+        if (Bucket, Key) in self.synthetic:
+            size, pattern = self.synthetic[(Bucket, Key)]
+            etag = hashlib.md5(pattern + str(size).encode()).hexdigest()
+        elif (Bucket, Key) in self.objects:
+            data = self.objects[(Bucket, Key)]
+            size, etag = len(data), hashlib.md5(data).hexdigest()
+        else:
+            # HEAD has no body, so S3 reports a bare 404 rather than NoSuchKey
+            raise _client_error("404", "HeadObject")
+        return {"ContentLength": size, "ETag": f'"{etag}"', "Metadata": self.metadata.get((Bucket, Key), {})}
+
+
+def default_guardrail_responder(text: str) -> dict:
+    """Deterministic stand-in for the model: clinical-looking text is VALID."""
+    lowered = text.lower()
+    if "patient" in lowered or "mg" in lowered:
+        return {
+            "classification": "VALID",
+            "reason": "Clinical notes present.",
+            "entities": {
+                "PatientName": "John Tan",
+                "PatientIdentifier": "S1234567A",
+                "Gender": "male",
+                "Vitals": "BP 120/80",
+                "Medications": "Metformin 500mg",
+            },
+        }
+    return {"classification": "INVALID", "reason": "Fiction or non-clinical text.", "entities": {}}
+
+
+class FakeBedrock:
+    """
+    bedrock-runtime stand-in for converse / invoke_model.
+
+    throttle_rate raises ThrottlingException on that fraction of calls,
+    outage=True fails every call with ServiceUnavailableException,
+    fail_when(chunk_text) -> bool fails only the calls holding a matching
+    chunk with it (a partial outage; the responder never sees those calls), and
+    converse_supported=False answers Converse with a ValidationException, as
+    models without tool use do.
+
+    Prompt caching follows Bedrock: the prefix up to a checkpoint (Converse
+    `cachePoint` after the tool config and system blocks, or an Anthropic
+    `cache_control` system block) is written on first use and read for
+    cache_ttl_s after each hit, if it reaches cache_min_tokens. Usage reports
+    the uncached input tokens, cache reads and cache writes separately and is
+    totalled in `usage`. prompt_cache=False rejects checkpoints with a
+    ValidationException, as models without caching do. Tokens are estimated
+    at 4 characters each; seconds_per_1k_input_tokens adds prefill time for
+    uncached input (a tenth of it for cache reads).
+    """
+
+    def __init__(self, latency_s: float = 0.0, throttle_rate: float = 0.0, outage: bool = False,
+                 converse_supported: bool = True, responder=default_guardrail_responder, seed: int = 0,
+                 prompt_cache: bool = True, cache_min_tokens: int = 1024, cache_ttl_s: float = 300.0,
+                 seconds_per_1k_input_tokens: float = 0.0, fail_when=None):
+        import random
+
+        self.latency_s = latency_s
+        self.throttle_rate = throttle_rate
+        self.outage = outage
+        self.fail_when = fail_when
+        self.converse_supported = converse_supported
+        self.responder = responder
+        self.prompt_cache = prompt_cache
+        self.cache_min_tokens = cache_min_tokens
+        self.cache_ttl_s = cache_ttl_s
+        self.seconds_per_1k_input_tokens = seconds_per_1k_input_tokens
+        self.calls: dict[str, int] = {}
+        self.errors: dict[str, int] = {}
+        self.usage = {"input": 0, "cache_read": 0, "cache_write": 0, "output": 0}
+        self._cache: dict[tuple, float] = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _error(self, code: str, op: str, message: str | None = None):
+        with self._lock:
+            self.errors[code] = self.errors.get(code, 0) + 1
+        return _client_error(code, op, message)
+
+    def _enter(self, op: str):
+        with self._lock:
+            self.calls[op] = self.calls.get(op, 0) + 1
+            throttled = self._rng.random() < self.throttle_rate
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        if self.outage:
+            raise self._error("ServiceUnavailableException", op)
+        if throttled:
+            raise self._error("ThrottlingException", op)
+
+    def _answer(self, prompt: str, op: str) -> dict:
+        chunks = re.findall(r'<chunk id="(\d+)">\n(.*?)\n</chunk>', prompt, flags=re.DOTALL)
+        texts = [text for _, text in chunks] or [prompt.split("INPUT:", 1)[-1]]
+        if self.fail_when and any(self.fail_when(text) for text in texts):
+            raise self._error("ServiceUnavailableException", op)
+        if chunks:
+            return {"results": [{"chunk_id": int(cid), **self.responder(text)} for cid, text in chunks]}
+        return self.responder(texts[0])
+
+    def _usage(self, model_id: str, prefix: str | None, rest: str) -> tuple[int, int, int]:
+        """(uncached input, cache read, cache write) tokens; prefix is None without a checkpoint."""
+        rest_tokens = len(rest) // 4
+        if prefix is None:
+            uncached, read, write = rest_tokens, 0, 0
+        else:
+            prefix_tokens = len(prefix) // 4
+            key = (model_id, hash(prefix))
+            now = time.monotonic()
+            with self._lock:
+                if prefix_tokens < self.cache_min_tokens:
+                    # Too short to cache: the checkpoint is ignored
+                    uncached, read, write = prefix_tokens + rest_tokens, 0, 0
+                elif self._cache.get(key, 0) > now:
+                    uncached, read, write = rest_tokens, prefix_tokens, 0
+                else:
+                    uncached, read, write = rest_tokens, 0, prefix_tokens
+                if read or write:
+                    self._cache[key] = now + self.cache_ttl_s
+        with self._lock:
+            self.usage["input"] += uncached
+            self.usage["cache_read"] += read
+            self.usage["cache_write"] += write
+            self.usage["output"] += 200
+        if self.seconds_per_1k_input_tokens:
+            time.sleep((uncached + write + read / 10) / 1000 * self.seconds_per_1k_input_tokens)
+        return uncached, read, write
+
+    def converse(self, modelId, messages, system=None, toolConfig=None, **kwargs):
+        self._enter("converse")
+        if not self.converse_supported:
+            raise self._error("ValidationException", "converse", "This model doesn't support tool use.")
+        system = system or []
+        checkpoint = next((n for n, block in enumerate(system) if "cachePoint" in block), None)
+        if checkpoint is not None and not self.prompt_cache:
+            raise self._error("ValidationException", "converse", "This model doesn't support prompt caching.")
+        tools = json.dumps(toolConfig or {}, sort_keys=True)
+        texts = [block.get("text", "") for block in system]
+        prompt = "".join(block.get("text", "") for block in messages[-1]["content"])
+        if checkpoint is None:
+            uncached, read, write = self._usage(modelId, None, tools + "".join(texts) + prompt)
+        else:
+            uncached, read, write = self._usage(modelId, tools + "".join(texts[:checkpoint]),
+                                                "".join(texts[checkpoint + 1:]) + prompt)
+        return {
+            "stopReason": "tool_use",
+            "output": {"message": {"content": [{"toolUse": {"name": "audit_output", "input": self._answer(prompt, "converse")}}]}},
+            "usage": {"inputTokens": uncached, "cacheReadInputTokens": read, "cacheWriteInputTokens": write,
+                      "outputTokens": 200},
+        }
+
+    def invoke_model(self, modelId, body, **kwargs):
+        self._enter("invoke_model")
+        request = json.loads(body)
+        system = request.get("system") or []
+        if isinstance(system, str):
+            system = [{"type": "text", "text": system}]
+        checkpoint = next((n for n, block in enumerate(system) if "cache_control" in block), None)
+        if checkpoint is not None and not self.prompt_cache:
+            raise self._error("ValidationException", "invoke_model", "This model doesn't support prompt caching.")
+        prompt = "".join(block.get("text", "") for block in request["messages"][-1]["content"])
+        texts = [block.get("text", "") for block in system]
+        if checkpoint is None:
+            uncached, read, write = self._usage(modelId, None, "".join(texts) + prompt)
+        else:
+            uncached, read, write = self._usage(modelId, "".join(texts[:checkpoint + 1]),
+                                                "".join(texts[checkpoint + 1:]) + prompt)
+        result = {
+            "content": [{"type": "text", "text": json.dumps(self._answer(prompt, "invoke_model"))}],
+            "usage": {"input_tokens": uncached, "cache_read_input_tokens": read,
+                      "cache_creation_input_tokens": write, "output_tokens": 200},
+        }
+        return {"body": FakeStreamingBody(json.dumps(result).encode("utf-8"))}
+
+
+class FakeTextract:
+    """
+    Textract stand-in for async text detection.
+
+    A job stays IN_PROGRESS for `seconds_per_page` per page after it starts,
+    then reports SUCCEEDED with PAGE and LINE blocks, paginated by MaxResults
+    as the real API does, or FAILED for a document key in `failing`. Given the FakeS3 holding the documents, a PDF has
+    one page of `lines_per_page` lines per /Page object; anything else is one
+    page. The text is seeded by key and page. latency_s is added to every call.
+    """
+
+    def __init__(self, s3=None, latency_s: float = 0.0, seconds_per_page: float = 0.0, lines_per_page: int = 45):
+        self.s3 = s3
+        self.latency_s = latency_s
+        self.seconds_per_page = seconds_per_page
+        self.lines_per_page = lines_per_page
+        self.jobs: dict[str, dict] = {}
+        self.calls: dict[str, int] = {}
+        # Jobs on these document keys end FAILED
+        self.failing: set[str] = set()
+        self._lock = threading.Lock()
+
+    def _record(self, op: str):
+        with self._lock:
+            self.calls[op] = self.calls.get(op, 0) + 1
+        if self.latency_s:
+            time.sleep(self.latency_s)
+
+    def _status(self, job: dict) -> str:
+        return "FAILED" if job["document"]["Name"] in self.failing else "SUCCEEDED"
+
+    def _pages(self, location: dict) -> int:
+        data = self.s3.objects.get((location["Bucket"], location["Name"]), b"") if self.s3 else b""
+        if data.startswith(b"%PDF"):
+            return max(1, len(re.findall(rb"/Type\s*/Page\b(?!s)", data)))
+        return 1
+
+    def start_document_text_detection(self, DocumentLocation, **kwargs):
+        self._record("start_document_text_detection")
+        job_id = uuid.uuid4().hex
+        pages = self._pages(DocumentLocation["S3Object"])
+        with self._lock:
+            self.jobs[job_id] = {
+                "document": DocumentLocation["S3Object"],
+                "status": "IN_PROGRESS",
+                "pages": pages,
+                "ready_at": time.monotonic() + pages * self.seconds_per_page,
+                "notification": kwargs.get("NotificationChannel"),
+            }
+        return {"JobId": job_id}
+
+    def completion_message(self, job_id: str) -> dict:
+        """Wait for the job to finish and return the SNS message Textract would publish."""
+        delay = self.jobs[job_id]["ready_at"] - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return {"JobId": job_id, "Status": self._status(self.jobs[job_id]), "API": "StartDocumentTextDetection"}
+
+    def get_document_text_detection(self, JobId, MaxResults: int = 1000, NextToken: str | None = None, **kwargs):
+        self._record("get_document_text_detection")
+        job = self.jobs[JobId]
+        if time.monotonic() < job["ready_at"]:
+            return {"JobStatus": "IN_PROGRESS"}
+        job["status"] = self._status(job)
+        if job["status"] == "FAILED":
+            return {"JobStatus": "FAILED", "StatusMessage": "Unable to process the document"}
+
+        pages = job["pages"]
+        total = pages * (self.lines_per_page + 1)
+        start = int(NextToken or 0)
+        blocks, page_lines = [], []
+        for n in range(start, min(total, start + MaxResults)):
+            page, line = divmod(n, self.lines_per_page + 1)
+            if line == 0 or not blocks:
+                page_lines = clinical_lines(self.lines_per_page, seed=f"{job['document']['Name']}:{page}")
+            if line == 0:
+                blocks.append({"BlockType": "PAGE", "Page": page + 1})
+            else:
+                blocks.append({"BlockType": "LINE", "Page": page + 1, "Text": page_lines[line - 1]})
+        response = {"JobStatus": "SUCCEEDED", "DocumentMetadata": {"Pages": pages}, "Blocks": blocks}
+        if start + MaxResults < total:
+            response["NextToken"] = str(start + MaxResults)
+        return response
+
+
+class FakeStepFunctions:
+    """
+    Task-token side of Step Functions: what handlers call to resume a
+    waitForTaskToken state. The pipeline runner reads `outcomes` to continue.
+    """
+
+    class exceptions:
+        class InvalidToken(Exception):
+            pass
+
+        class TaskTimedOut(Exception):
+            pass
+
+        class TaskDoesNotExist(Exception):
+            pass
+
+    def __init__(self):
+        self.outcomes: dict[str, tuple[str, str]] = {}
+        self.calls: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _resolve(self, op: str, token: str, outcome: tuple[str, str]):
+        with self._lock:
+            self.calls[op] = self.calls.get(op, 0) + 1
+            if token in self.outcomes:
+                raise self.exceptions.InvalidToken(token)
+            self.outcomes[token] = outcome
+        return {}
+
+    def send_task_success(self, taskToken, output, **kwargs):
+        return self._resolve("send_task_success", taskToken, ("success", output))
+
+    def send_task_failure(self, taskToken, error="", cause="", **kwargs):
+        return self._resolve("send_task_failure", taskToken, (error, cause))
+
+
+class FakeHealthLake:
+    """
+    Local HTTP stand-in for a HealthLake R4 datastore.
+
+    Serves the subset the handlers use: create (POST /{type}), update by id
+    (PUT /{type}/{id}), conditional update (PUT /{type}?identifier=...), Bundle
+    POST to the datastore root, read (GET /{type}/{id}) and search (GET /{type}?...).
+    SigV4 headers are accepted but not verified. Setting outage_status (e.g.
+    503) answers every request with that status until it is reset to None.
+    Use as a context manager; the base URL to put in HEALTHLAKE_ENDPOINT is
+    `endpoint`.
+    """
+
+    def __init__(self, latency_s: float = 0.0):
+        self.latency_s = latency_s
+        self.resources: dict[str, dict[str, dict]] = {}
+        self.requests: dict[str, int] = {}
+        self.outage_status: int | None = None
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def _count(self, kind: str):
+        with self._lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+    def _create(self, resource: dict, resource_id: str | None = None) -> dict:
+        resource = dict(resource)
+        resource["id"] = resource_id or str(uuid.uuid4())
+        resource["meta"] = {**resource.get("meta", {}), "versionId": "1"}
+        with self._lock:
+            self.resources.setdefault(resource["resourceType"], {})[resource["id"]] = resource
+        return resource
+
+    def _matching(self, resource_type: str, query: dict) -> list[dict]:
+        with self._lock:
+            matches = list(self.resources.get(resource_type, {}).values())
+        if "identifier" in query:
+            value = query["identifier"][0].split("|")[-1]
+            matches = [r for r in matches if any(i.get("value") == value for i in r.get("identifier", []))]
+        if "family" in query:
+            family = query["family"][0].lower()
+            matches = [r for r in matches if any(n.get("family", "").lower().startswith(family) for n in r.get("name", []))]
+        return matches
+
+    def _update(self, url: str, resource: dict) -> tuple[int, dict]:
+        """PUT by id (update-as-create) or conditional update; returns (status, resource)."""
+        from urllib.parse import parse_qs
+
+        path, _, query = url.partition("?")
+        resource_type = path.strip("/").split("/")[0]
+        if query:
+            matches = self._matching(resource_type, parse_qs(query))
+            if len(matches) > 1:
+                return 412, {"resourceType": "OperationOutcome", "issue": [{"code": "multiple-matches"}]}
+            resource_id = matches[0]["id"] if matches else None
+        else:
+            resource_id = path.strip("/").split("/")[1]
+
+        existing = self.resources.get(resource_type, {}).get(resource_id) if resource_id else None
+        res = self._create(resource, resource_id)
+        if existing:
+            res["meta"]["versionId"] = str(int(existing["meta"]["versionId"]) + 1)
+            return 200, res
+        return 201, res
+
+    def _bundle(self, bundle: dict) -> dict:
+        # Resolve urn:uuid references inside a transaction the way the server would
+        created = {}
+        out = []
+        for entry in bundle.get("entry", []):
+            request = entry.get("request", {})
+            text = json.dumps(entry["resource"])
+            for urn, ref in created.items():
+                text = text.replace(urn, ref)
+            if request.get("method") == "PUT":
+                status, res = self._update(request["url"], json.loads(text))
+            else:
+                status, res = 201, self._create(json.loads(text))
+            if status >= 400:
+                out.append({"response": {"status": f"{status} Precondition Failed", "outcome": res}})
+                continue
+            ref = f"{res['resourceType']}/{res['id']}"
+            if entry.get("fullUrl"):
+                created[entry["fullUrl"]] = ref
+            reason = "OK" if status == 200 else "Created"
+            out.append({"response": {"status": f"{status} {reason}",
+                                     "location": f"{ref}/_history/{res['meta']['versionId']}"}})
+        return {"resourceType": "Bundle", "type": f"{bundle.get('type')}-response", "entry": out}
+
+    def _search(self, resource_type: str, query: dict, self_url: str = "") -> dict:
+        """Paged searchset; the `next` link carries the offset in a `page` token like HealthLake's."""
+        from urllib.parse import urlencode
+
+        matches = self._matching(resource_type, query)
+        count = int(query.get("_count", ["20"])[0])
+        offset = int(query.get("page", ["0"])[0])
+        bundle = {
+            "resourceType": "Bundle",
+            "type": "searchset",
+            "total": len(matches),
+            "link": [{"relation": "self", "url": self_url}],
+            "entry": [{"resource": r} for r in matches[offset:offset + count]],
+        }
+        if offset + count < len(matches):
+            params = {k: v[0] for k, v in query.items() if k != "page"}
+            params["page"] = str(offset + count)
+            bundle["link"].append({"relation": "next", "url": f"{self_url.split('?')[0]}?{urlencode(params)}"})
+        return bundle
+
+    def __enter__(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import parse_qs, urlsplit
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status: int, body: dict):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/fhir+json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _outage(self) -> bool:
+                if fake.outage_status is None:
+                    return False
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                fake._count("unavailable")
+                self._reply(fake.outage_status, {"resourceType": "OperationOutcome"})
+                return True
+
+            def _route(self):
+                parts = urlsplit(self.path)
+                # /datastore/{id}/r4/{type}[/{id}]
+                segments = parts.path.split("/r4", 1)[-1].strip("/").split("/")
+                return [s for s in segments if s], parse_qs(parts.query)
+
+            def do_POST(self):
+                if fake.latency_s:
+                    time.sleep(fake.latency_s)
+                if self._outage():
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                segments, _ = self._route()
+                if not segments:
+                    fake._count("bundle")
+                    self._reply(200, fake._bundle(body))
+                else:
+                    fake._count("create")
+                    self._reply(201, fake._create(body))
+
+            def do_PUT(self):
+                if fake.latency_s:
+                    time.sleep(fake.latency_s)
+                if self._outage():
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                fake._count("update")
+                self._reply(*fake._update(self.path.split("/r4", 1)[-1], body))
+
+            def do_GET(self):
+                if fake.latency_s:
+                    time.sleep(fake.latency_s)
+                if self._outage():
+                    return
+                segments, query = self._route()
+                if len(segments) == 1:
+                    fake._count("search")
+                    self._reply(200, fake._search(segments[0], query, fake.endpoint + self.path))
+                    return
+                fake._count("read")
+                resource = fake.resources.get(segments[0], {}).get(segments[1])
+                if resource is None:
+                    self._reply(404, {"resourceType": "OperationOutcome"})
+                else:
+                    self._reply(200, resource)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
@@ -7,6 +7,11 @@ data "archive_file" "patient_query_zip" {
   output_path = "${path.module}/lambda_zips/patient_query.zip"
 }
 
+resource "random_password" "patient_query_cursor_key" {
+  length  = 48
+  special = false
+}
+
 resource "aws_lambda_function" "patient_query" {
   filename         = data.archive_file.patient_query_zip.output_path
   function_name    = "patient-query-${var.env}"
@@ -15,10 +20,13 @@ resource "aws_lambda_function" "patient_query" {
   source_code_hash = data.archive_file.patient_query_zip.output_base64sha256
   runtime          = "python3.11"
   timeout          = 30
+  layers           = [aws_lambda_layer_version.common.arn]
 
   environment {
     variables = {
-      HEALTHLAKE_ID = awscc_healthlake_fhir_datastore.store.datastore_id
+      HEALTHLAKE_ID            = awscc_healthlake_fhir_datastore.store.datastore_id
+      BUCKET_NAME              = aws_s3_bucket.data_lake.id
+      PATIENT_QUERY_CURSOR_KEY = random_password.patient_query_cursor_key.result
     }
   }
 }
@@ -38,6 +46,12 @@ resource "aws_apigatewayv2_route" "patients_route" {
   target    = "integrations/${aws_apigatewayv2_integration.patient_query_integration.id}"
 }
 
+resource "aws_apigatewayv2_route" "patients_export_route" {
+  api_id    = aws_apigatewayv2_api.http_api.id
+  route_key = "GET /patients/export"
+  target    = "integrations/${aws_apigatewayv2_integration.patient_query_integration.id}"
+}
+
 resource "aws_apigatewayv2_route" "patient_by_id_route" {
   api_id    = aws_apigatewayv2_api.http_api.id
   route_key = "GET /patients/{id}"
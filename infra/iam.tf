@@ -21,6 +21,23 @@ resource "aws_iam_role_policy" "sfn_policy" {
           aws_lambda_function.bedrock_guardrail.arn,
           aws_lambda_function.fhir_ingest.arn
         ]
+      },
+      {
+        # ParallelAnalysis is a Distributed Map: it reads the splitter's items from S3
+        # and runs each batch of iterations as a child execution of this state machine
+        Effect = "Allow",
+        Action = ["s3:GetObject"],
+        Resource = ["${aws_s3_bucket.data_lake.arn}/temp/results/*"]
+      },
+      {
+        Effect = "Allow",
+        Action = ["states:StartExecution"],
+        Resource = [aws_sfn_state_machine.pipeline.arn]
+      },
+      {
+        Effect = "Allow",
+        Action = ["states:DescribeExecution", "states:StopExecution"],
+        Resource = ["arn:aws:states:${var.aws_region}:${data.aws_caller_identity.current.account_id}:execution:${aws_sfn_state_machine.pipeline.name}/*"]
       }
     ]
   })
@@ -65,14 +82,30 @@ resource "aws_iam_role_policy" "lambda_policy" {
     Statement = [
       {
         Effect = "Allow",
-        Action = ["s3:GetObject", "s3:PutObject", "s3:ListBucket", "s3:HeadObject"],
+        Action = ["s3:GetObject", "s3:PutObject", "s3:ListBucket", "s3:HeadObject", "s3:AbortMultipartUpload"],
         Resource = ["${aws_s3_bucket.data_lake.arn}", "${aws_s3_bucket.data_lake.arn}/*"]
       },
+      {
+        # mime_extractor releases an attachment-ledger claim when its upload fails
+        Effect = "Allow",
+        Action = ["s3:DeleteObject"],
+        Resource = ["${aws_s3_bucket.data_lake.arn}/ledger/attachments/*"]
+      },
       {
         Effect = "Allow",
         Action = ["textract:*", "bedrock:InvokeModel", "healthlake:CreateResource", "healthlake:SearchWithGet", "healthlake:ReadResource", "healthlake:UpdateResource"],
         Resource = "*"
       },
+      {
+        Effect = "Allow",
+        Action = ["states:SendTaskSuccess", "states:SendTaskFailure"],
+        Resource = "*"
+      },
+      {
+        Effect = "Allow",
+        Action = ["iam:PassRole"],
+        Resource = [aws_iam_role.textract_publish_role.arn]
+      },
       {
         Effect = "Allow",
         Action = ["logs:CreateLogGroup", "logs:CreateLogStream", "logs:PutLogEvents"],
@@ -81,3 +114,26 @@ resource "aws_iam_role_policy" "lambda_policy" {
     ]
   })
 }
+
+# --- IAM Role Textract assumes to publish job completion to SNS ---
+resource "aws_iam_role" "textract_publish_role" {
+  name = "textract-sns-publish-role-${var.env}"
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [{ Action = "sts:AssumeRole", Effect = "Allow", Principal = { Service = "textract.amazonaws.com" } }]
+  })
+}
+
+resource "aws_iam_role_policy" "textract_publish_policy" {
+  role = aws_iam_role.textract_publish_role.id
+  policy = jsonencode({
+    Version = "2012-10-17",
+    Statement = [
+      {
+        Effect = "Allow",
+        Action = ["sns:Publish"],
+        Resource = [aws_sns_topic.textract_completion.arn]
+      }
+    ]
+  })
+}
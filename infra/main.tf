@@ -55,6 +55,98 @@ resource "aws_s3_bucket_policy" "allow_ses_put_raw_email" {
   })
 }
 
+# Bounds the size of the guardrail result cache (entries also carry their own TTL)
+resource "aws_s3_bucket_lifecycle_configuration" "data_lake" {
+  bucket = aws_s3_bucket.data_lake.id
+
+  rule {
+    id     = "expire-guardrail-result-cache"
+    status = "Enabled"
+    filter {
+      prefix = "cache/guardrail/"
+    }
+    expiration {
+      days = 7
+    }
+  }
+
+  rule {
+    id     = "expire-chunk-results"
+    status = "Enabled"
+    filter {
+      prefix = "temp/results/"
+    }
+    expiration {
+      days = 1
+    }
+  }
+
+  # Task tokens and completion markers; AwaitTextract gives up on a token after an hour
+  rule {
+    id     = "expire-textract-callbacks"
+    status = "Enabled"
+    filter {
+      prefix = "temp/textract_callbacks/"
+    }
+    expiration {
+      days = 1
+    }
+  }
+
+  # content_splitter aborts its packed upload on failure; this catches a Lambda killed mid-upload
+  rule {
+    id     = "abort-incomplete-chunk-uploads"
+    status = "Enabled"
+    filter {
+      prefix = "temp/chunks/"
+    }
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 1
+    }
+  }
+
+  # Checkpoint entries expire after CHECKPOINT_TTL_SECONDS (7 days); this removes them a day later
+  rule {
+    id     = "expire-stage-checkpoints"
+    status = "Enabled"
+    filter {
+      prefix = "checkpoints/"
+    }
+    expiration {
+      days = 8
+    }
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 1
+    }
+  }
+
+  # Attachment ledger claims and duplicate records: the dedup window (ATTACHMENT_LEDGER_RETENTION_DAYS)
+  rule {
+    id     = "expire-attachment-ledger"
+    status = "Enabled"
+    filter {
+      prefix = "ledger/attachments/"
+    }
+    expiration {
+      days = 30
+    }
+  }
+
+  rule {
+    id     = "expire-patient-exports"
+    status = "Enabled"
+    filter {
+      prefix = "exports/patients/"
+    }
+    expiration {
+      days = 1
+    }
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 1
+    }
+  }
+}
+
 resource "random_id" "suffix" { byte_length = 4 }
 
 # Enable EventBridge Notifications
@@ -147,10 +239,20 @@ resource "aws_lambda_function" "mime_extractor" {
   handler          = "handler.lambda_handler"
   source_code_hash = data.archive_file.mime_extractor_zip.output_base64sha256
   runtime          = "python3.11"
-  timeout          = 60
+  timeout          = 300
+  memory_size      = 512
+  layers           = [aws_lambda_layer_version.common.arn]
+
+  # Large attachments spool to /tmp while they upload
+  ephemeral_storage {
+    size = 2048
+  }
+
   environment {
     variables = {
-      BUCKET_NAME = aws_s3_bucket.data_lake.id
+      BUCKET_NAME               = aws_s3_bucket.data_lake.id
+      MIME_PARSE_MODE           = "streaming"
+      ATTACHMENT_LEDGER_BACKEND = "s3"
     }
   }
 }
@@ -178,6 +280,38 @@ resource "aws_lambda_function" "document_router" {
   source_code_hash = data.archive_file.document_router_zip.output_base64sha256
   runtime          = "python3.11"
   timeout          = 60
+  layers           = [aws_lambda_layer_version.common.arn]
+  environment {
+    variables = {
+      BUCKET_NAME              = aws_s3_bucket.data_lake.id
+      PDF_TEXT_DETECTION       = "on"
+      TEXTRACT_COMPLETION_MODE = "CALLBACK"
+      TEXTRACT_SNS_TOPIC_ARN   = aws_sns_topic.textract_completion.arn
+      TEXTRACT_ROLE_ARN        = aws_iam_role.textract_publish_role.arn
+    }
+  }
+}
+
+# Textract Completion Callback (SNS -> SendTaskSuccess)
+resource "aws_sns_topic" "textract_completion" {
+  name = "textract-completion-${var.env}"
+}
+
+data "archive_file" "textract_callback_zip" {
+  type        = "zip"
+  source_dir  = "${path.module}/../src/functions/textract_callback"
+  output_path = "${path.module}/lambda_zips/textract_callback.zip"
+}
+
+resource "aws_lambda_function" "textract_callback" {
+  filename         = data.archive_file.textract_callback_zip.output_path
+  function_name    = "textract-callback-${var.env}"
+  role             = aws_iam_role.lambda_role.arn
+  handler          = "handler.lambda_handler"
+  source_code_hash = data.archive_file.textract_callback_zip.output_base64sha256
+  runtime          = "python3.11"
+  timeout          = 30
+  layers           = [aws_lambda_layer_version.common.arn]
   environment {
     variables = {
       BUCKET_NAME = aws_s3_bucket.data_lake.id
@@ -185,6 +319,21 @@ resource "aws_lambda_function" "document_router" {
   }
 }
 
+resource "aws_lambda_permission" "sns_invoke_textract_callback" {
+  statement_id  = "AllowSNSInvoke"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.textract_callback.function_name
+  principal     = "sns.amazonaws.com"
+  source_arn    = aws_sns_topic.textract_completion.arn
+}
+
+resource "aws_sns_topic_subscription" "textract_callback_trigger" {
+  topic_arn  = aws_sns_topic.textract_completion.arn
+  protocol   = "lambda"
+  endpoint   = aws_lambda_function.textract_callback.arn
+  depends_on = [aws_lambda_permission.sns_invoke_textract_callback]
+}
+
 # Content Splitter
 data "archive_file" "content_splitter_zip" {
   type        = "zip"
@@ -200,10 +349,17 @@ resource "aws_lambda_function" "content_splitter" {
   source_code_hash = data.archive_file.content_splitter_zip.output_base64sha256
   runtime          = "python3.11"
   timeout          = 300
-  layers = ["arn:aws:lambda:us-east-1:336392948345:layer:AWSSDKPandas-Python311:12"]
+  layers = [
+    "arn:aws:lambda:us-east-1:336392948345:layer:AWSSDKPandas-Python311:12",
+    aws_lambda_layer_version.common.arn,
+  ]
   environment {
     variables = {
-      BUCKET_NAME = aws_s3_bucket.data_lake.id
+      BUCKET_NAME         = aws_s3_bucket.data_lake.id
+      SPLIT_MODE          = "streaming"
+      CHUNK_STORE_MODE    = "packed"
+      CHUNK_STRATEGY      = "boundary"
+      CHUNK_TARGET_TOKENS = "3000"
     }
   }
 }
@@ -223,14 +379,31 @@ resource "aws_lambda_function" "bedrock_guardrail" {
   source_code_hash = data.archive_file.bedrock_guardrail_zip.output_base64sha256
   runtime          = "python3.11"
   timeout          = 120
+  layers           = [aws_lambda_layer_version.common.arn]
   environment {
     variables = {
-      BUCKET_NAME      = aws_s3_bucket.data_lake.id
-      BEDROCK_MODEL_ID = var.bedrock_model_id
+      BUCKET_NAME          = aws_s3_bucket.data_lake.id
+      BEDROCK_MODEL_ID     = var.bedrock_model_id
+      RESULT_CACHE_BACKEND = "s3"
+      PRECLASSIFIER_MODE   = "on"
     }
   }
 }
 
+# Shared code layer (healthtech_common): HealthLake client, PDF text layer, EMF metrics, instrumentation
+data "archive_file" "common_layer_zip" {
+  type        = "zip"
+  source_dir  = "${path.module}/../src/layers/common"
+  output_path = "${path.module}/lambda_zips/common_layer.zip"
+}
+
+resource "aws_lambda_layer_version" "common" {
+  filename            = data.archive_file.common_layer_zip.output_path
+  layer_name          = "healthtech-common-${var.env}"
+  source_code_hash    = data.archive_file.common_layer_zip.output_base64sha256
+  compatible_runtimes = ["python3.11"]
+}
+
 # FHIR Ingest (UPDATED TO USE AWSCC)
 data "archive_file" "fhir_ingest_zip" {
   type        = "zip"
@@ -246,14 +419,20 @@ resource "aws_lambda_function" "fhir_ingest" {
   source_code_hash = data.archive_file.fhir_ingest_zip.output_base64sha256
   runtime          = "python3.11"
   timeout          = 120
+  layers           = [aws_lambda_layer_version.common.arn]
 
   environment {
     variables = {
-      BUCKET_NAME        = aws_s3_bucket.data_lake.id
+      BUCKET_NAME               = aws_s3_bucket.data_lake.id
       # UPDATED REFERENCES for AWSCC:
-      HEALTHLAKE_DS_ID   = awscc_healthlake_fhir_datastore.store.datastore_id
-      HEALTHLAKE_DS_ARN  = awscc_healthlake_fhir_datastore.store.datastore_arn
-      HEALTHLAKE_ID      = awscc_healthlake_fhir_datastore.store.datastore_id
+      HEALTHLAKE_DS_ID          = awscc_healthlake_fhir_datastore.store.datastore_id
+      HEALTHLAKE_DS_ARN         = awscc_healthlake_fhir_datastore.store.datastore_arn
+      HEALTHLAKE_ID             = awscc_healthlake_fhir_datastore.store.datastore_id
+      FHIR_WRITE_MODE           = "bundle"
+      FHIR_UPSERT_MODE          = "conditional"
+      PATIENT_INDEX_BACKEND     = "s3"
+      # Records each email attachment's outcome on mime_extractor's ledger claim
+      ATTACHMENT_LEDGER_BACKEND = "s3"
     }
   }
 }
@@ -273,6 +452,7 @@ resource "aws_lambda_function" "get_presigned_url" {
   source_code_hash = data.archive_file.get_presigned_url_zip.output_base64sha256
   runtime          = "python3.11"
   timeout          = 30
+  layers           = [aws_lambda_layer_version.common.arn]
   environment {
     variables = {
       BUCKET_NAME = aws_s3_bucket.data_lake.id
@@ -0,0 +1,39 @@
+"""
+Token-budget packing for batched guardrail requests.
+
+Token counts are estimated (~4 characters per token for English clinical text),
+which is close enough to keep a batch comfortably inside the model's context
+and output limits without shipping a tokenizer in the Lambda.
+"""
+
+CHARS_PER_TOKEN = 4
+
+# Per-chunk wrapper text in the batch prompt (<chunk id="n"> ... </chunk>)
+CHUNK_OVERHEAD_TOKENS = 16
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def pack_by_token_budget(items: list, token_budget: int, max_items: int, size_fn) -> list[list]:
+    """
+    Greedily group items, in order, so each group stays within token_budget and
+    max_items. An item larger than the budget on its own gets a group to itself.
+    """
+    packs = []
+    current = []
+    used = 0
+
+    for item in items:
+        cost = size_fn(item) + CHUNK_OVERHEAD_TOKENS
+        if current and (used + cost > token_budget or len(current) >= max_items):
+            packs.append(current)
+            current = []
+            used = 0
+        current.append(item)
+        used += cost
+
+    if current:
+        packs.append(current)
+    return packs
@@ -0,0 +1,175 @@
+"""
+Retry, path memory and circuit breaking around the bedrock-runtime client.
+
+- Throttling / transient service errors are retried here with full-jitter
+  exponential backoff, instead of being treated as "this API path failed".
+- Path memory records, per model and per container, whether Converse tool use
+  and prompt-cache checkpoints work, so warm invocations stop paying for a
+  call that is known to fail.
+- The circuit breaker opens after consecutive transient failures and fails
+  fast until a cool-down passes, so a Bedrock outage does not hold 20 Map
+  iterations in backoff loops; Step Functions retries the state instead.
+  After the cool-down one probe call goes through; the rest still fail fast
+  until it succeeds (close) or fails (re-open).
+"""
+import logging
+import random
+import re
+import threading
+import time
+
+from botocore.exceptions import ClientError
+from healthtech_common.instrumentation import phase, record_count
+
+logger = logging.getLogger()
+
+THROTTLING_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceQuotaExceededException",
+}
+
+TRANSIENT_CODES = THROTTLING_CODES | {
+    "ServiceUnavailableException",
+    "InternalServerException",
+    "ModelNotReadyException",
+    "ModelTimeoutException",
+}
+
+
+class BedrockThrottledError(Exception):
+    """Transient Bedrock errors persisted through every retry."""
+
+
+class CircuitOpenError(Exception):
+    """Bedrock has been failing; calls are short-circuited until the cool-down passes."""
+
+
+# ValidationException messages that mean the model cannot do Converse tool use at all
+TOOL_USE_UNSUPPORTED = re.compile(r"\btool(?:Config|Choice|Spec|s|\s+use)?\b", re.IGNORECASE)
+
+
+def error_code(e: ClientError) -> str:
+    return e.response.get("Error", {}).get("Code", "")
+
+
+def tool_use_unsupported(e: ClientError) -> bool:
+    """True if the error says the model rejects tool use, rather than this one request."""
+    return error_code(e) == "ValidationException" and bool(
+        TOOL_USE_UNSUPPORTED.search(e.response.get("Error", {}).get("Message", "")))
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 8, reset_timeout_s: float = 30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.clock = clock
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at >= self.reset_timeout_s:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "open" or self._probe_in_flight:
+                return False
+            # Half-open: this caller is the probe
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._probe_in_flight = False
+            self.consecutive_failures = 0
+            self.opened_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._probe_in_flight = False
+            self.consecutive_failures += 1
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                # (Re)open: a failed half-open probe restarts the cool-down
+                self.opened_at = self.clock()
+
+    def release(self) -> None:
+        """The call ended without saying whether Bedrock is healthy (e.g. a bad request); let another probe through."""
+        with self._lock:
+            self._probe_in_flight = False
+
+
+class GuardrailBedrockClient:
+    def __init__(self, client, max_attempts: int = 5, base_delay_s: float = 0.5, max_delay_s: float = 20.0,
+                 breaker: CircuitBreaker | None = None, sleep=time.sleep):
+        self.client = client
+        self.max_attempts = max_attempts
+        self.base_delay_s = base_delay_s
+        self.max_delay_s = max_delay_s
+        self.breaker = breaker or CircuitBreaker()
+        self.sleep = sleep
+        self.converse_tool_support: dict[str, bool] = {}
+        self.prompt_cache_support: dict[str, bool] = {}
+        self.stats = {"calls": 0, "throttled": 0, "retries": 0, "short_circuited": 0}
+
+    def call(self, operation: str, **kwargs):
+        """Invoke client.<operation>, retrying transient errors with full-jitter backoff."""
+        for attempt in range(self.max_attempts):
+            if not self.breaker.allow():
+                self.stats["short_circuited"] += 1
+                raise CircuitOpenError(f"Bedrock circuit open; skipping {operation}")
+
+            self.stats["calls"] += 1
+            try:
+                with phase("ModelCall"):
+                    resp = getattr(self.client, operation)(**kwargs)
+            except ClientError as e:
+                code = error_code(e)
+                if code not in TRANSIENT_CODES:
+                    self.breaker.release()
+                    raise
+                self.stats["throttled"] += 1
+                record_count("ModelThrottles")
+                self.breaker.record_failure()
+                if attempt == self.max_attempts - 1:
+                    raise BedrockThrottledError(f"{operation} failed after {self.max_attempts} attempts: {code}") from e
+
+                delay = random.uniform(0, min(self.max_delay_s, self.base_delay_s * (2 ** attempt)))
+                logger.warning("Bedrock %s %s (attempt %d/%d), retrying in %.2fs",
+                               operation, code, attempt + 1, self.max_attempts, delay)
+                self.stats["retries"] += 1
+                with phase("ModelBackoff"):
+                    self.sleep(delay)
+                continue
+            except Exception:
+                self.breaker.release()
+                raise
+
+            self.breaker.record_success()
+            return resp
+
+    def converse_supported(self, model_id: str) -> bool:
+        """Unknown models are tried; models known to fail go straight to invoke_model."""
+        return hasattr(self.client, "converse") and self.converse_tool_support.get(model_id, True)
+
+    def remember_converse(self, model_id: str, supported: bool) -> None:
+        if self.converse_tool_support.get(model_id) != supported:
+            logger.info("Converse tool use %s for model %s", "available" if supported else "unavailable", model_id)
+        self.converse_tool_support[model_id] = supported
+
+    def prompt_cache_supported(self, model_id: str) -> bool:
+        return self.prompt_cache_support.get(model_id, True)
+
+    def remember_prompt_cache(self, model_id: str, supported: bool) -> None:
+        if self.prompt_cache_support.get(model_id) != supported:
+            logger.info("Prompt caching %s for model %s", "available" if supported else "unavailable", model_id)
+        self.prompt_cache_support[model_id] = supported
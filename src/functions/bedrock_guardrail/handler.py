@@ -1,20 +1,75 @@
-import boto3
+import copy
 import json
 import os
 import re
 import logging
 from botocore.exceptions import ClientError
 
+from batching import estimate_tokens, pack_by_token_budget
+from bedrock_client import (BedrockThrottledError, CircuitBreaker, CircuitOpenError, GuardrailBedrockClient, error_code,
+                            tool_use_unsupported)
+from healthtech_common.checkpoints import build_checkpoint_store
+from healthtech_common.clients import lazy_client
+from healthtech_common.instrumentation import instrumented, phase, record_bytes, record_count, record_tokens
+from preclassifier import PreclassifierConfig, preclassify
+from result_cache import build_result_cache, cache_key
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Reuse clients across invocations
-s3 = boto3.client("s3")
-bedrock = boto3.client("bedrock-runtime")
-
-
-def _build_prompt(text_content: str) -> str:
-    return f"""
+# Built on first use and reused across invocations; pre-classified or cached chunks never build bedrock
+s3 = lazy_client("s3")
+# Retries are owned by GuardrailBedrockClient, so botocore's own retry loop is disabled
+bedrock = lazy_client("bedrock-runtime", config={"retries": {"max_attempts": 1, "mode": "standard"}})
+bedrock_client = GuardrailBedrockClient(
+    bedrock,
+    max_attempts=int(os.environ.get("BEDROCK_MAX_ATTEMPTS", "5")),
+    base_delay_s=float(os.environ.get("BEDROCK_BACKOFF_BASE_S", "0.5")),
+    max_delay_s=float(os.environ.get("BEDROCK_BACKOFF_MAX_S", "20")),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.environ.get("BEDROCK_CIRCUIT_THRESHOLD", "8")),
+        reset_timeout_s=float(os.environ.get("BEDROCK_CIRCUIT_RESET_S", "30")),
+    ),
+)
+
+# Bump whenever the system prompts, _build_prompt or the tool schema change; it is part of every cache key
+PROMPT_VERSION = "audit-v2"
+
+# on: end the static prompt prefix with a Bedrock prompt-cache checkpoint; off (default): plain
+# requests. Off until the prefix reaches the minimum: Bedrock ignores shorter checkpoints, and
+# models without caching (e.g. the default Claude 3.5 Sonnet v1) reject them.
+PROMPT_CACHE_MODE = os.environ.get("BEDROCK_PROMPT_CACHE", "off")
+# Bedrock only caches prefixes of at least this many tokens (1024 for most Claude models);
+# shorter prefixes are sent without a checkpoint even when caching is on
+PROMPT_CACHE_MIN_TOKENS = int(os.environ.get("BEDROCK_PROMPT_CACHE_MIN_TOKENS", "1024"))
+
+# on: short-circuit obvious NOISE / LEGAL_APPENDIX chunks; shadow: score and log only; off
+PRECLASSIFIER_MODE = os.environ.get("PRECLASSIFIER_MODE", "on")
+PRECLASSIFIER_CONFIG = PreclassifierConfig.from_env()
+
+# Batched Map items ({"batch": [...]}) are packed into requests of at most this many
+# estimated input tokens / chunks
+BATCH_TOKEN_BUDGET = int(os.environ.get("BATCH_TOKEN_BUDGET", "12000"))
+BATCH_MAX_CHUNKS = int(os.environ.get("BATCH_MAX_CHUNKS", "8"))
+BATCH_OUTPUT_TOKENS_PER_CHUNK = 400
+
+# Lives for the container lifetime so warm invocations share the memory tier
+result_cache = build_result_cache(
+    os.environ.get("RESULT_CACHE_BACKEND", "memory"),
+    s3=s3,
+    bucket=os.environ.get("BUCKET_NAME"),
+    prefix=os.environ.get("RESULT_CACHE_PREFIX", "cache/guardrail"),
+    table_name=os.environ.get("RESULT_CACHE_TABLE"),
+    ttl_seconds=int(os.environ.get("RESULT_CACHE_TTL_SECONDS", "604800")),
+    max_entries=int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "1024")),
+)
+
+# Per-chunk results of the document's earlier runs (keyed by document hash and chunk),
+# so a re-run only sends the model the chunks that never got a result
+checkpoints = build_checkpoint_store(s3, os.environ.get("BUCKET_NAME"))
+
+
+_AUDIT_TASKS = """
 You are a Medical Data Compliance Auditor.
 
 TASK 1: CLASSIFY
@@ -33,10 +88,23 @@ If VALID, extract:
 - Gender (male|female|other|unknown)
 - Vitals (free-text summary)
 - Medications (free-text list)
+""".strip()
+
 
+_OUTPUT_RULES = """
 OUTPUT RULES (VERY IMPORTANT):
 - Output ONLY a single JSON object.
 - No markdown, no ``` fences, no commentary, no extra keys.
+""".strip()
+
+# Static prompt prefixes: identical for every chunk, so they go in the system prompt ahead
+# of a prompt-cache checkpoint and only the user message (the INPUT) varies per call
+SYSTEM_PROMPT = f"""
+{_AUDIT_TASKS}
+
+The user message holds the INPUT text.
+
+{_OUTPUT_RULES}
 
 Required JSON schema:
 {{
@@ -50,12 +118,45 @@ Required JSON schema:
     "Medications": "string|<UNKNOWN>"
   }}
 }}
+""".strip()
+
+BATCH_SYSTEM_PROMPT = f"""
+{_AUDIT_TASKS}
 
-INPUT:
-{text_content}
+The user message holds the INPUT: separate excerpts, each wrapped in <chunk id="N"> tags.
+Apply TASK 1 and TASK 2 to EVERY chunk independently and return exactly one result per chunk id.
+
+{_OUTPUT_RULES}
+
+Required JSON schema:
+{{
+  "results": [
+    {{
+      "chunk_id": <integer id from the chunk tag>,
+      "classification": "VALID" | "INVALID",
+      "reason": "explanation",
+      "entities": {{
+        "PatientName": "string|<UNKNOWN>",
+        "PatientIdentifier": "string|<UNKNOWN>",
+        "Gender": "male|female|other|unknown",
+        "Vitals": "string|<UNKNOWN>",
+        "Medications": "string|<UNKNOWN>"
+      }}
+    }}
+  ]
+}}
 """.strip()
 
 
+def _build_prompt(text_content: str) -> str:
+    return f"INPUT:\n{text_content}"
+
+
+def _build_batch_prompt(chunks: list[tuple[int, str]]) -> str:
+    inputs = "\n\n".join(f'<chunk id="{chunk_id}">\n{text}\n</chunk>' for chunk_id, text in chunks)
+    return f"INPUT ({len(chunks)} chunks):\n{inputs}"
+
+
 def _extract_all_text_blocks(bedrock_result: dict) -> str:
     parts = []
     for block in bedrock_result.get("content", []):
@@ -106,11 +207,94 @@ def _normalize_entities(payload: dict) -> dict:
     return payload
 
 
-def _try_converse_tool_output(model_id: str, prompt: str) -> dict | None:
+AUDIT_RESULT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "classification": {"type": "string", "enum": ["VALID", "INVALID"]},
+        "reason": {"type": "string"},
+        "entities": {
+            "type": "object",
+            "properties": {
+                "PatientName": {"type": "string"},
+                "PatientIdentifier": {"type": "string"},
+                "Gender": {"type": "string"},
+                "Vitals": {"type": "string"},
+                "Medications": {"type": "string"},
+            },
+            "required": ["PatientName", "PatientIdentifier", "Gender", "Vitals", "Medications"],
+        },
+    },
+    "required": ["classification", "reason", "entities"],
+}
+
+BATCH_RESULT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "results": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"chunk_id": {"type": "integer"}, **AUDIT_RESULT_SCHEMA["properties"]},
+                "required": ["chunk_id", *AUDIT_RESULT_SCHEMA["required"]],
+            },
+        }
+    },
+    "required": ["results"],
+}
+
+
+def _converse_system(system: str, cache: bool) -> list[dict]:
+    # The checkpoint closes the cacheable prefix: tool config, then this system prompt
+    return [{"text": system}, {"cachePoint": {"type": "default"}}] if cache else [{"text": system}]
+
+
+def _anthropic_system(system: str, cache: bool) -> list[dict]:
+    block = {"type": "text", "text": system}
+    if cache:
+        block["cache_control"] = {"type": "ephemeral"}
+    return [block]
+
+
+def _is_cache_rejection(e: ClientError) -> bool:
+    """A ValidationException about the cache checkpoint, not about the rest of the request (e.g. tool use)."""
+    message = e.response.get("Error", {}).get("Message", "")
+    return error_code(e) == "ValidationException" and "cach" in message.lower()
+
+
+def _call_with_prompt_cache(model_id: str, operation: str, build_request, prefix: str):
+    """
+    bedrock_client.call(operation, **build_request(cache)), with cache checkpoints
+    when caching is on, the static prefix is long enough for Bedrock to cache and
+    the model is not known to reject them. A model whose ValidationException names
+    the cache checkpoint is remembered and asked without them from then on.
+    """
+    cache = (PROMPT_CACHE_MODE == "on" and estimate_tokens(prefix) >= PROMPT_CACHE_MIN_TOKENS
+             and bedrock_client.prompt_cache_supported(model_id))
+    try:
+        return bedrock_client.call(operation, **build_request(cache))
+    except ClientError as e:
+        if not cache or not _is_cache_rejection(e):
+            raise
+        resp = bedrock_client.call(operation, **build_request(False))
+        bedrock_client.remember_prompt_cache(model_id, False)
+        return resp
+
+
+def _record_usage(usage: dict | None) -> None:
+    tokens = record_tokens(usage)
+    # Token counts only; the prompt itself is PHI
+    logger.info("Model usage input=%d cache_read=%d cache_write=%d output=%d",
+                tokens["InputTokens"], tokens["CacheReadInputTokens"],
+                tokens["CacheWriteInputTokens"], tokens["OutputTokens"])
+
+
+def _try_converse_tool_output(model_id: str, system: str, prompt: str, input_schema: dict = AUDIT_RESULT_SCHEMA,
+                              max_tokens: int = 1000) -> dict | None:
     """
     Prefer structured output via Converse tool use (no JSON string parsing).
+    Throttling is retried inside bedrock_client and never triggers the invoke_model fallback.
     """
-    if not hasattr(bedrock, "converse"):
+    if not bedrock_client.converse_supported(model_id):
         return None
 
     tool_config = {
@@ -119,27 +303,7 @@ def _try_converse_tool_output(model_id: str, prompt: str) -> dict | None:
                 "toolSpec": {
                     "name": "audit_output",
                     "description": "Return the audit result as structured JSON.",
-                    "inputSchema": {
-                        "json": {
-                            "type": "object",
-                            "properties": {
-                                "classification": {"type": "string", "enum": ["VALID", "INVALID"]},
-                                "reason": {"type": "string"},
-                                "entities": {
-                                    "type": "object",
-                                    "properties": {
-                                        "PatientName": {"type": "string"},
-                                        "PatientIdentifier": {"type": "string"},
-                                        "Gender": {"type": "string"},
-                                        "Vitals": {"type": "string"},
-                                        "Medications": {"type": "string"},
-                                    },
-                                    "required": ["PatientName", "PatientIdentifier", "Gender", "Vitals", "Medications"],
-                                },
-                            },
-                            "required": ["classification", "reason", "entities"],
-                        }
-                    },
+                    "inputSchema": {"json": input_schema},
                 }
             }
         ],
@@ -147,13 +311,16 @@ def _try_converse_tool_output(model_id: str, prompt: str) -> dict | None:
     }
 
     try:
-        resp = bedrock.converse(
+        resp = _call_with_prompt_cache(model_id, "converse", lambda cache: dict(
             modelId=model_id,
+            system=_converse_system(system, cache),
             messages=[{"role": "user", "content": [{"text": prompt}]}],
             toolConfig=tool_config,
-            inferenceConfig={"maxTokens": 1000, "temperature": 0},
-        )
+            inferenceConfig={"maxTokens": max_tokens, "temperature": 0},
+        ), prefix=json.dumps(tool_config) + system)
 
+        bedrock_client.remember_converse(model_id, True)
+        _record_usage(resp.get("usage"))
         if resp.get("stopReason") != "tool_use":
             return None
 
@@ -167,52 +334,281 @@ def _try_converse_tool_output(model_id: str, prompt: str) -> dict | None:
 
     except ClientError as e:
         logger.warning("Converse tool-output call failed, falling back to invoke_model: %s", str(e))
+        # Only a model that rejects tool use stops trying Converse; anything else (access, one oversized
+        # chunk, a model not ready) falls back for this call alone
+        if tool_use_unsupported(e):
+            bedrock_client.remember_converse(model_id, False)
         return None
 
 
-def _invoke_model_text_output(model_id: str, prompt: str) -> dict:
-    body = json.dumps(
-        {
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 1000,
-            "temperature": 0,
-            "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
-        }
-    )
+def _invoke_model_text_output(model_id: str, system: str, prompt: str, max_tokens: int = 1000) -> dict:
+    def build_request(cache: bool) -> dict:
+        body = json.dumps(
+            {
+                "anthropic_version": "bedrock-2023-05-31",
+                "max_tokens": max_tokens,
+                "temperature": 0,
+                "system": _anthropic_system(system, cache),
+                "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
+            }
+        )
+        return {"modelId": model_id, "body": body}
 
-    resp = bedrock.invoke_model(modelId=model_id, body=body)
-    result = json.loads(resp["body"].read())
-    raw_text = _extract_all_text_blocks(result)
-    return _parse_json_from_text(raw_text)
+    resp = _call_with_prompt_cache(model_id, "invoke_model", build_request, prefix=system)
+    with phase("Parse"):
+        result = json.loads(resp["body"].read())
+        _record_usage(result.get("usage"))
+        raw_text = _extract_all_text_blocks(result)
+        return _parse_json_from_text(raw_text)
 
 
-def lambda_handler(event, context):
-    model_id = os.environ.get("BEDROCK_MODEL_ID", "anthropic.claude-3-5-sonnet-20240620-v1:0")
+def _read_chunk_text(event: dict) -> str:
+    """
+    Packed chunk stores put every chunk in one object; the Map item then carries
+    a [start, end) byte_range and only that slice is fetched.
+    """
+    get_kwargs = {"Bucket": event["s3_bucket"], "Key": event["s3_key"]}
+    byte_range = event.get("byte_range")
+    if byte_range:
+        start, end = byte_range
+        get_kwargs["Range"] = f"bytes={start}-{end - 1}"
+
+    with phase("S3Read"):
+        data = s3.get_object(**get_kwargs)["Body"].read()
+    record_bytes("S3Read", len(data))
+    return data.decode("utf-8")
+
+
+def _read_batch_texts(items: list[dict]) -> list[str]:
+    """
+    Chunks from a packed store that sit next to each other are fetched with one
+    ranged GET covering the whole batch, then sliced locally.
+    """
+    ranges = [item.get("byte_range") for item in items]
+    same_object = len({(item["s3_bucket"], item["s3_key"]) for item in items}) == 1
+    contiguous = all(ranges) and all(ranges[n][1] == ranges[n + 1][0] for n in range(len(ranges) - 1))
+
+    if not (same_object and contiguous):
+        return [_read_chunk_text(item) for item in items]
+
+    start, end = ranges[0][0], ranges[-1][1]
+    with phase("S3Read"):
+        obj = s3.get_object(Bucket=items[0]["s3_bucket"], Key=items[0]["s3_key"], Range=f"bytes={start}-{end - 1}")
+        data = obj["Body"].read()
+    record_bytes("S3Read", len(data))
+    return [data[a - start:b - start].decode("utf-8") for a, b in ranges]
+
+
+def _local_result(model_id: str, text_content: str) -> tuple[dict | None, str | None]:
+    """
+    Settle a chunk without the model where possible: pre-classifier first (pure CPU),
+    then the result cache. Returns (result or None, cache key for a later put).
+    """
+    with phase("Preclassify"):
+        precheck = preclassify(text_content, PRECLASSIFIER_CONFIG) if PRECLASSIFIER_MODE != "off" else None
+    if precheck is not None:
+        logger.info("Pre-classifier %s category=%s score=%s", PRECLASSIFIER_MODE, precheck["category"], json.dumps(precheck["preclassifier"]))
+        if PRECLASSIFIER_MODE == "on":
+            record_count("PreclassifiedChunks")
+            return precheck, None
+
+    if not result_cache:
+        return None, None
+
+    key = cache_key(text_content, model_id, PROMPT_VERSION)
+    with phase("CacheLookup"):
+        cached = result_cache.get(key)
+    record_count("CacheHits", cached is not None)
+    return (copy.deepcopy(cached) if cached is not None else None), key
+
+
+def _store_result(key: str | None, parsed_content: dict) -> None:
+    if result_cache and key:
+        result_cache.put(key, copy.deepcopy(parsed_content))
+
+
+def _result_checkpoint(item: dict) -> str:
+    return f"results/{item['chunk_set']}/{item['chunk_id']:06d}.json"
+
+
+def _checkpointed_result(item: dict, model_id: str) -> dict | None:
+    """The result an earlier run of this document stored for the chunk, if the model and prompt still match."""
+    if not checkpoints or not item.get("document_hash"):
+        return None
+    saved = checkpoints.get(item["document_hash"], _result_checkpoint(item))
+    if not saved or saved.get("model_id") != model_id or saved.get("prompt_version") != PROMPT_VERSION:
+        return None
+    record_count("CheckpointHits")
+    return saved["result"]
 
-    obj = s3.get_object(Bucket=event["s3_bucket"], Key=event["s3_key"])
-    text_content = obj["Body"].read().decode("utf-8")
 
-    # (Optional debug preview—remove in prod if PHI risk)
-    preview_head = text_content[:2000]
-    preview_tail = text_content[-2000:] if len(text_content) > 2000 else ""
-    logger.info("S3 input bucket=%s key=%s bytes=%d", event["s3_bucket"], event["s3_key"], len(text_content))
-    logger.info("S3 input HEAD(2000): %s", preview_head)
-    logger.info("S3 input TAIL(2000): %s", preview_tail)
+def _checkpoint_result(item: dict, model_id: str, parsed_content: dict) -> None:
+    if checkpoints and item.get("document_hash"):
+        checkpoints.put(item["document_hash"], _result_checkpoint(item),
+                        {"model_id": model_id, "prompt_version": PROMPT_VERSION, "result": parsed_content})
 
-    prompt = _build_prompt(text_content)
 
-    parsed_content = _try_converse_tool_output(model_id, prompt)
+def _model_classify(model_id: str, text_content: str) -> tuple[dict, bool]:
+    """Single-chunk model call. Returns (result, cacheable)."""
+    with phase("PromptBuild"):
+        prompt = _build_prompt(text_content)
+    record_count("ModelChunks")
+
+    parsed_content = _try_converse_tool_output(model_id, SYSTEM_PROMPT, prompt)
     if parsed_content is None:
         try:
-            parsed_content = _invoke_model_text_output(model_id, prompt)
+            parsed_content = _invoke_model_text_output(model_id, SYSTEM_PROMPT, prompt)
+        except (BedrockThrottledError, CircuitOpenError):
+            # Fail the iteration so Step Functions retries it, rather than recording INVALID
+            raise
         except Exception as e:
-            parsed_content = {
+            return {
                 "classification": "INVALID",
                 "reason": f"Failed to parse model output as JSON: {str(e)}",
                 "entities": {},
-            }
+            }, False
+
+    return parsed_content, True
+
+
+def _batch_model_classify(model_id: str, chunks: list[tuple[int, str]]) -> dict[int, dict]:
+    """
+    One model call for several chunks. Returns {chunk_id: result} for the results
+    that came back well-formed; anything missing is retried one chunk at a time.
+    """
+    with phase("PromptBuild"):
+        prompt = _build_batch_prompt(chunks)
+    record_count("ModelChunks", len(chunks))
+    max_tokens = BATCH_OUTPUT_TOKENS_PER_CHUNK * len(chunks)
+
+    payload = _try_converse_tool_output(model_id, BATCH_SYSTEM_PROMPT, prompt, input_schema=BATCH_RESULT_SCHEMA,
+                                        max_tokens=max_tokens)
+    if payload is None:
+        try:
+            payload = _invoke_model_text_output(model_id, BATCH_SYSTEM_PROMPT, prompt, max_tokens=max_tokens)
+        except (BedrockThrottledError, CircuitOpenError):
+            raise
+        except Exception as e:
+            logger.warning("Batched model output unusable, falling back to single-chunk calls: %s", str(e))
+            return {}
+
+    wanted = {chunk_id for chunk_id, _ in chunks}
+    by_id = {}
+    for res in payload.get("results") or []:
+        if not isinstance(res, dict) or res.get("classification") not in ("VALID", "INVALID"):
+            continue
+        try:
+            chunk_id = int(res.pop("chunk_id"))
+        except (KeyError, TypeError, ValueError):
+            continue
+        if chunk_id in wanted and chunk_id not in by_id:
+            by_id[chunk_id] = res
+    return by_id
+
+
+def _handle_batch(model_id: str, items: list[dict]) -> list[dict]:
+    """
+    Classify a batched Map item. Returns one record per chunk, in order, each in
+    the same shape as a single-chunk invocation.
+    """
+    results: list[dict | None] = [_checkpointed_result(item, model_id) for item in items]
+    todo = [n for n, parsed_content in enumerate(results) if parsed_content is None]
+    texts = _read_batch_texts([items[n] for n in todo]) if todo else []
+    pending = []
+
+    for n, text_content in zip(todo, texts):
+        parsed_content, key = _local_result(model_id, text_content)
+        if parsed_content is not None:
+            _checkpoint_result(items[n], model_id, parsed_content)
+            results[n] = parsed_content
+        else:
+            pending.append((n, text_content, key))
+
+    packs = pack_by_token_budget(pending, BATCH_TOKEN_BUDGET, BATCH_MAX_CHUNKS, lambda p: estimate_tokens(p[1]))
+    for pack in packs:
+        by_id = _batch_model_classify(model_id, [(n, text) for n, text, _ in pack]) if len(pack) > 1 else {}
+        if len(pack) > 1 and len(by_id) < len(pack):
+            logger.warning("Batched call returned %d/%d results; retrying the rest singly", len(by_id), len(pack))
+
+        for n, text_content, key in pack:
+            parsed_content = by_id.get(n)
+            cacheable = True
+            if parsed_content is None:
+                parsed_content, cacheable = _model_classify(model_id, text_content)
+            with phase("Parse"):
+                parsed_content = _normalize_entities(parsed_content)
+            if cacheable:
+                _store_result(key, parsed_content)
+                _checkpoint_result(items[n], model_id, parsed_content)
+            results[n] = parsed_content
+
+    logger.info("Batch chunks=%d model_requests=%d", len(items), len(packs))
+    for item, parsed_content in zip(items, results):
+        _attach_source(parsed_content, item)
+    return results
+
+
+def _attach_source(parsed_content: dict, item: dict) -> None:
+    """Document metadata and, for OCR text, the chunk's page range; fhir_ingest cites both in Provenance."""
+    parsed_content["metadata"] = item.get("metadata", {})
+    if item.get("pages"):
+        parsed_content["pages"] = item["pages"]
+
+
+def _log_stats() -> None:
+    # Container-lifetime counters
+    if result_cache:
+        logger.info("Result cache stats=%s", json.dumps(result_cache.stats))
+    logger.info("Bedrock client stats=%s circuit=%s", json.dumps(bedrock_client.stats), bedrock_client.breaker.state)
+
+
+def _store_results(event: dict, results: dict | list[dict]):
+    """
+    Write the item's results to the key content_splitter assigned it and return
+    a small reference instead; the Map state discards its output and
+    fhir_ingest reads the results back through the splitter's manifest.
+    """
+    result_key = event.get("result_key")
+    if not result_key:
+        return results
+
+    bucket = event["batch"][0]["s3_bucket"] if "batch" in event else event["s3_bucket"]
+    records = results if isinstance(results, list) else [results]
+    body = json.dumps(records)
+    with phase("S3Write"):
+        s3.put_object(Bucket=bucket, Key=result_key, Body=body, ContentType="application/json")
+    record_bytes("S3Write", len(body))
+    return {"result_key": result_key, "chunks": len(records)}
 
-    parsed_content = _normalize_entities(parsed_content)
-    parsed_content["metadata"] = event.get("metadata", {})
 
-    return parsed_content
+@instrumented("bedrock_guardrail")
+def lambda_handler(event, context):
+    model_id = os.environ.get("BEDROCK_MODEL_ID", "anthropic.claude-3-5-sonnet-20240620-v1:0")
+
+    if "batch" in event:
+        results = _handle_batch(model_id, event["batch"])
+        _log_stats()
+        return _store_results(event, results)
+
+    parsed_content = _checkpointed_result(event, model_id)
+    if parsed_content is None:
+        text_content = _read_chunk_text(event)
+        # Sizes only: chunk text is PHI and never goes to the logs
+        logger.info("S3 input bucket=%s key=%s chars=%d", event["s3_bucket"], event["s3_key"], len(text_content))
+
+        parsed_content, key = _local_result(model_id, text_content)
+        cacheable = True
+        if parsed_content is None:
+            parsed_content, cacheable = _model_classify(model_id, text_content)
+            with phase("Parse"):
+                parsed_content = _normalize_entities(parsed_content)
+            if cacheable:
+                _store_result(key, parsed_content)
+        if cacheable:
+            _checkpoint_result(event, model_id, parsed_content)
+
+    _log_stats()
+
+    _attach_source(parsed_content, event)
+
+    return _store_results(event, parsed_content)
@@ -0,0 +1,121 @@
+"""
+Cheap local scoring that settles obvious chunks without a model call.
+
+Two kinds of chunk are short-circuited, and only when no clinical vocabulary
+is present:
+- NOISE: blank pages and OCR debris (too little text, or mostly non-letters)
+- LEGAL_APPENDIX: statute / court-declaration text such as the Mental Capacity
+  Act extracts that fhir_ingest already ignores
+
+Everything else returns None and goes to Bedrock as before. The synthesized
+results use the same shape as model output, plus a `category` field that
+fhir_ingest reads directly instead of pattern-matching `reason`.
+"""
+import os
+import re
+from dataclasses import dataclass
+
+LEGAL_PATTERNS = [
+    r"mental capacity act",
+    r"\bsection\s+\d+[a-z]?\b",
+    r"\bsubsection\s*\(\d+\)",
+    r"\bschedule\s+\d+\b",
+    r"\bexplanatory notes?\b",
+    r"\bstatut(?:e|ory)\b",
+    r"\bpursuant to\b",
+    r"\bhereinafter\b",
+    r"\bin accordance with (?:this|the) act\b",
+    r"\bprovisions? (?:of|in) sections?\b",
+    r"\bduty is to the court\b",
+    r"\bstatement of truth\b",
+    r"\bi (?:confirm|declare) that\b",
+    r"\b(?:act|regulations?) \d{4}\b",
+    r"\bfor the purposes of this (?:act|part|section)\b",
+]
+
+MEDICAL_TERMS = [
+    "patient", "diagnosis", "diagnosed", "history", "examination", "symptom", "symptoms",
+    "medication", "medications", "prescribed", "dose", "dosage", "tablet", "tablets", "mg", "mcg",
+    "bp", "blood pressure", "pulse", "heart rate", "bpm", "mmhg", "temperature", "spo2", "respiratory",
+    "allergies", "allergy", "referral", "referred", "clinic", "clinical", "gp", "consultant",
+    "hospital", "admitted", "discharge", "discharged", "nric", "dob", "mri", "ct", "x-ray", "ecg",
+    "hba1c", "glucose", "cholesterol", "haemoglobin", "hemoglobin", "wbc", "platelets",
+    "dementia", "diabetes", "hypertension", "depression", "anxiety", "cognitive", "mmse", "moca",
+    "treatment", "therapy", "surgery", "prognosis", "vitals", "observations", "nurse", "physician",
+]
+
+LEGAL_RE = re.compile("|".join(f"(?:{p})" for p in LEGAL_PATTERNS), re.IGNORECASE)
+MEDICAL_RE = re.compile(r"\b(?:" + "|".join(re.escape(t) for t in MEDICAL_TERMS) + r")\b", re.IGNORECASE)
+WORD_RE = re.compile(r"[A-Za-z]{2,}")
+
+
+@dataclass
+class PreclassifierConfig:
+    # NOISE: fewer than min_chars non-space characters, or letters below min_alpha_ratio
+    min_chars: int = 40
+    min_alpha_ratio: float = 0.35
+    # LEGAL_APPENDIX: enough statute markers and (almost) no clinical vocabulary
+    legal_min_hits: int = 3
+    legal_min_per_1k_words: float = 6.0
+    max_medical_ratio: float = 0.004
+
+    @classmethod
+    def from_env(cls) -> "PreclassifierConfig":
+        return cls(
+            min_chars=int(os.environ.get("PRECLASS_MIN_CHARS", cls.min_chars)),
+            min_alpha_ratio=float(os.environ.get("PRECLASS_MIN_ALPHA_RATIO", cls.min_alpha_ratio)),
+            legal_min_hits=int(os.environ.get("PRECLASS_LEGAL_MIN_HITS", cls.legal_min_hits)),
+            legal_min_per_1k_words=float(os.environ.get("PRECLASS_LEGAL_MIN_PER_1K_WORDS", cls.legal_min_per_1k_words)),
+            max_medical_ratio=float(os.environ.get("PRECLASS_MAX_MEDICAL_RATIO", cls.max_medical_ratio)),
+        )
+
+
+def score(text: str) -> dict:
+    compact = "".join(text.split())
+    words = WORD_RE.findall(text)
+    alpha = sum(1 for c in compact if c.isalpha())
+    legal_hits = len(LEGAL_RE.findall(text))
+    medical_hits = len(MEDICAL_RE.findall(text))
+    n_words = len(words)
+
+    return {
+        "chars": len(compact),
+        "words": n_words,
+        "alpha_ratio": alpha / len(compact) if compact else 0.0,
+        "legal_hits": legal_hits,
+        "legal_per_1k_words": legal_hits * 1000 / n_words if n_words else 0.0,
+        "medical_hits": medical_hits,
+        "medical_ratio": medical_hits / n_words if n_words else 0.0,
+    }
+
+
+def preclassify(text: str, config: PreclassifierConfig) -> dict | None:
+    """Return a synthesized guardrail result, or None when the model must decide."""
+    s = score(text)
+
+    # Any clinical vocabulary at all means the model decides
+    if s["medical_ratio"] > config.max_medical_ratio:
+        return None
+
+    if s["chars"] < config.min_chars or s["alpha_ratio"] < config.min_alpha_ratio:
+        if s["medical_hits"]:
+            return None
+        return {
+            "classification": "INVALID",
+            "category": "NOISE",
+            "reason": "Pre-classifier: blank page or OCR noise, no readable clinical content.",
+            "entities": {},
+            "preclassifier": s,
+        }
+
+    if s["legal_hits"] >= config.legal_min_hits and s["legal_per_1k_words"] >= config.legal_min_per_1k_words:
+        return {
+            "classification": "INVALID",
+            "category": "LEGAL_APPENDIX",
+            "reason": "Pre-classifier: legal document / statute text (e.g. Mental Capacity Act provisions), "
+                      "no clinical patient data in this chunk.",
+            "entities": {},
+            "preclassifier": s,
+        }
+
+    return None
@@ -0,0 +1,174 @@
+"""
+Content-addressed cache of guardrail results.
+
+Keys are sha256(model_id, prompt_version, whitespace-normalized chunk text), so
+the same appendix, disclaimer or re-sent referral maps to the same entry no
+matter which document it arrives in. Changing the model or the prompt version
+changes every key, which is how stale results are invalidated.
+
+Backends:
+- memory:   per-container LRU (always in front of the remote backends)
+- s3:       one JSON object per key under a prefix
+- dynamodb: one item per key, `expires_at` doubles as the table TTL attribute
+"""
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+
+from healthtech_common.clients import lazy_client
+
+logger = logging.getLogger()
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def cache_key(text: str, model_id: str, prompt_version: str) -> str:
+    normalized = _WHITESPACE_RE.sub(" ", text).strip()
+    h = hashlib.sha256()
+    for part in (model_id, prompt_version, normalized):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+class MemoryCacheBackend:
+    """LRU with per-entry expiry; evicts least recently used past max_entries."""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: int = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+
+    def get(self, key: str) -> dict | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: dict) -> None:
+        self._entries[key] = (time.time() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class S3CacheBackend:
+    """
+    Entries carry their own expires_at; size is bounded by the bucket lifecycle
+    rule on the prefix rather than by this class.
+    """
+
+    def __init__(self, s3, bucket: str, prefix: str = "cache/guardrail", ttl_seconds: int = 604800):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key: str) -> dict | None:
+        try:
+            obj = self.s3.get_object(Bucket=self.bucket, Key=f"{self.prefix}/{key}.json")
+        except self.s3.exceptions.NoSuchKey:
+            return None
+        entry = json.loads(obj["Body"].read())
+        if entry.get("expires_at", 0) < time.time():
+            return None
+        return entry.get("value")
+
+    def put(self, key: str, value: dict) -> None:
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}/{key}.json",
+            Body=json.dumps({"expires_at": int(time.time() + self.ttl_seconds), "value": value}),
+        )
+
+
+class DynamoDBCacheBackend:
+    """Items expire through the table's TTL on `expires_at`; reads also check it."""
+
+    def __init__(self, table_name: str, ttl_seconds: int = 604800, client=None):
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.ddb = client or lazy_client("dynamodb")
+
+    def get(self, key: str) -> dict | None:
+        resp = self.ddb.get_item(TableName=self.table_name, Key={"cache_key": {"S": key}})
+        item = resp.get("Item")
+        if not item or int(item["expires_at"]["N"]) < time.time():
+            return None
+        return json.loads(item["value"]["S"])
+
+    def put(self, key: str, value: dict) -> None:
+        self.ddb.put_item(
+            TableName=self.table_name,
+            Item={
+                "cache_key": {"S": key},
+                "value": {"S": json.dumps(value)},
+                "expires_at": {"N": str(int(time.time() + self.ttl_seconds))},
+            },
+        )
+
+
+class ResultCache:
+    """Memory LRU in front of an optional remote backend, with hit/miss counters."""
+
+    def __init__(self, memory: MemoryCacheBackend, remote=None):
+        self.memory = memory
+        self.remote = remote
+        self.stats = {"hits": 0, "memory_hits": 0, "remote_hits": 0, "misses": 0, "errors": 0}
+
+    def get(self, key: str) -> dict | None:
+        value = self.memory.get(key)
+        if value is not None:
+            self.stats["hits"] += 1
+            self.stats["memory_hits"] += 1
+            return value
+
+        if self.remote is not None:
+            try:
+                value = self.remote.get(key)
+            except Exception as e:
+                # A cache outage must not fail the chunk; fall through to the model
+                self.stats["errors"] += 1
+                logger.warning("Result cache read failed: %s", str(e))
+                value = None
+            if value is not None:
+                self.memory.put(key, value)
+                self.stats["hits"] += 1
+                self.stats["remote_hits"] += 1
+                return value
+
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, key: str, value: dict) -> None:
+        self.memory.put(key, value)
+        if self.remote is not None:
+            try:
+                self.remote.put(key, value)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning("Result cache write failed: %s", str(e))
+
+
+def build_result_cache(backend: str, s3=None, bucket: str | None = None, prefix: str = "cache/guardrail",
+                       table_name: str | None = None, ttl_seconds: int = 604800,
+                       max_entries: int = 1024) -> ResultCache | None:
+    if backend in ("", "none", "off"):
+        return None
+
+    memory = MemoryCacheBackend(max_entries=max_entries, ttl_seconds=ttl_seconds)
+    if backend == "memory":
+        return ResultCache(memory)
+    if backend == "s3":
+        return ResultCache(memory, S3CacheBackend(s3, bucket, prefix=prefix, ttl_seconds=ttl_seconds))
+    if backend == "dynamodb":
+        return ResultCache(memory, DynamoDBCacheBackend(table_name, ttl_seconds=ttl_seconds))
+    raise ValueError(f"Unsupported result cache backend: {backend}")
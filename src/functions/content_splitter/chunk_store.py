@@ -0,0 +1,170 @@
+"""
+Chunk persistence strategies for content_splitter.
+
+Each writer takes chunks in order and returns the location fields that go into
+the Map item for that chunk:
+
+- serial:   one put_object per chunk (original behaviour)
+- parallel: same object layout, PUTs issued from a bounded thread pool
+- packed:   every chunk appended to one object via multipart upload, plus an
+            index.json of offsets; Map items carry a byte_range for a ranged GET
+
+Callers close() a writer once every chunk is written, or abort() it if the
+split fails part way, so no upload or thread pool is left open.
+"""
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# S3 minimum part size is 5MB (except the last part)
+PACKED_PART_BYTES = 8 * 1024 * 1024
+
+
+class SerialChunkWriter:
+    def __init__(self, s3, bucket, prefix):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def write(self, idx, text):
+        key = f"{self.prefix}/{idx}.txt"
+        self.s3.put_object(Bucket=self.bucket, Key=key, Body=text)
+        return {"s3_key": key}
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+
+class ParallelChunkWriter(SerialChunkWriter):
+    """
+    Per-chunk objects written from a thread pool. At most 2 * max_workers PUTs
+    are in flight, so chunk bodies do not pile up in memory behind a slow S3.
+    """
+
+    def __init__(self, s3, bucket, prefix, max_workers=16):
+        super().__init__(s3, bucket, prefix)
+        self.max_in_flight = max_workers * 2
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._in_flight = deque()
+
+    def write(self, idx, text):
+        key = f"{self.prefix}/{idx}.txt"
+        self._in_flight.append(self._pool.submit(self.s3.put_object, Bucket=self.bucket, Key=key, Body=text))
+        while len(self._in_flight) >= self.max_in_flight:
+            self._in_flight.popleft().result()
+        return {"s3_key": key}
+
+    def close(self):
+        try:
+            while self._in_flight:
+                self._in_flight.popleft().result()
+        finally:
+            self._pool.shutdown(wait=True)
+
+    def abort(self):
+        # Queued PUTs are dropped; the ones already running finish before the pool goes
+        while self._in_flight:
+            self._in_flight.popleft().cancel()
+        self._pool.shutdown(wait=True)
+
+
+class PackedChunkWriter:
+    """
+    Appends UTF-8 encoded chunks to `{prefix}/chunks.bin` through a multipart
+    upload, buffering at most one part. `{prefix}/index.json` records each
+    chunk's [start, end) byte offsets.
+
+    An open upload is billed until it is completed or aborted, so a failed
+    part aborts it here and a failed split must call abort().
+    """
+
+    def __init__(self, s3, bucket, prefix, part_bytes=PACKED_PART_BYTES):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = f"{prefix}/chunks.bin"
+        self.index_key = f"{prefix}/index.json"
+        self.part_bytes = part_bytes
+        self._upload_id = None
+        self._parts = []
+        self._buffer = bytearray()
+        self._offset = 0
+        self._index = []
+
+    def _flush_part(self):
+        if self._upload_id is None:
+            self._upload_id = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.key)["UploadId"]
+        part_number = len(self._parts) + 1
+        resp = self.s3.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=bytes(self._buffer),
+        )
+        self._parts.append({"ETag": resp["ETag"], "PartNumber": part_number})
+        self._buffer.clear()
+
+    def write(self, idx, text):
+        data = text.encode("utf-8")
+        start = self._offset
+        self._buffer += data
+        self._offset += len(data)
+        self._index.append([start, self._offset])
+
+        if len(self._buffer) >= self.part_bytes:
+            try:
+                self._flush_part()
+            except Exception:
+                self.abort()
+                raise
+        return {"s3_key": self.key, "byte_range": [start, self._offset]}
+
+    def close(self):
+        if not self._index:
+            return
+
+        if self._upload_id is None:
+            # Small document: a single PUT is cheaper than a multipart upload
+            self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer))
+        else:
+            try:
+                if self._buffer:
+                    self._flush_part()
+                self.s3.complete_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    UploadId=self._upload_id,
+                    MultipartUpload={"Parts": self._parts},
+                )
+            except Exception:
+                self.abort()
+                raise
+
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=self.index_key,
+            Body=json.dumps({"object": self.key, "chunks": self._index}),
+        )
+
+    def abort(self):
+        if self._upload_id is None:
+            return
+        upload_id, self._upload_id = self._upload_id, None
+        try:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=upload_id)
+        except Exception as e:
+            # Never hide the error that caused the abort; the bucket lifecycle rule reaps the upload
+            print(f"Could not abort multipart upload {upload_id} for {self.key}: {e}")
+
+
+def make_chunk_writer(mode, s3, bucket, prefix, max_workers=16):
+    if mode == "serial":
+        return SerialChunkWriter(s3, bucket, prefix)
+    if mode == "parallel":
+        return ParallelChunkWriter(s3, bucket, prefix, max_workers=max_workers)
+    if mode == "packed":
+        return PackedChunkWriter(s3, bucket, prefix)
+    raise ValueError(f"Unsupported chunk store mode: {mode}")
@@ -0,0 +1,157 @@
+"""
+Chunking strategies for content_splitter.
+
+Both strategies consume an iterable of text blocks (streamed from S3 or
+Textract) and yield chunk strings, holding at most one block plus one chunk.
+
+- fixed:    hard cut every N characters (the original behaviour)
+- boundary: chunks sized by an estimated token budget, cut at the strongest
+            boundary available near the budget (page > paragraph > line >
+            sentence > word), with optional overlap between neighbours
+
+split_with_pages() also reports the pages each chunk covers, for text whose
+pages end with a form feed (Textract output).
+"""
+import os
+from dataclasses import dataclass
+
+# Rough chars-per-token for English clinical prose; used instead of shipping a tokenizer
+CHARS_PER_TOKEN = float(os.environ.get('CHUNK_CHARS_PER_TOKEN', '4'))
+
+# Strongest first. Textract/pdf page breaks arrive as form feeds.
+BOUNDARIES = ['\f', '\n\n', '\n', '. ', '? ', '! ', '; ', ' ']
+
+
+def estimate_tokens(text):
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+@dataclass
+class ChunkingConfig:
+    strategy: str = 'boundary'
+    target_tokens: int = 1250
+    overlap_tokens: int = 0
+    # A boundary is only used if it leaves the chunk at least this fraction of the budget
+    min_fill: float = 0.5
+
+    @classmethod
+    def from_event(cls, event):
+        """Event `chunking` settings win over environment defaults; an explicit 0 is a setting too."""
+        overrides = event.get('chunking') or {}
+
+        def setting(name, env_name):
+            value = overrides.get(name)
+            return value if value is not None else os.environ.get(env_name, getattr(cls, name))
+
+        return cls(
+            strategy=overrides.get('strategy') or os.environ.get('CHUNK_STRATEGY', cls.strategy),
+            target_tokens=int(setting('target_tokens', 'CHUNK_TARGET_TOKENS')),
+            overlap_tokens=int(setting('overlap_tokens', 'CHUNK_OVERLAP_TOKENS')),
+            min_fill=float(setting('min_fill', 'CHUNK_MIN_FILL')),
+        )
+
+    @property
+    def chunk_chars(self):
+        return max(1, int(self.target_tokens * CHARS_PER_TOKEN))
+
+
+def iter_fixed_chunks(text_blocks, chunk_size):
+    """
+    Re-slice an iterable of text blocks into chunk_size character chunks.
+    Only one block plus one partial chunk is held at a time.
+    """
+    pending = ''
+    for block in text_blocks:
+        pending += block
+        start = 0
+        while len(pending) - start >= chunk_size:
+            yield pending[start:start + chunk_size]
+            start += chunk_size
+        pending = pending[start:]
+
+    if pending:
+        yield pending
+
+
+class FixedCharSplitter:
+    def __init__(self, config):
+        self.chunk_chars = config.chunk_chars
+
+    def split(self, text_blocks):
+        return iter_fixed_chunks(text_blocks, self.chunk_chars)
+
+    def iter_spans(self, text_blocks):
+        # Chunks never overlap, so each one advances the text by its full length
+        for chunk in self.split(text_blocks):
+            yield chunk, len(chunk)
+
+
+class BoundarySplitter:
+    def __init__(self, config):
+        self.max_chars = config.chunk_chars
+        self.min_chars = int(self.max_chars * config.min_fill)
+        self.overlap_chars = min(int(config.overlap_tokens * CHARS_PER_TOKEN), self.max_chars // 2)
+
+    def _find_cut(self, text, start):
+        """Index just past the strongest boundary in [start + min_chars, start + max_chars]."""
+        end = start + self.max_chars
+        floor = start + self.min_chars
+        for sep in BOUNDARIES:
+            pos = text.rfind(sep, floor, end)
+            if pos != -1:
+                return pos + len(sep)
+        return end
+
+    def _next_start(self, text, start, cut):
+        if not self.overlap_chars:
+            return cut
+        # Begin the overlap on a word boundary so the next chunk doesn't open mid-word
+        overlap_start = max(start + 1, cut - self.overlap_chars)
+        space = text.find(' ', overlap_start, cut)
+        return space + 1 if space != -1 else cut
+
+    def split(self, text_blocks):
+        for chunk, _ in self.iter_spans(text_blocks):
+            yield chunk
+
+    def iter_spans(self, text_blocks):
+        """(chunk, advance): advance is where the next chunk starts within this one (its length without overlap)."""
+        pending = ''
+        for block in text_blocks:
+            pending += block
+            start = 0
+            while len(pending) - start > self.max_chars:
+                cut = self._find_cut(pending, start)
+                next_start = self._next_start(pending, start, cut)
+                yield pending[start:cut], next_start - start
+                start = next_start
+            pending = pending[start:]
+
+        if pending.strip():
+            yield pending, len(pending)
+
+
+def page_range(chunk, first_page):
+    """[first, last] page holding text of a chunk that starts on first_page; pages end with a form feed."""
+    first = last = None
+    for n, part in enumerate(chunk.split('\f')):
+        if part.strip():
+            first = first_page + n if first is None else first
+            last = first_page + n
+    return [first, last] if first is not None else [first_page, first_page]
+
+
+def split_with_pages(splitter, text_blocks):
+    """(chunk, [first_page, last_page]) for text whose pages (numbered from 1) each end with a form feed."""
+    page = 1
+    for chunk, advance in splitter.iter_spans(text_blocks):
+        yield chunk, page_range(chunk, page)
+        page += chunk.count('\f', 0, advance)
+
+
+def make_splitter(config):
+    if config.strategy == 'fixed':
+        return FixedCharSplitter(config)
+    if config.strategy == 'boundary':
+        return BoundarySplitter(config)
+    raise ValueError(f"Unsupported chunk strategy: {config.strategy}")
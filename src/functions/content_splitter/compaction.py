@@ -0,0 +1,137 @@
+"""
+Text compaction for content_splitter, between extraction and chunking.
+
+OCR and PDF text carries page furniture that every guardrail call pays for
+as input tokens: the same letterhead and fax banner on every page, page
+numbers, runs of whitespace and words hyphenated across line ends. The
+compactor takes the form-feed separated pages one at a time and, in one pass
+over each page's lines:
+
+- drops page numbers among the first and last EDGE_LINES of a page:
+  labelled ones ("Page 3 of 12", "p. 3", "- 3 -") and bare ones ("3",
+  "3/12") that match the page's own number. Anywhere else a bare number is
+  a table cell or a reading ("72", "140/90") and is kept.
+- drops header/footer lines (the same edge lines) already seen in the same
+  place on an earlier page. The first copy is kept, so the letterhead is
+  still read once. Dates, times and page counters are ignored when comparing
+  (fax banners, print timestamps); any other number must match exactly.
+  Only lines with words in them count as furniture: table cells and lines
+  carrying clinical values (BP, HR, doses, units) are never dropped.
+- collapses whitespace runs and blank lines
+- re-joins a lower-case word split by a hyphen at the end of a line
+
+Form feeds are passed through unchanged, so chunk page ranges stay exact.
+"""
+import os
+import re
+
+from chunking import CHARS_PER_TOKEN
+
+# Lines at each end of a page that may be header/footer
+EDGE_LINES = int(os.environ.get('COMPACTION_EDGE_LINES', '3'))
+# Distinct header/footer lines remembered per document
+MAX_SEEN_LINES = int(os.environ.get('COMPACTION_MAX_SEEN_LINES', '512'))
+# "Page 3", "Page 3 of 12", "p. 3", "- 3 -"
+PAGE_LABEL = re.compile(r'^(?:(?:page|pg|p)\.?\s*\d{1,4}(?:\s*(?:of|/)\s*\d{1,4})?|[-\u2013\u2014]\s*\d{1,4}\s*[-\u2013\u2014])$',
+                        re.IGNORECASE)
+# "3", "3/12", "3 of 12": a page number only when it is the page's own
+BARE_PAGE_NUMBER = re.compile(r'^(\d{1,4})(?:\s*(?:of|/)\s*\d{1,4})?$', re.IGNORECASE)
+# Numbers that change from page to page of the same header: dates, times, page counters
+FURNITURE_NUMBERS = re.compile(
+    r'\b\d{1,4}[/.-]\d{1,2}[/.-]\d{2,4}\b|\b\d{1,2}:\d{2}(?::\d{2})?\b|\b(?:page|pg|p)\.?\s*\d{1,4}(?:\s*(?:of|/)\s*\d{1,4})?',
+    re.IGNORECASE)
+CLINICAL_VALUE = re.compile(
+    r'\b(?:BP|HR|RR|SpO2|SaO2|Temp|Pulse|BMI|GCS)\b|\d\s*(?:mg|mcg|g|ml|l|mmol|umol|mmhg|bpm|kg|cm|iu|units?|%)(?![a-z])',
+    re.IGNORECASE)
+# Header/footer lines have words in them; bare values are table cells
+WORD = re.compile(r'[^\W\d_]{3}')
+WHITESPACE = re.compile(r'[^\S\n\f]+')
+HYPHENATED = re.compile(r'[a-z]{2}-$')
+
+
+def iter_pages(text_blocks):
+    """(page text, ended_by_form_feed) for text blocks that may split pages anywhere."""
+    pending = ''
+    for block in text_blocks:
+        pending += block
+        *pages, pending = pending.split('\f')
+        for page in pages:
+            yield page, True
+    if pending:
+        yield pending, False
+
+
+class TextCompactor:
+    def __init__(self, edge_lines=EDGE_LINES, max_seen=MAX_SEEN_LINES):
+        self.edge_lines = edge_lines
+        self.max_seen = max_seen
+        self.seen = set()
+        self.pages = 0
+        self.lines_dropped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    @property
+    def bytes_saved(self):
+        return self.bytes_in - self.bytes_out
+
+    @property
+    def tokens_saved(self):
+        # Same estimate the chunker budgets with; bytes stand in for characters
+        return int(self.bytes_saved / CHARS_PER_TOKEN)
+
+    def _is_page_number(self, line):
+        if PAGE_LABEL.match(line):
+            return True
+        bare = BARE_PAGE_NUMBER.match(line)
+        return bare is not None and int(bare.group(1)) == self.pages
+
+    def _repeat_key(self, line, top):
+        return (top, FURNITURE_NUMBERS.sub('#', line.casefold()))
+
+    def compact_page(self, page):
+        """Compact one page; self.pages is its number (1-based), as set by compact()."""
+        lines = page.split('\n')
+        while lines and not lines[-1].strip():
+            lines.pop()
+        last_edge = len(lines) - self.edge_lines
+
+        out = []
+        for i, raw in enumerate(lines):
+            line = WHITESPACE.sub(' ', raw).strip()
+            if not line:
+                if out and out[-1]:
+                    out.append('')
+                continue
+            edge = i < self.edge_lines or i >= last_edge
+            if edge and self._is_page_number(line):
+                self.lines_dropped += 1
+                continue
+            if edge and WORD.search(line) and not CLINICAL_VALUE.search(line):
+                key = self._repeat_key(line, i < self.edge_lines)
+                if key in self.seen:
+                    self.lines_dropped += 1
+                    continue
+                if len(self.seen) < self.max_seen:
+                    self.seen.add(key)
+            if out and out[-1] and line[0].islower() and HYPHENATED.search(out[-1]):
+                out[-1] = out[-1][:-1] + line
+            else:
+                out.append(line)
+
+        while out and not out[-1]:
+            out.pop()
+        return '\n'.join(out)
+
+    def compact(self, text_blocks):
+        """Yield the compacted text page by page; each page keeps its trailing form feed."""
+        for page, ended in iter_pages(text_blocks):
+            self.pages += 1
+            compacted = self.compact_page(page)
+            if ended:
+                compacted = compacted + '\n\f' if compacted else '\f'
+                page += '\f'
+            self.bytes_in += len(page.encode('utf-8'))
+            self.bytes_out += len(compacted.encode('utf-8'))
+            if compacted:
+                yield compacted
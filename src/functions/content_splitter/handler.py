@@ -1,72 +1,302 @@
-import boto3
+import codecs
+import hashlib
 import json
+import os
 import time
+from dataclasses import asdict
 
-s3 = boto3.client('s3')
-textract = boto3.client('textract')
+from chunk_store import make_chunk_writer
+from chunking import CHARS_PER_TOKEN, ChunkingConfig, make_splitter, split_with_pages
+from compaction import TextCompactor
+from healthtech_common.checkpoints import build_checkpoint_store
+from healthtech_common.clients import lazy_client
+from healthtech_common.instrumentation import instrumented, phase, record_bytes, record_count, timed_iter
+from healthtech_common.pdf_text import iter_pdf_text
+from native_extractors import iter_csv_text, iter_ooxml_text
+
+s3 = lazy_client('s3')
+# Only built for OCR documents
+textract = lazy_client('textract')
+
+# 'streaming' reads the object in blocks and writes chunks as they fill;
+# 'buffered' is the original read-everything path.
+SPLIT_MODE = os.environ.get('SPLIT_MODE', 'streaming')
+STREAM_BLOCK_BYTES = int(os.environ.get('STREAM_BLOCK_BYTES', str(1024 * 1024)))
+
+# 'packed' (one object + byte ranges), 'parallel' (thread-pooled PUT per chunk) or 'serial'
+CHUNK_STORE_MODE = os.environ.get('CHUNK_STORE_MODE', 'packed')
+CHUNK_PUT_CONCURRENCY = int(os.environ.get('CHUNK_PUT_CONCURRENCY', '16'))
+
+# Chunks per Map item; > 1 enables batched inference in bedrock_guardrail
+GUARDRAIL_BATCH_SIZE = int(os.environ.get('GUARDRAIL_BATCH_SIZE', '1'))
+
+# The Map items go under this prefix too, read by the Map's ItemReader rather than passed in
+# the state, and bedrock_guardrail writes each item's results there; fhir_ingest reads them
+# back through the manifest instead of receiving the Map output
+RESULT_PREFIX = os.environ.get('RESULT_PREFIX', 'temp/results')
+
+# Stage checkpoints: the OCR text and the chunk list are kept per document so a re-run
+# skips Textract and re-splitting, and bedrock_guardrail can match its results to chunks
+checkpoints = build_checkpoint_store(s3, os.environ.get('BUCKET_NAME'))
+
+# 'on' strips repeated headers/footers, page numbers, whitespace runs and line-end
+# hyphenation from paged text (OCR and PDF) before it is chunked; 'off' keeps it verbatim
+COMPACTION = os.environ.get('COMPACTION', 'on')
+COMPACTED_SOURCES = ('ocr', 'pdf')
+
+# Events from before document_router reported a format fall back to the extension
+EXTENSION_FORMATS = {'.csv': 'csv', '.tsv': 'csv', '.docx': 'docx', '.xlsx': 'xlsx'}
+
+# Fallback polling (TEXTRACT_COMPLETION_MODE=POLL or callback timeout): exponential
+# backoff between status checks, bounded by the Lambda's remaining time.
+TEXTRACT_POLL_INITIAL_S = float(os.environ.get('TEXTRACT_POLL_INITIAL_S', '1'))
+TEXTRACT_POLL_MAX_S = float(os.environ.get('TEXTRACT_POLL_MAX_S', '20'))
+TEXTRACT_POLL_BUDGET_S = float(os.environ.get('TEXTRACT_POLL_BUDGET_S', '60'))
+
+class TextractJobInProgress(Exception):
+    """Raised when the poll budget runs out; the state machine retries SplitContent."""
+
+class TextractJobFailed(Exception):
+    """The job ended FAILED; the same error name the callback path fails the execution with."""
+
+def _wait_for_textract(job_id, context=None):
+    """
+    Return the first results page once the job has left IN_PROGRESS.
+    In CALLBACK mode the job is already finished and this is a single call.
+    """
+    delay = TEXTRACT_POLL_INITIAL_S
+    waited = 0.0
 
-def get_textract_results(job_id):
-    # Simple Poller inside Splitter for demo simplicity 
-    # (In high scale production, use a dedicated Wait State/Lambda)
-    pages = []
-    next_token = None
-    
     while True:
-        if next_token:
-            response = textract.get_document_text_detection(JobId=job_id, NextToken=next_token)
-        else:
+        with phase('TextractFetch'):
             response = textract.get_document_text_detection(JobId=job_id)
-            
         status = response['JobStatus']
-        if status == 'IN_PROGRESS':
-            time.sleep(2)
-            continue
-        elif status == 'FAILED':
-            raise Exception("Textract Failed")
-            
-        # Parse Blocks
-        for block in response['Blocks']:
-            if block['BlockType'] == 'LINE':
-                pages.append(block['Text']) # Simplified for demo
-        
+        if status != 'IN_PROGRESS':
+            if status == 'FAILED':
+                raise TextractJobFailed(f"Textract job {job_id} failed: {response.get('StatusMessage', 'no status message')}")
+            return response
+
+        remaining_s = context.get_remaining_time_in_millis() / 1000 if context else float('inf')
+        if waited + delay > TEXTRACT_POLL_BUDGET_S or delay > remaining_s - 30:
+            # Give the Lambda back rather than sleeping on billed time
+            raise TextractJobInProgress(f"Textract job {job_id} still IN_PROGRESS after {waited:.0f}s")
+
+        with phase('TextractWait'):
+            time.sleep(delay)
+        waited += delay
+        delay = min(delay * 2, TEXTRACT_POLL_MAX_S)
+
+def _iter_textract_blocks(job_id, context=None):
+    """Blocks of a finished job, one results page (up to 1000 blocks) held at a time."""
+    response = _wait_for_textract(job_id, context)
+    while True:
+        yield from response['Blocks']
+
         next_token = response.get('NextToken')
         if not next_token:
             break
-            
-    return "\n".join(pages)
+        with phase('TextractFetch'):
+            response = textract.get_document_text_detection(JobId=job_id, NextToken=next_token)
 
+def iter_textract_text(job_id, context=None):
+    """
+    Yield the job's text one document page at a time, as the results pages
+    arrive. LINE blocks arrive in page order; each page is yielded when the
+    first line of the next one shows up, ending in a form feed (blank pages
+    are a bare form feed) so the chunker cuts at page breaks and
+    split_with_pages() can number them. Memory holds one results page and
+    one document page, whatever the page count.
+    """
+    page, lines, line_count = 1, [], 0
+    for block in _iter_textract_blocks(job_id, context):
+        if block['BlockType'] != 'LINE':
+            continue
+        number = block.get('Page', page)
+        if number != page:
+            yield ('\n'.join(lines) + '\n\f' if lines else '\f') + '\f' * (number - page - 1)
+            page, lines = number, []
+        lines.append(block['Text'])
+        line_count += 1
+
+    if lines:
+        yield '\n'.join(lines) + '\n\f'
+    record_count('TextractPages', page)
+    record_count('TextractLines', line_count)
+
+def chunk_signature(source, chunk_config, compaction=COMPACTION):
+    """
+    Identifies how a document's chunks were cut. Checkpointed chunks and their
+    guardrail results are only reused under the same signature.
+    """
+    settings = {'source': source, 'chars_per_token': CHARS_PER_TOKEN, 'compaction': compaction, **asdict(chunk_config)}
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+def iter_s3_text(bucket, key, block_size=STREAM_BLOCK_BYTES):
+    """
+    Yield decoded text from an S3 object one block at a time.
+    The incremental decoder carries partial multi-byte UTF-8 sequences over
+    block boundaries, so the output matches a full read().decode().
+    """
+    obj = s3.get_object(Bucket=bucket, Key=key)
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+
+    for block in timed_iter(obj['Body'].iter_chunks(chunk_size=block_size), 'S3Read', size=len):
+        text = decoder.decode(block)
+        if text:
+            yield text
+
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+@instrumented('content_splitter')
 def lambda_handler(event, context):
     bucket = event['bucket']
     key = event['key']
     mode = event['mode']
     metadata = event.get('metadata', {})
-    
-    full_text = ""
-    
-    if mode == "ASYNC_OCR":
-        # Retrieve Textract Results
-        full_text = get_textract_results(event['job_id'])
+    split_mode = event.get('split_mode') or SPLIT_MODE
+    fmt = event.get('format') or EXTENSION_FORMATS.get(os.path.splitext(key)[1].lower(), 'text')
+    chunk_config = ChunkingConfig.from_event(event)
+    compaction = event.get('compaction') or COMPACTION
+
+    # Checkpoints live in the pipeline bucket; documents elsewhere are not checkpointed
+    doc_hash = event.get('document_hash') if checkpoints and checkpoints.bucket == bucket else None
+    source = 'ocr' if mode == "ASYNC_OCR" or fmt == 'ocr' else fmt
+    compactor = TextCompactor() if compaction == 'on' and source in COMPACTED_SOURCES else None
+    chunk_set = chunk_signature(source, chunk_config, compaction if compactor else 'off')
+    saved = checkpoints.get(doc_hash, f'chunks/{chunk_set}.json') if doc_hash else None
+
+    if saved is not None:
+        # Split by an earlier run: reuse its chunk objects and skip OCR and splitting
+        record_count('CheckpointHits')
+        output_chunks = [{**location, "s3_bucket": bucket, "metadata": metadata} for location in saved]
     else:
-        # Native Parse (Simulated for brevity)
-        obj = s3.get_object(Bucket=bucket, Key=key)
-        full_text = obj['Body'].read().decode('utf-8', errors='ignore')
-
-    # SPLIT LOGIC (e.g., 5000 chars per chunk ~ 2 pages)
-    chunk_size = 5000
-    text_chunks = [full_text[i:i+chunk_size] for i in range(0, len(full_text), chunk_size)]
-    
-    output_chunks = []
-    for idx, chunk in enumerate(text_chunks):
-        # Write chunk to 'temp/' (EventBridge IGNORES this prefix)
-        chunk_key = f"temp/chunks/{context.aws_request_id}/{idx}.txt"
-        s3.put_object(Bucket=bucket, Key=chunk_key, Body=chunk)
-        
-        output_chunks.append({
-            "chunk_id": idx,
-            "s3_bucket": bucket,
-            "s3_key": chunk_key,
-            "metadata": metadata,
-            "total_chunks": len(text_chunks)
-        })
-        
-    return {"chunks": output_chunks}
+        if mode == "ASYNC_OCR":
+            # Textract results, streamed page by page into the chunker
+            text_blocks = iter_textract_text(event['job_id'], context)
+            if doc_hash:
+                # Kept only once the splitter has read it to the end
+                text_blocks = checkpoints.text_writer(doc_hash, 'ocr.txt').tee(text_blocks)
+        elif fmt == 'ocr':
+            # document_router found the OCR text of an earlier run
+            text_blocks = iter_s3_text(bucket, event['text_key'])
+        elif fmt == 'pdf':
+            # Born-digital PDF that document_router sent past Textract: read its text layer
+            obj = s3.get_object(Bucket=bucket, Key=key)
+            text_blocks = iter_pdf_text(timed_iter(obj['Body'].iter_chunks(chunk_size=STREAM_BLOCK_BYTES), 'S3Read', size=len))
+        elif fmt in ('docx', 'xlsx'):
+            # Zip containers: paragraphs / sheet rows pulled out of the XML parts via ranged GETs
+            text_blocks = iter_ooxml_text(s3, bucket, key, fmt, page_chars=chunk_config.chunk_chars)
+        elif fmt == 'csv':
+            text_blocks = iter_csv_text(iter_s3_text(bucket, key), page_chars=chunk_config.chunk_chars)
+        elif split_mode == 'buffered':
+            # Native Parse (Simulated for brevity)
+            with phase('S3Read'):
+                data = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+            record_bytes('S3Read', len(data))
+            text_blocks = [data.decode('utf-8', errors='ignore')]
+        else:
+            text_blocks = iter_s3_text(bucket, key)
+
+        # SPLIT LOGIC: token-budgeted chunks cut at page/paragraph/line boundaries
+        # ('fixed' keeps the original 5000-char slicing)
+        splitter = make_splitter(chunk_config)
+
+        # Write chunks as soon as they are full, under the document's checkpoints if it has
+        # them and 'temp/' otherwise (EventBridge IGNORES both prefixes)
+        writer = make_chunk_writer(
+            event.get('chunk_store') or CHUNK_STORE_MODE,
+            s3,
+            bucket,
+            checkpoints.key(doc_hash, f'chunks/{chunk_set}') if doc_hash else f"temp/chunks/{context.aws_request_id}",
+            max_workers=CHUNK_PUT_CONCURRENCY,
+        )
+
+        # Extract covers reading and parsing the source; Split adds chunking on top of it
+        text_blocks = timed_iter(text_blocks, 'Extract')
+        if compactor:
+            text_blocks = timed_iter(compactor.compact(text_blocks), 'Compact')
+        if source == 'ocr':
+            # OCR text marks every page, so chunks can cite the pages they came from
+            chunks = split_with_pages(splitter, text_blocks)
+        else:
+            chunks = ((chunk, None) for chunk in splitter.split(text_blocks))
+        output_chunks = []
+        try:
+            for idx, (chunk, pages) in enumerate(timed_iter(chunks, 'Split')):
+                with phase('ChunkWrite'):
+                    location = writer.write(idx, chunk)
+
+                item = {
+                    "chunk_id": idx,
+                    "s3_bucket": bucket,
+                    **location,
+                    "metadata": metadata,
+                }
+                if pages:
+                    item["pages"] = pages
+                output_chunks.append(item)
+            with phase('ChunkWrite'):
+                writer.close()
+        except Exception:
+            # A failed read or split must not leave the packed multipart upload open
+            writer.abort()
+            raise
+
+        if compactor:
+            record_bytes('CompactionInput', compactor.bytes_in)
+            record_count('CompactionBytesSaved', compactor.bytes_saved)
+            record_count('CompactionTokensSaved', compactor.tokens_saved)
+            print(f"Compaction pages={compactor.pages} lines_dropped={compactor.lines_dropped} "
+                  f"bytes_in={compactor.bytes_in} bytes_saved={compactor.bytes_saved} "
+                  f"tokens_saved={compactor.tokens_saved}")
+
+        if doc_hash:
+            checkpoints.put(doc_hash, f'chunks/{chunk_set}.json',
+                            [{k: v for k, v in item.items() if k not in ('s3_bucket', 'metadata')} for item in output_chunks])
+
+    total_chunks = len(output_chunks)
+    record_count('Chunks', total_chunks)
+    for item in output_chunks:
+        item["total_chunks"] = total_chunks
+        if doc_hash:
+            item["document_hash"] = doc_hash
+            item["chunk_set"] = chunk_set
+
+    # Group consecutive chunks so one guardrail invocation can pack them into fewer model calls
+    batch_size = int(event.get('guardrail_batch_size') or GUARDRAIL_BATCH_SIZE)
+    if batch_size > 1:
+        output_chunks = [
+            {"batch": output_chunks[i:i + batch_size]}
+            for i in range(0, len(output_chunks), batch_size)
+        ]
+
+    # One result object per Map item, listed in chunk order for AggregateAndIngest
+    results_prefix = f"{RESULT_PREFIX}/{context.aws_request_id}"
+    result_keys = []
+    for n, item in enumerate(output_chunks):
+        item["result_key"] = f"{results_prefix}/{n:06d}.json"
+        result_keys.append(item["result_key"])
+
+    manifest_key = f"{results_prefix}/manifest.json"
+    items_key = f"{results_prefix}/items.json"
+    with phase('S3Write'):
+        s3.put_object(
+            Bucket=bucket,
+            Key=manifest_key,
+            Body=json.dumps({"bucket": bucket, "total_chunks": total_chunks, "result_keys": result_keys}),
+            ContentType='application/json',
+        )
+        # Step Functions caps state at 256KB, a few hundred inline items; the Map reads them from here
+        s3.put_object(Bucket=bucket, Key=items_key, Body=json.dumps(output_chunks), ContentType='application/json')
+
+    # The document's identity for fhir_ingest's patient index and placeholder identifiers
+    results_manifest = {"bucket": bucket, "key": manifest_key, "source": f"s3://{bucket}/{key}"}
+    if event.get('document_hash'):
+        results_manifest["document_hash"] = event['document_hash']
+    if metadata.get('content_sha256'):
+        # An email attachment: fhir_ingest records the outcome on its ledger claim
+        results_manifest["content_sha256"] = metadata['content_sha256']
+    chunk_manifest = {"bucket": bucket, "key": items_key, "items": len(output_chunks), "total_chunks": total_chunks}
+    return {"chunk_manifest": chunk_manifest, "results_manifest": results_manifest}
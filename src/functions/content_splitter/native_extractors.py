@@ -0,0 +1,384 @@
+"""
+Native text extraction for NATIVE_PARSE documents.
+
+Each extractor is a generator of text blocks for the chunker and holds one
+block in memory (plus, for XLSX, the workbook's shared-string table):
+- csv:  decoded incrementally and re-read with the csv module, so quoted
+        newlines stay inside their row
+- docx: word/document.xml streamed out of the zip through expat; one line
+        per paragraph, table cells separated by ' | '
+- xlsx: each worksheet streamed row by row, cells resolved against the
+        shared strings (numbers are kept as stored; date styles are not applied)
+
+Tabular formats start a new page (form feed, the chunker's strongest
+boundary) before a page outgrows the chunk budget and repeat the header row
+there, so every chunk is whole rows under their column names.
+
+Zip containers need random access to their central directory. S3RangeFile
+gives zipfile a seekable view of the object backed by ranged GETs, so the
+archive is never downloaded whole.
+"""
+import csv
+import io
+import os
+import zipfile
+import xml.etree.ElementTree as ET
+from xml.parsers import expat
+
+from healthtech_common.instrumentation import phase, record_bytes
+
+# Table page size when the caller does not pass its chunk budget
+PAGE_CHARS = 5000
+# Size of each ranged GET behind S3RangeFile, and of the text blocks handed to the chunker
+RANGE_BLOCK_BYTES = int(os.environ.get('NATIVE_RANGE_BLOCK_BYTES', str(1024 * 1024)))
+TEXT_BLOCK_CHARS = 64 * 1024
+XML_READ_BYTES = 256 * 1024
+# Lines the CSV dialect (delimiter, quoting) is sniffed from
+SNIFF_LINES = 20
+
+CELL_SEP = ' | '
+
+WML_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+SML_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PKG_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+# expat reports qualified names as '<namespace> <local name>'
+_W_P, _W_T, _W_TAB, _W_BR, _W_TYPE, _W_PAGE_BREAK, _W_TBL, _W_TR, _W_TC = (
+    f'{WML_NS} {name}' for name in ('p', 't', 'tab', 'br', 'type', 'lastRenderedPageBreak', 'tbl', 'tr', 'tc'))
+_S_ROW, _S_C, _S_V, _S_T, _S_SI, _S_RPH = (
+    f'{SML_NS} {name}' for name in ('row', 'c', 'v', 't', 'si', 'rPh'))
+
+
+class S3RangeFile(io.RawIOBase):
+    """Read-only, seekable S3 object; wrap in io.BufferedReader so reads become block-sized ranged GETs."""
+
+    def __init__(self, s3, bucket, key, size=None):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.size = size if size is not None else s3.head_object(Bucket=bucket, Key=key)['ContentLength']
+        self.pos = 0
+        self.requests = 0
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.pos = offset
+        elif whence == io.SEEK_CUR:
+            self.pos += offset
+        else:
+            self.pos = self.size + offset
+        return self.pos
+
+    def readinto(self, b):
+        if self.pos >= self.size:
+            return 0
+        end = min(self.size, self.pos + len(b))
+        with phase('S3Read'):
+            data = self.s3.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={self.pos}-{end - 1}")['Body'].read()
+        n = len(data)
+        record_bytes('S3Read', n)
+        b[:n] = data
+        self.pos += n
+        self.requests += 1
+        self.bytes_read += n
+        return n
+
+
+def open_s3_zip(s3, bucket, key, block_size=RANGE_BLOCK_BYTES):
+    return zipfile.ZipFile(io.BufferedReader(S3RangeFile(s3, bucket, key), buffer_size=block_size))
+
+
+def _blocks(lines, block_chars=TEXT_BLOCK_CHARS):
+    """Join lines into blocks of about block_chars so the chunker is not fed one row at a time."""
+    pending = []
+    size = 0
+    for line in lines:
+        pending.append(line)
+        size += len(line) + 1
+        if size >= block_chars:
+            yield '\n'.join(pending) + '\n'
+            pending = []
+            size = 0
+    if pending:
+        yield '\n'.join(pending) + '\n'
+
+
+def _paged_tables(tables, page_chars=PAGE_CHARS):
+    """
+    Lines for a sequence of (title, rows) tables, each table's first row being
+    its header. A form feed and the header again start a new page whenever the
+    page would reach page_chars. A table that still fits on the current page
+    follows the previous one after a blank line: pages only end full, so the
+    chunker (which skips boundaries that leave a chunk under-filled) cuts at
+    every one of them.
+    """
+    size = 0
+    for title, rows in tables:
+        header = None
+        started = False
+        for row in rows:
+            line = CELL_SEP.join(row)
+            if header is None:
+                header = (title + '\n' if title else '') + line
+                continue
+            if not started:
+                started = True
+                if not size:
+                    yield header
+                    size = len(header) + 1
+                elif size + len(header) + len(line) + 3 >= page_chars:
+                    yield '\f' + header
+                    size = len(header) + 1
+                else:
+                    yield '\n' + header
+                    size += len(header) + 2
+            # Keep the page (and the form feed after it) under page_chars so the chunker cuts exactly there
+            elif size + len(line) + 1 >= page_chars:
+                yield '\f' + header
+                size = len(header) + 1
+            yield line
+            size += len(line) + 1
+        if header is not None and not started:
+            # Header-only table
+            yield header
+            size += len(header) + 1
+
+
+# --- CSV ---
+
+def _lines(text_blocks):
+    pending = ''
+    for block in text_blocks:
+        pending += block
+        lines = pending.splitlines(keepends=True)
+        # The last piece may be a partial line (or a \r whose \n is in the next block)
+        pending = lines.pop() if lines and not lines[-1].endswith('\n') else ''
+        yield from lines
+    if pending:
+        yield pending
+
+
+def iter_csv_text(text_blocks, page_chars=PAGE_CHARS):
+    lines = _lines(text_blocks)
+    head = [line for _, line in zip(range(SNIFF_LINES), lines)]
+    if head:
+        head[0] = head[0].lstrip('\ufeff')
+    try:
+        dialect = csv.Sniffer().sniff(''.join(head), delimiters=',;\t|')
+    except csv.Error:
+        dialect = csv.excel
+
+    def all_lines():
+        yield from head
+        yield from lines
+
+    rows = ([cell.strip() for cell in row] for row in csv.reader(all_lines(), dialect) if any(row))
+    return _blocks(_paged_tables([(None, rows)], page_chars))
+
+
+# --- XML parts ---
+
+def _parse_part(part, handler):
+    """
+    Feed a zip member through expat XML_READ_BYTES at a time and yield what
+    the handler completed after each piece. Callbacks only, no element tree,
+    so memory does not grow with the part.
+    """
+    parser = expat.ParserCreate(namespace_separator=' ')
+    parser.buffer_text = True
+    parser.StartElementHandler = handler.start
+    parser.EndElementHandler = handler.end
+    parser.CharacterDataHandler = handler.data
+    while True:
+        data = part.read(XML_READ_BYTES)
+        parser.Parse(data, not data)
+        yield from handler.done
+        handler.done = []
+        if not data:
+            break
+
+
+class _DocxLines:
+    """word/document.xml -> one line per paragraph; a table row is one line of ' | '-separated cells."""
+
+    def __init__(self):
+        self.done = []
+        self.paragraph = []
+        self.cell = []
+        self.row = []
+        self.table_depth = 0
+        self.in_text = False
+
+    def start(self, name, attrs):
+        if name == _W_T:
+            self.in_text = True
+        elif name == _W_TAB:
+            self.paragraph.append('\t')
+        elif name == _W_BR:
+            self.paragraph.append('\f' if attrs.get(_W_TYPE) == 'page' else '\n')
+        elif name == _W_PAGE_BREAK:
+            self.paragraph.append('\f')
+        elif name == _W_TBL:
+            self.table_depth += 1
+
+    def data(self, text):
+        if self.in_text:
+            self.paragraph.append(text)
+
+    def end(self, name):
+        if name == _W_T:
+            self.in_text = False
+        elif name == _W_P:
+            text = ''.join(self.paragraph)
+            self.paragraph = []
+            if self.table_depth:
+                self.cell.append(text.strip())
+            elif text.strip() or '\f' in text:
+                self.done.append(text)
+        elif name == _W_TC:
+            self.row.append(' '.join(t for t in self.cell if t))
+            self.cell = []
+        elif name == _W_TR:
+            if any(self.row):
+                self.done.append(CELL_SEP.join(self.row))
+            self.row = []
+        elif name == _W_TBL:
+            self.table_depth -= 1
+
+
+class _SheetRows:
+    """
+    Worksheet -> list of cell values per non-empty row, gaps filled from the
+    cell references. With shared=None it reads the shared-string table instead
+    (one string per <si>).
+    """
+
+    def __init__(self, shared=None):
+        self.done = []
+        self.shared = shared
+        self.values = []
+        self.kind = 'n'
+        self.ref = None
+        self.text = []
+        self.in_text = False
+        self.phonetic = False
+
+    def start(self, name, attrs):
+        if name == _S_C:
+            self.kind = attrs.get('t', 'n')
+            self.ref = attrs.get('r')
+            self.text = []
+        elif name == _S_V or name == _S_T:
+            # Phonetic guides (<rPh>) carry their own <t>; they are not part of the value
+            self.in_text = not self.phonetic
+        elif name == _S_RPH:
+            self.phonetic = True
+        elif name == _S_SI:
+            self.text = []
+
+    def data(self, text):
+        if self.in_text:
+            self.text.append(text)
+
+    def end(self, name):
+        if name == _S_V or name == _S_T:
+            self.in_text = False
+        elif name == _S_RPH:
+            self.phonetic = False
+        elif name == _S_SI:
+            self.done.append(''.join(self.text))
+        elif name == _S_C:
+            value = ''.join(self.text)
+            if self.kind == 's' and value:
+                index = int(value)
+                value = self.shared[index] if index < len(self.shared) else ''
+            elif self.kind == 'b':
+                value = 'TRUE' if value == '1' else 'FALSE'
+            column = _column_index(self.ref)
+            if column is not None and column > len(self.values):
+                self.values.extend([''] * (column - len(self.values)))
+            self.values.append(value.strip())
+        elif name == _S_ROW:
+            values = self.values
+            while values and not values[-1]:
+                values.pop()
+            if values:
+                self.done.append(values)
+            self.values = []
+
+
+# --- DOCX ---
+
+def iter_docx_lines(zf):
+    with zf.open('word/document.xml') as part:
+        yield from _parse_part(part, _DocxLines())
+
+
+def iter_docx_text(zf):
+    return _blocks(iter_docx_lines(zf))
+
+
+# --- XLSX ---
+
+def _column_index(ref):
+    if not ref:
+        return None
+    index = 0
+    for ch in ref:
+        if ch.isdigit():
+            break
+        index = index * 26 + (ord(ch) - 64)
+    return index - 1 if index else None
+
+
+def load_shared_strings(zf):
+    if 'xl/sharedStrings.xml' not in zf.namelist():
+        return []
+    with zf.open('xl/sharedStrings.xml') as part:
+        return list(_parse_part(part, _SheetRows()))
+
+
+def workbook_sheets(zf):
+    """[(sheet name, zip path)] in workbook order."""
+    rels = ET.fromstring(zf.read('xl/_rels/workbook.xml.rels'))
+    targets = {}
+    for rel in rels.iter(f'{{{PKG_REL_NS}}}Relationship'):
+        target = rel.get('Target', '')
+        targets[rel.get('Id')] = target.lstrip('/') if target.startswith('/') else 'xl/' + target
+    workbook = ET.fromstring(zf.read('xl/workbook.xml'))
+    return [(sheet.get('name'), targets.get(sheet.get(f'{{{REL_NS}}}id')))
+            for sheet in workbook.iter(f'{{{SML_NS}}}sheet')]
+
+
+def iter_sheet_rows(zf, path, shared):
+    with zf.open(path) as part:
+        yield from _parse_part(part, _SheetRows(shared))
+
+
+def iter_xlsx_lines(zf, page_chars=PAGE_CHARS):
+    shared = load_shared_strings(zf)
+    names = set(zf.namelist())
+    tables = ((f"Sheet: {name}", iter_sheet_rows(zf, path, shared))
+              for name, path in workbook_sheets(zf) if path in names)
+    return _paged_tables(tables, page_chars)
+
+
+def iter_xlsx_text(zf, page_chars=PAGE_CHARS):
+    return _blocks(iter_xlsx_lines(zf, page_chars))
+
+
+def iter_ooxml_text(s3, bucket, key, fmt, page_chars=PAGE_CHARS, block_size=RANGE_BLOCK_BYTES):
+    """Text blocks of a DOCX or XLSX in S3; the zip is closed when the generator finishes."""
+    with open_s3_zip(s3, bucket, key, block_size=block_size) as zf:
+        yield from (iter_docx_text(zf) if fmt == 'docx' else iter_xlsx_text(zf, page_chars))
@@ -0,0 +1,77 @@
+"""
+File type sniffing for document_router.
+
+The extension on an incoming/ key is whatever the sender typed, so the router
+reads the first bytes of the object (a small ranged GET) and decides from the
+magic numbers instead: PDF, JPEG, PNG, TIFF, the OOXML zip containers (DOCX
+and XLSX, told apart by their part names) and plain text. The extension is
+only a tie-breaker for text (CSV or not) and for zips whose part names are
+not in the head of the file. Text is accepted as CSV (.csv, .tsv) only;
+other text files (.txt, .json, .xml, source code) are detected as 'text'
+and rejected, as they were before sniffing.
+"""
+import re
+import struct
+
+SNIFF_BYTES = 8192
+# The zip central directory lists every part name; read from the end when the head is not enough
+ZIP_TAIL_BYTES = 64 * 1024
+
+_ZIP_NAME = re.compile(rb'(?:word|xl|ppt)/')
+_TEXT_CONTROL = re.compile(rb'[\x00-\x08\x0e-\x1f]')
+
+# Formats Textract's async text detection accepts
+OCR_TYPES = {'pdf', 'jpeg', 'png', 'tiff'}
+NATIVE_TYPES = {'docx', 'xlsx', 'csv'}
+
+
+def _zip_part_names(data):
+    """Part names from local file headers (head of the file) or central directory entries (tail)."""
+    names = []
+    for sig, name_offset in ((b'PK\x03\x04', 26), (b'PK\x01\x02', 28)):
+        pos = data.find(sig)
+        while pos != -1 and pos + name_offset + 4 <= len(data):
+            name_len, = struct.unpack_from('<H', data, pos + name_offset)
+            extra = 4 if sig == b'PK\x03\x04' else 18
+            start = pos + name_offset + extra
+            names.append(data[start:start + name_len])
+            pos = data.find(sig, start)
+    return names
+
+
+def ooxml_type(data):
+    """'docx', 'xlsx', 'pptx' or None, from whichever zip part names the bytes contain."""
+    for name in _zip_part_names(data):
+        m = _ZIP_NAME.match(name)
+        if m:
+            return {b'word/': 'docx', b'xl/': 'xlsx', b'ppt/': 'pptx'}[m.group()]
+    return None
+
+
+def _looks_like_text(head):
+    if head.startswith((b'\xef\xbb\xbf', b'\xff\xfe', b'\xfe\xff')):
+        return True
+    # Binary formats are full of NULs and control bytes; text (UTF-8 or legacy code pages) has next to none
+    return bool(head) and b'\x00' not in head and len(_TEXT_CONTROL.findall(head)) <= len(head) // 100
+
+
+def sniff(head, ext=''):
+    """
+    Detected type of a file from its first bytes: one of OCR_TYPES,
+    NATIVE_TYPES, 'zip' (a zip whose parts are not in the head yet), 'text'
+    (text that is not CSV; not routed) or None.
+    """
+    # PDF readers accept the header anywhere in the first 1KB
+    if b'%PDF-' in head[:1024]:
+        return 'pdf'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'tiff'
+    if head.startswith(b'PK\x03\x04'):
+        return ooxml_type(head) or {'.docx': 'docx', '.xlsx': 'xlsx'}.get(ext) or 'zip'
+    if _looks_like_text(head):
+        return 'csv' if ext in ('.csv', '.tsv') else 'text'
+    return None
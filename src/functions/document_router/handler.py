@@ -1,43 +1,239 @@
-import boto3
+import json
 import os
+import time
 import urllib.parse
 
-textract = boto3.client('textract')
+from file_sniffer import NATIVE_TYPES, OCR_TYPES, SNIFF_BYTES, ZIP_TAIL_BYTES, ooxml_type, sniff
+from healthtech_common.checkpoints import build_checkpoint_store, document_hash, trusted_content_hash
+from healthtech_common.clients import lazy_client
+from healthtech_common.instrumentation import instrumented, phase, record_bytes, record_count
+from healthtech_common.metrics import emit_metrics
+from healthtech_common.pdf_text import text_layer_stats
 
+# Each built on first use: native documents never touch Textract, only completion events touch Step Functions
+textract = lazy_client('textract')
+s3 = lazy_client('s3')
+sfn = lazy_client('stepfunctions')
+
+# Stage checkpoints: documents whose OCR text survives from an earlier run skip Textract
+checkpoints = build_checkpoint_store(s3, os.environ.get('BUCKET_NAME'))
+
+# CALLBACK: Textract publishes completion to SNS and textract_callback resumes the
+# execution via a task token. POLL: content_splitter polls with backoff (fallback).
+TEXTRACT_COMPLETION_MODE = os.environ.get('TEXTRACT_COMPLETION_MODE', 'CALLBACK')
+TEXTRACT_SNS_TOPIC_ARN = os.environ.get('TEXTRACT_SNS_TOPIC_ARN')
+TEXTRACT_ROLE_ARN = os.environ.get('TEXTRACT_ROLE_ARN')
+CALLBACK_PREFIX = "temp/textract_callbacks"
+
+# PDFs with a readable text layer skip Textract: 'on' routes them to native parsing,
+# 'shadow' only reports what would have been routed, 'off' sends every PDF to Textract
+PDF_TEXT_DETECTION = os.environ.get('PDF_TEXT_DETECTION', 'on')
+PDF_SAMPLE_BYTES = int(os.environ.get('PDF_SAMPLE_BYTES', str(512 * 1024)))
+PDF_MIN_TEXT_CHARS = int(os.environ.get('PDF_MIN_TEXT_CHARS', '200'))
+PDF_MIN_TEXT_QUALITY = float(os.environ.get('PDF_MIN_TEXT_QUALITY', '0.9'))
+# Async DetectDocumentText list price, for the cost-avoided metric
+TEXTRACT_PRICE_PER_PAGE = float(os.environ.get('TEXTRACT_PRICE_PER_PAGE', '0.0015'))
+
+def _callback_enabled():
+    return TEXTRACT_COMPLETION_MODE == 'CALLBACK' and bool(TEXTRACT_SNS_TOPIC_ARN and TEXTRACT_ROLE_ARN)
+
+def _read_json(bucket, key):
+    try:
+        with phase('S3Read'):
+            obj = s3.get_object(Bucket=bucket, Key=key)
+            return json.loads(obj['Body'].read())
+    except s3.exceptions.NoSuchKey:
+        return None
+
+def _resume_execution(task_token, completion):
+    """Hand the Textract completion back to the waiting AwaitTextract state."""
+    try:
+        with phase('ResumeExecution'):
+            if completion.get('status') == 'SUCCEEDED':
+                sfn.send_task_success(taskToken=task_token, output=json.dumps(completion))
+            else:
+                sfn.send_task_failure(
+                    taskToken=task_token,
+                    error='TextractJobFailed',
+                    cause=json.dumps(completion),
+                )
+        record_count('ExecutionsResumed')
+    except (sfn.exceptions.InvalidToken, sfn.exceptions.TaskTimedOut, sfn.exceptions.TaskDoesNotExist):
+        # textract_callback got there first, or the state already timed out.
+        print(f"Task token for job {completion.get('job_id')} already resolved")
+
+def register_callback(event):
+    """
+    Invoked by the AwaitTextract state (lambda:invoke.waitForTaskToken).
+    Stores the task token for textract_callback. If the SNS notification beat
+    us here, the completion marker already exists and we resume immediately.
+    """
+    bucket = os.environ['BUCKET_NAME']
+    job_id = event['job_id']
+
+    with phase('S3Write'):
+        s3.put_object(
+            Bucket=bucket,
+            Key=f"{CALLBACK_PREFIX}/{job_id}/token.json",
+            Body=json.dumps({"task_token": event['task_token']}),
+        )
+
+    completion = _read_json(bucket, f"{CALLBACK_PREFIX}/{job_id}/completion.json")
+    if completion:
+        _resume_execution(event['task_token'], completion)
+
+    return {"registered": True, "job_id": job_id}
+
+def _read_range(bucket, key, start, end):
+    """Bytes [start, end) of the object."""
+    if end <= start:
+        return b''
+    with phase('S3Read'):
+        data = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}")['Body'].read()
+    record_bytes('S3Read', len(data))
+    return data
+
+def _has_text_layer(stats):
+    # Full-page images on half the text pages or more: a scan with an OCR layer, which Textract reads better
+    return (stats['chars'] >= PDF_MIN_TEXT_CHARS
+            and stats['quality'] >= PDF_MIN_TEXT_QUALITY
+            and stats['scan_images'] * 2 < stats['text_streams'])
+
+def detect_file_type(bucket, key, ext, size):
+    """
+    (detected type, PDF text-layer stats or None, bytes read). Reads the head
+    of the object, plus the zip directory or a larger PDF sample when needed.
+    """
+    head = _read_range(bucket, key, 0, min(size, SNIFF_BYTES))
+    read = len(head)
+    detected = sniff(head, ext)
+
+    if detected == 'zip':
+        tail = _read_range(bucket, key, max(0, size - ZIP_TAIL_BYTES), size)
+        read += len(tail)
+        detected = ooxml_type(tail) or 'zip'
+
+    text_layer = None
+    if detected == 'pdf' and PDF_TEXT_DETECTION != 'off':
+        sample = head + _read_range(bucket, key, len(head), min(size, PDF_SAMPLE_BYTES))
+        read = len(sample)
+        with phase('PdfTextScan'):
+            text_layer = text_layer_stats(sample)
+
+    return detected, text_layer, read
+
+def _emit_routing_metrics(route, detected, text_layer, text_pdf, sniff_bytes, sniff_ms):
+    pages = (text_layer or {}).get('pages') or 0
+    pages_avoided = pages if route == 'NATIVE_PARSE' and detected == 'pdf' else 0
+    emit_metrics(
+        {
+            "Documents": (1, "Count"),
+            "SniffBytes": (sniff_bytes, "Bytes"),
+            "SniffLatency": (round(sniff_ms, 2), "Milliseconds"),
+            "TextractPagesAvoided": (pages_avoided, "Count"),
+            "TextractCostAvoidedUSD": (round(pages_avoided * TEXTRACT_PRICE_PER_PAGE, 6), "None"),
+        },
+        {"Route": route, "DetectedType": detected or "unknown"},
+        properties={
+            "Function": "document_router",
+            "PdfTextDetection": PDF_TEXT_DETECTION,
+            # In shadow mode: PDFs that would have skipped Textract
+            "TextLayerDetected": text_pdf,
+            "TextLayer": text_layer,
+        },
+    )
+
+@instrumented('document_router')
 def lambda_handler(event, context):
+    if event.get('action') == 'register_callback':
+        return register_callback(event)
+
     # Triggered by EventBridge (Object Created in 'incoming/')
     bucket = event['detail']['bucket']['name']
     key = urllib.parse.unquote_plus(event['detail']['object']['key'])
     
-    # Determine File Type
+    # The extension is only a hint; the type comes from the file's magic bytes
     ext = os.path.splitext(key)[1].lower()
     
     # Fetch Metadata (to pass Source Info down the line)
-    head_obj = boto3.client('s3').head_object(Bucket=bucket, Key=key)
-    metadata = head_obj.get('Metadata', {})
+    with phase('S3Head'):
+        head_obj = s3.head_object(Bucket=bucket, Key=key)
+    metadata = dict(head_obj.get('Metadata', {}))
+    if trusted_content_hash(key, metadata) is None:
+        # Only mime_extractor's hash goes downstream (checkpoints, patient index, ledger)
+        metadata.pop('content_sha256', None)
+    doc_hash = document_hash(head_obj, key)
     
-    print(f"Routing file: {key} (Type: {ext})")
+    started = time.perf_counter()
+    detected, text_layer, sniff_bytes = detect_file_type(bucket, key, ext, head_obj.get('ContentLength', 0))
+    sniff_ms = (time.perf_counter() - started) * 1000
+
+    text_pdf = detected == 'pdf' and text_layer is not None and _has_text_layer(text_layer)
+    native_pdf = text_pdf and PDF_TEXT_DETECTION == 'on'
     
-    if ext in ['.pdf', '.jpg', '.png', '.jpeg']:
+    print(f"Routing file: {key} (Extension: {ext}, Detected: {detected}, Text layer: {text_pdf})")
+    
+    if native_pdf:
+        # Born-digital PDF: content_splitter reads the text layer directly
+        _emit_routing_metrics('NATIVE_PARSE', detected, text_layer, text_pdf, sniff_bytes, sniff_ms)
+        return {
+            "mode": "NATIVE_PARSE",
+            "format": "pdf",
+            "bucket": bucket,
+            "key": key,
+            "metadata": metadata,
+            "document_hash": doc_hash,
+        }
+
+    if detected in OCR_TYPES and checkpoints and checkpoints.has_text(doc_hash, 'ocr.txt'):
+        # An earlier run already paid for OCR: content_splitter reads its text checkpoint
+        record_count('CheckpointHits')
+        _emit_routing_metrics('NATIVE_PARSE', detected, text_layer, text_pdf, sniff_bytes, sniff_ms)
+        return {
+            "mode": "NATIVE_PARSE",
+            "format": "ocr",
+            "text_key": checkpoints.key(doc_hash, 'ocr.txt'),
+            "bucket": bucket,
+            "key": key,
+            "metadata": metadata,
+            "document_hash": doc_hash,
+        }
+
+    if detected in OCR_TYPES:
         # Start Async Textract
-        response = textract.start_document_text_detection(
-            DocumentLocation={'S3Object': {'Bucket': bucket, 'Name': key}}
-        )
+        request = {'DocumentLocation': {'S3Object': {'Bucket': bucket, 'Name': key}}}
+        completion_mode = 'POLL'
+        if _callback_enabled():
+            request['NotificationChannel'] = {
+                'SNSTopicArn': TEXTRACT_SNS_TOPIC_ARN,
+                'RoleArn': TEXTRACT_ROLE_ARN,
+            }
+            completion_mode = 'CALLBACK'
+
+        with phase('TextractStart'):
+            response = textract.start_document_text_detection(**request)
+        _emit_routing_metrics('ASYNC_OCR', detected, text_layer, text_pdf, sniff_bytes, sniff_ms)
         return {
             "mode": "ASYNC_OCR",
+            "completion_mode": completion_mode,
             "job_id": response['JobId'],
             "bucket": bucket,
             "key": key,
-            "metadata": metadata
+            "metadata": metadata,
+            "document_hash": doc_hash,
         }
     
-    elif ext in ['.csv', '.xlsx', '.docx']:
+    elif detected in NATIVE_TYPES:
+        _emit_routing_metrics('NATIVE_PARSE', detected, text_layer, text_pdf, sniff_bytes, sniff_ms)
         return {
             "mode": "NATIVE_PARSE",
+            "format": detected,
             "bucket": bucket,
             "key": key,
-            "metadata": metadata
+            "metadata": metadata,
+            "document_hash": doc_hash,
         }
         
     else:
-        raise ValueError(f"Unsupported file type: {ext}")
+        _emit_routing_metrics('UNSUPPORTED', detected, text_layer, text_pdf, sniff_bytes, sniff_ms)
+        raise ValueError(f"Unsupported file type: {ext} (detected: {detected})")
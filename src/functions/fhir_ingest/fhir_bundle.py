@@ -0,0 +1,106 @@
+"""
+Bundle-based FHIR writer for HealthLake.
+
+Resources are collected into `transaction` or `batch` Bundles bounded by entry
+count and serialized size, POSTed to the datastore root, and the per-entry
+responses are mapped back to the order resources were added.
+
+Related resources (e.g. a Patient and the Provenance that targets it) are
+added as one group and always land in the same Bundle:
+- transaction: entries are POSTed with `urn:uuid:` fullUrls and references
+  between them are resolved by the server
+- batch: entries are PUT to `{type}/{id}` so references use the client id;
+  a conditional PUT URL cannot be referenced, so callers write such a
+  resource before the ones that point at it
+"""
+import json
+import uuid
+
+
+def _status_code(status: str) -> int:
+    # FHIR entry.response.status is e.g. "201 Created"
+    try:
+        return int(str(status).split()[0])
+    except (ValueError, IndexError):
+        return 0
+
+
+class BundleWriter:
+    def __init__(self, post_bundle, bundle_type: str = "transaction", max_entries: int = 100,
+                 max_bytes: int = 4 * 1024 * 1024):
+        if bundle_type not in ("transaction", "batch"):
+            raise ValueError(f"Unsupported bundle type: {bundle_type}")
+        self.post_bundle = post_bundle
+        self.bundle_type = bundle_type
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.responses: list[dict] = []
+        self.bundles_posted = 0
+        self._entries: list[dict] = []
+        self._bytes = 0
+
+    def entry_for(self, resource: dict, put_url: str | None = None) -> dict:
+        """
+        Wrap a resource as a Bundle entry; use reference_for(entry) to point
+        other resources at it. put_url makes the entry a PUT to that URL, e.g.
+        `Patient/{id}` or a conditional update `Patient?identifier=...`.
+        """
+        resource_type = resource["resourceType"]
+        if self.bundle_type == "transaction":
+            return {
+                "fullUrl": f"urn:uuid:{uuid.uuid4()}",
+                "resource": resource,
+                "request": {"method": "PUT", "url": put_url} if put_url else {"method": "POST", "url": resource_type},
+            }
+
+        if not put_url:
+            resource.setdefault("id", str(uuid.uuid4()))
+        return {
+            "resource": resource,
+            "request": {"method": "PUT", "url": put_url or f"{resource_type}/{resource['id']}"},
+        }
+
+    def reference_for(self, entry: dict) -> str:
+        if self.bundle_type == "transaction":
+            return entry["fullUrl"]
+        return entry["request"]["url"]
+
+    def add_group(self, entries: list[dict]) -> list[int]:
+        """Queue entries that must share a Bundle. Returns their indexes into self.responses."""
+        size = sum(len(json.dumps(e, ensure_ascii=False).encode("utf-8")) for e in entries)
+        if self._entries and (
+            len(self._entries) + len(entries) > self.max_entries or self._bytes + size > self.max_bytes
+        ):
+            self.flush()
+
+        first = len(self.responses) + len(self._entries)
+        self._entries.extend(entries)
+        self._bytes += size
+        return list(range(first, first + len(entries)))
+
+    def flush(self) -> None:
+        if not self._entries:
+            return
+
+        bundle = {"resourceType": "Bundle", "type": self.bundle_type, "entry": self._entries}
+        result = self.post_bundle(bundle) or {}
+        self.bundles_posted += 1
+
+        response_entries = result.get("entry") or []
+        for n, sent in enumerate(self._entries):
+            resp = response_entries[n].get("response", {}) if n < len(response_entries) else {}
+            location = resp.get("location") or ""
+            self.responses.append({
+                "resourceType": sent["resource"]["resourceType"],
+                "status": _status_code(resp.get("status")),
+                "location": location,
+                # Location is "{type}/{id}/_history/{version}", possibly absolute
+                "id": location.split("/_history")[0].rstrip("/").split("/")[-1] if location else sent["resource"].get("id"),
+                "outcome": resp.get("outcome"),
+            })
+
+        self._entries = []
+        self._bytes = 0
+
+    def failures(self) -> list[dict]:
+        return [r for r in self.responses if not 200 <= r["status"] < 300]
@@ -1,17 +1,62 @@
-import boto3
 import json
 import uuid
 import os
 import html
-import urllib3
-import botocore.session
-from botocore.auth import SigV4Auth
-from botocore.awsrequest import AWSRequest
-
-# Control-plane client (not used for FHIR CRUD)
-healthlake = boto3.client("healthlake")
-
-_http = urllib3.PoolManager()
+import logging
+import urllib.parse
+from collections.abc import Iterator
+from datetime import datetime, timezone
+
+from fhir_bundle import BundleWriter
+from healthtech_common.attachment_ledger import LEDGER_PREFIX, build_attachment_ledger
+from healthtech_common.cache_generation import bump_generation
+from healthtech_common.clients import lazy_client
+from healthtech_common.healthlake import get_client
+from healthtech_common.instrumentation import instrumented, phase, record_count
+from patient_index import build_patient_index, document_key, identifier_key
+from result_stream import iter_result_records
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# FHIR requests go through healthtech_common.healthlake; S3 holds the chunk results and the cache generation
+s3 = lazy_client("s3")
+
+# 'bundle': one transaction/batch Bundle POST per group of resources; 'single': one POST per resource
+FHIR_WRITE_MODE = os.environ.get("FHIR_WRITE_MODE", "bundle")
+FHIR_BUNDLE_TYPE = os.environ.get("FHIR_BUNDLE_TYPE", "transaction")
+FHIR_BUNDLE_MAX_ENTRIES = int(os.environ.get("FHIR_BUNDLE_MAX_ENTRIES", "100"))
+FHIR_BUNDLE_MAX_BYTES = int(os.environ.get("FHIR_BUNDLE_MAX_BYTES", str(4 * 1024 * 1024)))
+
+# 'conditional': upsert the Patient keyed on its identifier; 'create': new Patient on every run
+FHIR_UPSERT_MODE = os.environ.get("FHIR_UPSERT_MODE", "conditional")
+
+# Parallel GETs when reading chunk results back through the splitter's manifest
+RESULT_FETCH_CONCURRENCY = int(os.environ.get("RESULT_FETCH_CONCURRENCY", "16"))
+
+# Namespace for ids derived from document keys (placeholder identifiers, Provenance ids)
+_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "urn:healthtech:fhir-ingest")
+# Provenance entity extension listing the source document pages, e.g. "1-3, 7"
+SOURCE_PAGES_EXTENSION = "https://example.com/fhir/StructureDefinition/source-pages"
+
+# Lives for the container lifetime so warm invocations share the memory tier
+patient_index = build_patient_index(
+    os.environ.get("PATIENT_INDEX_BACKEND", "memory"),
+    s3=s3,
+    bucket=os.environ.get("BUCKET_NAME"),
+    prefix=os.environ.get("PATIENT_INDEX_PREFIX", "index/patients"),
+    table_name=os.environ.get("PATIENT_INDEX_TABLE"),
+    max_entries=int(os.environ.get("PATIENT_INDEX_MAX_ENTRIES", "4096")),
+)
+
+# mime_extractor's claim on an email attachment's content hash; the outcome is recorded on it here
+attachment_ledger = build_attachment_ledger(
+    os.environ.get("ATTACHMENT_LEDGER_BACKEND", "none"),
+    s3=s3,
+    bucket=os.environ.get("BUCKET_NAME"),
+    prefix=os.environ.get("ATTACHMENT_LEDGER_PREFIX", LEDGER_PREFIX),
+    table_name=os.environ.get("ATTACHMENT_LEDGER_TABLE"),
+)
 
 
 def _is_unknown(v):
@@ -28,6 +73,10 @@ def _normalize_gender(v):
 
 
 def _is_legal_appendix_chunk(res: dict) -> bool:
+    # Set by the guardrail pre-classifier when it settled the chunk without a model call
+    if res.get("category") == "LEGAL_APPENDIX":
+        return True
+
     reason = (res.get("reason") or "").lower()
 
     legal_markers = [
@@ -52,104 +101,150 @@ def _is_legal_appendix_chunk(res: dict) -> bool:
     return True
 
 
-def _sigv4_post_to_healthlake(url: str, body_json: dict) -> dict:
-    region = os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION")
-    if not region:
-        raise ValueError("AWS_REGION is not set")
+def _healthlake_fhir_create(datastore_id: str, resource: dict) -> dict:
+    resource_type = resource.get("resourceType")
+    if not resource_type:
+        raise ValueError("FHIR resource missing resourceType")
 
-    body = json.dumps(body_json).encode("utf-8")
+    return get_client(datastore_id).post(resource_type, resource)
 
-    session = botocore.session.get_session()
-    creds = session.get_credentials()
-    if creds is None:
-        raise ValueError("No AWS credentials available for SigV4 signing")
-    frozen = creds.get_frozen_credentials()
 
-    req = AWSRequest(
-        method="POST",
-        url=url,
-        data=body,
-        headers={"Content-Type": "application/fhir+json", "Accept": "application/json"},
+def _new_bundle_writer(datastore_id: str) -> BundleWriter:
+    client = get_client(datastore_id)
+    return BundleWriter(
+        lambda bundle: client.post("", bundle),
+        bundle_type=FHIR_BUNDLE_TYPE,
+        max_entries=FHIR_BUNDLE_MAX_ENTRIES,
+        max_bytes=FHIR_BUNDLE_MAX_BYTES,
     )
-    SigV4Auth(frozen, "healthlake", region).add_auth(req)
-    prepared = req.prepare()
-
-    resp = _http.request(
-        "POST",
-        url,
-        body=body,
-        headers=dict(prepared.headers),
-        retries=False,
-        timeout=urllib3.Timeout(connect=5.0, read=30.0),
-    )
-
-    resp_text = resp.data.decode("utf-8") if resp.data else ""
-    if resp.status not in (200, 201):
-        raise Exception(f"HealthLake FHIR create failed status={resp.status} body={resp_text}")
 
-    return json.loads(resp_text) if resp_text else {}
 
+def _dedup_key(value: str) -> str:
+    """Vitals/medication strings that differ only in case, spacing or trailing punctuation are one value."""
+    return " ".join(str(value).casefold().split()).rstrip(".,;")
 
-def _healthlake_fhir_create(datastore_id: str, resource: dict) -> dict:
-    region = os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION")
-    resource_type = resource.get("resourceType")
-    if not resource_type:
-        raise ValueError("FHIR resource missing resourceType")
-
-    url = f"https://healthlake.{region}.amazonaws.com/datastore/{datastore_id}/r4/{resource_type}"
-    return _sigv4_post_to_healthlake(url, resource)
 
-
-def _aggregate_entities_one_patient(valid_results: list[dict]) -> dict:
+class ResultAggregator:
     """
-    Merge chunk-level entities into one patient-level entity set.
+    One pass over chunk results: partitions them (valid, noise, legal
+    appendix, hard invalid) and merges the valid chunks' entities into one
+    patient-level entity set. Only counts, first-seen values and the distinct
+    vitals/medications are kept, never the results themselves.
+
     Preference order: first non-unknown value wins.
-    Vitals/Medications: concatenate unique non-unknown strings.
+    Vitals/Medications: distinct non-unknown strings in first-seen order.
     """
-    agg = {
-        "PatientName": "<UNKNOWN>",
-        "PatientIdentifier": "<UNKNOWN>",
-        "Gender": "unknown",
-        "Vitals": "<UNKNOWN>",
-        "Medications": "<UNKNOWN>",
-    }
-
-    vitals = []
-    meds = []
 
-    for res in valid_results:
-        e = res.get("entities", {}) or {}
-
-        # PatientName
+    def __init__(self):
+        self.results = 0
+        self.valid = 0
+        self.noise = 0
+        self.legal_appendix = 0
+        self.hard_invalid = 0
+        self.first_invalid_reason = None
+        self.first_hard_invalid_reason = None
+        self.metadata = None
+        self._pages: list[list[int]] = []
+        self.entities = {
+            "PatientName": "<UNKNOWN>",
+            "PatientIdentifier": "<UNKNOWN>",
+            "Gender": "unknown",
+        }
+        self._vitals: dict[str, str] = {}
+        self._meds: dict[str, str] = {}
+
+    @property
+    def decided(self) -> bool:
+        """A hard-invalid chunk next to medical content rejects the document; nothing later changes that."""
+        return self.valid > 0 and self.hard_invalid > 0
+
+    def add(self, res: dict) -> None:
+        self.results += 1
+        classification = res.get("classification")
+        if classification == "VALID":
+            self.valid += 1
+            if self.metadata is None:
+                self.metadata = res.get("metadata", {})
+            self._merge(res.get("entities", {}) or {})
+            if res.get("pages"):
+                self._add_pages(*res["pages"])
+        elif classification == "INVALID":
+            if self.first_invalid_reason is None:
+                self.first_invalid_reason = res.get("reason", "No valid medical content found.")
+            # Blank/OCR-noise and legal appendix chunks are ignored when the document has medical content
+            noise = res.get("category") == "NOISE"
+            legal = _is_legal_appendix_chunk(res)
+            self.noise += noise
+            self.legal_appendix += legal
+            if not (noise or legal):
+                self.hard_invalid += 1
+                if self.first_hard_invalid_reason is None:
+                    self.first_hard_invalid_reason = res.get("reason", "Contains invalid content.")
+
+    def _merge(self, e: dict) -> None:
+        agg = self.entities
         if _is_unknown(agg["PatientName"]) and not _is_unknown(e.get("PatientName")):
             agg["PatientName"] = e.get("PatientName")
 
-        # PatientIdentifier
         if _is_unknown(agg["PatientIdentifier"]) and not _is_unknown(e.get("PatientIdentifier")):
             agg["PatientIdentifier"] = e.get("PatientIdentifier")
 
-        # Gender
         if agg["Gender"] == "unknown" and not _is_unknown(e.get("Gender")):
             agg["Gender"] = _normalize_gender(e.get("Gender"))
 
-        # Vitals / Medications (collect, then join)
-        v = e.get("Vitals")
-        if not _is_unknown(v) and v not in vitals:
-            vitals.append(v)
-
-        m = e.get("Medications")
-        if not _is_unknown(m) and m not in meds:
-            meds.append(m)
+        for field, seen in (("Vitals", self._vitals), ("Medications", self._meds)):
+            value = e.get(field)
+            if not _is_unknown(value):
+                seen.setdefault(_dedup_key(value), value)
+
+    def _add_pages(self, first: int, last: int) -> None:
+        # Chunks arrive in document order, so a range usually extends the previous one
+        if self._pages and self._pages[-1][0] <= first <= self._pages[-1][1] + 1:
+            self._pages[-1][1] = max(self._pages[-1][1], last)
+        else:
+            self._pages.append([first, last])
+
+    @property
+    def source_pages(self) -> list[list[int]]:
+        """Merged [first, last] page ranges of the valid chunks; empty when the source has no page numbers."""
+        merged: list[list[int]] = []
+        for first, last in sorted(self._pages):
+            if merged and first <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], last)
+            else:
+                merged.append([first, last])
+        return merged
+
+    def merged_entities(self) -> dict:
+        return {
+            **self.entities,
+            "Vitals": " | ".join(self._vitals.values()) if self._vitals else "<UNKNOWN>",
+            "Medications": " | ".join(self._meds.values()) if self._meds else "<UNKNOWN>",
+        }
+
+
+def _iter_results(event) -> Iterator[dict]:
+    """
+    Chunk results from the manifest content_splitter wrote (the Map state keeps
+    them out of the payload), or from an inline Map output list. Batched
+    guardrail invocations contribute a list of per-chunk records; both are flattened.
+    """
+    if isinstance(event, dict) and event.get("results_manifest"):
+        yield from iter_result_records(s3, event["results_manifest"], max_workers=RESULT_FETCH_CONCURRENCY)
+        return
+    for r in (event if isinstance(event, list) else []):
+        yield from (r if isinstance(r, list) else [r])
 
-    if vitals:
-        agg["Vitals"] = " | ".join(vitals)
-    if meds:
-        agg["Medications"] = " | ".join(meds)
 
-    return agg
+def _document_id(event) -> str | None:
+    """The source document's identity from the splitter's manifest: its document_hash, else its S3 object."""
+    manifest = event.get("results_manifest") if isinstance(event, dict) else None
+    if not manifest:
+        return None
+    return manifest.get("document_hash") or manifest.get("source")
 
 
-def _map_entities_to_patient_fhir(entities: dict) -> dict:
+def _map_entities_to_patient_fhir(entities: dict, document_id: str | None = None) -> dict:
     """
     Create a Patient resource that passes:
     - Narrative XHTML constraints [web:152]
@@ -161,11 +256,13 @@ def _map_entities_to_patient_fhir(entities: dict) -> dict:
     family = name_parts[-1] if len(name_parts) > 1 else patient_name
     given = name_parts[:-1] if len(name_parts) > 1 else [patient_name]
 
-    # Always provide identifier (real if extracted, else UUID placeholder)
+    # Always provide identifier (real if extracted, else a placeholder that is
+    # stable for the same document, so a re-run upserts the same Patient; two
+    # documents never share one, however alike their entities)
     identifier_system = os.environ.get("PATIENT_ID_SYSTEM", "urn:healthtech:patient-identifier")
     identifier_value = entities.get("PatientIdentifier")
     if _is_unknown(identifier_value):
-        identifier_value = str(uuid.uuid4())
+        identifier_value = str(uuid.uuid5(_ID_NAMESPACE, document_key(document_id)) if document_id else uuid.uuid4())
 
     gender = _normalize_gender(entities.get("Gender"))
 
@@ -190,46 +287,217 @@ def _map_entities_to_patient_fhir(entities: dict) -> dict:
     }
 
 
-def lambda_handler(event, context):
-    results = event if isinstance(event, list) else []
+def _format_pages(source_pages: list[list[int]]) -> str:
+    return ", ".join(str(first) if first == last else f"{first}-{last}" for first, last in source_pages)
+
+
+def _build_provenance(target_reference: str, metadata: dict, source_agent: str,
+                      source_pages: list[list[int]] | None = None) -> dict:
+    """
+    Provenance for an AI-ingested resource: the pipeline assembled it from a
+    document sent by source_agent. source_pages (OCR documents) are the page
+    ranges the extracted entities came from.
+    """
+    participant_system = "http://terminology.hl7.org/CodeSystem/provenance-participant-type"
+    source_name = metadata.get("original_name") or "uploaded document"
+    source = {
+        "role": "source",
+        "what": {"display": f"{source_name} via {metadata.get('source_channel', 'web')}"},
+    }
+    if source_pages:
+        pages = _format_pages(source_pages)
+        source["what"]["display"] += f", pages {pages}"
+        source["extension"] = [{"url": SOURCE_PAGES_EXTENSION, "valueString": pages}]
 
-    valid_results = [r for r in results if r.get("classification") == "VALID"]
-    invalid_results = [r for r in results if r.get("classification") == "INVALID"]
+    return {
+        "resourceType": "Provenance",
+        "target": [{"reference": target_reference}],
+        "recorded": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "agent": [
+            {
+                "type": {"coding": [{"system": participant_system, "code": "assembler"}]},
+                "who": {"display": "HealthTech AI ingest pipeline"},
+            },
+            {
+                "type": {"coding": [{"system": participant_system, "code": "author"}]},
+                "who": {"display": str(source_agent)},
+            },
+        ],
+        "entity": [source],
+    }
+
+
+def _write_resources(datastore_id: str, patient_resource: dict, metadata: dict, source_agent: str,
+                     patient_url: str | None = None, provenance_id: str | None = None,
+                     source_pages: list[list[int]] | None = None) -> dict:
+    """
+    Write the Patient and its Provenance; returns the Patient write result.
+
+    patient_url makes the Patient write a PUT to that URL (by id, or a
+    conditional update on its identifier). provenance_id makes the Provenance
+    a PUT by id, so a retried write replaces it instead of adding another.
+    """
+    client = get_client(datastore_id)
+    provenance_url = f"Provenance/{provenance_id}" if provenance_id else None
+
+    # batch Bundle entries cannot reference a conditionally-updated Patient, so write it first
+    if FHIR_WRITE_MODE == "single" or (patient_url and FHIR_BUNDLE_TYPE == "batch"):
+        if patient_url:
+            written = client.put(patient_url, patient_resource)
+        else:
+            written = _healthlake_fhir_create(datastore_id, patient_resource)
+        patient_id = written.get("id") or patient_resource.get("id")
+        if not patient_id:
+            raise Exception(f"HealthLake returned no Patient id for {patient_url or 'create'}")
+
+        provenance = _build_provenance(f"Patient/{patient_id}", metadata, source_agent, source_pages)
+        if provenance_id:
+            provenance["id"] = provenance_id
+            client.put(provenance_url, provenance)
+        else:
+            _healthlake_fhir_create(datastore_id, provenance)
+        return {"patient_id": patient_id, "resources_written": 2, "requests": 2}
+
+    writer = _new_bundle_writer(datastore_id)
+    patient_entry = writer.entry_for(patient_resource, put_url=patient_url)
+    provenance = _build_provenance(writer.reference_for(patient_entry), metadata, source_agent, source_pages)
+    if provenance_id:
+        provenance["id"] = provenance_id
+    patient_idx, _ = writer.add_group([patient_entry, writer.entry_for(provenance, put_url=provenance_url)])
+    writer.flush()
+
+    failures = writer.failures()
+    if failures:
+        raise Exception(f"HealthLake Bundle entries failed: {json.dumps(failures)}")
+
+    return {
+        "patient_id": writer.responses[patient_idx]["id"],
+        "resources_written": len(writer.responses),
+        "requests": writer.bundles_posted,
+    }
+
+
+def _upsert_resources(datastore_id: str, patient_resource: dict, document_id: str | None, metadata: dict,
+                      source_agent: str, source_pages: list[list[int]] | None = None) -> dict:
+    """
+    Idempotent variant of _write_resources.
+
+    - document already ingested (index hit): nothing is written; without a
+      document_id (inline results) the document is not indexed
+    - patient known (index hit): PUT Patient/{id}
+    - otherwise: conditional update `PUT Patient?identifier=system|value`,
+      which creates the Patient or updates the one carrying that identifier
+    """
+    identifier = patient_resource["identifier"][0]
+    id_key = identifier_key(identifier["system"], identifier["value"])
+    doc_key = document_key(document_id) if document_id else None
+
+    seen = patient_index.get(doc_key) if patient_index and doc_key else None
+    if seen:
+        return {"patient_id": seen["patient_id"], "resources_written": 0, "requests": 0, "deduplicated": True}
+
+    known = patient_index.get(id_key) if patient_index else None
+    if known:
+        patient_resource["id"] = known["patient_id"]
+        patient_url = f"Patient/{known['patient_id']}"
+    else:
+        # The server picks (or keeps) the id on a conditional update
+        patient_resource.pop("id", None)
+        token = urllib.parse.quote(f"{identifier['system']}|{identifier['value']}", safe="")
+        patient_url = f"Patient?identifier={token}"
+
+    written = _write_resources(
+        datastore_id, patient_resource, metadata, source_agent,
+        patient_url=patient_url,
+        provenance_id=str(uuid.uuid5(_ID_NAMESPACE, f"provenance:{doc_key}") if doc_key else uuid.uuid4()),
+        source_pages=source_pages,
+    )
+
+    if patient_index:
+        entry = {"patient_id": written["patient_id"]}
+        patient_index.put(id_key, entry)
+        if doc_key:
+            patient_index.put(doc_key, entry)
+    return {**written, "deduplicated": False}
+
+
+def _complete_attachment(event, response: dict) -> None:
+    digest = (event.get("results_manifest") or {}).get("content_sha256") if isinstance(event, dict) else None
+    if attachment_ledger and digest:
+        attachment_ledger.complete(digest, response["status"], patient_id=response.get("patient_id"),
+                                   execution_arn=event.get("execution_arn"))
+
+
+def _ingest(event) -> dict:
+    results = ResultAggregator()
+    # Includes waiting on ResultFetch
+    with phase("Aggregate"):
+        for res in _iter_results(event):
+            results.add(res)
+            if results.decided:
+                break
+    record_count("ChunkResults", results.results)
 
     # Reject only if NO valid chunks exist
-    if not valid_results:
-        reason = invalid_results[0].get("reason", "No valid medical content found.") if invalid_results else "Empty input"
+    if not results.valid:
+        reason = results.first_invalid_reason or "Empty input"
         return {"status": "REJECTED", "reason": reason}
 
-    # Ignore legal appendix invalid chunks when doc has medical content
-    legal_appendix = [r for r in invalid_results if _is_legal_appendix_chunk(r)]
-    hard_invalid = [r for r in invalid_results if r not in legal_appendix]
-
     # Optional safety: reject if hard-invalid mixed in
-    if hard_invalid:
-        reason = hard_invalid[0].get("reason", "Contains invalid content.")
-        return {"status": "REJECTED", "reason": reason}
+    if results.hard_invalid:
+        return {"status": "REJECTED", "reason": results.first_hard_invalid_reason}
 
-    metadata = valid_results[0].get("metadata", {}) if valid_results else {}
+    metadata = results.metadata or {}
     source_agent = metadata.get("sender", "Web Upload")
 
     # Merge entities across chunks into ONE patient
-    merged_entities = _aggregate_entities_one_patient(valid_results)
+    merged_entities = results.merged_entities()
 
     # If merge produced nothing useful, skip
     if _is_unknown(merged_entities.get("PatientName")) and _is_unknown(merged_entities.get("PatientIdentifier")):
         return {"status": "SKIPPED", "reason": "No usable patient entities extracted"}
 
-    patient_resource = _map_entities_to_patient_fhir(merged_entities)
+    document_id = _document_id(event)
+    patient_resource = _map_entities_to_patient_fhir(merged_entities, document_id)
 
     datastore_id = os.environ["HEALTHLAKE_ID"]
-    _healthlake_fhir_create(datastore_id, patient_resource)
+    with phase("FhirWrite"):
+        if FHIR_UPSERT_MODE == "conditional":
+            written = _upsert_resources(datastore_id, patient_resource, document_id, metadata, source_agent,
+                                        results.source_pages)
+        else:
+            written = _write_resources(datastore_id, patient_resource, metadata, source_agent,
+                                       source_pages=results.source_pages)
+    record_count("ResourcesWritten", written["resources_written"])
+
+    if patient_index:
+        logger.info("Patient index stats=%s", json.dumps(patient_index.stats))
+
+    if written["resources_written"] and os.environ.get("BUCKET_NAME"):
+        # Invalidate patient_query response caches; their TTL still bounds staleness if this fails
+        try:
+            bump_generation(s3, os.environ["BUCKET_NAME"])
+        except Exception as e:
+            logger.warning("Cache generation bump failed: %s", str(e))
 
     return {
         "status": "SUCCESS",
         "items_processed": 1,
+        "patient_id": written["patient_id"],
+        "resources_written": written["resources_written"],
+        "deduplicated": written.get("deduplicated", False),
         "source_agent": source_agent,
-        "ignored_legal_chunks": len(legal_appendix),
+        "ignored_legal_chunks": results.legal_appendix,
+        "ignored_noise_chunks": results.noise,
+        "chunk_results": results.results,
         "used_placeholder_identifier": _is_unknown(merged_entities.get("PatientIdentifier")),
         "gender": merged_entities.get("Gender", "unknown"),
     }
+
+
+@instrumented("fhir_ingest")
+def lambda_handler(event, context):
+    response = _ingest(event)
+    # Ingested, rejected or skipped, the document is finished; a failed write raises above and leaves the claim pending
+    _complete_attachment(event, response)
+    return response
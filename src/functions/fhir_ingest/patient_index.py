@@ -0,0 +1,146 @@
+"""
+Lookup index from patient identifier / document hash to HealthLake resource id.
+
+fhir_ingest consults it before writing, so a Step Functions retry or a
+referral that arrives twice (email and web upload) resolves to the Patient
+already written instead of creating another one:
+- document key: the same document (its document_hash, else its S3 object)
+  was already ingested, so the HealthLake round trip is skipped entirely
+- identifier key: the patient is known, so the Patient is updated in place by id
+  rather than through a conditional (search-backed) update
+
+Keys are sha256 digests, so no identifier value is stored in a key.
+
+Backends:
+- memory:   per-container LRU (always in front of the remote backends; the local stand-in)
+- s3:       one JSON object per key under a prefix
+- dynamodb: one item per key (partition key `index_key`)
+"""
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+
+from healthtech_common.clients import lazy_client
+
+logger = logging.getLogger()
+
+
+def _digest(*parts: str) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def identifier_key(system: str, value: str) -> str:
+    return "identifier-" + _digest(system, value.strip())
+
+
+def document_key(document_id: str) -> str:
+    """
+    Key of the source document. Never derived from the extracted entities: two
+    referrals for different patients can extract the same name, vitals and meds.
+    """
+    return "document-" + _digest(document_id)
+
+
+class MemoryIndexBackend:
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+
+    def get(self, key: str) -> dict | None:
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: dict) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class S3IndexBackend:
+    def __init__(self, s3, bucket: str, prefix: str = "index/patients"):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+
+    def get(self, key: str) -> dict | None:
+        try:
+            obj = self.s3.get_object(Bucket=self.bucket, Key=f"{self.prefix}/{key}.json")
+        except self.s3.exceptions.NoSuchKey:
+            return None
+        return json.loads(obj["Body"].read())
+
+    def put(self, key: str, value: dict) -> None:
+        self.s3.put_object(Bucket=self.bucket, Key=f"{self.prefix}/{key}.json", Body=json.dumps(value))
+
+
+class DynamoDBIndexBackend:
+    def __init__(self, table_name: str, client=None):
+        self.table_name = table_name
+        self.ddb = client or lazy_client("dynamodb")
+
+    def get(self, key: str) -> dict | None:
+        resp = self.ddb.get_item(TableName=self.table_name, Key={"index_key": {"S": key}})
+        item = resp.get("Item")
+        return json.loads(item["value"]["S"]) if item else None
+
+    def put(self, key: str, value: dict) -> None:
+        self.ddb.put_item(
+            TableName=self.table_name,
+            Item={"index_key": {"S": key}, "value": {"S": json.dumps(value)}},
+        )
+
+
+class PatientIndex:
+    """Memory LRU in front of an optional remote backend, with hit/miss counters."""
+
+    def __init__(self, memory: MemoryIndexBackend, remote=None):
+        self.memory = memory
+        self.remote = remote
+        self.stats = {"hits": 0, "misses": 0, "errors": 0}
+
+    def get(self, key: str) -> dict | None:
+        value = self.memory.get(key)
+        if value is None and self.remote is not None:
+            try:
+                value = self.remote.get(key)
+            except Exception as e:
+                # An index outage only costs the HealthLake round trip; the write is still conditional
+                self.stats["errors"] += 1
+                logger.warning("Patient index read failed: %s", str(e))
+            if value is not None:
+                self.memory.put(key, value)
+
+        self.stats["hits" if value is not None else "misses"] += 1
+        return value
+
+    def put(self, key: str, value: dict) -> None:
+        self.memory.put(key, value)
+        if self.remote is not None:
+            try:
+                self.remote.put(key, value)
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.warning("Patient index write failed: %s", str(e))
+
+
+def build_patient_index(backend: str, s3=None, bucket: str | None = None, prefix: str = "index/patients",
+                        table_name: str | None = None, max_entries: int = 4096) -> PatientIndex | None:
+    if backend in ("", "none", "off"):
+        return None
+
+    memory = MemoryIndexBackend(max_entries=max_entries)
+    if backend == "memory":
+        return PatientIndex(memory)
+    if backend == "s3":
+        return PatientIndex(memory, S3IndexBackend(s3, bucket, prefix=prefix))
+    if backend == "dynamodb":
+        return PatientIndex(memory, DynamoDBIndexBackend(table_name))
+    raise ValueError(f"Unsupported patient index backend: {backend}")
@@ -0,0 +1,61 @@
+"""
+Chunk results read back from S3 for AggregateAndIngest.
+
+bedrock_guardrail writes each Map item's results to the key content_splitter
+assigned it, and the Map state discards its output (ResultPath null), so a
+document's results never travel through the Step Functions payload. The
+splitter's manifest lists the keys in chunk order:
+
+    {"bucket": "...", "total_chunks": 1200, "result_keys": ["temp/results/<id>/000000.json", ...]}
+
+Objects are fetched by a small thread pool at most `window` keys ahead of
+the consumer and yielded in order, so memory holds a window of result
+objects rather than the document's, and a consumer that stops early leaves
+the rest unread.
+"""
+import json
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+from healthtech_common.instrumentation import phase, record_bytes
+
+
+def read_manifest(s3, ref: dict) -> dict:
+    obj = s3.get_object(Bucket=ref["bucket"], Key=ref["key"])
+    return json.loads(obj["Body"].read())
+
+
+def _read_records(s3, bucket: str, key: str) -> list[dict]:
+    # Runs on the pool, so ResultFetch time is summed across threads
+    with phase("ResultFetch"):
+        data = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+    record_bytes("ResultFetch", len(data))
+    records = json.loads(data)
+    return records if isinstance(records, list) else [records]
+
+
+def iter_result_records(s3, ref: dict, max_workers: int = 8, window: int | None = None) -> Iterator[dict]:
+    """Every chunk result listed in the manifest at ref ({"bucket", "key"}), in chunk order."""
+    manifest = read_manifest(s3, ref)
+    bucket = manifest.get("bucket") or ref["bucket"]
+    keys = iter(manifest.get("result_keys") or [])
+    window = window or max_workers * 4
+
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    pending = deque()
+    try:
+        for key in keys:
+            pending.append(pool.submit(_read_records, s3, bucket, key))
+            if len(pending) >= window:
+                break
+        while pending:
+            records = pending.popleft().result()
+            key = next(keys, None)
+            if key is not None:
+                pending.append(pool.submit(_read_records, s3, bucket, key))
+            yield from records
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
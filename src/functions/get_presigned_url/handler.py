@@ -1,24 +1,38 @@
-import boto3
 import os
 import json
 
-s3 = boto3.client('s3')
+from healthtech_common.checkpoints import WEB_UPLOAD_PREFIX
+from healthtech_common.clients import lazy_client
+from healthtech_common.instrumentation import instrumented, phase
 
+# SigV4 signs the metadata headers, so the upload cannot carry any the URL does not name
+s3 = lazy_client('s3', config={'signature_version': 's3v4'})
+
+# The only metadata a web upload carries; the client must send these headers with its PUT
+UPLOAD_METADATA = {'source_channel': 'web'}
+
+@instrumented('get_presigned_url')
 def lambda_handler(event, context):
     bucket = os.environ['BUCKET_NAME']
     filename = event['queryStringParameters']['filename']
-    
+
     # FORCE PREFIX 'incoming/' to trigger EventBridge
-    key = f"incoming/web_upload/{filename}"
-    
-    url = s3.generate_presigned_url(
-        'put_object',
-        Params={'Bucket': bucket, 'Key': key},
-        ExpiresIn=3600
-    )
-    
+    key = f"{WEB_UPLOAD_PREFIX}{filename}"
+
+    # Signing is local (no request), but the first call in a container loads credentials
+    with phase('Presign'):
+        url = s3.generate_presigned_url(
+            'put_object',
+            Params={'Bucket': bucket, 'Key': key, 'Metadata': UPLOAD_METADATA},
+            ExpiresIn=3600
+        )
+
     return {
         "statusCode": 200,
         "headers": {"Access-Control-Allow-Origin": "*"},
-        "body": json.dumps({"upload_url": url, "key": key})
+        "body": json.dumps({
+            "upload_url": url,
+            "key": key,
+            "upload_headers": {f"x-amz-meta-{name}": value for name, value in UPLOAD_METADATA.items()},
+        })
     }
@@ -1,60 +1,204 @@
-import boto3
 import email
 from email.policy import default
+import hashlib
 import json
 import urllib.parse
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
 
-s3 = boto3.client('s3')
+from boto3.s3.transfer import TransferConfig
 
+from healthtech_common.attachment_ledger import LEDGER_PREFIX, build_attachment_ledger
+from healthtech_common.clients import lazy_client
+from healthtech_common.instrumentation import instrumented, phase, record_bytes, record_count, timed_iter
+from mime_stream import MimeStream
+
+s3 = lazy_client('s3')
+
+# 'streaming': walk the S3 stream and spool attachments (bounded memory); 'buffered': whole email in memory
+MIME_PARSE_MODE = os.environ.get('MIME_PARSE_MODE', 'streaming')
+STREAM_BLOCK_BYTES = int(os.environ.get('MIME_STREAM_BLOCK_BYTES', str(1024 * 1024)))
+# Decoded attachments larger than this spill from memory to /tmp
+SPOOL_MAX_MEMORY_BYTES = int(os.environ.get('MIME_SPOOL_MAX_MEMORY_BYTES', str(8 * 1024 * 1024)))
+# Attachments uploaded side by side, and multipart parts in flight per attachment
+ATTACHMENT_UPLOAD_CONCURRENCY = int(os.environ.get('ATTACHMENT_UPLOAD_CONCURRENCY', '3'))
+MULTIPART_CHUNK_BYTES = int(os.environ.get('MULTIPART_CHUNK_BYTES', str(8 * 1024 * 1024)))
+MULTIPART_CONCURRENCY = int(os.environ.get('MULTIPART_CONCURRENCY', '4'))
+
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=MULTIPART_CHUNK_BYTES,
+    multipart_chunksize=MULTIPART_CHUNK_BYTES,
+    max_concurrency=MULTIPART_CONCURRENCY,
+)
+
+# Attachments already extracted (same sha256) are recorded against the original instead of re-entering incoming/
+ledger = build_attachment_ledger(
+    os.environ.get('ATTACHMENT_LEDGER_BACKEND', 'memory'),
+    s3=s3,
+    bucket=os.environ.get('BUCKET_NAME'),
+    prefix=os.environ.get('ATTACHMENT_LEDGER_PREFIX', LEDGER_PREFIX),
+    table_name=os.environ.get('ATTACHMENT_LEDGER_TABLE'),
+)
+
+
+def _attachment_metadata(sender, clean_name, digest):
+    return {
+        'source_channel': 'email',
+        'sender': str(sender),
+        'original_name': clean_name,
+        'content_sha256': digest
+    }
+
+
+def _is_duplicate(digest, target_key, msg_id, clean_name, size):
+    """Claim the content hash; False for the first copy, True (and recorded) for a repeat."""
+    if ledger is None:
+        return False
+    record = {'key': target_key, 'message_id': msg_id, 'original_name': clean_name, 'size': size}
+    original = ledger.claim(digest, record)
+    if original is None:
+        return False
+    ledger.record_duplicate(digest, original, record)
+    print(f"Skipped duplicate attachment {target_key} (same content as {original.get('key')}, "
+          f"{original.get('status', 'pending')})")
+    return True
+
+
+def _release(digest):
+    if ledger is not None:
+        ledger.release(digest)
+
+
+def _upload_attachment(bucket_name, target_key, fileobj, metadata, size):
+    try:
+        with phase('S3Upload'):
+            s3.upload_fileobj(fileobj, bucket_name, target_key, ExtraArgs={'Metadata': metadata}, Config=TRANSFER_CONFIG)
+        record_bytes('S3Upload', size)
+    except Exception:
+        _release(metadata['content_sha256'])
+        raise
+    finally:
+        fileobj.close()
+    print(f"Extracted attachment to: {target_key}")
+    return target_key
+
+
+def extract_streaming(body, bucket_name, msg_id):
+    blocks = timed_iter(body.iter_chunks(STREAM_BLOCK_BYTES), 'S3Read', size=len)
+    stream = MimeStream(blocks, spool_max_memory=SPOOL_MAX_MEMORY_BYTES)
+    sender = stream.headers['from']
+
+    # Parsing continues while earlier attachments upload; at most 2x the pool size wait, spooled
+    keys = []
+    duplicates = 0
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=ATTACHMENT_UPLOAD_CONCURRENCY) as pool:
+        completed = False
+        try:
+            # MimeParse includes the S3 reads it pulls blocks through
+            for att in timed_iter(stream.attachments(), 'MimeParse'):
+                clean_name = os.path.basename(att.filename)
+                target_key = f"incoming/{msg_id}/{clean_name}"
+                if _is_duplicate(att.sha256, target_key, msg_id, clean_name, att.size):
+                    att.file.close()
+                    duplicates += 1
+                    continue
+                in_flight.append((target_key, pool.submit(
+                    _upload_attachment, bucket_name, target_key, att.file,
+                    _attachment_metadata(sender, clean_name, att.sha256), att.size
+                )))
+                while len(in_flight) >= ATTACHMENT_UPLOAD_CONCURRENCY * 2:
+                    keys.append(in_flight.popleft()[1].result())
+            completed = True
+        finally:
+            if not completed:
+                # Let the uploads already started finish, but keep the error that stopped the parse:
+                # an upload failure here is only logged so it cannot replace it
+                wait([future for _, future in in_flight])
+                for target_key, future in in_flight:
+                    if future.exception() is not None:
+                        print(f"Upload of {target_key} failed after the extraction failed: {future.exception()}")
+                in_flight.clear()
+        while in_flight:
+            keys.append(in_flight.popleft()[1].result())
+    return keys, duplicates
+
+
+def extract_buffered(body, bucket_name, msg_id):
+    with phase('S3Read'):
+        raw = body.read()
+    record_bytes('S3Read', len(raw))
+    with phase('MimeParse'):
+        msg = email.message_from_bytes(raw, policy=default)
+    sender = msg['from']
+
+    keys = []
+    duplicates = 0
+    for part in msg.walk():
+        if part.get_content_maintype() == 'multipart': continue
+        if part.get_content_disposition() is None: continue
+
+        filename = part.get_filename()
+        if filename:
+            # Clean the filename
+            clean_name = os.path.basename(filename)
+
+            # WRITE TO 'incoming/' (Triggers EventBridge)
+            target_key = f"incoming/{msg_id}/{clean_name}"
+
+            with phase('MimeParse'):
+                payload = part.get_payload(decode=True)
+            digest = hashlib.sha256(payload).hexdigest()
+            if _is_duplicate(digest, target_key, msg_id, clean_name, len(payload)):
+                duplicates += 1
+                continue
+
+            try:
+                with phase('S3Upload'):
+                    s3.put_object(
+                        Bucket=bucket_name,
+                        Key=target_key,
+                        Body=payload,
+                        Metadata=_attachment_metadata(sender, clean_name, digest)
+                    )
+                record_bytes('S3Upload', len(payload))
+            except Exception:
+                _release(digest)
+                raise
+            print(f"Extracted attachment to: {target_key}")
+            keys.append(target_key)
+    return keys, duplicates
+
+
+@instrumented('mime_extractor')
 def lambda_handler(event, context):
     # Triggered by SNS from SES Receipt Rule
     sns_msg = json.loads(event['Records'][0]['Sns']['Message'])
-    
+
     # SES Notification Object
     msg_id = sns_msg['mail']['messageId']
     bucket_name = os.environ['BUCKET_NAME'] # Passed via Terraform
-    
+
     # Key where SES dumped the raw file
     raw_key = f"raw_email/{msg_id}"
-    
-    print(f"Processing raw email: {raw_key}")
-    
-    # 1. Get MIME Blob
+
+    print(f"Processing raw email: {raw_key} (mode: {MIME_PARSE_MODE})")
+
+    # 1. Get MIME Blob (as a stream; only the buffered mode reads it whole)
     try:
-        raw_obj = s3.get_object(Bucket=bucket_name, Key=raw_key)
-        raw_bytes = raw_obj['Body'].read()
+        body = s3.get_object(Bucket=bucket_name, Key=raw_key)['Body']
     except Exception as e:
         print(f"Error reading S3: {e}")
         return
-        
-    # 2. Parse MIME
-    msg = email.message_from_bytes(raw_bytes, policy=default)
-    sender = msg['from']
-    
-    # 3. Extract Attachments
-    for part in msg.walk():
-        if part.get_content_maintype() == 'multipart': continue
-        if part.get_content_disposition() is None: continue
-        
-        filename = part.get_filename()
-        if filename:
-            # Clean the filename
-            clean_name = os.path.basename(filename)
-            
-            # 4. WRITE TO 'incoming/' (Triggers EventBridge)
-            target_key = f"incoming/{msg_id}/{clean_name}"
-            
-            s3.put_object(
-                Bucket=bucket_name,
-                Key=target_key,
-                Body=part.get_payload(decode=True),
-                Metadata={
-                    'source_channel': 'email',
-                    'sender': str(sender),
-                    'original_name': clean_name
-                }
-            )
-            print(f"Extracted attachment to: {target_key}")
 
-    return {"status": "success"}
+    # 2. Parse MIME and write attachments to 'incoming/' (triggers EventBridge)
+    extract = extract_buffered if MIME_PARSE_MODE == 'buffered' else extract_streaming
+    keys, duplicates = extract(body, bucket_name, msg_id)
+
+    record_count('Attachments', len(keys))
+    record_count('DuplicateAttachments', duplicates)
+    if ledger is not None:
+        print(f"Attachment ledger stats: {json.dumps(ledger.stats)}")
+
+    return {"status": "success", "attachments": len(keys), "duplicates": duplicates}
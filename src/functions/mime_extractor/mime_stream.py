@@ -0,0 +1,237 @@
+"""
+Streaming MIME walker for mime_extractor.
+
+The raw message is read line by line from the S3 body, and each attachment
+is decoded and hashed straight into a spooled temp file (in memory up to a
+threshold, then on /tmp). Memory holds one read block plus the attachments still being
+uploaded, instead of the whole email several times over.
+
+Headers are small and still parsed by the stdlib, so filenames (RFC 2047/2231)
+and content types come out exactly as email.message_from_bytes reports them.
+Nested multiparts and attached messages (message/rfc822, e.g. forwards) are
+walked too.
+"""
+import binascii
+import hashlib
+import tempfile
+from dataclasses import dataclass
+from email.parser import BytesHeaderParser
+from email.policy import default
+
+# Longer runs without a newline (binary parts) are handed out in pieces
+MAX_LINE = 64 * 1024
+
+# Boundary lines are at most 70 chars plus dashes and whitespace
+MAX_BOUNDARY_LINE = 100
+
+# base64 text is decoded in batches rather than one 76-char line at a time
+B64_BATCH = 64 * 1024
+
+_header_parser = BytesHeaderParser(policy=default)
+
+
+class LineReader:
+    """Lines (endings included) from an iterable of byte blocks."""
+
+    def __init__(self, blocks):
+        self._blocks = iter(blocks)
+        self._buf = b''
+        self._pos = 0
+        self._pushed = []
+
+    def readline(self):
+        if self._pushed:
+            return self._pushed.pop()
+        while True:
+            nl = self._buf.find(b'\n', self._pos, self._pos + MAX_LINE)
+            if nl != -1:
+                line = self._buf[self._pos:nl + 1]
+                self._pos = nl + 1
+                return line
+            if len(self._buf) - self._pos >= MAX_LINE:
+                line = self._buf[self._pos:self._pos + MAX_LINE]
+                self._pos += MAX_LINE
+                return line
+            block = next(self._blocks, None)
+            if block is None:
+                line = self._buf[self._pos:]
+                self._buf, self._pos = b'', 0
+                return line
+            self._buf = self._buf[self._pos:] + block
+            self._pos = 0
+
+    def unread(self, line):
+        self._pushed.append(line)
+
+
+class _IdentityDecoder:
+    def __init__(self, out):
+        self.out = out
+
+    def line(self, eol_before, body):
+        self.out.write(eol_before)
+        self.out.write(body)
+
+    def close(self):
+        pass
+
+
+class _Base64Decoder:
+    def __init__(self, out):
+        self.out = out
+        self._buf = bytearray()
+
+    def line(self, eol_before, body):
+        self._buf += body.translate(None, b' \t')
+        if len(self._buf) >= B64_BATCH:
+            n = len(self._buf) // 4 * 4
+            self.out.write(binascii.a2b_base64(bytes(self._buf[:n])))
+            del self._buf[:n]
+
+    def close(self):
+        if self._buf:
+            try:
+                self.out.write(binascii.a2b_base64(bytes(self._buf)))
+            except binascii.Error:
+                # Truncated trailing quantum; the stdlib is lenient here too
+                pass
+            self._buf = bytearray()
+
+
+class _QuotedPrintableDecoder:
+    def __init__(self, out):
+        self.out = out
+        self._soft = False
+
+    def line(self, eol_before, body):
+        # A trailing '=' is a soft break: the line ending is not part of the content
+        if not self._soft:
+            self.out.write(eol_before)
+        self.out.write(binascii.a2b_qp(body))
+        self._soft = body.endswith(b'=')
+
+    def close(self):
+        pass
+
+
+_DECODERS = {'base64': _Base64Decoder, 'quoted-printable': _QuotedPrintableDecoder}
+
+
+class SpooledSink:
+    """Counts and hashes bytes written into a SpooledTemporaryFile."""
+
+    def __init__(self, max_memory):
+        self.file = tempfile.SpooledTemporaryFile(max_size=max_memory)
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        if data:
+            self.file.write(data)
+            self.sha256.update(data)
+            self.size += len(data)
+
+
+@dataclass
+class Attachment:
+    filename: str
+    content_type: str
+    file: object
+    size: int
+    sha256: str
+
+
+def _match_boundary(line, boundaries):
+    if len(line) > MAX_BOUNDARY_LINE or not line.startswith(b'--'):
+        return None
+    stripped = line.rstrip()
+    for boundary in reversed(boundaries):
+        if stripped == b'--' + boundary:
+            return ('part', boundary)
+        if stripped == b'--' + boundary + b'--':
+            return ('end', boundary)
+    return None
+
+
+class MimeStream:
+    """
+    stream = MimeStream(body.iter_chunks(block_size))
+    stream.headers['from']
+    for att in stream.attachments(): ...   # att.file is positioned at 0; the caller closes it
+    """
+
+    def __init__(self, blocks, spool_max_memory=8 * 1024 * 1024):
+        self.reader = LineReader(blocks)
+        self.spool_max_memory = spool_max_memory
+        self.headers = self._read_headers()
+
+    def _read_headers(self):
+        lines = []
+        while True:
+            line = self.reader.readline()
+            if not line or line in (b'\r\n', b'\n'):
+                break
+            lines.append(line)
+        return _header_parser.parsebytes(b''.join(lines))
+
+    def _copy_body(self, boundaries, decoder=None):
+        """
+        Feed lines to decoder until the next boundary line of any enclosing
+        multipart, which is left unread and returned (None at end of input).
+        The line ending before a boundary belongs to the boundary.
+        """
+        pending_eol = b''
+        while True:
+            line = self.reader.readline()
+            if not line:
+                return None
+            match = _match_boundary(line, boundaries)
+            if match:
+                self.reader.unread(line)
+                return match
+            if decoder is not None:
+                body = line.rstrip(b'\r\n')
+                decoder.line(pending_eol, body)
+                pending_eol = line[len(body):]
+
+    def attachments(self):
+        yield from self._entity(self.headers, [])
+
+    def _entity(self, headers, boundaries):
+        if headers.get_content_maintype() == 'multipart' and headers.get_param('boundary'):
+            yield from self._multipart(str(headers.get_param('boundary')).encode('utf-8'), boundaries)
+            return
+
+        if headers.get_content_type() == 'message/rfc822':
+            yield from self._entity(self._read_headers(), boundaries)
+            return
+
+        filename = headers.get_filename()
+        if headers.get_content_disposition() is None or not filename:
+            self._copy_body(boundaries)
+            return
+
+        sink = SpooledSink(self.spool_max_memory)
+        cte = str(headers.get('content-transfer-encoding', '7bit')).strip().lower()
+        decoder = _DECODERS.get(cte, _IdentityDecoder)(sink)
+        self._copy_body(boundaries, decoder)
+        decoder.close()
+
+        sink.file.seek(0)
+        yield Attachment(filename=filename, content_type=headers.get_content_type(), file=sink.file, size=sink.size,
+                         sha256=sink.sha256.hexdigest())
+
+    def _multipart(self, boundary, outer):
+        boundaries = outer + [boundary]
+
+        # Preamble, then one entity per delimiter
+        match = self._copy_body(boundaries)
+        while match == ('part', boundary):
+            self.reader.readline()
+            yield from self._entity(self._read_headers(), boundaries)
+            match = self._copy_body(boundaries)
+
+        if match == ('end', boundary):
+            self.reader.readline()
+            # Epilogue runs until the enclosing multipart's next boundary
+            self._copy_body(outer)
@@ -1,12 +1,16 @@
 import os
 import json
+import base64
 import urllib.parse
-import urllib3
-import botocore.session
-from botocore.auth import SigV4Auth
-from botocore.awsrequest import AWSRequest
 
-_http = urllib3.PoolManager()
+from healthtech_common.cache_generation import GenerationMarker
+from healthtech_common.clients import lazy_client
+from healthtech_common.healthlake import get_client
+from healthtech_common.instrumentation import instrumented, phase, record_count
+from ndjson_export import NdjsonExportWriter
+from pagination import InvalidCursor, decode_cursor, encode_cursor, next_path, rewrite_links
+from projection import cache_suffix, parse_projection, project_bundle, project_resource, projection_params
+from response_cache import CachedResponse, ResponseCache
 
 ALLOWED_PATIENT_SEARCH_PARAMS = {
     "identifier",
@@ -17,57 +21,159 @@ ALLOWED_PATIENT_SEARCH_PARAMS = {
     "_total",
 }
 
-def _sigv4_get(url: str) -> dict:
-    region = os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION")
-    if not region:
-        raise ValueError("AWS_REGION is not set")
-
-    session = botocore.session.get_session()
-    creds = session.get_credentials()
-    if creds is None:
-        raise ValueError("No AWS credentials available for SigV4 signing")
-    frozen = creds.get_frozen_credentials()
-
-    req = AWSRequest(
-        method="GET",
-        url=url,
-        headers={"Accept": "application/json"},
-    )
-    SigV4Auth(frozen, "healthlake", region).add_auth(req)
-    prepared = req.prepare()
-
-    resp = _http.request(
-        "GET",
-        url,
-        headers=dict(prepared.headers),
-        retries=False,
-        timeout=urllib3.Timeout(connect=5.0, read=30.0),
-    )
-
-    body = resp.data.decode("utf-8") if resp.data else ""
-    if resp.status not in (200, 201):
-        raise Exception(f"HealthLake GET failed status={resp.status} body={body}")
-
-    return json.loads(body) if body else {}
-
-def _healthlake_base() -> str:
-    region = os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION")
-    datastore_id = os.environ["HEALTHLAKE_ID"]
-    return f"https://healthlake.{region}.amazonaws.com/datastore/{datastore_id}/r4"
+# Read-through cache of HealthLake responses; TTL 0 turns it off
+CACHE_TTL_SECONDS = float(os.environ.get("PATIENT_QUERY_CACHE_TTL_SECONDS", "30"))
+CACHE_MAX_ENTRIES = int(os.environ.get("PATIENT_QUERY_CACHE_MAX_ENTRIES", "256"))
+# Bodies at least this large are gzipped for clients that accept it
+GZIP_MIN_BYTES = int(os.environ.get("PATIENT_QUERY_GZIP_MIN_BYTES", "2048"))
+
+# Signs pagination cursors; without a configured key cursors only work in the container that issued them
+CURSOR_KEY = os.environ.get("PATIENT_QUERY_CURSOR_KEY", "").encode("utf-8") or os.urandom(32)
+
+EXPORT_PREFIX = os.environ.get("PATIENT_EXPORT_PREFIX", "exports/patients")
+EXPORT_PAGE_SIZE = os.environ.get("PATIENT_EXPORT_PAGE_SIZE", "100")
+EXPORT_MAX_PAGES = int(os.environ.get("PATIENT_EXPORT_MAX_PAGES", "1000"))
+EXPORT_URL_TTL_SECONDS = int(os.environ.get("PATIENT_EXPORT_URL_TTL_SECONDS", "900"))
+# Stop fetching pages with this much invocation time left, and hand back a cursor instead
+EXPORT_TIME_RESERVE_MS = 5000
+
+s3 = lazy_client("s3")
+
+# Lives for the container lifetime so warm invocations share it
+response_cache = ResponseCache(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS) if CACHE_TTL_SECONDS > 0 else None
+
+# Bumped by fhir_ingest after every write; without a bucket only the TTL bounds staleness
+generation_marker = (
+    GenerationMarker(s3, os.environ["BUCKET_NAME"],
+                     check_interval_s=float(os.environ.get("CACHE_GENERATION_CHECK_SECONDS", "5")))
+    if os.environ.get("BUCKET_NAME") else None
+)
+
+_CORS_HEADERS = {
+    # Keep consistent with your existing API CORS (currently allow all).
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET,OPTIONS",
+    "Access-Control-Allow-Headers": "*",
+    "Access-Control-Expose-Headers": "ETag",
+}
 
 def _resp(status: int, body: dict):
     return {
         "statusCode": status,
-        "headers": {
-            "Content-Type": "application/json",
-            # Keep consistent with your existing API CORS (currently allow all).
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "GET,OPTIONS",
-            "Access-Control-Allow-Headers": "*",
-        },
+        "headers": {"Content-Type": "application/json", **_CORS_HEADERS},
         "body": json.dumps(body),
     }
 
+def _header(event, name: str) -> str:
+    # HTTP API (payload v2) lower-cases header names
+    headers = event.get("headers") or {}
+    return headers.get(name) or headers.get(name.title()) or ""
+
+def _cached_resp(event, cached: CachedResponse, cache_status: str):
+    headers = {
+        "Content-Type": "application/json",
+        "ETag": cached.etag,
+        # PHI: never stored by shared caches, always revalidated by the browser
+        "Cache-Control": "private, no-cache",
+        "Vary": "Accept-Encoding",
+        "X-Cache": cache_status,
+        **_CORS_HEADERS,
+    }
+
+    if_none_match = _header(event, "if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or cached.etag in [t.strip() for t in if_none_match.split(",")]):
+        return {"statusCode": 304, "headers": headers, "body": ""}
+
+    if len(cached.body) >= GZIP_MIN_BYTES and "gzip" in _header(event, "accept-encoding"):
+        headers["Content-Encoding"] = "gzip"
+        return {
+            "statusCode": 200,
+            "headers": headers,
+            "body": base64.b64encode(cached.gzipped()).decode("ascii"),
+            "isBase64Encoded": True,
+        }
+
+    return {"statusCode": 200, "headers": headers, "body": cached.body}
+
+def _cached_get(event, healthlake, path: str, transform, cache_key: str):
+    """Serve transform(HealthLake response) from the response cache, filling it on a miss."""
+    generation = generation_marker.current() if generation_marker else ""
+    use_cache = response_cache is not None and generation is not None
+
+    if use_cache:
+        cached = response_cache.get(cache_key, generation)
+        record_count("CacheHits", cached is not None)
+        if cached is not None:
+            return _cached_resp(event, cached, "HIT")
+
+    bundle = healthlake.get(path)
+    with phase("Transform"):
+        cached = CachedResponse.from_body(json.dumps(transform(bundle)))
+    if use_cache:
+        response_cache.put(cache_key, generation, cached)
+    return _cached_resp(event, cached, "MISS" if use_cache else "BYPASS")
+
+def _search_path(qs: dict, defaults: dict) -> tuple[str, dict]:
+    """
+    (HealthLake search path, projection params) for the request: the cursor's page
+    and the projection it was issued with, or the allow-listed query. Projection
+    params sent alongside a cursor override the cursor's.
+    """
+    if qs.get("cursor"):
+        path, params = decode_cursor(CURSOR_KEY, qs["cursor"])
+        return path, {**params, **projection_params(qs)}
+
+    # Allowlist query params to avoid turning this into an open proxy
+    safe_qs = {k: v for k, v in qs.items() if k in ALLOWED_PATIENT_SEARCH_PARAMS and v is not None}
+    for k, v in defaults.items():
+        safe_qs.setdefault(k, v)
+
+    # Sorted so equivalent queries share a cache entry
+    query = urllib.parse.urlencode(sorted(safe_qs.items()), doseq=True)
+    return "Patient" + (f"?{query}" if query else ""), projection_params(qs)
+
+def _export(context, healthlake, search_path: str, params: dict):
+    """Walk every page of search_path into an NDJSON object and return a presigned URL to it."""
+    bucket = os.environ.get("BUCKET_NAME")
+    if not bucket:
+        return _resp(501, {"message": "Export is not configured"})
+
+    projection = parse_projection(params)
+    key = f"{EXPORT_PREFIX}/{context.aws_request_id}.ndjson"
+    writer = NdjsonExportWriter(s3, bucket, key)
+    path, pages = search_path, 0
+    try:
+        while path and pages < EXPORT_MAX_PAGES:
+            if context.get_remaining_time_in_millis() < EXPORT_TIME_RESERVE_MS:
+                break
+            bundle = healthlake.get(path)
+            with phase("ExportWrite"):
+                for entry in bundle.get("entry") or []:
+                    if "resource" in entry:
+                        writer.write(project_resource(entry["resource"], projection))
+            pages += 1
+            path = next_path(bundle)
+        with phase("ExportWrite"):
+            writer.close()
+    except Exception:
+        writer.abort()
+        raise
+
+    body = {
+        "url": s3.generate_presigned_url(
+            "get_object", Params={"Bucket": bucket, "Key": key}, ExpiresIn=EXPORT_URL_TTL_SECONDS
+        ),
+        "format": "application/fhir+ndjson",
+        "resources": writer.lines,
+        "bytes": writer.bytes,
+        "pages": pages,
+    }
+    if path:
+        # Ran out of pages or time; a follow-up export can resume from here
+        body["next_cursor"] = encode_cursor(CURSOR_KEY, path, params)
+    return _resp(200, body)
+
+@instrumented("patient_query")
 def lambda_handler(event, context):
     method = event.get("requestContext", {}).get("http", {}).get("method", "GET")
     if method == "OPTIONS":
@@ -77,29 +183,38 @@ def lambda_handler(event, context):
     qs = event.get("queryStringParameters") or {}
     path_params = event.get("pathParameters") or {}
 
-    base = _healthlake_base()
+    healthlake = get_client()
 
-    # Route 1: GET /patients -> Patient search
+    # Route 1: GET /patients -> Patient search, paged with ?cursor= from the Bundle's next link
     if path.endswith("/patients"):
-        # Allowlist query params to avoid turning this into an open proxy
-        safe_qs = {k: v for k, v in qs.items() if k in ALLOWED_PATIENT_SEARCH_PARAMS and v is not None}
-
-        # Defaults helpful for console-like validation
-        safe_qs.setdefault("_count", "20")
-        safe_qs.setdefault("_total", "accurate")
-
-        query = urllib.parse.urlencode(safe_qs, doseq=True)
-        url = f"{base}/Patient" + (f"?{query}" if query else "")
-        data = _sigv4_get(url)
-        return _resp(200, data)
-
-    # Route 2: GET /patients/{id} -> Patient read
+        try:
+            # Defaults helpful for console-like validation
+            search_path, params = _search_path(qs, {"_count": "20", "_total": "accurate"})
+        except InvalidCursor as e:
+            return _resp(400, {"message": str(e)})
+        projection = parse_projection(params)
+
+        def transform(bundle):
+            return project_bundle(rewrite_links(bundle, CURSOR_KEY, path, params), projection)
+
+        return _cached_get(event, healthlake, search_path, transform, search_path + cache_suffix(projection))
+
+    # Route 2: GET /patients/export -> every page of a search as NDJSON in S3
+    if path.endswith("/patients/export"):
+        try:
+            search_path, params = _search_path(qs, {"_count": EXPORT_PAGE_SIZE})
+        except InvalidCursor as e:
+            return _resp(400, {"message": str(e)})
+        return _export(context, healthlake, search_path, params)
+
+    # Route 3: GET /patients/{id} -> Patient read
     if "/patients/" in path:
         patient_id = path_params.get("id") or path.split("/patients/")[-1].split("/")[0]
         if not patient_id:
             return _resp(400, {"message": "Missing patient id"})
-        url = f"{base}/Patient/{urllib.parse.quote(patient_id)}"
-        data = _sigv4_get(url)
-        return _resp(200, data)
+        read_path = f"Patient/{urllib.parse.quote(patient_id)}"
+        projection = parse_projection(qs)
+        return _cached_get(event, healthlake, read_path, lambda r: project_resource(r, projection),
+                           read_path + cache_suffix(projection))
 
     return _resp(404, {"message": "Not found"})
@@ -0,0 +1,61 @@
+"""
+NDJSON export of a Patient search, streamed to S3.
+
+Search pages are fetched one at a time and their resources appended as
+lines to a multipart upload, so Lambda memory holds one page plus one part
+regardless of the result size. The caller gets a presigned URL to the object.
+"""
+import json
+
+PART_SIZE = 8 * 1024 * 1024
+
+
+class NdjsonExportWriter:
+    def __init__(self, s3, bucket: str, key: str, part_size: int = PART_SIZE):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, 5 * 1024 * 1024)
+        self.lines = 0
+        self.bytes = 0
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts: list[dict] = []
+
+    def write(self, resource: dict) -> None:
+        self._buffer += json.dumps(resource, separators=(",", ":"), ensure_ascii=False).encode("utf-8") + b"\n"
+        self.lines += 1
+        if len(self._buffer) >= self.part_size:
+            self._upload_part()
+
+    def _upload_part(self) -> None:
+        if self._upload_id is None:
+            self._upload_id = self.s3.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType="application/fhir+ndjson"
+            )["UploadId"]
+        number = len(self._parts) + 1
+        resp = self.s3.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, PartNumber=number, Body=bytes(self._buffer)
+        )
+        self._parts.append({"ETag": resp["ETag"], "PartNumber": number})
+        self.bytes += len(self._buffer)
+        self._buffer = bytearray()
+
+    def close(self) -> None:
+        if self._upload_id is None:
+            # Small export: a single PUT, no multipart bookkeeping
+            self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer),
+                               ContentType="application/fhir+ndjson")
+            self.bytes += len(self._buffer)
+            self._buffer = bytearray()
+            return
+
+        if self._buffer:
+            self._upload_part()
+        self.s3.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id, MultipartUpload={"Parts": self._parts}
+        )
+
+    def abort(self) -> None:
+        if self._upload_id is not None:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
@@ -0,0 +1,68 @@
+"""
+Opaque cursors over HealthLake search paging.
+
+A cursor wraps the datastore-relative path of a Bundle `next` link, signed
+with HMAC so clients cannot turn it into an arbitrary HealthLake request.
+Clients only ever see `/patients?cursor=...`; HealthLake hosts, datastore
+ids and page tokens stay on the server. The cursor also carries the
+request's `_elements`/`_summary`, so every page of a search keeps the
+projection of the first.
+"""
+import base64
+import hashlib
+import hmac
+import json
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _sign(key: bytes, payload: bytes) -> str:
+    return base64.urlsafe_b64encode(hmac.new(key, payload, hashlib.sha256).digest()[:16]).decode("ascii").rstrip("=")
+
+
+def _b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+def encode_cursor(key: bytes, path: str, params: dict | None = None) -> str:
+    body = {"p": path, "q": params} if params else {"p": path}
+    payload = json.dumps(body, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=") + "." + _sign(key, payload)
+
+
+def decode_cursor(key: bytes, cursor: str, resource_type: str = "Patient") -> tuple[str, dict]:
+    """(datastore-relative search path, projection params) inside cursor; raises InvalidCursor if forged or malformed."""
+    try:
+        encoded, signature = cursor.split(".", 1)
+        payload = _b64decode(encoded)
+    except ValueError as e:
+        raise InvalidCursor("Malformed cursor") from e
+
+    if not hmac.compare_digest(signature, _sign(key, payload)):
+        raise InvalidCursor("Cursor signature mismatch")
+
+    body = json.loads(payload)
+    path = body["p"]
+    if not path.startswith(f"{resource_type}?"):
+        raise InvalidCursor("Cursor does not point at a search")
+    return path, body.get("q") or {}
+
+
+def next_path(bundle: dict) -> str | None:
+    """Datastore-relative path of the Bundle's `next` link, if any."""
+    for link in bundle.get("link") or []:
+        if link.get("relation") == "next" and link.get("url"):
+            # Links are absolute: https://healthlake.{region}.amazonaws.com/datastore/{id}/r4/Patient?...
+            return link["url"].split("/r4/", 1)[-1]
+    return None
+
+
+def rewrite_links(bundle: dict, key: bytes, api_path: str, params: dict | None = None) -> dict:
+    """Replace HealthLake paging links with an API `next` link carrying a cursor (and the params to keep)."""
+    path = next_path(bundle)
+    bundle = {k: v for k, v in bundle.items() if k != "link"}
+    if path:
+        bundle["link"] = [{"relation": "next", "url": f"{api_path}?cursor={encode_cursor(key, path, params)}"}]
+    return bundle
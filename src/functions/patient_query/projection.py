@@ -0,0 +1,51 @@
+"""
+Field projection for Patient responses.
+
+`_elements=name,gender` keeps only the listed top-level elements (plus the
+ones FHIR always requires); `_summary=true` drops the heavy ones, chiefly
+the ai-extracted-entities extension and the narrative. Applied in the
+Lambda so the browser never receives the dropped fields, whatever the
+datastore's own support for these parameters.
+"""
+
+MANDATORY_ELEMENTS = {"resourceType", "id", "meta"}
+HEAVY_ELEMENTS = {"extension", "modifierExtension", "text", "contained"}
+PROJECTION_PARAMS = ("_elements", "_summary")
+
+
+def projection_params(qs: dict) -> dict:
+    """The projection query params present in qs, as carried in pagination cursors."""
+    return {k: qs[k] for k in PROJECTION_PARAMS if qs.get(k)}
+
+
+def parse_projection(qs: dict) -> tuple[frozenset, bool] | None:
+    """(elements, summary) from query params, or None for the full resource."""
+    elements = frozenset(e.strip() for e in (qs.get("_elements") or "").split(",") if e.strip())
+    summary = (qs.get("_summary") or "").lower() == "true"
+    if not elements and not summary:
+        return None
+    return elements, summary
+
+
+def cache_suffix(projection: tuple[frozenset, bool] | None) -> str:
+    if projection is None:
+        return ""
+    elements, summary = projection
+    return f"#elements={','.join(sorted(elements))}&summary={summary}"
+
+
+def project_resource(resource: dict, projection: tuple[frozenset, bool] | None) -> dict:
+    if projection is None:
+        return resource
+    elements, summary = projection
+    if elements:
+        return {k: v for k, v in resource.items() if k in elements or k in MANDATORY_ELEMENTS}
+    return {k: v for k, v in resource.items() if k not in HEAVY_ELEMENTS}
+
+
+def project_bundle(bundle: dict, projection: tuple[frozenset, bool] | None) -> dict:
+    if projection is None or bundle.get("resourceType") != "Bundle":
+        return project_resource(bundle, projection)
+    entries = [{**e, "resource": project_resource(e["resource"], projection)} if "resource" in e else e
+               for e in bundle.get("entry") or []]
+    return {**bundle, "entry": entries}
@@ -0,0 +1,65 @@
+"""
+Per-container read-through cache of HealthLake responses for patient_query.
+
+Entries are keyed by the normalized HealthLake path (allow-listed, sorted
+query) and stamped with the cache generation they were filled under; a
+generation bump from fhir_ingest, the TTL or LRU eviction drops them.
+The ETag is a digest of the serialized body, so it is the same in every
+container and survives eviction.
+"""
+import gzip
+import hashlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+
+def make_etag(body: str) -> str:
+    return '"' + hashlib.sha256(body.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+@dataclass
+class CachedResponse:
+    body: str
+    etag: str
+    _gzipped: bytes | None = field(default=None, repr=False)
+
+    @classmethod
+    def from_body(cls, body: str) -> "CachedResponse":
+        return cls(body=body, etag=make_etag(body))
+
+    def gzipped(self) -> bytes:
+        # Compressed once per entry, on the first client that accepts gzip
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body.encode("utf-8"), compresslevel=6)
+        return self._gzipped
+
+
+class ResponseCache:
+    """LRU with per-entry expiry and a generation stamp."""
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 30.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._entries: OrderedDict[str, tuple[float, str, CachedResponse]] = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, key: str, generation: str) -> CachedResponse | None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, entry_generation, response = entry
+            if expires_at >= self.clock() and entry_generation == generation:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return response
+            del self._entries[key]
+
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, key: str, generation: str, response: CachedResponse) -> None:
+        self._entries[key] = (self.clock() + self.ttl_seconds, generation, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,63 @@
+import json
+import os
+
+from healthtech_common.clients import lazy_client
+from healthtech_common.instrumentation import instrumented, phase, record_count
+
+s3 = lazy_client('s3')
+sfn = lazy_client('stepfunctions')
+
+CALLBACK_PREFIX = "temp/textract_callbacks"
+
+def _read_json(bucket, key):
+    try:
+        with phase('S3Read'):
+            obj = s3.get_object(Bucket=bucket, Key=key)
+            return json.loads(obj['Body'].read())
+    except s3.exceptions.NoSuchKey:
+        return None
+
+def _resume_execution(task_token, completion):
+    try:
+        with phase('ResumeExecution'):
+            if completion.get('status') == 'SUCCEEDED':
+                sfn.send_task_success(taskToken=task_token, output=json.dumps(completion))
+            else:
+                sfn.send_task_failure(
+                    taskToken=task_token,
+                    error='TextractJobFailed',
+                    cause=json.dumps(completion),
+                )
+        record_count('ExecutionsResumed')
+    except (sfn.exceptions.InvalidToken, sfn.exceptions.TaskTimedOut, sfn.exceptions.TaskDoesNotExist):
+        # document_router resumed it already, or the state timed out and fell back to polling.
+        print(f"Task token for job {completion.get('job_id')} already resolved")
+
+@instrumented('textract_callback')
+def lambda_handler(event, context):
+    # Triggered by SNS: Textract job completion notification (NotificationChannel)
+    bucket = os.environ['BUCKET_NAME']
+
+    for record in event.get('Records', []):
+        msg = json.loads(record['Sns']['Message'])
+        completion = {
+            "job_id": msg['JobId'],
+            "status": msg['Status'],
+            "api": msg.get('API'),
+        }
+        job_id = completion['job_id']
+        print(f"Textract job {job_id} finished with status {completion['status']}")
+
+        # Record completion first so a token registered after this point still sees it
+        with phase('S3Write'):
+            s3.put_object(
+                Bucket=bucket,
+                Key=f"{CALLBACK_PREFIX}/{job_id}/completion.json",
+                Body=json.dumps(completion),
+            )
+
+        token = _read_json(bucket, f"{CALLBACK_PREFIX}/{job_id}/token.json")
+        if token:
+            _resume_execution(token['task_token'], completion)
+
+    return {"status": "success"}
@@ -0,0 +1,4 @@
+"""
+Code shared by several pipeline Lambdas, shipped as the `common` Lambda layer
+(installed under /opt/python, so it imports as `healthtech_common`).
+"""
@@ -0,0 +1,319 @@
+"""
+Content ledger for extracted email attachments.
+
+mime_extractor hashes each attachment (sha256 of the decoded bytes) while it
+is extracted. The first copy claims its hash and is written under incoming/,
+which starts the pipeline. Later copies (forwarded chains, CC'd copies,
+replies with the original attached) find the claim and are recorded against
+it instead, so OCR, guardrail and ingest run once per document.
+
+A claim is a lease until the pipeline reports back. fhir_ingest completes it
+with the outcome: status, Patient id and execution ARN, which duplicates then
+point at. A claim still pending after its lease (ATTACHMENT_LEDGER_LEASE_SECONDS,
+longer than an execution can run) belongs to a run that failed or was lost;
+the next copy takes it over and is written again. Every claim also carries
+`expires_at` (ATTACHMENT_LEDGER_RETENTION_DAYS), the dedup window: the bucket's
+lifecycle rule on the prefix, or DynamoDB TTL on the attribute, removes it.
+
+Backends:
+- memory:   per-container dict (the local stand-in; dedups within a warm container only)
+- s3:       one JSON object per hash, claimed with a conditional PUT (If-None-Match: *)
+            and taken over with If-Match on the lapsed claim's ETag
+- dynamodb: one item per hash (partition key `content_hash`), claimed or taken over
+            with a single condition expression
+
+The ledger fails open: if it cannot be reached the attachment is written as
+before, so an outage costs a duplicate run and never drops a document. An SDK
+too old to send conditional writes (LedgerUnsupported) fails open the same
+way. It is logged once per container as an error, and every claim it costs
+is counted in `errors` and the `AttachmentLedgerErrors` metric.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from botocore.exceptions import ClientError, ParamValidationError
+
+from .clients import lazy_client
+from .instrumentation import record_count
+
+logger = logging.getLogger()
+
+LEDGER_PREFIX = "ledger/attachments"
+# Longer than an execution can run (Textract wait, Map retries); a pending claim older than this is abandoned
+LEASE_SECONDS = int(os.environ.get("ATTACHMENT_LEDGER_LEASE_SECONDS", str(6 * 3600)))
+# Dedup window; keep in step with the lifecycle rule on LEDGER_PREFIX
+RETENTION_DAYS = int(os.environ.get("ATTACHMENT_LEDGER_RETENTION_DAYS", "30"))
+
+PENDING = "pending"
+_S3_CONFLICTS = ("PreconditionFailed", "ConditionalRequestConflict")
+
+
+class LedgerUnsupported(RuntimeError):
+    """The client cannot make the ledger's conditional writes, so the ledger cannot deduplicate."""
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _lapsed(record: dict, now: float) -> bool:
+    return record.get("status") == PENDING and record.get("lease_until", 0) <= now
+
+
+def _conditional_write(call, **kwargs):
+    try:
+        return call(**kwargs)
+    except ParamValidationError as e:
+        # Older botocore rejects If-None-Match/If-Match on PutObject before sending it
+        raise LedgerUnsupported(
+            f"S3 conditional writes are not supported by botocore in this runtime; "
+            f"bundle a newer boto3 or set ATTACHMENT_LEDGER_BACKEND=dynamodb ({e})"
+        ) from e
+
+
+class MemoryLedgerBackend:
+    def __init__(self):
+        self.entries = {}
+        self.duplicates = {}
+        self._lock = threading.Lock()
+
+    def claim(self, digest: str, record: dict, now: float) -> dict | None:
+        with self._lock:
+            held = self.entries.get(digest)
+            if held is None or _lapsed(held, now):
+                self.entries[digest] = record
+                return None
+            return held
+
+    def release(self, digest: str) -> None:
+        with self._lock:
+            self.entries.pop(digest, None)
+
+    def complete(self, digest: str, outcome: dict) -> None:
+        with self._lock:
+            if digest in self.entries:
+                self.entries[digest] = {**self.entries[digest], **outcome}
+
+    def add_duplicate(self, digest: str, record: dict) -> None:
+        with self._lock:
+            self.duplicates.setdefault(digest, []).append(record)
+
+
+class S3LedgerBackend:
+    def __init__(self, s3, bucket: str, prefix: str = LEDGER_PREFIX):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+
+    def _key(self, digest: str) -> str:
+        return f"{self.prefix}/{digest}.json"
+
+    def _read(self, digest: str) -> tuple[dict, str]:
+        obj = self.s3.get_object(Bucket=self.bucket, Key=self._key(digest))
+        return json.loads(obj["Body"].read()), obj.get("ETag")
+
+    def claim(self, digest: str, record: dict, now: float) -> dict | None:
+        body = json.dumps(record)
+        try:
+            _conditional_write(self.s3.put_object, Bucket=self.bucket, Key=self._key(digest), Body=body,
+                               IfNoneMatch="*")
+            return None
+        except ClientError as e:
+            # 412: already claimed; 409: a concurrent claim is in progress and will win
+            if e.response["Error"]["Code"] not in _S3_CONFLICTS:
+                raise
+
+        held, etag = self._read(digest)
+        if not _lapsed(held, now):
+            return held
+        try:
+            # Only replaces the lapsed claim we read; a copy that got there first keeps it
+            _conditional_write(self.s3.put_object, Bucket=self.bucket, Key=self._key(digest), Body=body, IfMatch=etag)
+            return None
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in _S3_CONFLICTS:
+                raise
+        return self._read(digest)[0]
+
+    def release(self, digest: str) -> None:
+        self.s3.delete_object(Bucket=self.bucket, Key=self._key(digest))
+
+    def complete(self, digest: str, outcome: dict) -> None:
+        try:
+            held, _ = self._read(digest)
+        except self.s3.exceptions.NoSuchKey:
+            # Not an email attachment, or its claim has already expired
+            return
+        self.s3.put_object(Bucket=self.bucket, Key=self._key(digest), Body=json.dumps({**held, **outcome}))
+
+    def add_duplicate(self, digest: str, record: dict) -> None:
+        # Mirrors the incoming/ key the copy would have had, so duplicates can be listed per message
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}/duplicates/{record['key']}.json",
+            Body=json.dumps({"content_hash": digest, **record}),
+        )
+
+
+class DynamoDBLedgerBackend:
+    """
+    Items keep the claim as JSON in `record`, with `status`, `lease_until` and
+    `expires_at` (enable TTL on it) as top-level attributes for the conditions.
+    """
+
+    def __init__(self, table_name: str, client=None):
+        self.table_name = table_name
+        self.ddb = client or lazy_client("dynamodb")
+
+    def claim(self, digest: str, record: dict, now: float) -> dict | None:
+        try:
+            self.ddb.put_item(
+                TableName=self.table_name,
+                Item={
+                    "content_hash": {"S": digest},
+                    "record": {"S": json.dumps(record)},
+                    "status": {"S": record["status"]},
+                    "lease_until": {"N": str(record["lease_until"])},
+                    "expires_at": {"N": str(record["expires_at"])},
+                },
+                ConditionExpression="attribute_not_exists(content_hash) OR (#status = :pending AND lease_until <= :now)",
+                ExpressionAttributeNames={"#status": "status"},
+                ExpressionAttributeValues={":pending": {"S": PENDING}, ":now": {"N": str(int(now))}},
+            )
+            return None
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+        item = self.ddb.get_item(TableName=self.table_name, Key={"content_hash": {"S": digest}}, ConsistentRead=True)
+        return json.loads(item["Item"]["record"]["S"])
+
+    def release(self, digest: str) -> None:
+        self.ddb.delete_item(TableName=self.table_name, Key={"content_hash": {"S": digest}})
+
+    def complete(self, digest: str, outcome: dict) -> None:
+        item = self.ddb.get_item(TableName=self.table_name, Key={"content_hash": {"S": digest}}, ConsistentRead=True)
+        if "Item" not in item:
+            return
+        record = {**json.loads(item["Item"]["record"]["S"]), **outcome}
+        self.ddb.update_item(
+            TableName=self.table_name,
+            Key={"content_hash": {"S": digest}},
+            UpdateExpression="SET #record = :record, #status = :status",
+            ExpressionAttributeNames={"#record": "record", "#status": "status"},
+            ExpressionAttributeValues={":record": {"S": json.dumps(record)}, ":status": {"S": record["status"]}},
+        )
+
+    def add_duplicate(self, digest: str, record: dict) -> None:
+        self.ddb.update_item(
+            TableName=self.table_name,
+            Key={"content_hash": {"S": digest}},
+            UpdateExpression="ADD duplicate_count :one SET last_duplicate = :record",
+            ExpressionAttributeValues={":one": {"N": "1"}, ":record": {"S": json.dumps(record)}},
+        )
+
+
+class AttachmentLedger:
+    """
+    mime_extractor:
+        original = ledger.claim(digest, record)
+        if original is None: upload, and ledger.release(digest) if that fails
+        else: ledger.record_duplicate(digest, original, record)
+    fhir_ingest, once the document is finished:
+        ledger.complete(digest, status, patient_id=..., execution_arn=...)
+    """
+
+    def __init__(self, backend, lease_seconds: int = LEASE_SECONDS, retention_days: int = RETENTION_DAYS,
+                 clock=time.time):
+        self.backend = backend
+        self.lease_seconds = lease_seconds
+        self.retention_days = retention_days
+        self.clock = clock
+        self.stats = {"claimed": 0, "pipeline_runs_avoided": 0, "bytes_skipped": 0, "errors": 0}
+        # Set by the first LedgerUnsupported; claims then skip the backend
+        self.unsupported = None
+        self._lock = threading.Lock()
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.stats[name] += n
+        if name == "errors":
+            record_count("AttachmentLedgerErrors", n)
+
+    def claim(self, digest: str, record: dict) -> dict | None:
+        """None if this copy is the first, or its claim had lapsed (and now owns the hash), else the holder's record."""
+        now = self.clock()
+        record = {
+            **record,
+            "status": PENDING,
+            "first_seen": _now(),
+            "lease_until": int(now + self.lease_seconds),
+            "expires_at": int(now + self.retention_days * 86400),
+        }
+        if self.unsupported is not None:
+            self._count("errors")
+            return None
+        try:
+            original = self.backend.claim(digest, record, now)
+        except LedgerUnsupported as e:
+            self._count("errors")
+            self.unsupported = e
+            logger.error("Attachment ledger disabled for this container, not deduplicating: %s", str(e))
+            return None
+        except Exception as e:
+            self._count("errors")
+            logger.warning("Attachment ledger unavailable, not deduplicating: %s", str(e))
+            return None
+        if original is None:
+            self._count("claimed")
+        return original
+
+    def release(self, digest: str) -> None:
+        # The claimed copy never reached incoming/; let the next copy take its place
+        try:
+            self.backend.release(digest)
+        except Exception as e:
+            self._count("errors")
+            logger.warning("Attachment ledger release failed for %s: %s", digest, str(e))
+
+    def complete(self, digest: str, status: str, **result) -> None:
+        """Record the pipeline's outcome on the claim; ends its lease."""
+        try:
+            self.backend.complete(digest, {**result, "status": status.lower(), "completed_at": _now()})
+        except Exception as e:
+            self._count("errors")
+            logger.warning("Attachment ledger completion failed for %s: %s", digest, str(e))
+
+    def record_duplicate(self, digest: str, original: dict, record: dict) -> None:
+        self._count("pipeline_runs_avoided")
+        self._count("bytes_skipped", record.get("size", 0))
+        try:
+            self.backend.add_duplicate(digest, {
+                **record,
+                "duplicate_of": original.get("key"),
+                "original_message_id": original.get("message_id"),
+                # Where the original run stands: pending, or its outcome and Patient
+                "original_status": original.get("status"),
+                "patient_id": original.get("patient_id"),
+                "execution_arn": original.get("execution_arn"),
+                "seen": _now(),
+            })
+        except Exception as e:
+            self._count("errors")
+            logger.warning("Attachment ledger duplicate record failed for %s: %s", digest, str(e))
+
+
+def build_attachment_ledger(backend: str, s3=None, bucket: str | None = None, prefix: str = LEDGER_PREFIX,
+                            table_name: str | None = None) -> AttachmentLedger | None:
+    if backend in ("", "none", "off"):
+        return None
+    if backend == "memory":
+        return AttachmentLedger(MemoryLedgerBackend())
+    if backend == "s3":
+        return AttachmentLedger(S3LedgerBackend(s3, bucket, prefix=prefix))
+    if backend == "dynamodb":
+        return AttachmentLedger(DynamoDBLedgerBackend(table_name))
+    raise ValueError(f"Unsupported attachment ledger backend: {backend}")
@@ -0,0 +1,54 @@
+"""
+Cross-container invalidation marker for read caches.
+
+Writers bump a small S3 object after changing the data behind a cache;
+readers stamp cached entries with the marker value they were filled under and
+drop them when it changes. Readers re-read the marker at most once per
+check interval, so it costs one GET per interval per container rather than
+one per request, and staleness is bounded by that interval.
+"""
+import logging
+import time
+import uuid
+
+logger = logging.getLogger()
+
+PATIENT_QUERY_GENERATION_KEY = "cache/patient_query/generation"
+
+
+def bump_generation(s3, bucket: str, key: str = PATIENT_QUERY_GENERATION_KEY) -> str:
+    value = uuid.uuid4().hex
+    s3.put_object(Bucket=bucket, Key=key, Body=value.encode("utf-8"))
+    return value
+
+
+class GenerationMarker:
+    def __init__(self, s3, bucket: str, key: str = PATIENT_QUERY_GENERATION_KEY, check_interval_s: float = 5.0,
+                 clock=time.monotonic):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.check_interval_s = check_interval_s
+        self.clock = clock
+        self._value = None
+        self._checked_at = 0.0
+
+    def current(self) -> str | None:
+        """Marker value, or None if it cannot be read (callers should then bypass their cache)."""
+        now = self.clock()
+        if self._value is not None and now - self._checked_at < self.check_interval_s:
+            return self._value
+
+        try:
+            obj = self.s3.get_object(Bucket=self.bucket, Key=self.key)
+            self._value = obj["Body"].read().decode("utf-8")
+        except self.s3.exceptions.NoSuchKey:
+            # Nothing has been written since the marker was introduced
+            self._value = "0"
+        except Exception as e:
+            logger.warning("Cache generation read failed: %s", str(e))
+            self._value = None
+            return None
+
+        self._checked_at = now
+        return self._value
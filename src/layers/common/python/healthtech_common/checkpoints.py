@@ -0,0 +1,221 @@
+"""
+Stage checkpoints, so a re-run of a document resumes where the last one failed.
+
+Every finished stage output is stored under the document's content hash:
+
+    checkpoints/<document hash>/ocr.txt                      Textract text (content_splitter)
+    checkpoints/<document hash>/chunks/<signature>.json      chunk list (content_splitter)
+    checkpoints/<document hash>/chunks/<signature>/...       chunk objects the list points at
+    checkpoints/<document hash>/results/<signature>/<n>.json guardrail result for chunk n
+
+A new execution for the same content (a re-upload, or a retried
+EventBridge delivery after a failed Map iteration or HealthLake write) then
+skips Textract, reuses the chunks and calls the model only for chunks
+without a result. The chunk signature covers the chunking settings, so
+chunks cut differently never pick up each other's results; guardrail
+results also record the model and prompt version they came from.
+
+Entries carry their own expiry (CHECKPOINT_TTL_SECONDS) and the bucket's
+lifecycle rule on `checkpoints/` removes them a day after that; nothing
+deletes them earlier. Another execution for the same document may still be
+reading them (a retried event, a re-upload), and one document's ingest cannot
+tell when the others are done. Like the
+result cache the store fails open: a checkpoint that cannot be read or
+written costs a redo, never the execution. CHECKPOINTS=off disables it.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections.abc import Iterable, Iterator
+
+from .instrumentation import phase, record_bytes
+
+logger = logging.getLogger()
+
+CHECKPOINT_PREFIX = "checkpoints"
+# S3 minimum part size is 5MB (except the last part)
+TEXT_PART_BYTES = 8 * 1024 * 1024
+
+# get_presigned_url puts web uploads here; their metadata is whatever the uploader sent
+WEB_UPLOAD_PREFIX = "incoming/web_upload/"
+SHA256_HEX = re.compile(r"^[0-9a-f]{64}$")
+
+
+def trusted_content_hash(key: str, metadata: dict | None) -> str | None:
+    """
+    The `content_sha256` metadata mime_extractor writes on attachments, or
+    None. Not trusted on web uploads: a client holding a presigned URL could
+    send another document's hash and take over its checkpoints, patient index
+    entry and ledger claim.
+    """
+    sha = ((metadata or {}).get("content_sha256") or "").lower()
+    if key.startswith(WEB_UPLOAD_PREFIX) or not SHA256_HEX.match(sha):
+        return None
+    return sha
+
+
+def document_hash(head: dict, key: str) -> str:
+    """
+    Checkpoint identity for a head_object response of the object at key.
+
+    For an email attachment this is its content hash (trusted_content_hash).
+    Otherwise it is derived from the ETag and size and prefixed `etag-`: an
+    identity of the stored object, not a hash of its content. It is stable
+    across retried events for the object, and across re-uploads of the same
+    bytes only while S3 gives them the same ETag (a single PUT without
+    SSE-KMS). A multipart or SSE-KMS re-upload gets a new ETag and starts
+    fresh checkpoints. Never compare it with content hashes.
+    """
+    sha = trusted_content_hash(key, head.get("Metadata"))
+    if sha:
+        return sha
+    stored = f"{head.get('ETag', '')}:{head.get('ContentLength', 0)}"
+    return "etag-" + hashlib.sha256(stored.encode("utf-8")).hexdigest()
+
+
+class TextCheckpointWriter:
+    """
+    Tees streamed text blocks into one object. Small texts are written with a
+    single PUT on completion, larger ones through a multipart upload holding
+    at most one part in memory. The object only appears if the stream was
+    read to the end; a failed write is logged and the stream carries on.
+    """
+
+    def __init__(self, s3, bucket: str, key: str, expires_at: int, part_bytes: int = TEXT_PART_BYTES):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.expires_at = expires_at
+        self.part_bytes = part_bytes
+        self.failed = False
+        self._upload_id = None
+        self._parts = []
+        self._buffer = bytearray()
+
+    def _flush_part(self) -> None:
+        if self._upload_id is None:
+            self._upload_id = self.s3.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, Metadata={"expires-at": str(self.expires_at)},
+            )["UploadId"]
+        part_number = len(self._parts) + 1
+        resp = self.s3.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                   PartNumber=part_number, Body=bytes(self._buffer))
+        self._parts.append({"ETag": resp["ETag"], "PartNumber": part_number})
+        record_bytes("CheckpointWrite", len(self._buffer))
+        self._buffer.clear()
+
+    def _fail(self, e: Exception) -> None:
+        logger.warning("Text checkpoint write failed: %s", str(e))
+        self.failed = True
+        self._buffer.clear()
+        if self._upload_id is not None:
+            try:
+                self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            except Exception as abort_error:
+                # The bucket's lifecycle rule aborts it later
+                logger.warning("Text checkpoint abort failed: %s", str(abort_error))
+            self._upload_id = None
+
+    def _close(self) -> None:
+        with phase("CheckpointWrite"):
+            if self._upload_id is None:
+                self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer),
+                                   Metadata={"expires-at": str(self.expires_at)})
+                record_bytes("CheckpointWrite", len(self._buffer))
+                return
+            if self._buffer:
+                self._flush_part()
+            self.s3.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                              MultipartUpload={"Parts": self._parts})
+
+    def tee(self, blocks: Iterable[str]) -> Iterator[str]:
+        completed = False
+        try:
+            for block in blocks:
+                if not self.failed:
+                    self._buffer += block.encode("utf-8")
+                    if len(self._buffer) >= self.part_bytes:
+                        try:
+                            with phase("CheckpointWrite"):
+                                self._flush_part()
+                        except Exception as e:
+                            self._fail(e)
+                yield block
+            completed = True
+        finally:
+            if not self.failed:
+                if completed:
+                    try:
+                        self._close()
+                    except Exception as e:
+                        self._fail(e)
+                elif self._upload_id is not None:
+                    # The reader stopped early: keep no partial text
+                    self._fail(RuntimeError("text stream not read to the end"))
+
+
+class CheckpointStore:
+    def __init__(self, s3, bucket: str, prefix: str = CHECKPOINT_PREFIX, ttl_seconds: int = 7 * 24 * 3600):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+        self.ttl_seconds = ttl_seconds
+
+    def key(self, doc_hash: str, name: str) -> str:
+        return f"{self.prefix}/{doc_hash}/{name}"
+
+    def get(self, doc_hash: str, name: str):
+        """The stored value, or None when missing, expired or unreadable."""
+        try:
+            with phase("CheckpointRead"):
+                obj = self.s3.get_object(Bucket=self.bucket, Key=self.key(doc_hash, name))
+                entry = json.loads(obj["Body"].read())
+        except self.s3.exceptions.NoSuchKey:
+            return None
+        except Exception as e:
+            logger.warning("Checkpoint read failed: %s", str(e))
+            return None
+        if entry.get("expires_at", 0) <= time.time():
+            return None
+        return entry.get("value")
+
+    def put(self, doc_hash: str, name: str, value) -> None:
+        body = json.dumps({"expires_at": int(time.time()) + self.ttl_seconds, "value": value})
+        try:
+            with phase("CheckpointWrite"):
+                self.s3.put_object(Bucket=self.bucket, Key=self.key(doc_hash, name), Body=body,
+                                   ContentType="application/json")
+            record_bytes("CheckpointWrite", len(body))
+        except Exception as e:
+            logger.warning("Checkpoint write failed: %s", str(e))
+
+    def has_text(self, doc_hash: str, name: str) -> bool:
+        """Whether a text checkpoint written by text_writer() exists and has not expired."""
+        try:
+            with phase("CheckpointRead"):
+                head = self.s3.head_object(Bucket=self.bucket, Key=self.key(doc_hash, name))
+        except Exception as e:
+            # A missing key is a 404 ClientError from HEAD
+            if getattr(e, "response", {}).get("Error", {}).get("Code") not in ("404", "NoSuchKey", "NotFound"):
+                logger.warning("Checkpoint head failed: %s", str(e))
+            return False
+        return int((head.get("Metadata") or {}).get("expires-at", 0)) > time.time()
+
+    def text_writer(self, doc_hash: str, name: str) -> TextCheckpointWriter:
+        return TextCheckpointWriter(self.s3, self.bucket, self.key(doc_hash, name),
+                                    int(time.time()) + self.ttl_seconds)
+
+
+def build_checkpoint_store(s3, bucket: str | None) -> CheckpointStore | None:
+    """The store configured by the CHECKPOINT* environment, or None when disabled."""
+    if os.environ.get("CHECKPOINTS", "on") == "off" or not bucket:
+        return None
+    return CheckpointStore(
+        s3,
+        bucket,
+        prefix=os.environ.get("CHECKPOINT_PREFIX", CHECKPOINT_PREFIX),
+        ttl_seconds=int(os.environ.get("CHECKPOINT_TTL_SECONDS", str(7 * 24 * 3600))),
+    )
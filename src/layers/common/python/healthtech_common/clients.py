@@ -0,0 +1,77 @@
+"""
+boto3 clients built on first use and shared for the container's lifetime.
+
+    s3 = lazy_client("s3")
+    bedrock = lazy_client("bedrock-runtime", config={"retries": {"max_attempts": 1}})
+
+    s3.get_object(...)  # the client is built here, once
+
+Building a client loads its service model and resolves its endpoint (around
+100ms for S3), and handlers used to do that at import for every client they
+might need. A handler now pays only for the clients its invocation actually
+touches: the splitter builds no Textract client for native documents, the
+guardrail no bedrock-runtime client when every chunk is pre-classified or
+cached. Time spent building one lands in the invocation's `ClientInit`
+phase.
+
+Clients are keyed by service and config, so modules asking for the same
+client share it. Creation is serialised because boto3's default session is
+not thread-safe; built clients are, and are used from worker threads as
+before. Module attributes holding a LazyClient can still be replaced
+outright (`handler.s3 = FakeS3()`), which is how the benchmarks inject
+stand-ins.
+"""
+import threading
+
+import boto3
+from botocore.config import Config
+
+from .instrumentation import phase, record_count
+
+_clients: dict[tuple, object] = {}
+_lock = threading.Lock()
+
+
+def get_client(service: str, config: dict | None = None):
+    """The shared client for service, built now if this is its first use."""
+    key = (service, repr(sorted((config or {}).items())))
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            with phase("ClientInit"):
+                client = boto3.client(service, config=Config(**config) if config else None)
+            record_count("ClientsCreated")
+            _clients[key] = client
+    return client
+
+
+def created() -> list[str]:
+    """Services whose clients have been built in this container."""
+    return [service for service, _ in _clients]
+
+
+class LazyClient:
+    """Stands in for a boto3 client; attribute access builds the real one through get_client()."""
+
+    def __init__(self, service: str, config: dict | None = None):
+        self.service = service
+        self.config = config
+        self._client = None
+
+    def __getattr__(self, name):
+        # Only reached for names the proxy itself lacks: client methods, `exceptions`, `meta`
+        client = self._client
+        if client is None:
+            client = self._client = get_client(self.service, self.config)
+        return getattr(client, name)
+
+    def __repr__(self):
+        state = "built" if self._client is not None else "not built"
+        return f"<LazyClient {self.service} ({state})>"
+
+
+def lazy_client(service: str, config: dict | None = None) -> LazyClient:
+    return LazyClient(service, config)
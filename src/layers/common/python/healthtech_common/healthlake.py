@@ -0,0 +1,195 @@
+"""
+SigV4-signed client for the HealthLake FHIR REST API.
+
+One client is kept per datastore for the container's lifetime, holding:
+- a single botocore session; credentials are frozen once and re-frozen only
+  when they are within HEALTHLAKE_CREDENTIAL_REFRESH_S of expiring
+- the SigV4 signer built from those credentials
+- a urllib3 PoolManager whose keep-alive connections are reused across
+  warm invocations
+
+429 and 5xx responses are retried with full-jitter backoff (honouring
+Retry-After). POSTs create resources, so they are only retried on 429 and
+503, where HealthLake has rejected the request without processing it.
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+
+import botocore.session
+import urllib3
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+
+from .instrumentation import phase, record_bytes, record_count
+
+logger = logging.getLogger()
+
+POOL_MAXSIZE = int(os.environ.get("HEALTHLAKE_POOL_MAXSIZE", "10"))
+MAX_ATTEMPTS = int(os.environ.get("HEALTHLAKE_MAX_ATTEMPTS", "4"))
+BACKOFF_BASE_S = float(os.environ.get("HEALTHLAKE_BACKOFF_BASE_S", "0.2"))
+BACKOFF_MAX_S = float(os.environ.get("HEALTHLAKE_BACKOFF_MAX_S", "5"))
+CONNECT_TIMEOUT_S = float(os.environ.get("HEALTHLAKE_CONNECT_TIMEOUT_S", "5"))
+READ_TIMEOUT_S = float(os.environ.get("HEALTHLAKE_READ_TIMEOUT_S", "30"))
+CREDENTIAL_REFRESH_S = float(os.environ.get("HEALTHLAKE_CREDENTIAL_REFRESH_S", "300"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Statuses where the request was rejected before any write happened
+NON_IDEMPOTENT_RETRY_STATUSES = {429, 503}
+
+
+class HealthLakeError(Exception):
+    def __init__(self, method: str, url: str, status: int, body: str):
+        super().__init__(f"HealthLake {method} failed status={status} body={body}")
+        self.method = method
+        self.url = url
+        self.status = status
+        self.body = body
+
+
+def _region() -> str:
+    region = os.environ.get("AWS_REGION") or os.environ.get("AWS_DEFAULT_REGION")
+    if not region:
+        raise ValueError("AWS_REGION is not set")
+    return region
+
+
+class _Signer:
+    """SigV4 signer over credentials that are re-frozen only near expiry."""
+
+    def __init__(self, region: str, service: str = "healthlake", refresh_margin_s: float = CREDENTIAL_REFRESH_S):
+        self.region = region
+        self.service = service
+        self.refresh_margin_s = refresh_margin_s
+        self._session = botocore.session.get_session()
+        self._credentials = None
+        self._expiry = None
+        self._auth = None
+        self._lock = threading.Lock()
+
+    def _stale(self) -> bool:
+        if self._auth is None:
+            return True
+        if self._expiry is None:
+            # Static credentials (e.g. the Lambda execution role's env vars) never need a refresh
+            return False
+        return (self._expiry - datetime.now(timezone.utc)).total_seconds() < self.refresh_margin_s
+
+    def _refresh(self) -> None:
+        if self._credentials is None:
+            self._credentials = self._session.get_credentials()
+            if self._credentials is None:
+                raise ValueError("No AWS credentials available for SigV4 signing")
+
+        # RefreshableCredentials fetch new keys here when they are close to expiry
+        frozen = self._credentials.get_frozen_credentials()
+        self._expiry = getattr(self._credentials, "_expiry_time", None)
+        self._auth = SigV4Auth(frozen, self.service, self.region)
+
+    def sign(self, method: str, url: str, body: bytes | None, headers: dict) -> dict:
+        with self._lock:
+            if self._stale():
+                self._refresh()
+            auth = self._auth
+
+        req = AWSRequest(method=method, url=url, data=body, headers=headers)
+        auth.add_auth(req)
+        return dict(req.prepare().headers)
+
+
+class HealthLakeClient:
+    def __init__(self, datastore_id: str, region: str | None = None, endpoint: str | None = None,
+                 pool_maxsize: int = POOL_MAXSIZE, max_attempts: int = MAX_ATTEMPTS,
+                 backoff_base_s: float = BACKOFF_BASE_S, backoff_max_s: float = BACKOFF_MAX_S, sleep=time.sleep):
+        self.region = region or _region()
+        # HEALTHLAKE_ENDPOINT points the client at a local stand-in for benchmarks
+        endpoint = endpoint or os.environ.get("HEALTHLAKE_ENDPOINT") or f"https://healthlake.{self.region}.amazonaws.com"
+        self.base_url = f"{endpoint.rstrip('/')}/datastore/{datastore_id}/r4"
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.sleep = sleep
+        self.signer = _Signer(self.region)
+        self.http = urllib3.PoolManager(
+            maxsize=pool_maxsize,
+            block=False,
+            headers={"Connection": "keep-alive"},
+            timeout=urllib3.Timeout(connect=CONNECT_TIMEOUT_S, read=READ_TIMEOUT_S),
+            # Only connection setup is retried by urllib3; status retries happen below
+            retries=urllib3.Retry(total=None, connect=2, read=0, redirect=0, status=0, other=0),
+        )
+        self.stats = {"requests": 0, "retries": 0}
+
+    def url(self, path: str) -> str:
+        if path.startswith(("http://", "https://")):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def _delay(self, attempt: int, resp) -> float:
+        retry_after = resp.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return min(self.backoff_max_s, float(retry_after))
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max_s, self.backoff_base_s * (2 ** attempt)))
+
+    def request(self, method: str, path: str, body: dict | None = None, headers: dict | None = None) -> dict:
+        url = self.url(path)
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        base_headers = {"Accept": "application/json"}
+        if data is not None:
+            base_headers["Content-Type"] = "application/fhir+json"
+        base_headers.update(headers or {})
+
+        retry_statuses = NON_IDEMPOTENT_RETRY_STATUSES if method == "POST" else RETRY_STATUSES
+        for attempt in range(self.max_attempts):
+            # Signatures are time-bound, so each attempt is signed afresh
+            signed = self.signer.sign(method, url, data, base_headers)
+            self.stats["requests"] += 1
+            # FhirPost / FhirPut / FhirGet, retries included
+            with phase(f"Fhir{method.title()}"):
+                resp = self.http.request(method, url, body=data, headers=signed)
+            record_bytes(f"Fhir{method.title()}", len(data or b"") + len(resp.data or b""))
+
+            if resp.status in retry_statuses and attempt < self.max_attempts - 1:
+                delay = self._delay(attempt, resp)
+                logger.warning("HealthLake %s status=%d (attempt %d/%d), retrying in %.2fs",
+                               method, resp.status, attempt + 1, self.max_attempts, delay)
+                self.stats["retries"] += 1
+                record_count("FhirRetries")
+                self.sleep(delay)
+                continue
+            break
+
+        text = resp.data.decode("utf-8") if resp.data else ""
+        if not 200 <= resp.status < 300:
+            raise HealthLakeError(method, url, resp.status, text)
+        return json.loads(text) if text else {}
+
+    def get(self, path: str, headers: dict | None = None) -> dict:
+        return self.request("GET", path, headers=headers)
+
+    def post(self, path: str, body: dict, headers: dict | None = None) -> dict:
+        return self.request("POST", path, body=body, headers=headers)
+
+    def put(self, path: str, body: dict, headers: dict | None = None) -> dict:
+        return self.request("PUT", path, body=body, headers=headers)
+
+
+_clients: dict[str, HealthLakeClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(datastore_id: str | None = None) -> HealthLakeClient:
+    """Container-wide client for datastore_id (default: HEALTHLAKE_ID)."""
+    datastore_id = datastore_id or os.environ["HEALTHLAKE_ID"]
+    with _clients_lock:
+        client = _clients.get(datastore_id)
+        if client is None:
+            client = _clients[datastore_id] = HealthLakeClient(datastore_id)
+        return client
@@ -0,0 +1,207 @@
+"""
+Per-invocation hot-path timings, emitted as one EMF record per invocation.
+
+    @instrumented("bedrock_guardrail")
+    def lambda_handler(event, context):
+        with phase("S3Read"):
+            body = s3.get_object(...)["Body"].read()
+        record_bytes("S3Read", len(body))
+
+Phases are summed per invocation, so a phase entered once per chunk reports
+its total time and its call count. Phases may nest; the inner phase's time
+is also part of the outer one's. The module-level helpers record onto the
+invocation in flight from anywhere below the handler (sibling modules, this
+layer, worker threads) and do nothing outside one, so library code can call
+them unconditionally. A container serves one invocation at a time, which is
+why the invocation is module state rather than a context variable (thread
+pools would not inherit one).
+
+The record has dimension `Function` and metrics `Duration`, `ColdStart`,
+`Errors`, `<Phase>Time` (ms), `<Name>Bytes`, Bedrock `InputTokens` /
+`CacheReadInputTokens` / `CacheWriteInputTokens` / `OutputTokens` and any
+counters. Like every EMF record it must never carry
+PHI. A phase costs two perf_counter() calls and a lock; the record is one
+print when the handler returns. INSTRUMENTATION=off leaves handlers unwrapped.
+"""
+import functools
+import os
+import threading
+import time
+from collections.abc import Iterable, Iterator
+
+from .metrics import emit_metrics
+
+ENABLED = os.environ.get("INSTRUMENTATION", "on") != "off"
+
+_cold_start = True
+_current: "Invocation | None" = None
+
+
+class Invocation:
+    def __init__(self, function: str, cold_start: bool):
+        self.function = function
+        self.cold_start = cold_start
+        self.started = time.perf_counter()
+        # name -> [seconds, calls]
+        self.phases: dict[str, list] = {}
+        self.bytes: dict[str, int] = {}
+        self.counts: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        with self._lock:
+            totals = self.phases.get(name)
+            if totals is None:
+                self.phases[name] = [seconds, 1]
+            else:
+                totals[0] += seconds
+                totals[1] += 1
+
+    def add_bytes(self, name: str, n: int) -> None:
+        with self._lock:
+            self.bytes[name] = self.bytes.get(name, 0) + n
+
+    def add_count(self, name: str, n: float = 1) -> None:
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def emit(self, request_id: str | None = None, error: str | None = None) -> dict:
+        metrics = {
+            "Duration": (round((time.perf_counter() - self.started) * 1000, 3), "Milliseconds"),
+            "ColdStart": (int(self.cold_start), "Count"),
+            "Errors": (int(error is not None), "Count"),
+        }
+        with self._lock:
+            for name, (seconds, _) in self.phases.items():
+                metrics[f"{name}Time"] = (round(seconds * 1000, 3), "Milliseconds")
+            for name, n in self.bytes.items():
+                metrics[f"{name}Bytes"] = (n, "Bytes")
+            for name, n in self.counts.items():
+                metrics[name] = (n, "Count")
+            calls = {name: totals[1] for name, totals in self.phases.items()}
+
+        properties = {"RequestId": request_id, "PhaseCalls": calls}
+        if error:
+            properties["Error"] = error
+        return emit_metrics(metrics, {"Function": self.function}, properties=properties)
+
+
+class _Phase:
+    __slots__ = ("name", "invocation", "started")
+
+    def __init__(self, name: str, invocation: Invocation):
+        self.name = name
+        self.invocation = invocation
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.invocation.add_phase(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class _NoPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+def phase(name: str):
+    """Context manager adding the block's wall time to phase `name`."""
+    invocation = _current
+    return _Phase(name, invocation) if invocation is not None else _NO_PHASE
+
+
+def timed(name: str):
+    """Decorator form of phase()."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def timed_iter(items: Iterable, name: str, size=None) -> Iterator:
+    """
+    Yield from items, charging the time spent producing each item to phase
+    `name`, and size(item) to its byte count when size is given (e.g. len for
+    the blocks of a streamed S3 body).
+    """
+    iterator = iter(items)
+    while True:
+        with phase(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        if size is not None:
+            record_bytes(name, size(item))
+        yield item
+
+
+def record_bytes(name: str, n: int) -> None:
+    invocation = _current
+    if invocation is not None:
+        invocation.add_bytes(name, n)
+
+
+def record_count(name: str, n: float = 1) -> None:
+    invocation = _current
+    if invocation is not None:
+        invocation.add_count(name, n)
+
+
+def record_tokens(usage: dict | None) -> dict[str, int]:
+    """
+    Record Bedrock usage from Converse ({"inputTokens", "cacheReadInputTokens", ...})
+    or an Anthropic invoke_model body ({"input_tokens", "cache_read_input_tokens", ...}).
+    Input tokens are the uncached part of the prompt; cache reads and writes are
+    counted separately. Returns the usage under the metric names.
+    """
+    usage = usage or {}
+    tokens = {
+        "InputTokens": usage.get("inputTokens", usage.get("input_tokens", 0)),
+        "CacheReadInputTokens": usage.get("cacheReadInputTokens", usage.get("cache_read_input_tokens", 0)),
+        "CacheWriteInputTokens": usage.get("cacheWriteInputTokens", usage.get("cache_creation_input_tokens", 0)),
+        "OutputTokens": usage.get("outputTokens", usage.get("output_tokens", 0)),
+    }
+    if usage:
+        for name, n in tokens.items():
+            record_count(name, n or 0)
+    return tokens
+
+
+def instrumented(function: str):
+    """Wrap a Lambda handler so each invocation emits its phase record, also when it raises."""
+    def decorate(handler):
+        if not ENABLED:
+            return handler
+
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            global _cold_start, _current
+            invocation = Invocation(function, _cold_start)
+            _cold_start = False
+            _current = invocation
+            error = None
+            try:
+                return handler(event, context)
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                _current = None
+                invocation.emit(getattr(context, "aws_request_id", None), error)
+        return wrapper
+    return decorate
@@ -0,0 +1,38 @@
+"""
+CloudWatch Embedded Metric Format (EMF) records.
+
+A record is one JSON line on stdout; CloudWatch Logs extracts the metrics
+from it, so emitting costs a print rather than a PutMetricData call on the
+request path. Properties ride along in the same line for Logs Insights but
+are not metrics. Never put PHI (names, identifiers, document text) in either.
+"""
+import json
+import os
+import time
+
+NAMESPACE = os.environ.get("METRICS_NAMESPACE", "HealthTech/Pipeline")
+
+
+def emit_metrics(metrics: dict[str, tuple[float, str]], dimensions: dict[str, str],
+                 properties: dict | None = None, namespace: str = NAMESPACE) -> dict:
+    """
+    emit_metrics({"Documents": (1, "Count")}, {"Route": "NATIVE_PARSE"})
+
+    metrics maps name -> (value, CloudWatch unit); every metric is published
+    under the one dimension set given.
+    """
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": namespace,
+                "Dimensions": [list(dimensions)],
+                "Metrics": [{"Name": name, "Unit": unit} for name, (_, unit) in metrics.items()],
+            }],
+        },
+        **(properties or {}),
+        **dimensions,
+        **{name: value for name, (value, _) in metrics.items()},
+    }
+    print(json.dumps(record, default=str))
+    return record
@@ -0,0 +1,290 @@
+"""
+Text layer of born-digital PDFs, read without a PDF library.
+
+Page content lives in (usually Flate-compressed) content streams whose
+text-showing operators (Tj, TJ, ' and ") carry the strings drawn on the page.
+For documents produced by word processors, EHR exports and reporting tools
+those strings are the text itself, so scanning the file's streams in order
+recovers it while holding one stream at a time. Image and font streams are
+skipped without being buffered.
+
+This is deliberately not a full PDF reader: fonts with CID encodings
+(Identity-H) show glyph ids rather than characters, and scanned pages carry
+images instead of text. Both come out as little or unreadable text, which
+`text_layer_stats` reports so document_router can send those files to
+Textract. document_router samples the head of a file; content_splitter
+extracts the whole text once the router has chosen the native route.
+"""
+import re
+import zlib
+
+# Stream data larger than this is skipped rather than buffered (page content is rarely over 1MB)
+MAX_STREAM_BYTES = 16 * 1024 * 1024
+# How far back from `stream` to look for the object's dictionary
+DICT_LOOKBACK = 4096
+
+# Full-page scans: an image this many pixels or larger (8.5x11in at ~85dpi)
+SCAN_IMAGE_PIXELS = 700_000
+
+# TJ adjustments (thousandths of an em) wider than this are word gaps
+TJ_SPACE = 180
+
+_STREAM_START = re.compile(rb'>>\s*stream\r?\n')
+_SKIP_STREAM = re.compile(
+    rb'/Subtype\s*/(?:Image|Type1C|CIDFontType0C|OpenType)\b|/Length[123]\b|/Type\s*/(?:XRef|Metadata|EmbeddedFile)\b'
+)
+_OTHER_FILTER = re.compile(rb'/(?:DCTDecode|JPXDecode|CCITTFaxDecode|JBIG2Decode|LZWDecode|ASCII85Decode|RunLengthDecode)\b')
+_IMAGE = re.compile(rb'/Subtype\s*/Image\b')
+_WIDTH = re.compile(rb'/Width\s+(\d+)')
+_HEIGHT = re.compile(rb'/Height\s+(\d+)')
+_OBJECT_STREAM = re.compile(rb'/Type\s*/ObjStm\b')
+_PAGE = re.compile(rb'/Type\s*/Page(?![a-zA-Z])')
+_PAGES_COUNT = re.compile(rb'/Type\s*/Pages\b[^>]*?/Count\s+(\d+)|/Count\s+(\d+)[^>]*?/Type\s*/Pages\b')
+_LINEARIZED_PAGES = re.compile(rb'/Linearized\b[^>]*?/N\s+(\d+)')
+
+_TOKEN = re.compile(rb"""
+    \((?:\\.|[^\\()]|\((?:\\.|[^\\()])*\))*\)    # literal string, one level of nested parens
+  | <<|>>
+  | <[0-9A-Fa-f\s]*>                            # hex string
+  | [\[\]]
+  | /[^\s/\[\]()<>{}%]*                          # name
+  | [-+]?(?:\d+\.?\d*|\.\d+)                     # number
+  | [A-Za-z'"*]+[01]?                            # operator
+  | %[^\r\n]*                                    # comment
+""", re.X | re.S)
+_ESCAPE = re.compile(rb'\\([nrtbf()\\]|[0-7]{1,3}|\r\n|\r|\n)')
+_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f'}
+_WHITESPACE = re.compile(rb'\s')
+_INLINE_IMAGE_END = re.compile(rb'\sEI(?=\s|$)')
+_CONTROL = re.compile('[\x00-\x08\x0b\x0e-\x1f\x7f\ufffd]')
+_PUNCTUATION = set(".,;:!?()[]{}%/\\-+*=&#@$'\"<>_|~^`°§•–—‘’“”…·")
+
+
+def iter_streams(blocks, max_stream_bytes=MAX_STREAM_BYTES):
+    """
+    (dictionary, data) for every stream in the byte blocks, in file order.
+    data is None for image, font and oversize streams, which are never
+    buffered whole. A stream cut off by the end of the input is not yielded.
+    """
+    blocks = iter(blocks)
+    buf = bytearray()
+    pos = 0
+
+    while True:
+        m = _STREAM_START.search(buf, pos)
+        if m is None:
+            block = next(blocks, None)
+            if block is None:
+                return
+            # Keep enough tail for a keyword split across blocks and the dictionary lookback
+            cut = max(0, min(pos, len(buf) - DICT_LOOKBACK))
+            del buf[:cut]
+            pos = max(0, pos - cut - 16)
+            buf += block
+            continue
+
+        dict_start = buf.rfind(b'obj', max(0, m.start() - DICT_LOOKBACK), m.start())
+        dictionary = bytes(buf[dict_start if dict_start != -1 else max(0, m.start() - DICT_LOOKBACK):m.end()])
+        skip = bool(_SKIP_STREAM.search(dictionary))
+
+        start = m.end()
+        while True:
+            end = buf.find(b'endstream', start)
+            if end != -1:
+                break
+            if skip or len(buf) - start > max_stream_bytes:
+                # Not needed (or too big): drop what has arrived, keeping a split `endstream`
+                skip = True
+                keep = max(start, len(buf) - 8)
+                del buf[:keep]
+                start = 0
+            block = next(blocks, None)
+            if block is None:
+                return
+            buf += block
+
+        yield dictionary, (None if skip else bytes(buf[start:end]))
+        del buf[:end + len(b'endstream')]
+        pos = 0
+
+
+def _inflate(dictionary, data):
+    if _OTHER_FILTER.search(dictionary):
+        return None
+    if b'/FlateDecode' in dictionary or b'/Fl ' in dictionary or b'/Fl]' in dictionary:
+        decompressor = zlib.decompressobj()
+        try:
+            return decompressor.decompress(data)
+        except zlib.error:
+            # Truncated or damaged stream: keep whatever inflated cleanly
+            return decompressor.flush() or None
+    return data
+
+
+def _literal(token):
+    def unescape(m):
+        e = m.group(1)
+        if e in _ESCAPES:
+            return _ESCAPES[e]
+        if e[:1] in b'\r\n':
+            return b''
+        if e[:1].isdigit():
+            return bytes([int(e, 8) & 0xFF])
+        return e
+    return _ESCAPE.sub(unescape, token[1:-1])
+
+
+def _hex(token):
+    digits = _WHITESPACE.sub(b'', token[1:-1])
+    if len(digits) % 2:
+        digits += b'0'
+    return bytes.fromhex(digits.decode('ascii'))
+
+
+def _decode(raw):
+    if raw.startswith(b'\xfe\xff'):
+        return raw[2:].decode('utf-16-be', errors='replace')
+    # WinAnsiEncoding, what simple TrueType/Type1 fonts from office tools use
+    return raw.decode('cp1252', errors='replace')
+
+
+def content_text(content):
+    """Text drawn by one content stream, with line breaks where the text position moves down."""
+    out = []
+    stack = [[]]
+    last_y = None
+    pos = 0
+
+    while True:
+        m = _TOKEN.search(content, pos)
+        if m is None:
+            break
+        token = m.group()
+        pos = m.end()
+        first = token[:1]
+
+        if first == b'(':
+            stack[-1].append(_literal(token))
+        elif first == b'<' and token != b'<<':
+            stack[-1].append(_hex(token))
+        elif token == b'[':
+            stack.append([])
+        elif token == b']':
+            if len(stack) > 1:
+                array = stack.pop()
+                stack[-1].append(array)
+        elif first in b'/%<>':
+            continue
+        elif first in b'+-.' or first.isdigit():
+            stack[-1].append(float(token))
+        else:
+            operands = stack[-1]
+            if token == b'Tj' and operands and isinstance(operands[-1], bytes):
+                out.append(_decode(operands[-1]))
+            elif token == b'TJ' and operands and isinstance(operands[-1], list):
+                for item in operands[-1]:
+                    if isinstance(item, bytes):
+                        out.append(_decode(item))
+                    elif item < -TJ_SPACE:
+                        out.append(' ')
+            elif token in (b"'", b'"') and operands and isinstance(operands[-1], bytes):
+                out.append('\n' + _decode(operands[-1]))
+            elif token == b'T*':
+                out.append('\n')
+            elif token in (b'Td', b'TD') and len(operands) >= 2:
+                out.append('\n' if operands[-1] != 0 else ' ')
+            elif token == b'Tm' and len(operands) >= 6:
+                y = operands[-1]
+                out.append('\n' if last_y is not None and y != last_y else ' ')
+                last_y = y
+            elif token == b'ET':
+                out.append('\n')
+            elif token == b'ID':
+                # Inline image data is binary; resume after its EI
+                end = _INLINE_IMAGE_END.search(content, pos)
+                pos = end.end() if end else len(content)
+            stack = [[]]
+
+    return ''.join(out)
+
+
+def clean_text(text):
+    return _CONTROL.sub('', text)
+
+
+def iter_pdf_text(blocks):
+    """
+    Text of each content stream that draws any, followed by a form feed
+    (the chunker's page boundary; one content stream per page is the norm).
+    """
+    for dictionary, data in iter_streams(blocks):
+        if data is None or _OBJECT_STREAM.search(dictionary):
+            continue
+        content = _inflate(dictionary, data)
+        if not content or b'T' not in content:
+            continue
+        text = clean_text(content_text(content)).strip()
+        if text:
+            yield text + '\n\f'
+
+
+def text_quality(text):
+    """Share of visible characters that are letters, digits or ordinary punctuation."""
+    visible = 0
+    good = 0
+    for c in text:
+        if c.isspace():
+            continue
+        visible += 1
+        if c.isalnum() or c in _PUNCTUATION:
+            good += 1
+    return good / visible if visible else 0.0
+
+
+def text_layer_stats(data):
+    """
+    What a sample of a PDF (typically its head) says about its text layer:
+    readable characters found, text-bearing streams, full-page images and an
+    estimate of the page count (None if the sample does not show it).
+    """
+    stats = {'text_streams': 0, 'image_streams': 0, 'scan_images': 0, 'chars': 0, 'quality': 0.0, 'pages': None}
+    texts = []
+    page_objects = len(_PAGE.findall(data))
+    counts = [int(a or b) for a, b in _PAGES_COUNT.findall(data)]
+
+    for dictionary, stream in iter_streams([data]):
+        if _IMAGE.search(dictionary):
+            stats['image_streams'] += 1
+            width, height = _WIDTH.search(dictionary), _HEIGHT.search(dictionary)
+            if width and height and int(width.group(1)) * int(height.group(1)) >= SCAN_IMAGE_PIXELS:
+                stats['scan_images'] += 1
+            continue
+        if stream is None:
+            continue
+        content = _inflate(dictionary, stream)
+        if not content:
+            continue
+        if _OBJECT_STREAM.search(dictionary):
+            # Compressed object dictionaries: where Page and Pages objects hide in PDF 1.5+
+            page_objects += len(_PAGE.findall(content))
+            counts += [int(a or b) for a, b in _PAGES_COUNT.findall(content)]
+            continue
+        if b'T' not in content:
+            continue
+        text = content_text(content)
+        if text.strip():
+            stats['text_streams'] += 1
+            texts.append(text)
+
+    text = ''.join(texts)
+    stats['quality'] = round(text_quality(text), 3)
+    stats['chars'] = len(clean_text(text).strip())
+
+    linearized = _LINEARIZED_PAGES.search(data[:2048])
+    if linearized:
+        stats['pages'] = int(linearized.group(1))
+    elif counts:
+        stats['pages'] = max(counts)
+    elif page_objects:
+        stats['pages'] = page_objects
+    return stats